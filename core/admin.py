@@ -1,9 +1,15 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
+from .esportazione_fhir import elimina as elimina_esportazione
+from .forms import AssegnazioneTurnoAdminForm
 from .models import (
     Paziente, Stanza, Letto, Episodio, Farmaco, Prescrizione, RigaPrescrizione,
     OrarioDose, Somministrazione, ParametroVitale, DiarioIgiene, Documento,
     ContattoEmergenza, RecapitoContatto, Allergia, Pietanza, MenuPeriodo, MenuPasto, VoceMenu,
-    Dipendente, TurnoTipo, PianoTurniPeriodo, AssegnazioneTurno
+    Dipendente, TurnoTipo, PianoTurniPeriodo, AssegnazioneTurno, Ingrediente, RicettaIngrediente,
+    FabbisognoTurno, AssenzaDipendente, OreMensili, PermanenzaLetto, RegistroModifica, TokenAPI,
+    EsportazioneFHIR,
 )
 
 class RecapitoContattoInline(admin.TabularInline):
@@ -46,6 +52,21 @@ class EpisodioAdmin(admin.ModelAdmin):
     list_display = ("paziente", "data_inizio", "data_fine", "stato", "medico", "letto")
     list_filter = ("stato", "data_inizio", "data_fine")
 
+@admin.register(PermanenzaLetto)
+class PermanenzaLettoAdmin(admin.ModelAdmin):
+    list_display = ("letto", "paziente", "data_inizio", "data_fine", "episodio")
+    list_filter = ("letto__stanza",)
+    date_hierarchy = "data_inizio"
+    search_fields = ("paziente__cognome", "paziente__nome")
+    ordering = ("-data_inizio",)
+
+    # storico generato dai cambi letto dell'episodio: sola lettura
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Farmaco)
 class FarmacoAdmin(admin.ModelAdmin):
     list_display = ("nome", "forma", "forza_val", "forza_udm", "produttore")
@@ -151,6 +172,20 @@ class MenuPastoInline(admin.TabularInline):
     extra = 0
     ordering = ("data", "pasto")
 
+class RicettaIngredienteInline(admin.TabularInline):
+    model = RicettaIngrediente
+    fields = ("ingrediente", "quantita_porzione")
+    extra = 1
+    autocomplete_fields = ("ingrediente",)
+
+# ---------- Ingrediente ----------
+@admin.register(Ingrediente)
+class IngredienteAdmin(admin.ModelAdmin):
+    list_display = ("nome", "udm", "note")
+    list_filter = ("udm",)
+    search_fields = ("nome",)
+    ordering = ("nome",)
+
 # ---------- Pietanza ----------
 @admin.register(Pietanza)
 class PietanzaAdmin(admin.ModelAdmin):
@@ -158,6 +193,7 @@ class PietanzaAdmin(admin.ModelAdmin):
     list_filter = ("categoria",)
     search_fields = ("nome", "tag_dieta", "allergeni_note")
     ordering = ("nome",)
+    inlines = (RicettaIngredienteInline,)
 
 # ---------- MenuPeriodo ----------
 @admin.register(MenuPeriodo)
@@ -197,6 +233,7 @@ class MenuPastoAdmin(admin.ModelAdmin):
 # ---- Inline assegnazioni dentro il Periodo ----
 class AssegnazioneTurnoInline(admin.TabularInline):
     model = AssegnazioneTurno
+    form = AssegnazioneTurnoAdminForm
     fields = ("data", "turno", "dipendente", "note")
     ordering = ("data", "turno__ordine", "dipendente__cognome")
     extra = 0
@@ -204,10 +241,24 @@ class AssegnazioneTurnoInline(admin.TabularInline):
 
 @admin.register(Dipendente)
 class DipendenteAdmin(admin.ModelAdmin):
-    list_display = ("cognome", "nome", "ruolo", "attivo")
+    list_display = ("cognome", "nome", "ruolo", "ore_settimanali", "attivo")
     list_filter = ("ruolo", "attivo")
     search_fields = ("cognome", "nome")
     ordering = ("cognome", "nome")
+    readonly_fields = ("link_calendario",)
+    actions = ("rigenera_link_calendario",)
+
+    @admin.display(description="Calendario turni (iCal)")
+    def link_calendario(self, obj):
+        if not obj.token_calendario:
+            return "—"
+        url = reverse("turni_calendario_ics", args=[obj.token_calendario])
+        return format_html('<a href="{}">{}</a>', url, url)
+
+    @admin.action(description="Rigenera link calendario (revoca il precedente)")
+    def rigenera_link_calendario(self, request, queryset):
+        for dip in queryset:
+            dip.rigenera_token_calendario()
 
 @admin.register(TurnoTipo)
 class TurnoTipoAdmin(admin.ModelAdmin):
@@ -217,6 +268,37 @@ class TurnoTipoAdmin(admin.ModelAdmin):
     search_fields = ("codice", "nome")
     ordering = ("ordine", "codice")
 
+@admin.register(FabbisognoTurno)
+class FabbisognoTurnoAdmin(admin.ModelAdmin):
+    list_display = ("turno", "ruolo", "minimo")
+    list_editable = ("minimo",)
+    list_filter = ("turno", "ruolo")
+    ordering = ("turno__ordine", "ruolo")
+
+@admin.register(AssenzaDipendente)
+class AssenzaDipendenteAdmin(admin.ModelAdmin):
+    list_display = ("dipendente", "tipo", "data_inizio", "data_fine", "note")
+    list_filter = ("tipo",)
+    date_hierarchy = "data_inizio"
+    search_fields = ("dipendente__cognome", "dipendente__nome", "note")
+    ordering = ("-data_inizio",)
+    autocomplete_fields = ("dipendente",)
+
+@admin.register(OreMensili)
+class OreMensiliAdmin(admin.ModelAdmin):
+    list_display = ("dipendente", "mese", "turni", "minuti_lavorati", "minuti_notturni",
+                    "minuti_festivi", "minuti_straordinari")
+    list_filter = ("mese", "dipendente__ruolo")
+    search_fields = ("dipendente__cognome", "dipendente__nome")
+    ordering = ("-mese", "dipendente__cognome")
+
+    # riepilogo derivato: sola lettura
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(PianoTurniPeriodo)
 class PianoTurniPeriodoAdmin(admin.ModelAdmin):
     list_display = ("__str__", "data_inizio", "data_fine", "stato")
@@ -240,6 +322,7 @@ class PianoTurniPeriodoAdmin(admin.ModelAdmin):
 
 @admin.register(AssegnazioneTurno)
 class AssegnazioneTurnoAdmin(admin.ModelAdmin):
+    form = AssegnazioneTurnoAdminForm
     list_display = ("data", "turno", "dipendente", "periodo", "note")
     list_filter = ("periodo", "turno", "dipendente")
     date_hierarchy = "data"
@@ -254,4 +337,58 @@ class AssegnazioneTurnoAdmin(admin.ModelAdmin):
                 init[k] = request.GET.get(k)
         if "data" in request.GET:
             init["data"] = request.GET.get("data")  # YYYY-MM-DD
-        return init
\ No newline at end of file
+        return init
+
+@admin.register(RegistroModifica)
+class RegistroModificaAdmin(admin.ModelAdmin):
+    """Sola lettura: il registro è append-only."""
+    list_display = ("istante", "azione", "modello", "oggetto_id", "utente_id")
+    list_filter = ("azione", "modello")
+    search_fields = ("=oggetto_id",)
+    date_hierarchy = "istante"
+    show_full_result_count = False  # COUNT(*) su una tabella che cresce sempre
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TokenAPI)
+class TokenAPIAdmin(admin.ModelAdmin):
+    """I token si creano con ``manage.py token_api`` (la chiave si vede solo lì); qui si revocano."""
+    list_display = ("nome", "utente", "attivo", "creato_il", "ultimo_uso")
+    list_filter = ("attivo",)
+    list_editable = ("attivo",)
+    search_fields = ("nome", "utente__username")
+    fields = ("utente", "nome", "attivo", "creato_il", "ultimo_uso")
+    readonly_fields = ("utente", "creato_il", "ultimo_uso")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(EsportazioneFHIR)
+class EsportazioneFHIRAdmin(admin.ModelAdmin):
+    """Job avviati da /fhir/$export ed eseguiti da ``manage.py esporta_fhir``: solo consultazione."""
+    list_display = ("richiesta_il", "utente", "tipi", "dal", "stato", "avanzamento", "battito_il", "completata_il")
+    list_filter = ("stato",)
+    readonly_fields = [f.name for f in EsportazioneFHIR._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        elimina_esportazione(obj)  # anche i file su disco
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            elimina_esportazione(obj)
+
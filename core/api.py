@@ -0,0 +1,526 @@
+# core/api.py
+"""
+API JSON in sola lettura (v1) per tablet e schermi di reparto.
+
+- Autenticazione: ``Authorization: Bearer <token>`` (TokenAPI) oppure la sessione del sito.
+- Paginazione a cursore (keyset) sull'ordinamento della risorsa, che segue un indice:
+  ``?limite=50&cursore=...``; la risposta riporta il cursore della pagina successiva.
+- ``fields=a,b`` e ``fields[relazione]=...`` limitano i campi (``.only()``);
+  ``include=paziente,righe.orari`` aggiunge le relazioni (select_related / Prefetch).
+- ETag sul contenuto: con ``If-None-Match`` uguale la risposta è 304 senza corpo.
+- ``/fhir/$export``: export FHIR in blocco (NDJSON) con URL di stato, vedi core/esportazione_fhir.py.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import secrets
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Q
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import esportazione_fhir
+from .export import streaming_per_asgi
+from .models import (
+    AssegnazioneTurno, DiarioIgiene, Dipendente, Episodio, EsportazioneFHIR, Farmaco, Letto, MenuPasto, OrarioDose,
+    ParametroVitale, Paziente, Pietanza, Prescrizione, RigaPrescrizione, Somministrazione, Stanza,
+    TokenAPI, TurnoTipo, VoceMenu,
+)
+
+LIMITE_PREDEFINITO = 50
+LIMITE_MASSIMO = 500
+ULTIMO_USO_OGNI = timedelta(minutes=15)  # aggiornamento di TokenAPI.ultimo_uso, non a ogni richiesta
+
+
+class ErroreAPI(Exception):
+    def __init__(self, messaggio, status=400):
+        super().__init__(messaggio)
+        self.status = status
+
+
+# === RISORSE ===
+@dataclass
+class Relazione:
+    campo: str
+    risorsa: "Risorsa"
+    multipla: bool = False  # relazione inversa o M2M: Prefetch; altrimenti select_related
+
+
+@dataclass
+class Risorsa:
+    modello: type
+    campi: tuple  # campi esposti (le FK con il nome della colonna, es. "paziente_id"); "id" è sempre incluso
+    ordinamento: tuple = ("-id",)  # keyset: l'ultimo campo deve essere univoco
+    filtri: dict = field(default_factory=dict)  # parametro GET -> (lookup, conversione)
+    relazioni: dict = field(default_factory=dict)
+
+
+def _intero(v):
+    return int(v)
+
+
+def _booleano(v):
+    return v.lower() in ("1", "true", "si", "sì")
+
+
+def _data(v):
+    return date.fromisoformat(v)
+
+
+def _istante(v):
+    """ISO 8601; una data da sola vale la mezzanotte locale."""
+    dt = parse_datetime(v)
+    if dt is None:
+        dt = datetime.combine(date.fromisoformat(v), time.min)
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+def _filtri_intervallo(campo, conversione):
+    return {"dal": (f"{campo}__gte", conversione), "al": (f"{campo}__lt", conversione)}
+
+
+STANZE = Risorsa(Stanza, ("nome",))
+LETTI = Risorsa(Letto, ("stanza_id", "codice"), relazioni={"stanza": Relazione("stanza", STANZE)})
+FARMACI = Risorsa(Farmaco, ("nome", "forma", "forza_val", "forza_udm", "codice_atc"))
+PAZIENTI = Risorsa(
+    Paziente,
+    ("nome", "cognome", "sesso", "data_nascita", "codice_fiscale", "tessera_sanitaria", "telefono"),
+    ordinamento=("cognome", "nome", "id"),
+)
+EPISODI = Risorsa(
+    Episodio,
+    ("paziente_id", "data_inizio", "data_fine", "stato", "provenienza", "letto_id", "motivo"),
+    filtri={"paziente": ("paziente_id", _intero), "aperti": ("data_fine__isnull", _booleano)},
+    relazioni={"paziente": Relazione("paziente", PAZIENTI), "letto": Relazione("letto", LETTI)},
+)
+ORARI = Risorsa(OrarioDose, ("riga_id", "ora", "giorni_settimana"))
+RIGHE = Risorsa(
+    RigaPrescrizione,
+    ("prescrizione_id", "farmaco_id", "dose_val", "dose_udm", "via", "prn", "note"),
+    relazioni={"farmaco": Relazione("farmaco", FARMACI), "orari": Relazione("orari", ORARI, multipla=True)},
+)
+PRESCRIZIONI = Risorsa(
+    Prescrizione,
+    ("paziente_id", "medico_id", "data_inizio", "data_fine", "attiva", "note"),
+    filtri={"paziente": ("paziente_id", _intero), "attiva": ("attiva", _booleano)},
+    relazioni={"paziente": Relazione("paziente", PAZIENTI), "righe": Relazione("righe", RIGHE, multipla=True)},
+)
+SOMMINISTRAZIONI = Risorsa(
+    Somministrazione,
+    ("paziente_id", "riga_id", "programmata_il", "data_ora", "operatore_id", "dose_erogata", "stato", "note"),
+    filtri={"paziente": ("paziente_id", _intero), **_filtri_intervallo("data_ora", _istante)},
+    relazioni={"paziente": Relazione("paziente", PAZIENTI), "riga": Relazione("riga", RIGHE)},
+)
+PARAMETRI = Risorsa(
+    ParametroVitale,
+    ("paziente_id", "rilevato_il", "pas", "pad", "fc", "spo2", "temp_c", "glicemia_mgdl", "note", "operatore_id"),
+    ordinamento=("-rilevato_il", "-id"),  # indice (paziente, rilevato_il)
+    filtri={"paziente": ("paziente_id", _intero), **_filtri_intervallo("rilevato_il", _istante)},
+    relazioni={"paziente": Relazione("paziente", PAZIENTI)},
+)
+IGIENE = Risorsa(
+    DiarioIgiene,
+    ("paziente_id", "rilevato_il", "evento", "operatore_id"),
+    ordinamento=("-rilevato_il", "-id"),
+    filtri={"paziente": ("paziente_id", _intero), **_filtri_intervallo("rilevato_il", _istante)},
+    relazioni={"paziente": Relazione("paziente", PAZIENTI)},
+)
+PIETANZE = Risorsa(Pietanza, ("nome", "categoria"))
+VOCI_MENU = Risorsa(
+    VoceMenu, ("pasto_id", "pietanza_id", "descrizione_libera", "ordine"),
+    relazioni={"pietanza": Relazione("pietanza", PIETANZE)},
+)
+MENU = Risorsa(
+    MenuPasto,
+    ("periodo_id", "data", "pasto", "note"),
+    ordinamento=("data", "pasto", "id"),  # indice (data, pasto)
+    filtri={"periodo": ("periodo_id", _intero), **_filtri_intervallo("data", _data)},
+    relazioni={"voci": Relazione("voci", VOCI_MENU, multipla=True)},
+)
+TIPI_TURNO = Risorsa(TurnoTipo, ("codice", "nome", "ora_inizio", "ora_fine", "is_riposo"))
+DIPENDENTI = Risorsa(Dipendente, ("nome", "cognome", "ruolo", "attivo"))
+TURNI = Risorsa(
+    AssegnazioneTurno,
+    ("periodo_id", "data", "turno_id", "dipendente_id", "note"),
+    ordinamento=("data", "turno_id", "id"),  # indice (data, turno); la colonna, non l'ordinamento di TurnoTipo
+    filtri={
+        "periodo": ("periodo_id", _intero), "dipendente": ("dipendente_id", _intero),
+        **_filtri_intervallo("data", _data),
+    },
+    relazioni={"turno": Relazione("turno", TIPI_TURNO), "dipendente": Relazione("dipendente", DIPENDENTI)},
+)
+
+# nome nell'URL -> risorsa
+RISORSE = {
+    "pazienti": PAZIENTI,
+    "episodi": EPISODI,
+    "prescrizioni": PRESCRIZIONI,
+    "somministrazioni": SOMMINISTRAZIONI,
+    "parametri": PARAMETRI,
+    "igiene": IGIENE,
+    "menu": MENU,
+    "turni": TURNI,
+}
+
+
+# === AUTENTICAZIONE ===
+def _digest(chiave):
+    return hashlib.sha256(chiave.encode()).hexdigest()
+
+
+def crea_token(utente, nome):
+    """Crea un token per l'utente; la chiave in chiaro si vede solo ora."""
+    chiave = secrets.token_urlsafe(32)
+    TokenAPI.objects.create(utente=utente, nome=nome, digest=_digest(chiave))
+    return chiave
+
+
+def _utente(request):
+    intestazione = request.headers.get("Authorization", "")
+    if intestazione.startswith("Bearer "):
+        token = (
+            TokenAPI.objects.select_related("utente")
+            .filter(digest=_digest(intestazione[7:].strip()), attivo=True, utente__is_active=True)
+            .first()
+        )
+        if token is None:
+            return None
+        adesso = timezone.now()
+        if token.ultimo_uso is None or adesso - token.ultimo_uso > ULTIMO_USO_OGNI:
+            TokenAPI.objects.filter(pk=token.pk).update(ultimo_uso=adesso)
+        return token.utente
+    return request.user if request.user.is_authenticated else None
+
+
+# === INTERROGAZIONE ===
+def _albero_include(risorsa, testo):
+    """"righe.orari,paziente" -> {"righe": {"orari": {}}, "paziente": {}}, validato sulle relazioni."""
+    albero = {}
+    for percorso in filter(None, (testo or "").split(",")):
+        nodo, corrente = albero, risorsa
+        for nome in percorso.split("."):
+            if nome not in corrente.relazioni:
+                raise ErroreAPI(f"include non valido: {percorso}")
+            corrente = corrente.relazioni[nome].risorsa
+            nodo = nodo.setdefault(nome, {})
+    return albero
+
+
+def _campi_richiesti(request, risorsa, albero):
+    """{percorso include ("" = risorsa principale): campi} da fields= e fields[percorso]=."""
+    campi = {}
+    for chiave, valore in request.GET.items():
+        if chiave == "fields":
+            percorso = ""
+        elif chiave.startswith("fields[") and chiave.endswith("]"):
+            percorso = chiave[7:-1]
+        else:
+            continue
+        corrente, nodo = risorsa, albero
+        for nome in filter(None, percorso.split(".")):
+            if nome not in nodo:
+                raise ErroreAPI(f"{chiave}: relazione non inclusa")
+            corrente, nodo = corrente.relazioni[nome].risorsa, nodo[nome]
+        nomi = tuple(n for n in valore.split(",") if n and n != "id")
+        ignoti = set(nomi) - set(corrente.campi)
+        if ignoti:
+            raise ErroreAPI(f"{chiave}: campi non disponibili: {', '.join(sorted(ignoti))}")
+        campi[percorso] = nomi
+    return campi
+
+
+def _nomi_modello(modello, colonne):
+    per_colonna = {f.attname: f.name for f in modello._meta.concrete_fields}
+    return [per_colonna[c] for c in colonne]
+
+
+def _piano(risorsa, albero, campi, percorso="", prefisso=""):
+    """(campi per only(), percorsi select_related, Prefetch) della risorsa e delle relazioni incluse."""
+    colonne = ("id", *campi.get(percorso, risorsa.campi))
+    solo = [prefisso + n for n in _nomi_modello(risorsa.modello, colonne)]
+    select, prefetch = [], []
+    for nome, sotto in albero.items():
+        rel = risorsa.relazioni[nome]
+        percorso_figlio = f"{percorso}.{nome}" if percorso else nome
+        if rel.multipla:
+            # la FK verso il padre serve al prefetch per ricollegare le righe
+            verso_padre = risorsa.modello._meta.get_field(rel.campo).field.name
+            s, sel, pre = _piano(rel.risorsa, sotto, campi, percorso_figlio)
+            qs = rel.risorsa.modello.objects.only(*s, verso_padre).select_related(*sel).prefetch_related(*pre)
+            prefetch.append(Prefetch(prefisso + rel.campo, queryset=qs))
+        else:
+            solo.append(prefisso + rel.campo)
+            select.append(prefisso + rel.campo)
+            s, sel, pre = _piano(rel.risorsa, sotto, campi, percorso_figlio, f"{prefisso}{rel.campo}__")
+            solo += s
+            select += sel
+            prefetch += pre
+    return solo, select, prefetch
+
+
+def _serializza(obj, risorsa, albero, campi, percorso=""):
+    dati = {"id": obj.pk}
+    for colonna in campi.get(percorso, risorsa.campi):
+        dati[colonna] = getattr(obj, colonna)
+    for nome, sotto in albero.items():
+        rel = risorsa.relazioni[nome]
+        figlio = f"{percorso}.{nome}" if percorso else nome
+        valore = getattr(obj, rel.campo)
+        if rel.multipla:
+            dati[nome] = [_serializza(o, rel.risorsa, sotto, campi, figlio) for o in valore.all()]
+        else:
+            dati[nome] = _serializza(valore, rel.risorsa, sotto, campi, figlio) if valore is not None else None
+    return dati
+
+
+def _queryset(request, risorsa):
+    albero = _albero_include(risorsa, request.GET.get("include"))
+    campi = _campi_richiesti(request, risorsa, albero)
+    solo, select, prefetch = _piano(risorsa, albero, campi)
+    chiavi = [risorsa.modello._meta.get_field(c.lstrip("-")).name for c in risorsa.ordinamento]
+    qs = (
+        risorsa.modello.objects
+        .only(*solo, *chiavi)
+        .select_related(*select)
+        .prefetch_related(*prefetch)
+        .order_by(*risorsa.ordinamento)
+    )
+    for parametro, (lookup, conversione) in risorsa.filtri.items():
+        valore = request.GET.get(parametro)
+        if valore:
+            try:
+                qs = qs.filter(**{lookup: conversione(valore)})
+            except ValueError:
+                raise ErroreAPI(f"{parametro}: valore non valido")
+    if request.GET.get("id"):
+        try:
+            qs = qs.filter(pk__in=[int(v) for v in request.GET["id"].split(",")])
+        except ValueError:
+            raise ErroreAPI("id: valore non valido")
+    return qs, albero, campi
+
+
+# === CURSORE (keyset) ===
+def _a_testo(v):
+    # isoformat completo: DjangoJSONEncoder tronca i microsecondi e il cursore salterebbe righe
+    if isinstance(v, (date, time, datetime)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return str(v)
+    return v
+
+
+def _codifica_cursore(risorsa, obj):
+    valori = [_a_testo(getattr(obj, risorsa.modello._meta.get_field(c.lstrip("-")).attname)) for c in risorsa.ordinamento]
+    return base64.urlsafe_b64encode(json.dumps(valori).encode()).decode().rstrip("=")
+
+
+def _dopo_cursore(risorsa, cursore):
+    """Q delle righe che seguono il cursore: (a > x) OR (a = x AND b > y) OR ... (< per i campi decrescenti)."""
+    try:
+        valori = json.loads(base64.urlsafe_b64decode(cursore + "=" * (-len(cursore) % 4)))
+        if len(valori) != len(risorsa.ordinamento):
+            raise ValueError
+        campi = [risorsa.modello._meta.get_field(c.lstrip("-")) for c in risorsa.ordinamento]
+        valori = [f.target_field.to_python(v) if f.is_relation else f.to_python(v) for f, v in zip(campi, valori)]
+    except (ValueError, TypeError, binascii.Error, json.JSONDecodeError):
+        raise ErroreAPI("cursore non valido")
+    condizione = Q()
+    uguali = {}
+    for chiave, campo, valore in zip(risorsa.ordinamento, campi, valori):
+        confronto = "lt" if chiave.startswith("-") else "gt"
+        condizione |= Q(**uguali, **{f"{campo.attname}__{confronto}": valore})
+        uguali[campo.attname] = valore
+    return condizione
+
+
+# === RISPOSTE ===
+def _risposta(request, corpo):
+    contenuto = json.dumps(corpo, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+    etag = '"%s"' % hashlib.md5(contenuto, usedforsecurity=False).hexdigest()
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        risposta = HttpResponseNotModified()
+    else:
+        risposta = HttpResponse(contenuto, content_type="application/json")
+    risposta["ETag"] = etag
+    risposta["Cache-Control"] = "private, no-cache"
+    risposta["Vary"] = "Authorization, Cookie"
+    return risposta
+
+
+def _errore(messaggio, status):
+    return JsonResponse({"errore": messaggio}, status=status)
+
+
+def _csrf_rifiutato(request):
+    """Il controllo di CsrfViewMiddleware, per le viste esenti autenticate dalla sessione."""
+    return CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {}) is not None
+
+
+def _vista_api(funzione=None, *, metodi=("GET",)):
+    """
+    Autenticazione e conversione degli ErroreAPI in risposte JSON. Il CSRF si verifica qui e
+    solo per la sessione: con il token Bearer non c'è cookie che un altro sito possa sfruttare.
+    """
+    if funzione is None:
+        return lambda f: _vista_api(f, metodi=metodi)
+
+    @csrf_exempt
+    @require_http_methods(list(metodi))
+    def vista(request, *args, **kwargs):
+        utente = _utente(request)
+        if utente is None:
+            risposta = _errore("autenticazione richiesta", 401)
+            risposta["WWW-Authenticate"] = 'Bearer realm="novadomus"'
+            return risposta
+        if not request.headers.get("Authorization", "").startswith("Bearer ") and _csrf_rifiutato(request):
+            return _errore("verifica CSRF non riuscita", 403)
+        request.user = utente
+        try:
+            return funzione(request, *args, **kwargs)
+        except ErroreAPI as e:
+            return _errore(str(e), e.status)
+    vista.__name__ = funzione.__name__
+    return vista
+
+
+@_vista_api
+def elenco(request, risorsa):
+    """GET /api/v1/<risorsa>/: pagina di risultati e cursore della successiva."""
+    risorsa_api = RISORSE[risorsa]
+    qs, albero, campi = _queryset(request, risorsa_api)
+    try:
+        limite = min(max(int(request.GET.get("limite", LIMITE_PREDEFINITO)), 1), LIMITE_MASSIMO)
+    except ValueError:
+        raise ErroreAPI("limite: valore non valido")
+    if request.GET.get("cursore"):
+        qs = qs.filter(_dopo_cursore(risorsa_api, request.GET["cursore"]))
+    righe = list(qs[:limite + 1])
+    successivo = _codifica_cursore(risorsa_api, righe[limite - 1]) if len(righe) > limite else None
+    return _risposta(request, {
+        "dati": [_serializza(o, risorsa_api, albero, campi) for o in righe[:limite]],
+        "successivo": successivo,
+    })
+
+
+@_vista_api
+def dettaglio(request, risorsa, pk):
+    """GET /api/v1/<risorsa>/<id>/ (accetta fields= e include= come l'elenco)."""
+    if risorsa not in RISORSE:
+        raise ErroreAPI("risorsa inesistente", 404)
+    risorsa_api = RISORSE[risorsa]
+    qs, albero, campi = _queryset(request, risorsa_api)
+    obj = qs.filter(pk=pk).first()
+    if obj is None:
+        raise ErroreAPI("non trovato", 404)
+    return _risposta(request, {"dati": _serializza(obj, risorsa_api, albero, campi)})
+
+
+# === EXPORT FHIR IN BLOCCO ($export) ===
+FORMATI_NDJSON = {"application/fhir+ndjson", "application/ndjson", "ndjson"}
+
+
+def _esito_fhir(messaggio, status, severita="error"):
+    """OperationOutcome FHIR con un solo problema."""
+    return JsonResponse({
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": severita, "code": "processing" if status >= 500 else "invalid", "diagnostics": messaggio}],
+    }, status=status, content_type="application/fhir+json")
+
+
+def _job(request, pk):
+    job = EsportazioneFHIR.objects.filter(pk=pk, utente=request.user).exclude(stato=EsportazioneFHIR.Stato.ANNULLATA).first()
+    if job is None:
+        raise ErroreAPI("export inesistente", 404)
+    return job
+
+
+@_vista_api
+def fhir_export(request):
+    """
+    GET /fhir/$export?_type=Patient,Observation&_since=...: avvia l'export (202, Content-Location
+    con l'URL di stato). Una richiesta uguale ancora in coda o in corso restituisce lo stesso job.
+    """
+    tipi = [t.strip() for t in request.GET.get("_type", "").split(",") if t.strip()] or esportazione_fhir.TIPI
+    sconosciuti = [t for t in tipi if t not in esportazione_fhir.SORGENTI]
+    if sconosciuti:
+        return _esito_fhir(f"_type non supportati: {', '.join(sconosciuti)}", 400)
+    formato = request.GET.get("_outputFormat")
+    if formato and formato not in FORMATI_NDJSON:
+        return _esito_fhir("_outputFormat: supportato solo application/fhir+ndjson", 400)
+    dal = None
+    if request.GET.get("_since"):
+        try:
+            dal = _istante(request.GET["_since"])
+        except ValueError:
+            return _esito_fhir("_since: istante non valido", 400)
+
+    tipi = ",".join(dict.fromkeys(tipi))
+    job = EsportazioneFHIR.objects.filter(
+        utente=request.user, tipi=tipi, dal=dal,
+        stato__in=[EsportazioneFHIR.Stato.IN_CODA, EsportazioneFHIR.Stato.IN_CORSO],
+    ).first()
+    if job is None:
+        job = EsportazioneFHIR.objects.create(
+            utente=request.user, tipi=tipi, dal=dal, richiesta=request.build_absolute_uri()[:500],
+        )
+    risposta = HttpResponse(status=202)
+    risposta["Content-Location"] = request.build_absolute_uri(reverse("fhir_export_stato", args=[job.pk]))
+    return risposta
+
+
+@_vista_api(metodi=("GET", "DELETE"))
+def fhir_export_stato(request, pk):
+    """
+    GET: 202 con X-Progress finché il job è in coda o in corso, poi 200 con il manifest dei file
+    (500 con OperationOutcome se non è riuscito). DELETE: annulla il job o ne elimina i file.
+    """
+    job = _job(request, pk)
+    if request.method == "DELETE":
+        if job.stato == EsportazioneFHIR.Stato.IN_CORSO:
+            # il worker se ne accorge al prossimo aggiornamento e rimuove i file parziali
+            EsportazioneFHIR.objects.filter(pk=job.pk).update(stato=EsportazioneFHIR.Stato.ANNULLATA)
+        else:
+            esportazione_fhir.elimina(job)
+        return HttpResponse(status=202)
+
+    if job.stato in (EsportazioneFHIR.Stato.IN_CODA, EsportazioneFHIR.Stato.IN_CORSO):
+        risposta = HttpResponse(status=202)
+        risposta["X-Progress"] = job.avanzamento or job.get_stato_display()
+        risposta["Retry-After"] = "10"
+        return risposta
+    if job.stato == EsportazioneFHIR.Stato.ERRORE:
+        return _esito_fhir(job.errore or "export non riuscito", 500)
+    return JsonResponse({
+        "transactionTime": job.iniziata_il.isoformat(),
+        "request": job.richiesta,
+        "requiresAccessToken": True,
+        "output": [
+            {**f, "url": request.build_absolute_uri(reverse("fhir_export_file", args=[job.pk, f["type"]]))}
+            for f in job.file
+        ],
+        "error": [],
+    })
+
+
+@_vista_api
+def fhir_export_file(request, pk, tipo):
+    """GET: file NDJSON di un tipo di risorsa, inviato a blocchi dal disco."""
+    job = _job(request, pk)
+    if job.stato != EsportazioneFHIR.Stato.COMPLETATA or tipo not in job.elenco_tipi:
+        raise ErroreAPI("file inesistente", 404)
+    try:
+        f = open(esportazione_fhir.cartella(job) / f"{tipo}.ndjson", "rb")
+    except FileNotFoundError:
+        raise ErroreAPI("file scaduto o eliminato", 404)
+    return streaming_per_asgi(request, FileResponse(f, content_type="application/fhir+ndjson"))
@@ -0,0 +1,271 @@
+# core/audit.py
+"""
+Registro delle modifiche ai modelli clinici (RegistroModifica), campo per campo.
+
+Prima di salvare un'istanza già esistente se ne rilegge la riga (pre_save, una query per pk:
+caricare liste e diari non costa nulla); dopo il salvataggio la si confronta con i valori
+attuali e la differenza entra in un buffer in memoria (dopo il commit, se si è
+in una transazione: le modifiche annullate non si registrano). Un thread del processo
+scarica il buffer con bulk_create ogni AUDIT_FLUSH_S secondi, appena si raggiungono
+AUDIT_BATCH voci e all'uscita del processo: nella richiesta resta solo il confronto.
+"""
+import atexit
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from datetime import date
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from .models import (
+    Allergia, ContattoEmergenza, DiarioIgiene, Documento, Episodio, OrarioDose, ParametroVitale, Paziente,
+    Prescrizione, RecapitoContatto, RegistroModifica, RigaPrescrizione, Somministrazione, VoceIgiene,
+)
+
+logger = logging.getLogger("core.audit")
+
+MODELLI_CLINICI = (
+    Paziente, ContattoEmergenza, RecapitoContatto, Allergia, Episodio, Prescrizione, RigaPrescrizione,
+    OrarioDose, Somministrazione, ParametroVitale, VoceIgiene, DiarioIgiene, Documento,
+)
+
+# cambiano a ogni salvataggio senza dire nulla sulla modifica
+CAMPI_ESCLUSI = {"creato_il", "aggiornato_il"}
+
+_richiesta = ContextVar("core_audit_richiesta", default=None)
+_campi_per_modello = {}
+
+
+def _campi(modello):
+    campi = _campi_per_modello.get(modello)
+    if campi is None:
+        campi = _campi_per_modello[modello] = tuple(
+            f.attname for f in modello._meta.concrete_fields if f.attname not in CAMPI_ESCLUSI
+        )
+    return campi
+
+
+def _valore(v):
+    return v.name if isinstance(v, FieldFile) else v
+
+
+def istantanea(instance):
+    """Valori dei campi presenti sull'istanza (i campi differiti restano fuori)."""
+    d = instance.__dict__
+    return {f: _valore(d[f]) for f in _campi(type(instance)) if f in d}
+
+
+def istantanea_dal_db(instance, using):
+    """Valori della riga salvata dell'istanza, com'erano prima del salvataggio in corso."""
+    modello = type(instance)
+    riga = modello._base_manager.using(using).filter(pk=instance.pk).values(*_campi(modello)).first()
+    return riga or {}
+
+
+def _utente(instance):
+    richiesta = _richiesta.get()
+    utente = getattr(richiesta, "user", None)
+    if utente is not None and utente.is_authenticated:
+        return utente.pk
+    return getattr(instance, "aggiornato_da_id", None)
+
+
+# === BUFFER ===
+class _Buffer:
+    def __init__(self):
+        self._voci = []
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def aggiungi(self, voce):
+        with self._lock:
+            if self._pid != os.getpid():  # dopo un fork (worker gunicorn) il thread del padre non esiste
+                self._pid, self._thread = os.getpid(), None
+            self._voci.append(voce)
+            pieno = len(self._voci) >= settings.AUDIT_BATCH
+            if self._thread is None and settings.AUDIT_THREAD:
+                self._thread = threading.Thread(target=self._ciclo, name="audit-flush", daemon=True)
+                self._thread.start()
+        if pieno:
+            if settings.AUDIT_THREAD:
+                self._sveglia.set()
+            else:
+                self.scarica()
+
+    def scarica(self):
+        """Scrive il buffer con bulk_create; in caso di errore le voci tornano in coda (entro AUDIT_MAX_BUFFER)."""
+        with self._lock:
+            voci, self._voci = self._voci, []
+        if not voci:
+            return 0
+        _partizioni_del_mese()
+        try:
+            RegistroModifica.objects.bulk_create(
+                [RegistroModifica(**v) for v in voci], batch_size=settings.AUDIT_BATCH,
+            )
+        except Exception:
+            logger.exception("Scrittura di %d voci del registro modifiche non riuscita", len(voci))
+            with self._lock:
+                self._voci[:0] = voci
+                perse = len(self._voci) - settings.AUDIT_MAX_BUFFER
+                if perse > 0:
+                    del self._voci[:perse]
+                    logger.error("Registro modifiche: %d voci scartate (buffer pieno)", perse)
+            return 0
+        return len(voci)
+
+    def _ciclo(self):
+        while True:
+            self._sveglia.wait(settings.AUDIT_FLUSH_S)
+            self._sveglia.clear()
+            try:
+                self.scarica()
+            finally:
+                close_old_connections()
+
+
+buffer = _Buffer()
+atexit.register(buffer.scarica)
+
+
+def registra(instance, azione, modifiche, using):
+    if not modifiche:
+        return
+    voce = {
+        "istante": timezone.now(),
+        "modello": instance._meta.label_lower,
+        "oggetto_id": str(instance.pk),
+        "azione": azione,
+        "utente_id": _utente(instance),
+        "modifiche": modifiche,
+    }
+    if connections[using].in_atomic_block:
+        transaction.on_commit(lambda: buffer.aggiungi(voce), using=using)
+    else:
+        buffer.aggiungi(voce)
+
+
+def valori_iniziali(instance):
+    """Modifiche di una creazione: i campi valorizzati, da None al valore."""
+    return {f: [None, v] for f, v in istantanea(instance).items() if v not in (None, "")}
+
+
+def registra_creazioni(oggetti, using):
+    """Voci "C" per oggetti inseriti con bulk_create, che non emette post_save."""
+    for obj in oggetti:
+        if isinstance(obj, MODELLI_CLINICI):
+            registra(obj, "C", valori_iniziali(obj), using)
+
+
+def differenze(prima, dopo):
+    return {f: [prima.get(f), v] for f, v in dopo.items() if f in prima and prima[f] != v}
+
+
+class AuditMiddleware:
+    """Rende disponibile la richiesta (quindi l'utente) alle voci del registro prodotte dalla view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _richiesta.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _richiesta.reset(token)
+
+    async def __acall__(self, request):
+        token = _richiesta.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _richiesta.reset(token)
+
+
+# === PARTIZIONI (solo PostgreSQL) ===
+def _mese_successivo(mese):
+    return date(mese.year + mese.month // 12, mese.month % 12 + 1, 1)
+
+
+def assicura_partizioni(mesi_avanti=2, oggi=None):
+    """
+    Crea le partizioni mensili dal mese corrente a quello tra ``mesi_avanti`` mesi; restituisce i nomi creati.
+    Le righe del mese già finite nella partizione DEFAULT (che altrimenti impedirebbe la CREATE)
+    vengono spostate nella nuova partizione, nella stessa transazione.
+    """
+    if connection.vendor != "postgresql":
+        return []
+    tabella = RegistroModifica._meta.db_table
+    mese = (oggi or timezone.localdate()).replace(day=1)
+    create = []
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute("SELECT relname FROM pg_class WHERE relname LIKE %s", [f"{tabella}%"])
+        esistenti = {r[0] for r in cur.fetchall()}
+        for _ in range(mesi_avanti + 1):
+            nome, fine = f"{tabella}_p{mese:%Y_%m}", _mese_successivo(mese)
+            if nome not in esistenti:
+                if f"{tabella}_default" in esistenti:
+                    cur.execute(f"CREATE TEMP TABLE {nome}_sposta (LIKE {tabella}) ON COMMIT DROP")
+                    cur.execute(
+                        f"WITH spostate AS (DELETE FROM {tabella}_default WHERE istante >= %s AND istante < %s "
+                        f"RETURNING *) INSERT INTO {nome}_sposta SELECT * FROM spostate",
+                        [mese, fine],
+                    )
+                cur.execute(f"CREATE TABLE {nome} PARTITION OF {tabella} FOR VALUES FROM ('{mese}') TO ('{fine}')")
+                if f"{tabella}_default" in esistenti:
+                    cur.execute(f"INSERT INTO {tabella} SELECT * FROM {nome}_sposta")
+                create.append(nome)
+            mese = fine
+    return create
+
+
+_mese_partizioni = None
+
+
+def _partizioni_del_mese():
+    """Al primo scarico di ogni mese (per processo) crea le partizioni in anticipo: niente cron da ricordare."""
+    global _mese_partizioni
+    mese = timezone.localdate().replace(day=1)
+    if mese == _mese_partizioni:
+        return
+    try:
+        create = assicura_partizioni()
+    except Exception:  # un altro processo le sta creando, o mancano i permessi: riprova al prossimo scarico
+        logger.warning("Partizioni del registro modifiche non create", exc_info=True)
+        return
+    _mese_partizioni = mese
+    if create:
+        logger.info("Partizioni del registro modifiche create: %s", ", ".join(create))
+
+
+def stacca_partizioni(prima_di):
+    """Stacca (senza cancellarle) le partizioni dei mesi precedenti a ``prima_di``, da archiviare a parte."""
+    if connection.vendor != "postgresql":
+        return []
+    tabella = RegistroModifica._meta.db_table
+    limite = f"{tabella}_p{prima_di.replace(day=1):%Y_%m}"
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s AND c.relname LIKE %s ORDER BY 1",
+            [tabella, f"{tabella}_p%"],
+        )
+        staccate = [r[0] for r in cur.fetchall() if r[0] < limite]
+        for nome in staccate:
+            cur.execute(f"ALTER TABLE {tabella} DETACH PARTITION {nome}")
+    return staccate
@@ -0,0 +1,165 @@
+# core/benchmark.py
+"""
+Benchmark delle viste di core/urls.py sul database corrente (tipicamente generato con
+``genera_dati``): tempo mediano/p95 e numero di query per rotta, confrontati con una
+baseline salvata in JSON.
+"""
+import json
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from .models import (
+    AssegnazioneTurno, ContattoEmergenza, DiarioIgiene, Dipendente, Episodio, EsportazioneFHIR, MenuPeriodo,
+    ParametroVitale, Paziente, PianoTurniPeriodo, Somministrazione,
+)
+
+
+# rotte con effetti anche in GET (fhir_export mette in coda un job): mai misurate a ripetizione
+ROTTE_CON_EFFETTI = {"fhir_export", "sincronizzazione"}
+
+
+def rotte_core():
+    return [p.name for p in get_resolver("core.urls").url_patterns if getattr(p, "name", None)]
+
+
+def argomenti_rotte(utente=None):
+    """
+    {nome rotta: (kwargs, query string)} con oggetti reali del database: l'ospite in degenza
+    con più dati, il menu e il piano turni del mese corrente, un dipendente attivo, l'ultimo
+    export FHIR completato dell'utente. Le rotte che richiedono oggetti assenti restano fuori,
+    come quelle di ROTTE_CON_EFFETTI.
+    """
+    oggi = timezone.localdate()
+    episodio = Episodio.objects.filter(data_fine__isnull=True).order_by("data_inizio").first()
+    paziente = episodio.paziente if episodio else Paziente.objects.first()
+    contatto = ContattoEmergenza.objects.filter(paziente=paziente).first() if paziente else None
+    menu = (MenuPeriodo.objects.filter(data_inizio__lte=oggi, data_fine__gte=oggi).first()
+            or MenuPeriodo.objects.first())
+    periodo = (PianoTurniPeriodo.objects.filter(data_inizio__lte=oggi, data_fine__gte=oggi).first()
+               or PianoTurniPeriodo.objects.first())
+    dipendente = Dipendente.objects.filter(attivo=True, token_calendario__isnull=False).first()
+    esportazione = EsportazioneFHIR.objects.filter(utente=utente, stato=EsportazioneFHIR.Stato.COMPLETATA).first()
+
+    args = {nome: ({}, "") for nome in rotte_core() if nome not in ROTTE_CON_EFFETTI}
+    per_oggetto = {
+        "paziente_setup": paziente and ({"pk": paziente.pk}, ""),
+        "paziente_anagrafica": paziente and ({}, f"?p={paziente.pk}"),
+        "contatti_edit": paziente and ({"pk": paziente.pk}, ""),
+        "contatto_nuovo": paziente and ({"pk": paziente.pk}, ""),
+        "contatto_modifica": contatto and ({"cid": contatto.pk}, ""),
+        "allergie_edit": paziente and ({"pk": paziente.pk}, ""),
+        "menu_settimana_editor": menu and ({"pk": menu.pk}, ""),
+        "report_menu_periodo_print": menu and ({"pk": menu.pk}, ""),
+        "report_lista_spesa": menu and ({"pk": menu.pk}, ""),
+        "turni_periodo_gestisci": periodo and ({"pk": periodo.pk}, ""),
+        "turni_copertura": periodo and ({"pk": periodo.pk}, ""),
+        "turni_calendario_ics": dipendente and ({"token": dipendente.token_calendario}, ""),
+        "report_ore_csv": ({}, f"?mese={oggi:%Y-%m}"),
+        "export_diario": ({"diario": "parametri", "formato": "xlsx"}, f"?dal={oggi - timedelta(days=90)}&al={oggi}"),
+        "api_dettaglio": paziente and ({"risorsa": "pazienti", "pk": paziente.pk}, ""),
+        "somministrazione_righe": paziente and ({}, f"?paziente={paziente.pk}"),
+        "fhir_export_stato": esportazione and ({"pk": esportazione.pk}, ""),
+        "fhir_export_file": esportazione and ({"pk": esportazione.pk, "tipo": "Patient"}, ""),
+    }
+    for nome, valore in per_oggetto.items():
+        if valore:
+            args[nome] = valore
+        else:
+            args.pop(nome, None)
+    # le viste diario, filtrate sull'ospite, sono il caso d'uso quotidiano più frequente
+    if paziente:
+        for nome in ("parametri_diario", "igiene_diario", "terapia_diario", "prescrizioni_lista"):
+            args[f"{nome}?paziente"] = ({}, f"?paziente={paziente.pk}")
+        # stessi dati via API, da confrontare con le pagine HTML
+        args["api_prescrizioni?include"] = ({}, f"?paziente={paziente.pk}&attiva=1&include=righe.orari,righe.farmaco")
+        args["api_parametri?paziente"] = ({}, f"?paziente={paziente.pk}")
+    return args
+
+
+def _percentile(valori, p):
+    ordinati = sorted(valori)
+    return ordinati[min(len(ordinati) - 1, round(p / 100 * (len(ordinati) - 1)))]
+
+
+def esegui(utente, ripetizioni=5, filtro=None, senza_cache=False):
+    """Misura ogni rotta (un giro di riscaldamento escluso): {chiave: {mediana_ms, p95_ms, query, status}}."""
+    client = Client()
+    client.force_login(utente)
+    risultati = {}
+    with override_settings(ALLOWED_HOSTS=["testserver"]):
+        for chiave, (kwargs, query_string) in sorted(argomenti_rotte(utente).items()):
+            nome = chiave.split("?")[0]
+            if filtro and not any(f in chiave for f in filtro):
+                continue
+            url = reverse(nome, kwargs=kwargs) + query_string
+            tempi, n_query, status = [], 0, None
+            for i in range(ripetizioni + 1):
+                if senza_cache:
+                    cache.clear()
+                with CaptureQueriesContext(connection) as ctx:
+                    t0 = time.perf_counter()
+                    response = client.get(url)
+                    if getattr(response, "streaming", False):
+                        for _ in response.streaming_content:
+                            pass
+                    durata = (time.perf_counter() - t0) * 1000
+                if i == 0:
+                    status = response.status_code
+                    continue  # riscaldamento
+                tempi.append(durata)
+                n_query = len(ctx.captured_queries)
+            risultati[chiave] = {
+                "mediana_ms": round(statistics.median(tempi), 2),
+                "p95_ms": round(_percentile(tempi, 95), 2),
+                "query": n_query,
+                "status": status,
+            }
+    return risultati
+
+
+def dimensioni_dataset():
+    return {
+        m.__name__: m.objects.count()
+        for m in (Paziente, Episodio, Somministrazione, ParametroVitale, DiarioIgiene, AssegnazioneTurno)
+    }
+
+
+def salva_baseline(percorso, risultati):
+    dati = {
+        "creato_il": timezone.now().isoformat(timespec="seconds"),
+        "dataset": dimensioni_dataset(),
+        "rotte": risultati,
+    }
+    Path(percorso).write_text(json.dumps(dati, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def carica_baseline(percorso):
+    return json.loads(Path(percorso).read_text(encoding="utf-8"))
+
+
+def confronta(risultati, baseline, soglia_pct=20, minimo_ms=2):
+    """
+    Righe di confronto con la baseline: (chiave, base, attuale, delta %, regressione).
+    È regressione un aumento delle query o un tempo mediano oltre soglia (e oltre minimo_ms in assoluto,
+    per non segnalare il rumore delle viste da pochi millisecondi).
+    """
+    righe = []
+    base_rotte = baseline.get("rotte", {})
+    for chiave, attuale in sorted(risultati.items()):
+        base = base_rotte.get(chiave)
+        if base is None:
+            righe.append((chiave, None, attuale, None, False))
+            continue
+        delta = (attuale["mediana_ms"] - base["mediana_ms"]) / base["mediana_ms"] * 100 if base["mediana_ms"] else 0
+        lenta = delta > soglia_pct and attuale["mediana_ms"] - base["mediana_ms"] > minimo_ms
+        righe.append((chiave, base, attuale, delta, lenta or attuale["query"] > base["query"]))
+    return righe
@@ -0,0 +1,231 @@
+# core/cache.py
+"""
+Cache applicativa a due livelli e chiavi versionate per modello.
+
+``CacheLivelli`` (backend di CACHES["default"]) tiene un LRU per processo davanti alla
+cache condivisa (CACHES["condivisa"]: file di default, Redis con CACHE_URL=redis://...).
+Le voci normali restano nel livello locale al più TTL_LOCALE secondi, così una delete fatta
+da un altro worker si vede entro quel tempo; le voci versionate ("vm:...") sono immutabili
+e restano locali per tutto il loro timeout.
+
+Le chiavi versionate includono la generazione dei modelli da cui dipende il dato:
+ogni save/delete di un modello TracciaMixin incrementa la sua generazione (core/signals.py),
+quindi le voci vecchie non vengono più lette e scadono da sole, senza invalidazioni a mano.
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger("core.cache")
+
+PREFISSO_VERSIONATE = "vm:"
+PREFISSO_GENERAZIONE = "gen:"
+
+_MANCANTE = object()
+
+
+class CacheLivelli(BaseCache):
+    """LRU locale (per processo) davanti a un'altra cache di CACHES, con conteggio di hit e miss."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        opzioni = params.get("OPTIONS", {})
+        self._alias_condivisa = opzioni.get("CONDIVISA", location or "condivisa")
+        self._max_voci = int(opzioni.get("MAX_VOCI", 1000))
+        self._ttl_locale = float(opzioni.get("TTL_LOCALE", 5))
+        self._metriche_ogni = int(opzioni.get("METRICHE_OGNI", 0))  # 0 = nessun log periodico
+        # chiave -> (scadenza monotonic, valore serializzato): come LocMemCache, chi legge riceve una copia
+        self._locale = OrderedDict()
+        self._lock = threading.Lock()
+        self.statistiche = Counter()
+
+    @property
+    def condivisa(self):
+        return caches[self._alias_condivisa]
+
+    # --- livello locale ---
+    def _chiave(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def _leggi_locale(self, k):
+        with self._lock:
+            voce = self._locale.get(k)
+            if voce is None:
+                return _MANCANTE
+            if voce[0] < time.monotonic():
+                del self._locale[k]
+                return _MANCANTE
+            self._locale.move_to_end(k)
+        return pickle.loads(voce[1])
+
+    def _scrivi_locale(self, key, k, value, timeout):
+        ttl = self._ttl_locale
+        if key.startswith(PREFISSO_VERSIONATE):
+            ttl = 86400 if timeout is None else timeout
+        elif timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            return
+        dati = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._locale[k] = (time.monotonic() + ttl, dati)
+            self._locale.move_to_end(k)
+            while len(self._locale) > self._max_voci:
+                self._locale.popitem(last=False)
+
+    def _scarta_locale(self, k):
+        with self._lock:
+            self._locale.pop(k, None)
+
+    def _conta(self, esito):
+        self.statistiche[esito] += 1
+        if self._metriche_ogni and sum(self.statistiche.values()) % self._metriche_ogni == 0:
+            logger.info("cache: %s", metriche())
+
+    # --- API BaseCache ---
+    def get(self, key, default=None, version=None):
+        k = self._chiave(key, version)
+        valore = self._leggi_locale(k)
+        if valore is not _MANCANTE:
+            self._conta("hit_locale")
+            return valore
+        valore = self.condivisa.get(key, _MANCANTE, version=version)
+        if valore is _MANCANTE:
+            self._conta("miss")
+            return default
+        self._conta("hit_condivisa")
+        self._scrivi_locale(key, k, valore, None)
+        return valore
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        k = self._chiave(key, version)
+        timeout = self.get_backend_timeout(timeout)
+        self.condivisa.set(key, value, timeout=self._secondi(timeout), version=version)
+        self._scrivi_locale(key, k, value, self._secondi(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        aggiunto = self.condivisa.add(key, value, timeout=self._secondi(timeout), version=version)
+        if aggiunto:
+            self._scrivi_locale(key, self._chiave(key, version), value, self._secondi(timeout))
+        return aggiunto
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        return self.condivisa.touch(key, timeout=self._secondi(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._scarta_locale(self._chiave(key, version))
+        return self.condivisa.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._scarta_locale(self._chiave(key, version))
+        return self.condivisa.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        if self._leggi_locale(self._chiave(key, version)) is not _MANCANTE:
+            return True
+        return self.condivisa.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._locale.clear()
+        self.condivisa.clear()
+
+    def close(self, **kwargs):
+        self.condivisa.close(**kwargs)
+
+    @staticmethod
+    def _secondi(scadenza):
+        # get_backend_timeout restituisce una scadenza assoluta (o None); la cache condivisa vuole secondi
+        return None if scadenza is None else max(0, scadenza - time.time())
+
+
+# === GENERAZIONI PER MODELLO ===
+def _condivisa():
+    """Le generazioni si leggono sempre dal livello condiviso: devono essere uguali in tutti i processi."""
+    return getattr(cache, "condivisa", cache)
+
+
+def _chiave_generazione(modello):
+    return f"{PREFISSO_GENERAZIONE}{modello._meta.label_lower}"
+
+
+def generazioni(*modelli):
+    """{modello: generazione corrente}. Una generazione assente parte dall'ora in nanosecondi,
+    così dopo uno sfratto non può ripetere un valore già usato."""
+    condivisa = _condivisa()
+    chiavi = {_chiave_generazione(m): m for m in modelli}
+    valori = condivisa.get_many(list(chiavi))
+    mancanti = [k for k in chiavi if k not in valori]
+    if mancanti:
+        for k in mancanti:
+            condivisa.add(k, time.time_ns(), timeout=None)
+        valori.update(condivisa.get_many(mancanti))
+    return {m: valori.get(k, 0) for k, m in chiavi.items()}
+
+
+def _incrementa(modelli):
+    condivisa = _condivisa()
+    for m in modelli:
+        k = _chiave_generazione(m)
+        try:
+            condivisa.incr(k)
+            condivisa.touch(k, timeout=None)  # l'incr generico di BaseCache riscrive con il timeout di default
+        except ValueError:  # mai letta o scaduta
+            condivisa.set(k, time.time_ns(), timeout=None)
+
+
+def incrementa_generazione(*modelli, using=DEFAULT_DB_ALIAS):
+    """
+    Rende obsolete le voci versionate che dipendono dai modelli indicati. Subito, per le letture
+    successive dello stesso processo, e di nuovo al commit: una richiesta concorrente che ha letto
+    i dati prima del commit potrebbe averli salvati con la generazione appena incrementata.
+    Da chiamare a mano dopo bulk_create/update/SQL diretto, che non emettono segnali.
+    """
+    _incrementa(modelli)
+    if connections[using].in_atomic_block:
+        transaction.on_commit(lambda: _incrementa(modelli), using=using)
+
+
+def chiave_versionata(prefisso, modelli, *parti):
+    gen = generazioni(*modelli)
+    versioni = ".".join(str(gen[m]) for m in modelli)
+    return f"{PREFISSO_VERSIONATE}{prefisso}:{versioni}:" + ":".join(str(p) for p in parti)
+
+
+# hit/miss delle voci versionate per prefisso (per processo)
+_metriche_prefissi = Counter()
+
+
+def in_cache(prefisso, modelli, calcola, *parti, timeout=3600):
+    """
+    Valore derivato dai modelli indicati (più le parti che identificano la variante, es. l'anno),
+    calcolato con ``calcola()`` solo se manca per le generazioni correnti.
+    """
+    chiave = chiave_versionata(prefisso, modelli, *parti)
+    valore = cache.get(chiave, _MANCANTE)
+    if valore is not _MANCANTE:
+        _metriche_prefissi[(prefisso, "hit")] += 1
+        return valore
+    _metriche_prefissi[(prefisso, "miss")] += 1
+    valore = calcola()
+    cache.set(chiave, valore, timeout)
+    return valore
+
+
+def metriche():
+    """Contatori del processo: esiti per livello (se la cache è a livelli) e hit/miss per prefisso versionato."""
+    dati = {"livelli": dict(getattr(cache, "statistiche", {})), "prefissi": {}}
+    for (prefisso, esito), n in sorted(_metriche_prefissi.items()):
+        dati["prefissi"].setdefault(prefisso, {"hit": 0, "miss": 0})[esito] = n
+    for voce in dati["prefissi"].values():
+        totale = voce["hit"] + voce["miss"]
+        voce["hit_ratio"] = round(voce["hit"] / totale, 3) if totale else None
+    return dati
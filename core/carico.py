@@ -0,0 +1,223 @@
+# core/carico.py
+"""
+Generatore di carico asyncio (solo libreria standard) che simula il cambio turno:
+N infermieri si autenticano e alternano registrazioni di somministrazioni e parametri
+con letture di diari e schede, contro un server locale (runserver o gunicorn del Procfile).
+Riporta throughput, latenze p50/p95/p99 ed errori per rotta.
+"""
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.utils import timezone
+
+from .models import Episodio, RigaPrescrizione
+
+
+@dataclass
+class Risposta:
+    status: int
+    intestazioni: dict
+    corpo: bytes
+
+
+@dataclass
+class StatisticheRotta:
+    latenze_ms: list = field(default_factory=list)
+    errori: int = 0
+    stati: dict = field(default_factory=dict)
+
+    def registra(self, ms, status, ok):
+        self.latenze_ms.append(ms)
+        self.stati[status] = self.stati.get(status, 0) + 1
+        if not ok:
+            self.errori += 1
+
+    def percentile(self, p):
+        if not self.latenze_ms:
+            return 0.0
+        ordinate = sorted(self.latenze_ms)
+        return ordinate[min(len(ordinate) - 1, int(p / 100 * len(ordinate)))]
+
+
+class ClienteHTTP:
+    """Client HTTP/1.1 minimale con cookie di sessione; una connessione per richiesta (worker sync di gunicorn)."""
+
+    def __init__(self, base_url, timeout=30):
+        parti = urlsplit(base_url)
+        self.host, self.porta = parti.hostname, parti.port or 80
+        self.timeout = timeout
+        self.cookie = {}
+
+    @property
+    def csrf(self):
+        return self.cookie.get("csrftoken", "")
+
+    async def richiesta(self, metodo, percorso, dati=None):
+        corpo = urlencode(dati or {}, doseq=True).encode() if metodo == "POST" else b""
+        righe = [
+            f"{metodo} {percorso} HTTP/1.1",
+            f"Host: {self.host}:{self.porta}",
+            "Connection: close",
+            "User-Agent: novadomus-carico",
+        ]
+        if self.cookie:
+            righe.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookie.items()))
+        if metodo == "POST":
+            righe += ["Content-Type: application/x-www-form-urlencoded", f"Content-Length: {len(corpo)}",
+                      f"X-CSRFToken: {self.csrf}"]
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.porta), self.timeout)
+        try:
+            writer.write(("\r\n".join(righe) + "\r\n\r\n").encode() + corpo)
+            await writer.drain()
+            grezza = await asyncio.wait_for(reader.read(), self.timeout)  # fino alla chiusura
+        finally:
+            writer.close()
+        return self._interpreta(grezza)
+
+    def _interpreta(self, grezza):
+        testata, _, corpo = grezza.partition(b"\r\n\r\n")
+        righe = testata.decode("latin-1").split("\r\n")
+        status = int(righe[0].split()[1])
+        intestazioni = {}
+        for riga in righe[1:]:
+            nome, _, valore = riga.partition(":")
+            nome, valore = nome.strip().lower(), valore.strip()
+            if nome == "set-cookie":
+                for k, morsel in SimpleCookie(valore).items():
+                    if morsel.value:
+                        self.cookie[k] = morsel.value
+                    else:
+                        self.cookie.pop(k, None)
+            intestazioni[nome] = valore
+        if intestazioni.get("transfer-encoding") == "chunked":
+            corpo = _dechunk(corpo)
+        return Risposta(status, intestazioni, corpo)
+
+
+def _dechunk(dati):
+    out, i = bytearray(), 0
+    while True:
+        fine = dati.index(b"\r\n", i)
+        n = int(dati[i:fine].split(b";")[0], 16)
+        if n == 0:
+            return bytes(out)
+        out += dati[fine + 2:fine + 2 + n]
+        i = fine + 2 + n + 2
+
+
+def dati_reparto():
+    """Ospiti in degenza con le righe di terapia attive: i bersagli delle registrazioni simulate."""
+    pazienti = list(Episodio.objects.filter(data_fine__isnull=True).values_list("paziente_id", flat=True))
+    righe = {}
+    for riga_id, paziente_id, dose in (
+        RigaPrescrizione.objects
+        .filter(prescrizione__attiva=True, prescrizione__paziente_id__in=pazienti)
+        .values_list("id", "prescrizione__paziente_id", "dose_val")
+    ):
+        righe.setdefault(paziente_id, []).append((riga_id, dose))
+    return {"pazienti": pazienti, "righe": righe}
+
+
+# (nome, peso): mix di un cambio turno, in prevalenza registrazioni
+MIX_CAMBIO_TURNO = [
+    ("somministrazione", 35),
+    ("parametro", 20),
+    ("diario_parametri", 20),
+    ("scheda", 15),
+    ("diario_terapia", 10),
+]
+
+
+class Infermiere:
+    def __init__(self, n, base_url, credenziali, reparto, statistiche, rnd, pensiero_s):
+        self.n = n
+        self.http = ClienteHTTP(base_url)
+        self.credenziali = credenziali
+        self.reparto = reparto
+        self.stat = statistiche
+        self.rnd = rnd
+        self.pensiero_s = pensiero_s
+
+    async def _misura(self, rotta, metodo, percorso, dati=None, attesi=(200,)):
+        t0 = time.perf_counter()
+        try:
+            r = await self.http.richiesta(metodo, percorso, dati)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            self.stat.setdefault(rotta, StatisticheRotta()).registra((time.perf_counter() - t0) * 1000, "errore rete", False)
+            return None
+        self.stat.setdefault(rotta, StatisticheRotta()).registra((time.perf_counter() - t0) * 1000, r.status, r.status in attesi)
+        return r
+
+    async def accedi(self):
+        await self._misura("login GET", "GET", "/login/")
+        utente, password = self.credenziali
+        r = await self._misura("login POST", "POST", "/login/", {
+            "username": utente, "password": password, "csrfmiddlewaretoken": self.http.csrf,
+        }, attesi=(302,))
+        return bool(r and r.status == 302)
+
+    def _paziente(self):
+        return self.rnd.choice(self.reparto["pazienti"])
+
+    async def somministrazione(self):
+        pazienti = [p for p in self.reparto["pazienti"] if p in self.reparto["righe"]]
+        if not pazienti:
+            return await self.diario_terapia()
+        pid = self.rnd.choice(pazienti)
+        await self._misura("somministrazione_nuova GET", "GET", f"/terapia/somministrazioni/nuova/?paziente={pid}")
+        riga_id, dose = self.rnd.choice(self.reparto["righe"][pid])
+        adesso = timezone.localtime()
+        await self._misura("somministrazione_nuova POST", "POST", "/terapia/somministrazioni/nuova/", {
+            "paziente": pid, "riga": riga_id, "stato": "SOMMINISTRATO", "dose_erogata": dose,
+            "programmata_il": (adesso - timedelta(minutes=self.rnd.randint(0, 30))).strftime("%Y-%m-%dT%H:00"),
+            "data_ora": adesso.strftime("%Y-%m-%dT%H:%M"), "csrfmiddlewaretoken": self.http.csrf,
+        }, attesi=(302,))
+
+    async def parametro(self):
+        pid = self._paziente()
+        await self._misura("parametro_nuovo GET", "GET", f"/parametri/nuovo/?paziente={pid}")
+        await self._misura("parametro_nuovo POST", "POST", "/parametri/nuovo/", {
+            "paziente": pid, "rilevato_il": timezone.localtime().strftime("%Y-%m-%dT%H:%M"),
+            "pas": self.rnd.randint(105, 160), "pad": self.rnd.randint(60, 95), "fc": self.rnd.randint(55, 100),
+            "spo2": self.rnd.randint(90, 99), "temp_c": f"{self.rnd.uniform(35.8, 37.6):.1f}",
+            "csrfmiddlewaretoken": self.http.csrf,
+        }, attesi=(302,))
+
+    async def diario_parametri(self):
+        await self._misura("parametri_diario", "GET", f"/parametri/diario/?paziente={self._paziente()}")
+
+    async def scheda(self):
+        await self._misura("paziente_anagrafica", "GET", f"/pazienti/anagrafica/?p={self._paziente()}")
+
+    async def diario_terapia(self):
+        await self._misura("terapia_diario", "GET", f"/terapia/diario/?paziente={self._paziente()}")
+
+    async def turno(self, scadenza, ritardo_s):
+        await asyncio.sleep(ritardo_s)  # ingresso scaglionato nella rampa
+        if not await self.accedi():
+            return
+        azioni = [nome for nome, _ in MIX_CAMBIO_TURNO]
+        pesi = [peso for _, peso in MIX_CAMBIO_TURNO]
+        while time.monotonic() < scadenza:
+            await getattr(self, self.rnd.choices(azioni, pesi)[0])()
+            if self.pensiero_s:
+                await asyncio.sleep(self.rnd.expovariate(1 / self.pensiero_s))
+
+
+async def esegui_carico(base_url, credenziali, reparto, infermieri=50, durata_s=60, rampa_s=10, pensiero_s=1.0, seed=1):
+    """Esegue lo scenario e restituisce ({rotta: StatisticheRotta}, secondi effettivi)."""
+    rnd = random.Random(seed)
+    statistiche = {}
+    inizio = time.monotonic()
+    scadenza = inizio + rampa_s + durata_s
+    gruppo = [
+        Infermiere(i, base_url, credenziali, reparto, statistiche, random.Random(rnd.random()), pensiero_s)
+        for i in range(infermieri)
+    ]
+    await asyncio.gather(*(inf.turno(scadenza, rampa_s * i / max(1, infermieri)) for i, inf in enumerate(gruppo)))
+    return statistiche, time.monotonic() - inizio
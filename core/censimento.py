@@ -0,0 +1,246 @@
+# core/censimento.py
+"""
+Censimento giornaliero degli ospiti (giornate di degenza) e storico dei letti.
+
+Convenzione: è giornata di degenza ogni giorno D con data_inizio <= D < data_fine
+(il giorno di dimissione non si conta); per gli episodi aperti fino a oggi incluso.
+Le modifiche a un episodio aggiornano solo le sue righe, e solo nei giorni toccati dai campi
+cambiati (CAMPI_CENSIMENTO, confrontati dal signal pre_save); il comando ``censimento``
+estende ogni giorno gli episodi aperti e, con --ricostruisci, rigenera tutto con
+una join set-based su una serie di date (generate_series / CTE ricorsiva). Il report
+mensile conta comunque gli episodi aperti fino a oggi, anche se il comando è indietro.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .cache import in_cache, incrementa_generazione
+from .models import Episodio, GiornataDegenza, PermanenzaLetto
+
+# campi dell'episodio da cui dipendono le giornate: se non cambiano, il salvataggio non tocca il censimento
+CAMPI_CENSIMENTO = ("data_inizio", "data_fine", "letto_id", "provenienza", "paziente_id")
+
+
+# === STORICO LETTI ===
+def _giorno_trasferimento(episodio, giorno=None):
+    """Giorno del cambio letto (default oggi), entro le date dell'episodio."""
+    giorno = max(giorno or timezone.localdate(), episodio.data_inizio)
+    return min(giorno, episodio.data_fine) if episodio.data_fine else giorno
+
+
+def registra_permanenze(episodio, letto_prec=None, data_fine_prec=None, creato=False, giorno=None):
+    """
+    Allinea PermanenzaLetto a un salvataggio dell'episodio: apertura all'accettazione,
+    chiusura/apertura al cambio letto (trasferimento nel giorno indicato, default oggi),
+    chiusura alla dimissione.
+    """
+    giorno = _giorno_trasferimento(episodio, giorno)
+    aperte = PermanenzaLetto.objects.filter(episodio=episodio, data_fine__isnull=True)
+    if creato:
+        if episodio.letto_id:
+            PermanenzaLetto.objects.create(
+                episodio=episodio, paziente_id=episodio.paziente_id, letto_id=episodio.letto_id,
+                data_inizio=episodio.data_inizio, data_fine=episodio.data_fine,
+            )
+        return
+
+    if episodio.letto_id != letto_prec:
+        # trasferimento: una permanenza iniziata oggi e subito lasciata non conta
+        PermanenzaLetto.objects.filter(episodio=episodio, data_fine__isnull=True, data_inizio__gte=giorno).delete()
+        aperte.update(data_fine=giorno)
+        if episodio.letto_id:
+            PermanenzaLetto.objects.create(
+                episodio=episodio, paziente_id=episodio.paziente_id, letto_id=episodio.letto_id,
+                data_inizio=giorno, data_fine=episodio.data_fine,
+            )
+    elif episodio.data_fine != data_fine_prec:
+        ultima = PermanenzaLetto.objects.filter(episodio=episodio).order_by("-data_inizio").first()
+        if ultima and (ultima.data_fine is None or ultima.data_fine == data_fine_prec):
+            if episodio.data_fine and ultima.data_inizio >= episodio.data_fine:
+                ultima.delete()  # letto lasciato il giorno stesso in cui era stato assegnato
+            else:
+                ultima.data_fine = episodio.data_fine  # dimissione (o sua annullata)
+                ultima.save(update_fields=["data_fine"])
+
+
+# === GIORNATE DI DEGENZA ===
+def _ultimo_giorno(data_fine, oggi):
+    return data_fine - timedelta(days=1) if data_fine else oggi
+
+
+def sincronizza_episodio(episodio, prec=None, oggi=None):
+    """
+    Allinea le giornate dell'episodio dopo un salvataggio. ``prec``: valori di CAMPI_CENSIMENTO
+    prima del salvataggio (None: episodio nuovo, si rigenerano tutte). Con istruzioni set-based
+    si toccano solo i giorni usciti o entrati nell'intervallo, quelli dal cambio letto in poi e,
+    se cambiano provenienza o paziente, un UPDATE sulle righe dell'episodio.
+    """
+    oggi = oggi or timezone.localdate()
+    inizio, ultimo = episodio.data_inizio, _ultimo_giorno(episodio.data_fine, oggi)
+    giornate = GiornataDegenza.objects.filter(episodio=episodio)
+    with transaction.atomic():
+        if prec is None:
+            giornate.delete()
+            _inserisci_giornate(inizio, ultimo, episodio.pk)
+        else:
+            inizio_prec, fine_prec, letto_prec, provenienza_prec, paziente_prec = prec
+            giornate.filter(Q(data__lt=inizio) | Q(data__gt=ultimo)).delete()
+            if episodio.letto_id != letto_prec:
+                letto = (
+                    PermanenzaLetto.objects
+                    .filter(episodio_id=OuterRef("episodio_id"), data_inizio__lte=OuterRef("data"))
+                    .filter(Q(data_fine__isnull=True) | Q(data_fine__gt=OuterRef("data")))
+                    .order_by("-data_inizio", "-id")
+                    .values("letto_id")[:1]
+                )
+                giornate.filter(data__gte=_giorno_trasferimento(episodio)).update(letto_id=Subquery(letto))
+            if (episodio.provenienza, episodio.paziente_id) != (provenienza_prec, paziente_prec):
+                giornate.update(provenienza=episodio.provenienza, paziente_id=episodio.paziente_id)
+            # giorni entrati nell'intervallo: prima del vecchio inizio e dopo il vecchio ultimo giorno
+            _inserisci_giornate(inizio, min(ultimo, inizio_prec - timedelta(days=1)), episodio.pk)
+            _inserisci_giornate(max(inizio, _ultimo_giorno(fine_prec, oggi) + timedelta(days=1)), ultimo, episodio.pk)
+    incrementa_generazione(GiornataDegenza)  # update() e SQL diretto: nessun segnale
+
+
+def _sql_giornate(vendor, per_episodio=False):
+    """
+    INSERT ... SELECT delle giornate nell'intervallo [%s, %s]: serie di date in join con
+    gli episodi che coprono ciascun giorno e con la permanenza valida quel giorno
+    (con ``per_episodio`` solo l'episodio del terzo parametro).
+    """
+    tg, te, tp = GiornataDegenza._meta.db_table, Episodio._meta.db_table, PermanenzaLetto._meta.db_table
+    corpo = f"""
+        SELECT g.giorno, e.id, e.paziente_id,
+               (SELECT p.letto_id FROM {tp} p
+                 WHERE p.episodio_id = e.id AND p.data_inizio <= g.giorno
+                   AND (p.data_fine IS NULL OR p.data_fine > g.giorno)
+                 ORDER BY p.data_inizio DESC, p.id DESC LIMIT 1),
+               e.provenienza
+          FROM giorni g
+          JOIN {te} e ON e.data_inizio <= g.giorno AND (e.data_fine IS NULL OR e.data_fine > g.giorno)
+         WHERE 1 = 1 {"AND e.id = %s" if per_episodio else ""}
+    """  # WHERE esplicito: in SQLite evita che "ON CONFLICT" venga letto come condizione di join
+    insert = f"INSERT INTO {tg} (data, episodio_id, paziente_id, letto_id, provenienza)"
+    if vendor == "postgresql":
+        return (
+            f"{insert} WITH giorni AS ("
+            f"  SELECT d::date AS giorno FROM generate_series(%s::date, %s::date, interval '1 day') AS d"
+            f") {corpo} ON CONFLICT (episodio_id, data) DO NOTHING"
+        )
+    # SQLite (e altri): CTE ricorsiva
+    return (
+        f"{insert} WITH RECURSIVE giorni(giorno) AS ("
+        f"  SELECT date(%s) UNION ALL SELECT date(giorno, '+1 day') FROM giorni WHERE giorno < date(%s)"
+        f") {corpo} ON CONFLICT (episodio_id, data) DO NOTHING"
+    )
+
+
+def _inserisci_giornate(da, a, episodio_id=None):
+    if da > a:
+        return 0
+    with connection.cursor() as cur:
+        if episodio_id is None:
+            cur.execute(_sql_giornate(connection.vendor), [da, a])
+        else:
+            cur.execute(_sql_giornate(connection.vendor, per_episodio=True), [da, a, episodio_id])
+        return max(cur.rowcount, 0)
+
+
+def estendi_censimento(da, a):
+    """Inserisce le giornate mancanti nell'intervallo (idempotente)."""
+    inserite = _inserisci_giornate(da, a)
+    if inserite:
+        incrementa_generazione(GiornataDegenza)  # SQL diretto: nessun segnale
+    return inserite
+
+
+def ricostruisci_censimento(oggi=None):
+    """
+    Rigenera storico letti (per gli episodi che non ne hanno) e tutte le giornate,
+    con istruzioni set-based: nessuna espansione degli episodi in Python.
+    """
+    oggi = oggi or timezone.localdate()
+    tp, te = PermanenzaLetto._meta.db_table, Episodio._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cur:
+            cur.execute(
+                f"INSERT INTO {tp} (episodio_id, paziente_id, letto_id, data_inizio, data_fine) "
+                f"SELECT e.id, e.paziente_id, e.letto_id, e.data_inizio, e.data_fine FROM {te} e "
+                f"WHERE e.letto_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {tp} p WHERE p.episodio_id = e.id)"
+            )
+        GiornataDegenza.objects.all().delete()
+        incrementa_generazione(GiornataDegenza)
+        primo = Episodio.objects.order_by("data_inizio").values_list("data_inizio", flat=True).first()
+        return estendi_censimento(primo, oggi) if primo else 0
+
+
+def aggiorna_censimento(oggi=None):
+    """Job giornaliero: aggiunge le giornate degli episodi aperti dall'ultimo giorno censito a oggi."""
+    oggi = oggi or timezone.localdate()
+    ultimo = GiornataDegenza.objects.order_by("-data").values_list("data", flat=True).first()
+    if ultimo is None:
+        return ricostruisci_censimento(oggi)
+    return estendi_censimento(min(ultimo, oggi), oggi)
+
+
+# === INTERROGAZIONI ===
+def occupante(letto, giorno):
+    """Episodio nel letto il giorno indicato (lookup sull'indice di validità)."""
+    return (
+        PermanenzaLetto.objects
+        .filter(letto=letto, data_inizio__lte=giorno)
+        .filter(Q(data_fine__isnull=True) | Q(data_fine__gt=giorno))
+        .select_related("episodio", "paziente")
+        .order_by("-data_inizio")
+        .first()
+    )
+
+
+def _giornate_non_censite(anno, oggi):
+    """
+    Giornate degli episodi aperti successive all'ultima censita, fino a oggi: quelle che il comando
+    ``censimento`` non ha ancora aggiunto (o mai, se non è schedulato). Una query, conteggi per mese.
+    """
+    primo, ultimo_anno = date(anno, 1, 1), min(oggi, date(anno, 12, 31))
+    aperti = (
+        Episodio.objects
+        .filter(data_fine__isnull=True, data_inizio__lte=ultimo_anno)
+        .values("id", "data_inizio", "provenienza")
+        .annotate(censito=Max("giornate__data"))
+        .values_list("data_inizio", "provenienza", "censito")
+    )
+    out = Counter()
+    for inizio, provenienza, censito in aperti:
+        giorno = max(inizio, primo, censito + timedelta(days=1) if censito else inizio)
+        while giorno <= ultimo_anno:
+            mese = giorno.replace(day=1)
+            fine = min((mese + timedelta(days=32)).replace(day=1) - timedelta(days=1), ultimo_anno)
+            out[(mese, provenienza)] += (fine - giorno).days + 1
+            giorno = fine + timedelta(days=1)
+    return out
+
+
+def giornate_mensili(anno, oggi=None):
+    """
+    {(mese, provenienza): giornate} dell'anno, con un'unica query aggregata (in cache fino alla prossima
+    modifica, o al giorno dopo): gli episodi aperti contano fino a oggi anche se il censimento è indietro.
+    """
+    oggi = oggi or timezone.localdate()
+
+    def calcola():
+        righe = (
+            GiornataDegenza.objects
+            .filter(data__year=anno)
+            .annotate(mese=TruncMonth("data"))
+            .values("mese", "provenienza")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        giornate = Counter({(r["mese"], r["provenienza"]): r["n"] for r in righe})
+        giornate.update(_giornate_non_censite(anno, oggi))
+        return dict(giornate)
+    return in_cache("censimento_mensile", (Episodio, GiornataDegenza), calcola, anno, oggi)
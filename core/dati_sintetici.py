@@ -0,0 +1,328 @@
+# core/dati_sintetici.py
+"""
+Generatore di un dataset RSA realistico per prove di carico e benchmark.
+
+Tutto viene scritto con bulk_create a blocchi (i signal non scattano): alla fine
+si ricostruiscono i derivati (ore mensili, censimento) e si svuotano le cache.
+Stanze, personale e piani turni generati sono riconoscibili dal prefisso.
+"""
+import random
+import secrets
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import incrementa_generazione
+from .censimento import ricostruisci_censimento
+from .letti import invalida_tabellone
+from .models import (
+    DiarioIgiene, Dipendente, Episodio, Farmaco, Ingrediente, Letto, MenuPasto, MenuPeriodo,
+    OrarioDose, ParametroVitale, Paziente, PianoTurniPeriodo, Pietanza, Prescrizione,
+    RicettaIngrediente, RigaPrescrizione, RuoloDipendente, Somministrazione, Stanza, TurnoTipo,
+    VoceMenu, AssegnazioneTurno, PROVENIENZA, TracciaMixin,
+)
+from .ore import ricalcola_tutto
+from .turni import invalida_indice_orario
+
+NOMI_M = ["Giuseppe", "Giovanni", "Antonio", "Mario", "Luigi", "Francesco", "Angelo", "Vincenzo", "Pietro", "Carlo"]
+NOMI_F = ["Maria", "Anna", "Giuseppina", "Rosa", "Angela", "Giovanna", "Teresa", "Lucia", "Carmela", "Caterina"]
+COGNOMI = ["Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci", "Marino", "Greco",
+           "Bruno", "Gallo", "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti"]
+FARMACI = [
+    ("Paracetamolo", "cpr", 500, "mg"), ("Furosemide", "cpr", 25, "mg"), ("Ramipril", "cpr", 5, "mg"),
+    ("Metformina", "cpr", 500, "mg"), ("Pantoprazolo", "cpr", 20, "mg"), ("Bisoprololo", "cpr", 2.5, "mg"),
+    ("Quetiapina", "cpr", 25, "mg"), ("Lorazepam", "gtt", 2, "mg/ml"), ("Enoxaparina", "F", 4000, "UI"),
+    ("Levotiroxina", "cpr", 50, "mcg"), ("Amlodipina", "cpr", 5, "mg"), ("Acido acetilsalicilico", "cpr", 100, "mg"),
+    ("Lattulosio", "FL", 66.7, "g/100ml"), ("Colecalciferolo", "gtt", 10000, "UI/ml"), ("Donepezil", "cpr", 5, "mg"),
+    ("Atorvastatina", "cpr", 20, "mg"), ("Sertralina", "cpr", 50, "mg"), ("Macrogol", "bust", 10, "g"),
+]
+PIETANZE = [
+    ("Pasta al pomodoro", "PRIMO", ["Pasta", "Passata di pomodoro", "Olio extravergine"]),
+    ("Risotto alla parmigiana", "PRIMO", ["Riso", "Parmigiano", "Brodo vegetale"]),
+    ("Minestrone", "PRIMO", ["Verdure miste", "Pasta", "Olio extravergine"]),
+    ("Semolino", "PRIMO", ["Semolino", "Latte"]),
+    ("Pollo arrosto", "SECON", ["Petto di pollo", "Olio extravergine"]),
+    ("Merluzzo al vapore", "SECON", ["Merluzzo", "Limone"]),
+    ("Polpette al sugo", "SECON", ["Carne macinata", "Passata di pomodoro", "Pane"]),
+    ("Frittata", "SECON", ["Uova", "Parmigiano"]),
+    ("Purè di patate", "CONT", ["Patate", "Latte", "Burro"]),
+    ("Zucchine trifolate", "CONT", ["Zucchine", "Olio extravergine"]),
+    ("Carote lesse", "CONT", ["Carote"]),
+    ("Mela cotta", "FRUTT", ["Mele"]),
+    ("Budino alla vaniglia", "DOLCE", ["Latte", "Zucchero"]),
+]
+UDM_INGREDIENTI = {"Latte": "ml", "Brodo vegetale": "ml", "Passata di pomodoro": "ml", "Olio extravergine": "ml",
+                   "Uova": "pz", "Mele": "pz", "Limone": "pz"}
+TURNI_BASE = [("M", "Mattina", time(7), time(14), 1), ("P", "Pomeriggio", time(14), time(21), 2),
+              ("N", "Notte", time(21), time(7), 3), ("R", "Riposo", None, None, 4)]
+# ciclo di 5 giorni: dopo la notte due riposi (rispetta il riposo minimo fra i turni)
+CICLO_TURNI = ["M", "P", "N", "R", "R"]
+MESI_CF = "ABCDEHLMPRST"
+
+
+class _Caricatore:
+    """Accumula istanze per modello e le scrive con bulk_create a blocchi."""
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.buffer = {}
+        self.totali = {}
+
+    def aggiungi(self, obj):
+        coda = self.buffer.setdefault(type(obj), [])
+        coda.append(obj)
+        if len(coda) >= self.batch:
+            self.scarica(type(obj))
+
+    def scarica(self, modello=None):
+        for m in [modello] if modello else list(self.buffer):
+            coda = self.buffer.get(m) or []
+            if coda:
+                m.objects.bulk_create(coda, batch_size=self.batch)
+                self.totali[m.__name__] = self.totali.get(m.__name__, 0) + len(coda)
+                self.buffer[m] = []
+
+
+def _codice_fiscale(i, sesso, nascita):
+    # forma valida (non il carattere di controllo): l'indice è codificato in base 26 nelle prime 6 lettere
+    lettere = ""
+    for _ in range(6):
+        i, r = divmod(i, 26)
+        lettere = chr(65 + r) + lettere
+    giorno = nascita.day + (40 if sesso == "F" else 0)
+    return f"{lettere}{nascita.year % 100:02d}{MESI_CF[nascita.month - 1]}{giorno:02d}Z{i % 1000:03d}X"
+
+
+def _ora(giorno, ora, tz):
+    return datetime.combine(giorno, ora, tzinfo=tz)
+
+
+def genera(letti=60, anni=2, dipendenti=40, prefisso="SIM", seed=1, batch=5000, operatore=None, log=None):
+    """
+    Genera stanze e letti, ospiti con episodi in successione su ogni letto, prescrizioni
+    con orari e somministrazioni, parametri e igiene giornalieri, menu e turni mensili
+    dall'inizio dell'intervallo a oggi. Restituisce {modello: righe create}.
+    """
+    log = log or (lambda msg: None)
+    rnd = random.Random(seed)
+    tz = timezone.get_current_timezone()
+    oggi = timezone.localdate()
+    inizio = oggi - timedelta(days=round(365 * anni))
+    car = _Caricatore(batch)
+
+    with transaction.atomic():
+        _genera_struttura_e_ospiti(rnd, tz, car, letti, inizio, oggi, prefisso, operatore, log)
+        _genera_menu(rnd, car, inizio, oggi, log)
+        _genera_turni(rnd, car, dipendenti, inizio, oggi, prefisso, log)
+        car.scarica()
+
+    log("Ricostruzione di ore mensili e censimento…")
+    ricalcola_tutto()
+    ricostruisci_censimento(oggi)
+    invalida_tabellone()
+    invalida_indice_orario()
+    incrementa_generazione(*(m for m in apps.get_app_config("core").get_models() if issubclass(m, TracciaMixin)))
+    return car.totali
+
+
+def _genera_struttura_e_ospiti(rnd, tz, car, n_letti, inizio, oggi, prefisso, operatore, log):
+    # stanze da due letti
+    stanze = Stanza.objects.bulk_create(
+        [Stanza(nome=f"{prefisso}{i + 1:03d}") for i in range((n_letti + 1) // 2)]
+    )
+    letti = Letto.objects.bulk_create(
+        [Letto(stanza=s, codice=c) for s in stanze for c in "AB"][:n_letti]
+    )
+    farmaci = []
+    for nome, forma, forza, udm in FARMACI:
+        f, _ = Farmaco.objects.get_or_create(
+            nome=nome, forma=forma, forza_val=Decimal(str(forza)), forza_udm=udm,
+        )
+        farmaci.append(f)
+
+    cf_esistenti = set(Paziente.objects.values_list("codice_fiscale", flat=True))
+    provenienze = [p for p, _ in PROVENIENZA]
+    indice_cf = len(cf_esistenti)
+
+    # episodi in successione su ogni letto, con brevi vuoti fra una dimissione e l'accettazione successiva
+    piano = []  # (paziente, letto, data_inizio, data_fine)
+    for letto in letti:
+        giorno = inizio - timedelta(days=rnd.randint(0, 400))
+        while giorno <= oggi:
+            durata = max(int(rnd.lognormvariate(5.5, 0.8)), 7)  # mediana ~8 mesi
+            fine = giorno + timedelta(days=durata)
+            if fine > oggi:
+                fine = None
+            sesso = rnd.choice("MF")
+            nascita = date(oggi.year - rnd.randint(70, 100), rnd.randint(1, 12), rnd.randint(1, 28))
+            cf = _codice_fiscale(indice_cf, sesso, nascita)
+            while cf in cf_esistenti:
+                indice_cf += 1
+                cf = _codice_fiscale(indice_cf, sesso, nascita)
+            cf_esistenti.add(cf)
+            indice_cf += 1
+            paziente = Paziente(
+                nome=rnd.choice(NOMI_M if sesso == "M" else NOMI_F), cognome=rnd.choice(COGNOMI),
+                sesso=sesso, data_nascita=nascita, codice_fiscale=cf,
+            )
+            piano.append((paziente, letto, giorno, fine))
+            giorno = (fine or oggi) + timedelta(days=rnd.randint(1, 10))
+
+    Paziente.objects.bulk_create([p for p, *_ in piano], batch_size=car.batch)
+    Episodio.objects.bulk_create([
+        Episodio(paziente=p, letto=letto, data_inizio=da, data_fine=a,
+                 stato="DIMESSO" if a else "ATTIVO", provenienza=rnd.choice(provenienze))
+        for p, letto, da, a in piano
+    ], batch_size=car.batch)
+    for paziente, _, da, a in piano:
+        _genera_diari(rnd, tz, car, paziente, farmaci, max(da, inizio), a or oggi, a is None, operatore)
+    car.scarica()
+    log(f"{len(letti)} letti, {len(piano)} ospiti.")
+
+
+def _genera_diari(rnd, tz, car, paziente, farmaci, dal, al, in_degenza, operatore):
+    """Terapia (cambiata ogni 2-4 mesi), parametri e igiene di un ospite nel suo periodo di degenza."""
+    if dal > al:
+        return
+    operatore_id = operatore.pk if operatore else None  # negli oggetti in blocco si passano gli id (più rapido)
+    # prescrizioni, righe e orari: tre bulk_create per ospite
+    periodi, d = [], dal
+    while d <= al:
+        fine = min(d + timedelta(days=rnd.randint(60, 120)), al)
+        periodi.append((d, fine))
+        d = fine + timedelta(days=1)
+    prescrizioni = []
+    for da, a in periodi:
+        in_corso = in_degenza and a == al
+        prescrizioni.append(Prescrizione(paziente=paziente, data_inizio=da, data_fine=None if in_corso else a, attiva=in_corso))
+    Prescrizione.objects.bulk_create(prescrizioni)
+    righe = []
+    for prescrizione in prescrizioni:
+        for farmaco in rnd.sample(farmaci, rnd.randint(2, 5)):
+            righe.append(RigaPrescrizione(
+                prescrizione=prescrizione, farmaco=farmaco, dose_val=Decimal(rnd.choice(["1", "1", "2", "0.5"])),
+                dose_udm=farmaco.forma or "cpr", via="Orale",
+            ))
+    RigaPrescrizione.objects.bulk_create(righe)
+    orari = {riga: sorted(rnd.sample([time(8), time(12), time(18), time(21)], rnd.randint(1, 3))) for riga in righe}
+    OrarioDose.objects.bulk_create([OrarioDose(riga=r, ora=o) for r, ore in orari.items() for o in ore])
+
+    for riga, ore in orari.items():
+        d, fine = riga.prescrizione.data_inizio, riga.prescrizione.data_fine or al
+        while d <= fine:
+            for o in ore:
+                programmata = _ora(d, o, tz)
+                esito = rnd.random()
+                stato = "SOMMINISTRATO" if esito < 0.95 else ("RIFIUTATO" if esito < 0.98 else "SALTATO")
+                car.aggiungi(Somministrazione(
+                    paziente_id=paziente.pk, riga_id=riga.pk, programmata_il=programmata,
+                    data_ora=programmata + timedelta(minutes=rnd.randint(-15, 30)),
+                    dose_erogata=riga.dose_val if stato == "SOMMINISTRATO" else None,
+                    stato=stato, operatore_id=operatore_id,
+                ))
+            d += timedelta(days=1)
+
+    d = dal
+    while d <= al:
+        for ora in rnd.sample([time(7, 30), time(15), time(20)], rnd.randint(1, 3)):
+            car.aggiungi(ParametroVitale(
+                paziente_id=paziente.pk, rilevato_il=_ora(d, ora, tz), operatore_id=operatore_id,
+                pas=rnd.randint(105, 160), pad=rnd.randint(60, 95), fc=rnd.randint(55, 100),
+                spo2=rnd.randint(90, 99), temp_c=Decimal(f"{rnd.uniform(35.8, 37.6):.1f}"),
+                glicemia_mgdl=rnd.randint(80, 190) if rnd.random() < 0.3 else None,
+            ))
+        if d.weekday() in (1, 4):  # due docce a settimana
+            car.aggiungi(DiarioIgiene(
+                paziente_id=paziente.pk, rilevato_il=_ora(d, time(9, rnd.randint(0, 59)), tz), operatore_id=operatore_id,
+                evento="DOCCIA_CAPELLI" if d.weekday() == 1 else "DOCCIA", giorno=d,
+            ))
+        d += timedelta(days=1)
+
+
+def _genera_menu(rnd, car, inizio, oggi, log):
+    """Un periodo di menu pubblicato per mese; i giorni che hanno già un menu vengono lasciati com'erano."""
+    ingredienti = {}
+    pietanze = {}
+    for nome, categoria, ingr in PIETANZE:
+        p, creata = Pietanza.objects.get_or_create(nome=nome, defaults={"categoria": categoria})
+        pietanze.setdefault(categoria, []).append(p)
+        for nome_i in ingr:
+            if nome_i not in ingredienti:
+                ingredienti[nome_i], _ = Ingrediente.objects.get_or_create(
+                    nome=nome_i, defaults={"udm": UDM_INGREDIENTI.get(nome_i, "g")},
+                )
+            if creata:
+                RicettaIngrediente.objects.create(
+                    pietanza=p, ingrediente=ingredienti[nome_i],
+                    quantita_porzione=Decimal(rnd.choice([20, 50, 80, 120])),
+                )
+
+    occupati = set(MenuPasto.objects.filter(data__gte=inizio.replace(day=1)).values_list("data", "pasto"))
+    mese = inizio.replace(day=1)
+    n = 0
+    while mese <= oggi:
+        fine = (mese.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        periodo = MenuPeriodo(nome=f"Menu {mese:%m/%Y}", data_inizio=mese, data_fine=fine, stato=MenuPeriodo.Stato.PUBB)
+        pasti, voci = [], []
+        d = mese
+        while d <= fine:
+            for pasto, portate in (("COLAZ", []), ("PRANZ", ["PRIMO", "SECON", "CONT", "FRUTT"]),
+                                   ("CENA", ["PRIMO", "SECON", "CONT"])):
+                if (d, pasto) in occupati:
+                    continue
+                mp = MenuPasto(periodo=periodo, data=d, pasto=pasto)
+                pasti.append(mp)
+                if not portate:
+                    voci.append((mp, None, "Latte, caffè d'orzo e fette biscottate", 1))
+                for k, categoria in enumerate(portate, start=1):
+                    voci.append((mp, rnd.choice(pietanze[categoria]), "", k))
+            d += timedelta(days=1)
+        mese = fine + timedelta(days=1)
+        if not pasti:
+            continue
+        periodo.save()
+        MenuPasto.objects.bulk_create(pasti, batch_size=car.batch)
+        for mp, pietanza, testo, ordine in voci:
+            car.aggiungi(VoceMenu(pasto=mp, pietanza=pietanza, descrizione_libera=testo, ordine=ordine))
+        n += len(pasti)
+    car.scarica(VoceMenu)
+    log(f"{n} pasti a menu.")
+
+
+def _genera_turni(rnd, car, n_dipendenti, inizio, oggi, prefisso, log):
+    """Personale (OSS e infermieri) su un ciclo M-P-N-R-R sfalsato, un piano pubblicato per mese."""
+    turni = {}
+    for codice, nome, da, a, ordine in TURNI_BASE:
+        turni[codice], _ = TurnoTipo.objects.get_or_create(
+            codice=codice,
+            defaults={"nome": nome, "ora_inizio": da, "ora_fine": a, "is_riposo": da is None, "ordine": ordine},
+        )
+    dipendenti = Dipendente.objects.bulk_create([
+        Dipendente(
+            nome=rnd.choice(NOMI_M + NOMI_F), cognome=f"{prefisso} {rnd.choice(COGNOMI)}",
+            ruolo=RuoloDipendente.INF if i % 4 == 0 else RuoloDipendente.OSS,
+            ore_settimanali=Decimal(rnd.choice([38, 38, 36, 30, 24])),
+            token_calendario=secrets.token_urlsafe(32),  # bulk_create non passa da save()
+        )
+        for i in range(n_dipendenti)
+    ])
+    mese = inizio.replace(day=1)
+    while mese <= oggi:
+        fine = (mese.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        periodo = PianoTurniPeriodo.objects.create(
+            nome=f"{prefisso} {mese:%m/%Y}", data_inizio=mese, data_fine=fine, stato=PianoTurniPeriodo.Stato.PUBB,
+        )
+        d = mese
+        while d <= fine:
+            k = (d - inizio).days
+            for i, dip in enumerate(dipendenti):
+                car.aggiungi(AssegnazioneTurno(
+                    periodo=periodo, data=d, dipendente=dip, turno=turni[CICLO_TURNI[(i + k) % len(CICLO_TURNI)]],
+                ))
+            d += timedelta(days=1)
+        mese = fine + timedelta(days=1)
+    car.scarica(AssegnazioneTurno)
+    log(f"{len(dipendenti)} dipendenti in turno.")
@@ -0,0 +1,137 @@
+# core/db_router.py
+"""
+Letture delle viste di sola consultazione (diari, report, export) sulla replica.
+
+Il middleware decide per richiesta, in base al nome della rotta, e lo comunica al router
+con una ContextVar (valida anche per le risposte in streaming, consumate dopo la view).
+Dopo una scrittura il browser riceve un cookie che per DB_REPLICA_STICKY_S secondi
+riporta tutte le letture sul primario (read-your-writes), anche su worker diversi.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA = "replica"
+COOKIE_SCRITTURA = "nd_scrittura"
+
+# rotte di sola lettura servite dalla replica (nomi di core/urls.py)
+ROTTE_REPLICA = {
+    "parametri_diario", "igiene_diario", "terapia_diario", "prescrizioni_lista",
+    "menu_diario", "turni_diario", "turni_copertura", "turni_in_servizio", "turni_calendario_ics",
+    "letti_tabellone", "paziente_anagrafica",
+    "report_menu_periodo_select", "report_menu_periodo_print", "report_lista_spesa",
+    "report_ore_csv", "report_censimento", "report_diari", "export_diario",
+}
+
+# sessioni e utenti si leggono sempre dal primario: con la replica in ritardo l'utente risulterebbe scollegato
+APP_SOLO_PRIMARIO = {"sessions", "auth", "contenttypes"}
+
+_alias_lettura = ContextVar("core_alias_lettura", default=None)
+
+
+class ReplicaRouter:
+    """Scritture e migrazioni sempre sul primario; letture sulla replica solo se richiesto dalla richiesta in corso."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in APP_SOLO_PRIMARIO:
+            return DEFAULT_DB_ALIAS
+        return _alias_lettura.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # stessi dati su entrambi gli alias
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def _in_streaming(contenuto, alias):
+    """Mantiene l'alias di lettura mentre il server consuma una risposta in streaming."""
+    iteratore = iter(contenuto)
+    while True:
+        token = _alias_lettura.set(alias)
+        try:
+            pezzo = next(iteratore, None)
+        finally:
+            _alias_lettura.reset(token)
+        if pezzo is None:
+            return
+        yield pezzo
+
+
+async def _in_streaming_asincrono(contenuto, alias):
+    """Come _in_streaming() per le risposte asincrone (export sotto ASGI, vedi export.in_asincrono)."""
+    iteratore = aiter(contenuto)
+    while True:
+        token = _alias_lettura.set(alias)
+        try:
+            pezzo = await anext(iteratore, None)
+        finally:
+            _alias_lettura.reset(token)
+        if pezzo is None:
+            return
+        yield pezzo
+
+
+class ReplicaLetturaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if REPLICA not in settings.DATABASES:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.rotte = set(getattr(settings, "DB_REPLICA_ROTTE", ROTTE_REPLICA))
+        self.sticky_s = getattr(settings, "DB_REPLICA_STICKY_S", 15)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request._alias_lettura = None
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, "_alias_token", None)
+            if token is not None:
+                _alias_lettura.reset(token)
+        return self._concludi(request, response)
+
+    async def __acall__(self, request):
+        request._alias_lettura = None
+        # process_view gira in sync_to_async, su una copia del contesto: il suo token qui non vale,
+        # si ripristina il valore precedente con un token creato in questo contesto
+        token = _alias_lettura.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _alias_lettura.reset(token)
+        return self._concludi(request, response)
+
+    def _concludi(self, request, response):
+        if request.method not in ("GET", "HEAD", "OPTIONS"):
+            # read-your-writes: per qualche secondo le letture di questo browser vanno sul primario
+            response.set_cookie(COOKIE_SCRITTURA, "1", max_age=self.sticky_s, httponly=True, samesite="Lax")
+        elif request._alias_lettura and getattr(response, "streaming", False):
+            avvolgi = _in_streaming_asincrono if response.is_async else _in_streaming
+            response.streaming_content = avvolgi(response.streaming_content, request._alias_lettura)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (
+            request.method in ("GET", "HEAD")
+            and match and match.url_name in self.rotte
+            and COOKIE_SCRITTURA not in request.COOKIES
+        ):
+            request._alias_lettura = REPLICA
+            request._alias_token = _alias_lettura.set(REPLICA)
+        return None
@@ -0,0 +1,228 @@
+# core/esportazione_fhir.py
+"""
+Export FHIR in blocco (FHIR Bulk Data ``$export``) per il fascicolo sanitario regionale.
+
+Il client avvia il job da ``/fhir/$export`` (api.fhir_export) e interroga l'URL di stato; il job
+gira nel worker ``manage.py esporta_fhir --continuo``. Per ogni tipo di risorsa le righe si leggono
+con ``values().iterator(chunk_size=...)`` (cursore lato server su PostgreSQL), a blocchi, e si
+serializzano su più processi (core/fhir.py); i byte NDJSON vanno nel file del tipo man mano che i
+blocchi tornano, nell'ordine di lettura. Con ``_since`` si esportano solo le righe con
+``aggiornato_il`` successivo (gli update() in blocco non lo aggiornano).
+
+Ogni aggiornamento del job in corso ne rinnova ``battito_il``: se il worker muore, dopo
+FHIR_EXPORT_BATTITO_MINUTI il job torna in coda (recupera_interrotti), fino a FHIR_EXPORT_TENTATIVI
+tentativi. Un worker fermato con SIGTERM rimette subito in coda il suo job (Interrotto).
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import fhir
+from .models import (
+    PROVENIENZA, Episodio, EsportazioneFHIR, OrarioDose, ParametroVitale, Paziente, RigaPrescrizione,
+    Somministrazione,
+)
+
+logger = logging.getLogger(__name__)
+
+BLOCCO = 1000  # righe per blocco (e per fetch dal cursore)
+AVANZAMENTO_OGNI = 10  # blocchi tra due aggiornamenti di EsportazioneFHIR.avanzamento
+Stato = EsportazioneFHIR.Stato
+
+
+def _orari(righe):
+    """Orari di somministrazione delle righe del blocco, con una query per blocco."""
+    per_riga = {r["id"]: r for r in righe}
+    for r in righe:
+        r["orari"] = []
+    for riga_id, ora, giorni in OrarioDose.objects.filter(riga_id__in=per_riga).values_list("riga_id", "ora", "giorni_settimana"):
+        per_riga[riga_id]["orari"].append((ora, giorni))
+    return righe
+
+
+def _provenienza(righe):
+    nomi = dict(PROVENIENZA)
+    for r in righe:
+        r["provenienza"] = nomi.get(r["provenienza"], r["provenienza"])
+    return righe
+
+
+@dataclass(frozen=True)
+class Sorgente:
+    righe: object  # queryset values(), ordinato per id
+    aggiornato: tuple = ("aggiornato_il",)  # campi confrontati con _since
+    completa: object = None  # blocco -> blocco, per i dati collegati (una query per blocco)
+
+
+SORGENTI = {
+    "Patient": Sorgente(Paziente.objects.order_by("id").values(
+        "id", "nome", "cognome", "sesso", "data_nascita", "codice_fiscale", "telefono", "email",
+        "comune_residenza", "provincia_residenza", "indirizzo_via", "indirizzo_civico", "indirizzo_cap", "aggiornato_il",
+    )),
+    "Encounter": Sorgente(Episodio.objects.order_by("id").values(
+        "id", "paziente_id", "data_inizio", "data_fine", "motivo", "provenienza",
+        "letto__codice", "letto__stanza__nome", "aggiornato_il",
+    ), completa=_provenienza),
+    "MedicationRequest": Sorgente(RigaPrescrizione.objects.order_by("id").values(
+        "id", "prescrizione_id", "prescrizione__paziente_id", "prescrizione__data_inizio", "prescrizione__data_fine",
+        "prescrizione__attiva", "prescrizione__note", "prescrizione__aggiornato_il",
+        "farmaco__nome", "farmaco__codice_atc", "dose_val", "dose_udm", "via", "prn", "note", "aggiornato_il",
+    ), aggiornato=("aggiornato_il", "prescrizione__aggiornato_il"), completa=_orari),
+    "MedicationAdministration": Sorgente(Somministrazione.objects.order_by("id").values(
+        "id", "paziente_id", "riga_id", "riga__farmaco__nome", "riga__farmaco__codice_atc", "riga__dose_udm",
+        "riga__via", "programmata_il", "data_ora", "dose_erogata", "stato", "note", "aggiornato_il",
+    )),
+    "Observation": Sorgente(ParametroVitale.objects.order_by("id").values(
+        "id", "paziente_id", "rilevato_il", "pas", "pad", "fc", "spo2", "temp_c", "glicemia_mgdl", "note", "aggiornato_il",
+    )),
+}
+TIPI = list(SORGENTI)
+
+
+class Interrotto(Exception):
+    """Il worker si sta fermando (SIGTERM): il job in corso torna in coda."""
+
+
+def cartella(job):
+    return Path(settings.FHIR_EXPORT_DIR) / str(job.pk)
+
+
+def _blocchi(sorgente, dal):
+    righe = sorgente.righe
+    if dal:
+        righe = righe.filter(reduce(or_, (Q(**{f"{campo}__gt": dal}) for campo in sorgente.aggiornato)))
+    blocco = []
+    for r in righe.iterator(chunk_size=BLOCCO):
+        blocco.append(r)
+        if len(blocco) == BLOCCO:
+            yield sorgente.completa(blocco) if sorgente.completa else blocco
+            blocco = []
+    if blocco:
+        yield sorgente.completa(blocco) if sorgente.completa else blocco
+
+
+def _in_corso(job, **campi):
+    """
+    Aggiorna il job e ne rinnova il battito se è ancora in corso con questo worker; False se nel
+    frattempo è stato annullato o, dato per morto, rimesso in coda (iniziata_il identifica l'esecuzione).
+    """
+    return bool(
+        EsportazioneFHIR.objects.filter(pk=job.pk, stato=Stato.IN_CORSO, iniziata_il=job.iniziata_il)
+        .update(battito_il=timezone.now(), **campi)
+    )
+
+
+def _esporta_tipo(job, tipo, percorso, esecutore, in_volo):
+    """Scrive il file NDJSON del tipo; restituisce il numero di risorse, None se il job è stato annullato."""
+    totale = 0
+    with open(percorso, "wb") as f:
+        for i, (ndjson, n) in enumerate(fhir.serializza(esecutore, tipo, _blocchi(SORGENTI[tipo], job.dal), in_volo), 1):
+            f.write(ndjson)
+            totale += n
+            if i % AVANZAMENTO_OGNI == 0 and not _in_corso(job, avanzamento=f"{tipo}: {totale} risorse"):
+                return None
+    return totale
+
+
+def esegui(job, processi=None):
+    """
+    Esegue un job in coda, se nessun altro worker l'ha già preso (False in quel caso).
+    ``processi``: dimensione del pool (predefinito FHIR_EXPORT_PROCESSI, 0 = uno per CPU; 1 = senza pool).
+    """
+    adesso = timezone.now()
+    preso = EsportazioneFHIR.objects.filter(pk=job.pk, stato=Stato.IN_CODA).update(
+        stato=Stato.IN_CORSO, iniziata_il=adesso, battito_il=adesso, tentativi=F("tentativi") + 1,
+    )
+    if not preso:
+        return False
+    job.stato, job.iniziata_il = Stato.IN_CORSO, adesso
+    processi = processi or settings.FHIR_EXPORT_PROCESSI or os.cpu_count() or 1
+    # spawn: i processi figli non ereditano le connessioni al database del worker;
+    # ignorano SIGTERM, così il worker che si ferma chiude il pool senza blocchi persi
+    esecutore = (
+        ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context("spawn"),
+                            initializer=fhir.ignora_sigterm)
+        if processi > 1 else nullcontext()
+    )
+    dove = cartella(job)
+    dove.mkdir(parents=True, exist_ok=True)
+    file = []
+    try:
+        with esecutore as ex:
+            for tipo in job.elenco_tipi:
+                if not _in_corso(job, avanzamento=f"{tipo}: in corso"):
+                    break
+                n = _esporta_tipo(job, tipo, dove / f"{tipo}.ndjson", ex, in_volo=2 * processi)
+                if n is None:
+                    break
+                file.append({"type": tipo, "count": n})
+            else:
+                if _in_corso(job, stato=Stato.COMPLETATA, completata_il=timezone.now(), avanzamento="", file=file):
+                    return True
+    except Interrotto:
+        # di nuovo in coda per il prossimo worker, senza consumare un tentativo; i file si riscrivono
+        _in_corso(job, stato=Stato.IN_CODA, avanzamento="", tentativi=F("tentativi") - 1)
+        raise
+    except Exception as e:
+        logger.exception("Export FHIR %s non riuscito", job.pk)
+        _in_corso(job, stato=Stato.ERRORE, completata_il=timezone.now(), errore=str(e)[:1000])
+    # errore o annullamento: i file parziali non servono, a meno che il job non sia passato a un altro worker
+    if not EsportazioneFHIR.objects.filter(pk=job.pk, stato__in=[Stato.IN_CODA, Stato.IN_CORSO]).exists():
+        shutil.rmtree(dove, ignore_errors=True)
+    return True
+
+
+def prossimo():
+    return EsportazioneFHIR.objects.filter(stato=Stato.IN_CODA).order_by("richiesta_il").first()
+
+
+def recupera_interrotti():
+    """
+    Job in corso senza battito da più di FHIR_EXPORT_BATTITO_MINUTI (worker morto): tornano in coda,
+    o in errore dopo FHIR_EXPORT_TENTATIVI tentativi. Restituisce (rimessi in coda, falliti).
+    """
+    adesso = timezone.now()
+    fermi = EsportazioneFHIR.objects.filter(
+        Q(battito_il__lt=adesso - timedelta(minutes=settings.FHIR_EXPORT_BATTITO_MINUTI)) | Q(battito_il__isnull=True),
+        stato=Stato.IN_CORSO,
+    )
+    falliti = 0
+    for job in fermi.filter(tentativi__gte=settings.FHIR_EXPORT_TENTATIVI):
+        if EsportazioneFHIR.objects.filter(pk=job.pk, stato=Stato.IN_CORSO, iniziata_il=job.iniziata_il).update(
+            stato=Stato.ERRORE, completata_il=adesso, avanzamento="",
+            errore=f"Worker interrotto durante l'export ({job.tentativi} tentativi).",
+        ):
+            shutil.rmtree(cartella(job), ignore_errors=True)
+            falliti += 1
+    ripresi = fermi.update(stato=Stato.IN_CODA, avanzamento="")
+    if ripresi or falliti:
+        logger.warning("Export FHIR interrotti (worker senza battito): %s rimessi in coda, %s in errore", ripresi, falliti)
+    return ripresi, falliti
+
+
+def elimina(job):
+    shutil.rmtree(cartella(job), ignore_errors=True)
+    job.delete()
+
+
+def pulisci_scaduti():
+    """Elimina job e file conclusi da più di FHIR_EXPORT_SCADENZA_ORE; restituisce quanti."""
+    limite = timezone.now() - timedelta(hours=settings.FHIR_EXPORT_SCADENZA_ORE)
+    scaduti = list(EsportazioneFHIR.objects.filter(
+        stato__in=[Stato.COMPLETATA, Stato.ERRORE, Stato.ANNULLATA], richiesta_il__lt=limite,
+    ))
+    for job in scaduti:
+        elimina(job)
+    return len(scaduti)
@@ -0,0 +1,272 @@
+# core/export.py
+"""
+Export dei diari (igiene, parametri vitali, somministrazioni) per le verifiche ASL, in CSV o XLSX.
+
+Le righe si leggono con ``values_list(...).iterator(chunk_size=...)`` (cursore lato server su
+PostgreSQL) e il file si scrive mentre viene inviato con StreamingHttpResponse: la memoria resta
+la stessa con cento righe o con un anno di diari.
+
+L'XLSX è uno zip scritto in streaming con zipfile, senza dipendenze: un solo foglio con stringhe
+inline (niente tabella di stringhe condivise da tenere in memoria fino alla fine) e data descriptor
+al posto delle dimensioni note in anticipo.
+
+Sotto ASGI una StreamingHttpResponse con iteratore sincrono viene letta tutta con
+sync_to_async(list) prima dell'invio: streaming_per_asgi() le passa invece un iteratore
+asincrono che produce un lotto di pezzi alla volta in un thread.
+"""
+import csv
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DiarioIgiene, ParametroVitale, Somministrazione
+
+CHUNK_RIGHE = 2000
+PEZZO_BYTE = 64 * 1024  # dimensione minima dei pezzi inviati al client
+
+
+# === DIARI ESPORTABILI ===
+@dataclass(frozen=True)
+class Diario:
+    titolo: str
+    modello: type
+    colonne: tuple  # (intestazione, campo di values_list, conversione o None)
+    campo_data: str = "rilevato_il"  # filtro del periodo e ordinamento
+    annotazioni: tuple = ()  # (nome, espressione) aggiunte prima del filtro
+
+    def righe(self, dal, al, paziente_id=None):
+        """Iteratore di tuple già convertite, per istante; dal/al sono date locali incluse."""
+        qs = self.modello.objects.annotate(**dict(self.annotazioni))
+        inizio = timezone.make_aware(datetime.combine(dal, time.min))
+        fine = timezone.make_aware(datetime.combine(al + timedelta(days=1), time.min))
+        qs = qs.filter(**{f"{self.campo_data}__gte": inizio, f"{self.campo_data}__lt": fine})
+        if paziente_id:
+            qs = qs.filter(paziente_id=paziente_id)
+        conversioni = [conv for _, _, conv in self.colonne]
+        valori = (
+            qs.order_by(self.campo_data, "id")
+            .values_list(*(campo for _, campo, _ in self.colonne))
+            .iterator(chunk_size=CHUNK_RIGHE)
+        )
+        for riga in valori:
+            yield tuple(conv(v) if conv and v is not None else v for conv, v in zip(conversioni, riga))
+
+    @property
+    def intestazioni(self):
+        return [intestazione for intestazione, _, _ in self.colonne]
+
+
+def _scelte(scelte):
+    return dict(scelte).get
+
+
+_PAZIENTE = (("Cognome", "paziente__cognome", None), ("Nome", "paziente__nome", None),
+             ("Codice fiscale", "paziente__codice_fiscale", None))
+_OPERATORE = ("Operatore", "operatore__username", None)
+
+DIARI = {
+    "igiene": Diario(
+        titolo="Diario igiene",
+        modello=DiarioIgiene,
+        colonne=(("Data e ora", "rilevato_il", None), *_PAZIENTE,
+                 ("Evento", "evento", _scelte(DiarioIgiene.EVENTO_CHOICES)), _OPERATORE),
+    ),
+    "parametri": Diario(
+        titolo="Parametri vitali",
+        modello=ParametroVitale,
+        colonne=(("Data e ora", "rilevato_il", None), *_PAZIENTE,
+                 ("PA MAX", "pas", None), ("PA MIN", "pad", None), ("FC (b/m)", "fc", None),
+                 ("SpO2 (%)", "spo2", None), ("Temperatura (°C)", "temp_c", None),
+                 ("Glicemia (mg/dl)", "glicemia_mgdl", None), ("Variazione terapia", "variazione_terapia", None),
+                 ("Note", "note", None), _OPERATORE),
+    ),
+    "somministrazioni": Diario(
+        titolo="Somministrazioni",
+        modello=Somministrazione,
+        # le dosi rifiutate o saltate possono non avere data_ora: contano all'ora programmata
+        annotazioni=(("quando", Coalesce("data_ora", "programmata_il")),),
+        campo_data="quando",
+        colonne=(("Programmata il", "programmata_il", None), ("Somministrata il", "data_ora", None), *_PAZIENTE,
+                 ("Farmaco", "riga__farmaco__nome", None), ("Dose", "dose_erogata", None),
+                 ("Unità", "riga__dose_udm", None), ("Esito", "stato", _scelte(Somministrazione.STATO)),
+                 ("Note", "note", None), _OPERATORE),
+    ),
+}
+
+
+# === CSV ===
+class Eco:
+    """Pseudo-buffer per csv.writer: restituisce la riga invece di scriverla."""
+    def write(self, value):
+        return value
+
+
+def _testo_csv(v):
+    if isinstance(v, datetime):
+        return f"{timezone.localtime(v):%d/%m/%Y %H:%M}"
+    if isinstance(v, date):
+        return f"{v:%d/%m/%Y}"
+    if isinstance(v, Decimal):
+        return str(v).replace(".", ",")
+    return v
+
+
+def csv_in_streaming(intestazioni, righe):
+    w = csv.writer(Eco(), delimiter=";")
+    yield "\ufeff"  # BOM per Excel
+    yield w.writerow(intestazioni)
+    for riga in righe:
+        yield w.writerow([_testo_csv(v) for v in riga])
+
+
+# === XLSX ===
+class _Tubo(io.RawIOBase):
+    """File solo scrittura e non posizionabile: zipfile ci scrive, il generatore lo svuota."""
+
+    def __init__(self):
+        self._pezzi = []
+        self.dimensione = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._pezzi.append(bytes(b))
+        self.dimensione += len(b)
+        return len(b)
+
+    def svuota(self):
+        dati = b"".join(self._pezzi)
+        self._pezzi.clear()
+        self.dimensione = 0
+        return dati
+
+
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+_CARATTERI_NON_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+STILE_DATA_ORA, STILE_DATA, STILE_INTESTAZIONE = 1, 2, 3
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{nome}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+# stili (cellXfs): 0 normale, 1 data e ora, 2 data, 3 intestazione in grassetto
+_STILI = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm"/><numFmt numFmtId="165" formatCode="dd/mm/yyyy"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="4">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+</cellXfs>
+</styleSheet>"""
+
+_INIZIO_FOGLIO = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>
+<sheetData>"""
+
+_FINE_FOGLIO = "</sheetData></worksheet>"
+
+
+def _cella(v, stile=0):
+    if v is None or v == "":
+        return "<c/>"
+    if isinstance(v, datetime):
+        locale = timezone.localtime(v).replace(tzinfo=None) if timezone.is_aware(v) else v
+        return f'<c s="{STILE_DATA_ORA}"><v>{(locale - _EPOCA_EXCEL) / timedelta(days=1):.6f}</v></c>'
+    if isinstance(v, date):
+        return f'<c s="{STILE_DATA}"><v>{(v - _EPOCA_EXCEL.date()).days}</v></c>'
+    if isinstance(v, (int, float, Decimal)) and not isinstance(v, bool):
+        return f"<c><v>{v}</v></c>"
+    testo = escape(_CARATTERI_NON_XML.sub("", str(v)))
+    s = f' s="{stile}"' if stile else ""
+    return f'<c t="inlineStr"{s}><is><t xml:space="preserve">{testo}</t></is></c>'
+
+
+def xlsx_in_streaming(titolo, intestazioni, righe):
+    """Genera i byte di una cartella di lavoro XLSX con un foglio, senza tenere le righe in memoria."""
+    tubo = _Tubo()
+    with zipfile.ZipFile(tubo, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(nome=escape(titolo[:31], {'"': "&quot;"})))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", _STILI)
+        # dimensione ignota in anticipo: ZIP64 per non fermarsi a 4 GB
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as foglio:
+            foglio.write(_INIZIO_FOGLIO.encode())
+            foglio.write(("<row>" + "".join(_cella(t, STILE_INTESTAZIONE) for t in intestazioni) + "</row>").encode())
+            for riga in righe:
+                foglio.write(("<row>" + "".join(_cella(v) for v in riga) + "</row>").encode())
+                if tubo.dimensione >= PEZZO_BYTE:
+                    yield tubo.svuota()
+            foglio.write(_FINE_FOGLIO.encode())
+    yield tubo.svuota()  # directory centrale dello zip
+
+
+# === ASGI ===
+def _lotto(iteratore, byte_per_lotto):
+    lotto, dimensione = [], 0
+    for pezzo in iteratore:
+        lotto.append(pezzo)
+        dimensione += len(pezzo)
+        if dimensione >= byte_per_lotto:
+            break
+    return lotto
+
+
+async def in_asincrono(pezzi, byte_per_lotto=None):
+    """
+    Iteratore asincrono su un iteratore sincrono di pezzi: ogni lotto di circa byte_per_lotto
+    (predefinito PEZZO_BYTE) si produce con sync_to_async. thread_sensitive: tutti i lotti girano
+    sullo stesso thread, quindi sulla stessa connessione e sullo stesso cursore di .iterator().
+    Il generatore originale resta registrato in response.close(), che il server chiama comunque.
+    """
+    iteratore = iter(pezzi)
+    prossimo = sync_to_async(_lotto, thread_sensitive=True)
+    while lotto := await prossimo(iteratore, byte_per_lotto or PEZZO_BYTE):
+        for pezzo in lotto:
+            yield pezzo
+
+
+def streaming_per_asgi(request, risposta):
+    """Sotto ASGI sostituisce il contenuto sincrono di una risposta in streaming con in_asincrono()."""
+    if isinstance(request, ASGIRequest) and risposta.streaming and not risposta.is_async:
+        risposta.streaming_content = in_asincrono(risposta.streaming_content)
+    return risposta
@@ -0,0 +1,239 @@
+# core/fhir.py
+"""
+Serializzazione FHIR R4 (NDJSON) delle righe lette da core/esportazione_fhir.py.
+
+Modulo in puro Python (nessun import Django), come core/pianificatore.py: i blocchi di righe
+(dict di values()) vanno ai processi del pool, che restituiscono i byte NDJSON già pronti.
+"""
+import json
+import signal
+from collections import defaultdict, deque
+from datetime import date, datetime, time
+from decimal import Decimal
+
+SISTEMA_CF = "http://hl7.it/sid/codiceFiscale"
+SISTEMA_ATC = "http://www.whocc.no/atc"
+SISTEMA_LOINC = "http://loinc.org"
+SISTEMA_UCUM = "http://unitsofmeasure.org"
+SISTEMA_CATEGORIA_OSS = "http://terminology.hl7.org/CodeSystem/observation-category"
+SISTEMA_ACT_CODE = "http://terminology.hl7.org/CodeSystem/v3-ActCode"
+
+GENERE = {"M": "male", "F": "female", "X": "other"}
+GIORNI = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]  # "1234567" di OrarioDose.giorni_settimana
+ESITO_SOMMINISTRAZIONE = {
+    "SOMMINISTRATO": ("completed", None),
+    "RIFIUTATO": ("not-done", "Rifiutato"),
+    "SALTATO": ("not-done", "Non disponibile/saltato"),
+}
+
+# (suffisso dell'id, campo, LOINC, descrizione, unità UCUM, categoria)
+PARAMETRI = [
+    ("fc", "fc", "8867-4", "Heart rate", "/min", "vital-signs"),
+    ("spo2", "spo2", "59408-5", "Oxygen saturation in Arterial blood by Pulse oximetry", "%", "vital-signs"),
+    ("temp", "temp_c", "8310-5", "Body temperature", "Cel", "vital-signs"),
+    ("glic", "glicemia_mgdl", "2339-0", "Glucose [Mass/volume] in Blood", "mg/dL", "laboratory"),
+]
+
+
+def _json(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (datetime, date, time)):
+        return v.isoformat()
+    raise TypeError(f"{type(v).__name__} non serializzabile")
+
+
+def _rif(tipo, pk):
+    return {"reference": f"{tipo}/{pk}"}
+
+
+def _meta(*istanti):
+    return {"lastUpdated": max(i for i in istanti if i).isoformat()}
+
+
+def _senza_vuoti(d):
+    return {k: v for k, v in d.items() if v not in (None, "", [], {})}
+
+
+def _quantita(valore, unita):
+    return {"value": valore, "unit": unita, "system": SISTEMA_UCUM, "code": unita}
+
+
+def _farmaco(r, prefisso):
+    concetto = {"text": r[f"{prefisso}farmaco__nome"]}
+    if r[f"{prefisso}farmaco__codice_atc"]:
+        concetto["coding"] = [{"system": SISTEMA_ATC, "code": r[f"{prefisso}farmaco__codice_atc"]}]
+    return concetto
+
+
+# === RISORSE ===
+def paziente(r):
+    indirizzo = _senza_vuoti({
+        "line": [" ".join(filter(None, [r["indirizzo_via"], r["indirizzo_civico"]]))] if r["indirizzo_via"] else [],
+        "city": r["comune_residenza"],
+        "district": r["provincia_residenza"],
+        "postalCode": r["indirizzo_cap"],
+    })
+    telecom = [{"system": "phone", "value": r["telefono"]}] if r["telefono"] else []
+    if r["email"]:
+        telecom.append({"system": "email", "value": r["email"]})
+    yield _senza_vuoti({
+        "resourceType": "Patient",
+        "id": str(r["id"]),
+        "meta": _meta(r["aggiornato_il"]),
+        "identifier": [{"system": SISTEMA_CF, "value": r["codice_fiscale"]}],
+        "name": [{"use": "official", "family": r["cognome"], "given": [r["nome"]]}],
+        "gender": GENERE.get(r["sesso"], "unknown"),
+        "birthDate": r["data_nascita"],
+        "telecom": telecom,
+        "address": [{**indirizzo, "country": "IT"}] if indirizzo else [],
+    })
+
+
+def episodio(r):
+    letto = " ".join(filter(None, [r["letto__stanza__nome"], r["letto__codice"]]))
+    yield _senza_vuoti({
+        "resourceType": "Encounter",
+        "id": str(r["id"]),
+        "meta": _meta(r["aggiornato_il"]),
+        "status": "finished" if r["data_fine"] else "in-progress",
+        "class": {"system": SISTEMA_ACT_CODE, "code": "IMP", "display": "inpatient encounter"},
+        "subject": _rif("Patient", r["paziente_id"]),
+        "period": _senza_vuoti({"start": r["data_inizio"], "end": r["data_fine"]}),
+        "reasonCode": [{"text": r["motivo"]}] if r["motivo"] else [],
+        "hospitalization": {"admitSource": {"text": r["provenienza"]}} if r["provenienza"] else None,
+        "location": [{"location": {"display": letto}}] if letto else [],
+    })
+
+
+def _posologia(r):
+    """Una dosageInstruction per gruppo di giorni della settimana, con gli orari del gruppo."""
+    base = _senza_vuoti({
+        "text": f"{r['dose_val']} {r['dose_udm']} via {r['via']}" + (" al bisogno" if r["prn"] else ""),
+        "asNeededBoolean": r["prn"] or None,
+        "route": {"text": r["via"]},
+        "doseAndRate": [{"doseQuantity": {"value": r["dose_val"], "unit": r["dose_udm"]}}],
+    })
+    per_giorni = defaultdict(list)
+    for ora, giorni in sorted(r.get("orari", ())):
+        per_giorni[giorni].append(ora)
+    if not per_giorni:
+        return [base]
+    posologie = []
+    for sequenza, (giorni, ore) in enumerate(sorted(per_giorni.items()), start=1):
+        ripetizione = {"timeOfDay": ore}
+        if set(giorni) != set("1234567"):
+            ripetizione["dayOfWeek"] = [GIORNI[int(g) - 1] for g in sorted(giorni)]
+        posologie.append({"sequence": sequenza, **base, "timing": {"repeat": ripetizione}})
+    return posologie
+
+
+def riga_prescrizione(r):
+    yield _senza_vuoti({
+        "resourceType": "MedicationRequest",
+        "id": str(r["id"]),
+        "meta": _meta(r["aggiornato_il"], r["prescrizione__aggiornato_il"]),
+        "groupIdentifier": {"value": f"prescrizione-{r['prescrizione_id']}"},
+        "status": "active" if r["prescrizione__attiva"] else "completed",
+        "intent": "order",
+        "medicationCodeableConcept": _farmaco(r, ""),
+        "subject": _rif("Patient", r["prescrizione__paziente_id"]),
+        "authoredOn": r["prescrizione__data_inizio"],
+        "note": [{"text": t} for t in (r["note"], r["prescrizione__note"]) if t],
+        "dosageInstruction": _posologia(r),
+        "dispenseRequest": {"validityPeriod": _senza_vuoti({
+            "start": r["prescrizione__data_inizio"], "end": r["prescrizione__data_fine"],
+        })},
+    })
+
+
+def somministrazione(r):
+    stato, motivo = ESITO_SOMMINISTRAZIONE.get(r["stato"], ("unknown", None))
+    dose = None
+    if r["dose_erogata"] is not None:
+        dose = {"dose": {"value": r["dose_erogata"], "unit": r["riga__dose_udm"]}, "route": {"text": r["riga__via"]}}
+    yield _senza_vuoti({
+        "resourceType": "MedicationAdministration",
+        "id": str(r["id"]),
+        "meta": _meta(r["aggiornato_il"]),
+        "status": stato,
+        "statusReason": [{"text": motivo}] if motivo else [],
+        "medicationCodeableConcept": _farmaco(r, "riga__"),
+        "subject": _rif("Patient", r["paziente_id"]),
+        "request": _rif("MedicationRequest", r["riga_id"]),
+        "effectiveDateTime": r["data_ora"] or r["programmata_il"],
+        "dosage": dose,
+        "note": [{"text": r["note"]}] if r["note"] else [],
+    })
+
+
+def _osservazione(r, suffisso, codice, descrizione, categoria, **valore):
+    return _senza_vuoti({
+        "resourceType": "Observation",
+        "id": f"{r['id']}-{suffisso}",
+        "meta": _meta(r["aggiornato_il"]),
+        "status": "final",
+        "category": [{"coding": [{"system": SISTEMA_CATEGORIA_OSS, "code": categoria}]}],
+        "code": {"coding": [{"system": SISTEMA_LOINC, "code": codice, "display": descrizione}], "text": descrizione},
+        "subject": _rif("Patient", r["paziente_id"]),
+        "effectiveDateTime": r["rilevato_il"],
+        "note": [{"text": r["note"]}] if r["note"] else [],
+        **valore,
+    })
+
+
+def parametro_vitale(r):
+    """Una Observation per valore rilevato; la pressione come pannello con due componenti."""
+    if r["pas"] is not None or r["pad"] is not None:
+        componenti = [
+            {"code": {"coding": [{"system": SISTEMA_LOINC, "code": codice, "display": descrizione}]},
+             "valueQuantity": _quantita(r[campo], "mm[Hg]")}
+            for campo, codice, descrizione in (("pas", "8480-6", "Systolic blood pressure"),
+                                               ("pad", "8462-4", "Diastolic blood pressure"))
+            if r[campo] is not None
+        ]
+        yield _osservazione(r, "pa", "85354-9", "Blood pressure panel", "vital-signs", component=componenti)
+    for suffisso, campo, codice, descrizione, unita, categoria in PARAMETRI:
+        if r[campo] is not None:
+            yield _osservazione(r, suffisso, codice, descrizione, categoria, valueQuantity=_quantita(r[campo], unita))
+
+
+SERIALIZZATORI = {
+    "Patient": paziente,
+    "Encounter": episodio,
+    "MedicationRequest": riga_prescrizione,
+    "MedicationAdministration": somministrazione,
+    "Observation": parametro_vitale,
+}
+
+
+# === BLOCCHI ===
+def ignora_sigterm():
+    """Inizializzatore dei processi del pool: allo SIGTERM si ferma il worker, che poi chiude il pool."""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def blocco_ndjson(tipo, righe):
+    """(byte NDJSON, numero di risorse) per un blocco di righe; gira nei processi del pool."""
+    serializza = SERIALIZZATORI[tipo]
+    codifica = json.JSONEncoder(default=_json, ensure_ascii=False, separators=(",", ":")).encode
+    linee = [codifica(risorsa) for r in righe for risorsa in serializza(r)]
+    return ("\n".join(linee) + "\n").encode() if linee else b"", len(linee)
+
+
+def serializza(esecutore, tipo, blocchi, in_volo=4):
+    """
+    (byte, numero) per ogni blocco, nello stesso ordine. Con un esecutore (ProcessPoolExecutor)
+    al massimo ``in_volo`` blocchi sono in lavorazione, così la lettura non corre avanti in memoria.
+    """
+    if esecutore is None:
+        for blocco in blocchi:
+            yield blocco_ndjson(tipo, blocco)
+        return
+    attesa = deque()
+    for blocco in blocchi:
+        attesa.append(esecutore.submit(blocco_ndjson, tipo, blocco))
+        if len(attesa) >= in_volo:
+            yield attesa.popleft().result()
+    while attesa:
+        yield attesa.popleft().result()
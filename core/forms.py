@@ -3,6 +3,7 @@ from django.forms import inlineformset_factory
 from django.core.exceptions import ValidationError
 from django.views import View
 from datetime import date
+from django.utils import timezone
 from .models import (
 Episodio, Letto, Paziente, ParametroVitale, DiarioIgiene, Prescrizione, RigaPrescrizione,
  Farmaco, Somministrazione, ContattoEmergenza, Allergia, MenuPeriodo, Pasto,
@@ -10,6 +11,8 @@ Episodio, Letto, Paziente, ParametroVitale, DiarioIgiene, Prescrizione, RigaPres
  Pietanza, RecapitoContatto)
 from django.forms.widgets import ClearableFileInput
 from django.forms.models import BaseInlineFormSet
+from .export import DIARI
+from .turni import conflitti_turno
 
 
 class PazienteForm(forms.ModelForm):
@@ -148,6 +151,29 @@ RecapitoFormSet = inlineformset_factory(
     extra=2, can_delete=True
 )
 
+class SceltePrecaricateMixin:
+    """
+    Formset: le scelte delle select indicate in `campi_precaricati` vengono lette una volta
+    e condivise da tutti i form (altrimenti ogni riga, extra ed empty_form rifanno la query).
+    """
+    campi_precaricati = ()
+
+    def _construct_form(self, i, **kwargs):
+        return self._condividi_scelte(super()._construct_form(i, **kwargs))
+
+    @property
+    def empty_form(self):
+        return self._condividi_scelte(super().empty_form)
+
+    def _condividi_scelte(self, form):
+        scelte = self.__dict__.setdefault("_scelte_precaricate", {})
+        for nome in self.campi_precaricati:
+            campo = form.fields[nome]
+            if nome not in scelte:
+                scelte[nome] = list(iter(campo.choices))  # iter(): evita il COUNT di len()
+            campo.choices = scelte[nome]
+        return form
+
 # --- C) Allergie: form + formset con coerenza categoria/target e dedup ---
 class AllergiaForm(forms.ModelForm):
     class Meta:
@@ -175,7 +201,9 @@ class AllergiaForm(forms.ModelForm):
         cd["sostanza_libera"] = sost
         return cd
 
-class BaseAllergiaFormSet(BaseInlineFormSet):
+class BaseAllergiaFormSet(SceltePrecaricateMixin, BaseInlineFormSet):
+    campi_precaricati = ("farmaco",)
+
     def clean(self):
         super().clean()
         visti = set()
@@ -308,6 +336,11 @@ class DiarioIgieneForm(forms.ModelForm):
             "evento": forms.Select(attrs={"class": "select"}),
         }
 
+    def _get_validation_exclusions(self):
+        # giorno non è nel form ma si ricava da rilevato_il (DiarioIgiene.clean):
+        # così il vincolo igiene_un_evento_al_giorno si verifica prima del salvataggio
+        return super()._get_validation_exclusions() - {"giorno"}
+
 class PrescrizioneForm(forms.ModelForm):
     class Meta:
         model = Prescrizione
@@ -414,10 +447,14 @@ class RigaPrescrizioneForm(forms.ModelForm):
             out.append(p)
         return out
 
+class BaseRigaPrescrizioneFormSet(SceltePrecaricateMixin, BaseInlineFormSet):
+    campi_precaricati = ("farmaco",)
+
 RigaPrescrizioneFormSet = inlineformset_factory(
     Prescrizione,
     RigaPrescrizione,
     form=RigaPrescrizioneForm,
+    formset=BaseRigaPrescrizioneFormSet,
     extra=1,
     can_delete=True,
 )
@@ -471,7 +508,7 @@ class SomministrazioneForm(forms.ModelForm):
             qs = RigaPrescrizione.objects.filter(
                 prescrizione__paziente=paziente_prefiltro,
                 prescrizione__attiva=True
-            ).select_related("farmaco", "prescrizione")
+            ).select_related("farmaco", "prescrizione").order_by("id")
         else:
             qs = RigaPrescrizione.objects.none()
         self.fields["riga"].queryset = qs
@@ -569,11 +606,12 @@ class TurniDiarioFilterForm(forms.Form):
 class DipendenteForm(forms.ModelForm):
     class Meta:
         model = Dipendente
-        fields = ["cognome", "nome", "ruolo", "attivo"]
+        fields = ["cognome", "nome", "ruolo", "ore_settimanali", "attivo"]
         widgets = {
             "cognome": forms.TextInput(attrs={"class": "input"}),
             "nome": forms.TextInput(attrs={"class": "input"}),
             "ruolo": forms.Select(attrs={"class": "select"}),
+            "ore_settimanali": forms.NumberInput(attrs={"class": "input", "step": "0.5", "min": "0"}),
         }
 
 class PianoTurniPeriodoForm(forms.ModelForm):
@@ -622,6 +660,28 @@ class AssegnazioneTurnoForm(forms.ModelForm):
             # Un turno al giorno per dipendente nello stesso periodo (match alla constraint DB)
             if dip and AssegnazioneTurno.objects.filter(periodo=self.periodo, data=data, dipendente=dip).exists():
                 self.add_error(None, "Questo dipendente ha già un turno in questa data nel periodo.")
+                return cleaned
+        _controlla_conflitti_turno(self, cleaned)
+        return cleaned
+
+def _controlla_conflitti_turno(form, cleaned):
+    """Doppi turni, sovrapposizioni e riposo insufficiente rispetto a tutti i periodi."""
+    data, dip, turno = cleaned.get("data"), cleaned.get("dipendente"), cleaned.get("turno")
+    if not (data and dip and turno):
+        return
+    for a, motivo in conflitti_turno(dip.pk, data, turno, escludi_pk=form.instance.pk):
+        periodo = f" ({a.periodo})" if a.periodo_id else ""
+        form.add_error(None, f"Conflitto con {a.turno} del {a.data:%d/%m/%Y}{periodo}: {motivo}.")
+
+class AssegnazioneTurnoAdminForm(forms.ModelForm):
+    """Form dell'admin: stessi controlli di conflitto fra periodi del form di gestione."""
+    class Meta:
+        model = AssegnazioneTurno
+        fields = "__all__"
+
+    def clean(self):
+        cleaned = super().clean()
+        _controlla_conflitti_turno(self, cleaned)
         return cleaned
         
 class MenuPeriodoForm(forms.ModelForm):
@@ -659,4 +719,130 @@ class MenuPeriodoSelectForm(forms.Form):
         label="Periodo",
         queryset=MenuPeriodo.objects.all().order_by("-data_inizio"),  # <-- QUI
         widget=forms.Select(attrs={"class": "select"})
-    )
\ No newline at end of file
+    )
+# === SINCRONIZZAZIONE OFFLINE: validazione a lotti (core/sincronizzazione.py) ===
+class SceltaPrecaricata(forms.ModelChoiceField):
+    """ModelChoiceField che cerca il valore in un dizionario {pk: oggetto} già caricato, senza query."""
+
+    def __init__(self, oggetti, originale):
+        super().__init__(
+            queryset=originale.queryset.none(), required=originale.required, label=originale.label,
+            widget=originale.widget,
+        )
+        self.oggetti = oggetti
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.oggetti[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages["invalid_choice"], code="invalid_choice")
+
+
+class ValidazioneALottiMixin:
+    """
+    Form delle voci sincronizzate: le FK in ``precaricati`` ({campo: {pk: oggetto}}) si risolvono
+    sugli oggetti caricati una volta per tutto il lotto invece che con una query per voce.
+    """
+
+    def __init__(self, *args, precaricati=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._precaricati = precaricati or {}
+        for nome, oggetti in self._precaricati.items():
+            self.fields[nome] = SceltaPrecaricata(oggetti, self.fields[nome])
+
+    def _get_validation_exclusions(self):
+        # già verificate sul dizionario: Model.full_clean farebbe una query per ogni FK
+        return super()._get_validation_exclusions() | set(self._precaricati)
+
+
+class SomministrazioneSyncForm(ValidazioneALottiMixin, SomministrazioneForm):
+    pass
+
+
+class ParametroVitaleSyncForm(ValidazioneALottiMixin, ParametroVitaleForm):
+    pass
+
+
+class DiarioIgieneSyncForm(ValidazioneALottiMixin, DiarioIgieneForm):
+    def _get_validation_exclusions(self):
+        # i doppioni si cercano per tutto il lotto con una query (igiene.separa_doppioni)
+        return super()._get_validation_exclusions() | {"giorno"}
+
+
+# === GIRO PARAMETRI: una riga per ospite, salvate insieme ===
+class ParametroGiroForm(ValidazioneALottiMixin, ParametroVitaleForm):
+    """Riga del giro: stesse regole di ParametroVitaleForm; l'ora di rilevazione è comune a tutto il giro."""
+
+    class Meta(ParametroVitaleForm.Meta):
+        fields = ["paziente", "pas", "pad", "fc", "spo2", "temp_c", "glicemia_mgdl", "note"]
+        widgets = {**ParametroVitaleForm.Meta.widgets, "paziente": forms.HiddenInput()}
+
+    def has_changed(self):
+        # l'ospite è sempre presente (campo nascosto): conta solo se è stato inserito un valore
+        return any(nome != "paziente" for nome in self.changed_data)
+
+
+class BaseGiroParametriFormSet(forms.BaseFormSet):
+    def get_form_kwargs(self, index):
+        # le righe lasciate vuote (ospite non rilevato) non si validano e non si salvano
+        return {**super().get_form_kwargs(index), "empty_permitted": True}
+
+
+GiroParametriFormSet = forms.formset_factory(ParametroGiroForm, formset=BaseGiroParametriFormSet, extra=0)
+
+
+class GiroParametriForm(forms.Form):
+    rilevato_il = forms.DateTimeField(
+        label="Rilevati il",
+        widget=forms.DateTimeInput(attrs={"class": "input", "type": "datetime-local"}, format="%Y-%m-%dT%H:%M"),
+    )
+
+
+# === IGIENE DI REPARTO: stesso evento per più ospiti ===
+class IgieneRepartoForm(forms.Form):
+    """Ospiti spuntati, evento e ora comuni; ``ospiti`` sono i pazienti in degenza già caricati dalla vista."""
+    evento = forms.ChoiceField(
+        label="Evento", choices=DiarioIgiene.EVENTO_CHOICES, widget=forms.Select(attrs={"class": "select"}),
+    )
+    rilevato_il = forms.DateTimeField(
+        label="Rilevato il",
+        widget=forms.DateTimeInput(attrs={"class": "input", "type": "datetime-local"}, format="%Y-%m-%dT%H:%M"),
+    )
+    pazienti = forms.TypedMultipleChoiceField(
+        label="Ospiti", coerce=int, widget=forms.CheckboxSelectMultiple,
+        error_messages={"required": "Selezionare almeno un ospite."},
+    )
+
+    def __init__(self, *args, ospiti=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["pazienti"].choices = [(p.pk, f"{p.cognome} {p.nome}") for p in ospiti]
+
+
+# === EXPORT DIARI (verifiche ASL) ===
+class ExportDiarioForm(forms.Form):
+    diario = forms.ChoiceField(
+        label="Diario", choices=[(k, d.titolo) for k, d in DIARI.items()],
+        widget=forms.Select(attrs={"class": "select"}),
+    )
+    formato = forms.ChoiceField(
+        label="Formato", choices=[("xlsx", "Excel (XLSX)"), ("csv", "CSV")],
+        widget=forms.Select(attrs={"class": "select"}),
+    )
+    paziente = forms.ModelChoiceField(
+        queryset=Paziente.objects.order_by("cognome", "nome"), required=False, label="Ospite",
+        empty_label="Tutti", widget=forms.Select(attrs={"class": "select"}),
+    )
+    dal = forms.DateField(required=False, label="Dal", widget=forms.DateInput(attrs={"type": "date", "class": "input"}))
+    al = forms.DateField(required=False, label="Al", widget=forms.DateInput(attrs={"type": "date", "class": "input"}))
+
+    def clean(self):
+        cleaned = super().clean()
+        # predefinito: dal primo del mese a oggi
+        oggi = timezone.localdate()
+        cleaned["al"] = cleaned.get("al") or oggi
+        cleaned["dal"] = cleaned.get("dal") or cleaned["al"].replace(day=1)
+        if cleaned["dal"] > cleaned["al"]:
+            self.add_error("al", "La data finale precede quella iniziale.")
+        return cleaned
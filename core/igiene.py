@@ -0,0 +1,46 @@
+# core/igiene.py
+"""
+Eventi di igiene registrati in blocco (giro docce di reparto, sincronizzazione offline).
+
+Il vincolo igiene_un_evento_al_giorno (paziente, evento, giorno) garantisce l'unicità; qui
+si trovano prima, con una query per tutto il blocco, gli eventi già presenti, per segnalarli
+all'operatore invece di far fallire l'inserimento.
+"""
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .models import DiarioIgiene
+
+
+def chiave_evento(evento):
+    evento.imposta_giorno()
+    return (evento.paziente_id, evento.evento, evento.giorno)
+
+
+def eventi_esistenti(eventi):
+    """Chiavi (paziente_id, evento, giorno) degli ``eventi`` (non salvati) già registrate nel diario."""
+    per_giorno = defaultdict(set)  # (evento, giorno) -> pazienti
+    for e in eventi:
+        paziente_id, tipo, giorno = chiave_evento(e)
+        per_giorno[(tipo, giorno)].add(paziente_id)
+    if not per_giorno:
+        return set()
+    filtro = Q()
+    for (tipo, giorno), pazienti in per_giorno.items():
+        filtro |= Q(evento=tipo, giorno=giorno, paziente_id__in=pazienti)
+    return set(DiarioIgiene.objects.filter(filtro).values_list("paziente_id", "evento", "giorno"))
+
+
+def separa_doppioni(eventi):
+    """(nuovi, doppioni): doppioni sono gli eventi già nel diario o ripetuti nel blocco stesso."""
+    esistenti = eventi_esistenti(eventi)
+    nuovi, doppioni = [], []
+    for e in eventi:
+        chiave = chiave_evento(e)
+        if chiave in esistenti:
+            doppioni.append(e)
+        else:
+            esistenti.add(chiave)
+            nuovi.append(e)
+    return nuovi, doppioni
@@ -0,0 +1,113 @@
+# core/letti.py
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from .models import Episodio, Letto
+
+# Il tabellone viene invalidato dai signal (accettazioni, dimissioni, letti), il timeout è solo una rete di sicurezza
+TABELLONE_CHIAVE = "core:letti:tabellone"
+TABELLONE_TIMEOUT = 60 * 60 * 24
+
+
+class LettoOccupato(Exception):
+    """Il letto è stato assegnato nel frattempo a un altro episodio attivo."""
+
+
+def _letti_con_episodio_attivo():
+    # LEFT JOIN sull'episodio attivo (data_fine nulla) di ogni letto: una sola query
+    return Letto.objects.annotate(
+        attivo=FilteredRelation("episodio", condition=Q(episodio__data_fine__isnull=True)),
+    )
+
+
+def letti_liberi():
+    return (
+        _letti_con_episodio_attivo()
+        .filter(attivo__isnull=True)
+        .select_related("stanza")
+        .order_by("stanza__nome", "codice")
+    )
+
+
+def _costruisci_tabellone():
+    righe = (
+        _letti_con_episodio_attivo()
+        .order_by("stanza__nome", "codice")
+        .values(
+            "id", "codice", "stanza_id", "stanza__nome",
+            "attivo__id", "attivo__data_inizio",
+            "attivo__paziente_id", "attivo__paziente__cognome", "attivo__paziente__nome", "attivo__paziente__sesso",
+        )
+    )
+    stanze = {}
+    for r in righe:
+        stanza = stanze.setdefault(r["stanza_id"], {"id": r["stanza_id"], "nome": r["stanza__nome"], "letti": []})
+        occupante = None
+        if r["attivo__id"]:
+            occupante = {
+                "episodio_id": r["attivo__id"],
+                "paziente_id": r["attivo__paziente_id"],
+                "cognome": r["attivo__paziente__cognome"],
+                "nome": r["attivo__paziente__nome"],
+                "sesso": r["attivo__paziente__sesso"],
+                "data_inizio": r["attivo__data_inizio"],
+            }
+        stanza["letti"].append({"id": r["id"], "codice": r["codice"], "occupante": occupante})
+    return list(stanze.values())
+
+
+def tabellone_letti(oggi=None):
+    """
+    Stanze e letti con l'occupante attuale. I dati vengono dalla cache;
+    i giorni di degenza si calcolano qui, così la cache resta valida anche dopo mezzanotte.
+    """
+    stanze = cache.get(TABELLONE_CHIAVE)
+    if stanze is None:
+        stanze = _costruisci_tabellone()
+        cache.set(TABELLONE_CHIAVE, stanze, TABELLONE_TIMEOUT)
+
+    oggi = oggi or timezone.localdate()
+    totale = occupati = 0
+    for stanza in stanze:
+        sessi = set()
+        for letto in stanza["letti"]:
+            totale += 1
+            occ = letto["occupante"]
+            if occ:
+                occupati += 1
+                occ["giorni"] = (oggi - occ["data_inizio"]).days + 1
+                sessi.add(occ["sesso"])
+        stanza["sessi"] = sorted(sessi)
+        stanza["liberi"] = sum(1 for l in stanza["letti"] if not l["occupante"])
+    return {"stanze": stanze, "totale": totale, "occupati": occupati, "liberi": totale - occupati}
+
+
+def invalida_tabellone():
+    cache.delete(TABELLONE_CHIAVE)
+
+
+def salva_episodio_con_letto(episodio):
+    """
+    Salva l'episodio bloccando la riga del letto (SELECT ... FOR UPDATE) e ricontrollando
+    che sia libero; il vincolo parziale sul DB resta l'ultima garanzia.
+    """
+    try:
+        with transaction.atomic():
+            if episodio.letto_id:
+                Letto.objects.select_for_update().filter(pk=episodio.letto_id).first()
+                preso = (
+                    Episodio.objects
+                    .filter(letto_id=episodio.letto_id, data_fine__isnull=True)
+                    .exclude(pk=episodio.pk)
+                    .exists()
+                )
+                if preso:
+                    raise LettoOccupato()
+            episodio.save()
+    except IntegrityError as e:
+        if episodio.letto_id and "letto" in str(e).lower():
+            raise LettoOccupato() from e
+        raise
+    return episodio
@@ -0,0 +1,70 @@
+# core/management/commands/benchmark_viste.py
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import carica_baseline, confronta, dimensioni_dataset, esegui, salva_baseline
+
+
+class Command(BaseCommand):
+    help = (
+        "Misura tempo e query di ogni vista di core (diari, report, form) sul database corrente "
+        "e li confronta con la baseline salvata; --salva aggiorna la baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--utente", help="Username con cui autenticarsi (default: primo superuser).")
+        parser.add_argument("--ripetizioni", type=int, default=5, help="Richieste misurate per rotta (dopo il riscaldamento).")
+        parser.add_argument("--rotte", nargs="*", help="Solo le rotte il cui nome contiene uno di questi testi.")
+        parser.add_argument("--baseline", default=str(settings.BASE_DIR / "benchmark_baseline.json"),
+                            help="File JSON della baseline.")
+        parser.add_argument("--salva", action="store_true", help="Salva i risultati come nuova baseline.")
+        parser.add_argument("--soglia", type=float, default=20, help="Rallentamento %% oltre cui segnalare una regressione.")
+        parser.add_argument("--senza-cache", action="store_true", help="Svuota la cache prima di ogni richiesta.")
+        parser.add_argument("--fallisci", action="store_true", help="Esce con errore se ci sono regressioni (per la CI).")
+
+    def handle(self, *args, **o):
+        User = get_user_model()
+        utente = (User.objects.filter(username=o["utente"]).first() if o["utente"]
+                  else User.objects.filter(is_superuser=True).order_by("pk").first())
+        if utente is None:
+            raise CommandError("Nessun utente con cui eseguire il benchmark (usa --utente).")
+
+        dataset = dimensioni_dataset()
+        self.stdout.write("Dataset: " + ", ".join(f"{k} {v}" for k, v in dataset.items()))
+        risultati = esegui(utente, ripetizioni=max(1, o["ripetizioni"]), filtro=o["rotte"], senza_cache=o["senza_cache"])
+
+        if o["salva"]:
+            salva_baseline(o["baseline"], risultati)
+            for chiave, r in sorted(risultati.items()):
+                self.stdout.write(f"{chiave:42} {r['mediana_ms']:9.1f} ms  p95 {r['p95_ms']:9.1f}  {r['query']:4} query")
+            self.stdout.write(self.style.SUCCESS(f"Baseline salvata in {o['baseline']} ({len(risultati)} rotte)."))
+            return
+
+        try:
+            baseline = carica_baseline(o["baseline"])
+        except FileNotFoundError:
+            raise CommandError(f"Baseline {o['baseline']} assente: eseguire prima con --salva.")
+        if baseline.get("dataset") != dataset:
+            self.stdout.write(self.style.WARNING(f"Attenzione: baseline misurata su un altro dataset ({baseline.get('dataset')})."))
+
+        regressioni = 0
+        self.stdout.write(f"{'rotta':42} {'base ms':>9} {'ora ms':>9} {'delta':>8} {'query':>11}")
+        for chiave, base, attuale, delta, regressione in confronta(risultati, baseline, o["soglia"]):
+            if base is None:
+                self.stdout.write(f"{chiave:42} {'-':>9} {attuale['mediana_ms']:9.1f} {'nuova':>8} {attuale['query']:>11}")
+                continue
+            riga = (f"{chiave:42} {base['mediana_ms']:9.1f} {attuale['mediana_ms']:9.1f} {delta:+7.0f}% "
+                    f"{base['query']:>5} → {attuale['query']:<3}")
+            if regressione:
+                regressioni += 1
+                riga = self.style.ERROR(riga)
+            self.stdout.write(riga)
+
+        if regressioni:
+            messaggio = f"{regressioni} rotte in regressione rispetto alla baseline."
+            if o["fallisci"]:
+                raise CommandError(messaggio)
+            self.stdout.write(self.style.WARNING(messaggio))
+        else:
+            self.stdout.write(self.style.SUCCESS("Nessuna regressione rispetto alla baseline."))
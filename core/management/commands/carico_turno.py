@@ -0,0 +1,96 @@
+# core/management/commands/carico_turno.py
+import asyncio
+import shlex
+import socket
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.carico import esegui_carico, dati_reparto
+
+
+class Command(BaseCommand):
+    help = (
+        "Prova di carico del cambio turno: N infermieri virtuali (asyncio, nessun servizio esterno) "
+        "registrano somministrazioni e parametri e consultano diari e schede su un server locale; "
+        "riporta throughput, latenze p50/p95/p99 ed errori per rotta."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server da provare.")
+        parser.add_argument("--utente", required=True, help="Username degli infermieri virtuali.")
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--infermieri", type=int, default=50)
+        parser.add_argument("--durata", type=float, default=60, help="Secondi di carico a regime (dopo la rampa).")
+        parser.add_argument("--rampa", type=float, default=10, help="Secondi in cui entrano in servizio tutti gli infermieri.")
+        parser.add_argument("--pensiero", type=float, default=1.0, help="Pausa media fra due azioni (s), 0 = nessuna.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--avvia", action="store_true",
+                            help="Avvia il comando web del Procfile (gunicorn) sulla porta di --url e lo ferma alla fine.")
+        parser.add_argument("--workers", type=int, help="Worker gunicorn con --avvia (default: quelli del Procfile).")
+        parser.add_argument("--processo", default="web",
+                            help="Processo del Procfile da avviare con --avvia (web = WSGI, web_asgi = worker uvicorn).")
+
+    def handle(self, *args, **o):
+        reparto = dati_reparto()
+        if not reparto["pazienti"]:
+            raise CommandError("Nessun ospite in degenza: generare prima i dati (genera_dati).")
+
+        server = self._avvia_server(o) if o["avvia"] else None
+        try:
+            statistiche, secondi = asyncio.run(esegui_carico(
+                o["url"], (o["utente"], o["password"]), reparto, infermieri=o["infermieri"],
+                durata_s=o["durata"], rampa_s=o["rampa"], pensiero_s=o["pensiero"], seed=o["seed"],
+            ))
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+        self._rapporto(statistiche, secondi)
+
+    def _avvia_server(self, o):
+        procfile = settings.BASE_DIR / "Procfile"
+        web = next((r.split(":", 1)[1] for r in procfile.read_text().splitlines()
+                    if r.startswith(f"{o['processo']}:")), None)
+        if not web:
+            raise CommandError(f"Nessun processo '{o['processo']}' nel Procfile.")
+        host, porta = o["url"].split("//", 1)[1].split("/")[0].split(":")
+        comando = shlex.split(web) + ["--bind", f"{host}:{porta}"]
+        if o["workers"]:
+            comando += ["--workers", str(o["workers"])]
+        self.stdout.write("Avvio: " + " ".join(comando))
+        try:
+            server = subprocess.Popen(comando, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise CommandError(f"Comando '{comando[0]}' non trovato: installare i requirements o avviare il server a mano.")
+        for _ in range(100):  # fino a 10 s per l'avvio
+            try:
+                socket.create_connection((host, int(porta)), timeout=0.2).close()
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    raise CommandError("Il server non è partito (controllare il Procfile e gunicorn).")
+                time.sleep(0.1)
+        server.terminate()
+        raise CommandError(f"Il server non risponde su {host}:{porta}.")
+
+    def _rapporto(self, statistiche, secondi):
+        self.stdout.write(
+            f"{'rotta':30} {'richieste':>9} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errori':>8}  stati"
+        )
+        totale = errori = 0
+        for rotta, s in sorted(statistiche.items()):
+            n = len(s.latenze_ms)
+            totale += n
+            errori += s.errori
+            riga = (f"{rotta:30} {n:9} {n / secondi:7.1f} {s.percentile(50):8.1f} {s.percentile(95):8.1f} "
+                    f"{s.percentile(99):8.1f} {s.errori / n * 100 if n else 0:7.1f}%  "
+                    + ", ".join(f"{k}×{v}" for k, v in sorted(s.stati.items(), key=str)))
+            self.stdout.write(self.style.ERROR(riga) if s.errori else riga)
+        stile = self.style.WARNING if errori else self.style.SUCCESS
+        self.stdout.write(stile(
+            f"Totale: {totale} richieste in {secondi:.1f}s ({totale / secondi:.1f} req/s), "
+            f"errori {errori} ({errori / totale * 100 if totale else 0:.1f}%)."
+        ))
@@ -0,0 +1,23 @@
+# core/management/commands/censimento.py
+from django.core.management.base import BaseCommand
+
+from core.censimento import aggiorna_censimento, ricostruisci_censimento
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggiorna il censimento giornaliero (giornate di degenza) fino a oggi. "
+        "Da eseguire ogni giorno; con --ricostruisci rigenera l'intera tabella."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ricostruisci", action="store_true",
+                            help="Rigenera storico letti mancante e tutte le giornate (set-based).")
+
+    def handle(self, *args, **options):
+        if options["ricostruisci"]:
+            n = ricostruisci_censimento()
+            self.stdout.write(self.style.SUCCESS(f"Censimento ricostruito: {n} giornate."))
+        else:
+            n = aggiorna_censimento()
+            self.stdout.write(self.style.SUCCESS(f"Censimento aggiornato: {n} giornate aggiunte."))
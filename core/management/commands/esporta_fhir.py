@@ -0,0 +1,49 @@
+# core/management/commands/esporta_fhir.py
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.esportazione_fhir import Interrotto, esegui, prossimo, pulisci_scaduti, recupera_interrotti
+
+
+def _interrompi(signum, frame):
+    raise Interrotto()
+
+
+class Command(BaseCommand):
+    help = (
+        "Esegue gli export FHIR in coda (avviati da /fhir/$export) ed elimina quelli scaduti. "
+        "Con --continuo resta in attesa di nuovi job (processo worker del Procfile). "
+        "Con SIGTERM si ferma rimettendo in coda il job in corso."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--continuo", action="store_true")
+        parser.add_argument("--intervallo", type=float, default=5, help="Secondi tra due controlli della coda.")
+        parser.add_argument("--processi", type=int, default=None,
+                            help="Processi di serializzazione (predefinito FHIR_EXPORT_PROCESSI).")
+
+    def handle(self, *args, **o):
+        signal.signal(signal.SIGTERM, _interrompi)
+        try:
+            self._ciclo(o)
+        except Interrotto:
+            self.stdout.write("SIGTERM: worker fermato, l'eventuale job in corso è di nuovo in coda.")
+
+    def _ciclo(self, o):
+        while True:
+            eliminati = pulisci_scaduti()
+            if eliminati:
+                self.stdout.write(f"Export scaduti eliminati: {eliminati}.")
+            ripresi, falliti = recupera_interrotti()
+            if ripresi or falliti:
+                self.stdout.write(f"Export interrotti: {ripresi} rimessi in coda, {falliti} in errore.")
+            while (job := prossimo()) is not None:
+                inizio = time.monotonic()
+                esegui(job, processi=o["processi"])
+                job.refresh_from_db()
+                self.stdout.write(f"Export {job.pk} ({job.tipi}): {job.get_stato_display()} in {time.monotonic() - inizio:.1f} s.")
+            if not o["continuo"]:
+                return
+            time.sleep(o["intervallo"])
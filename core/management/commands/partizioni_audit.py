@@ -0,0 +1,30 @@
+# core/management/commands/partizioni_audit.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.audit import assicura_partizioni, stacca_partizioni
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea in anticipo le partizioni mensili del registro modifiche (solo PostgreSQL). "
+        "Le crea già il processo web al primo scarico del registro di ogni mese; "
+        "con --stacca-prima stacca quelle vecchie da archiviare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mesi-avanti", type=int, default=2)
+        parser.add_argument("--stacca-prima", metavar="AAAA-MM",
+                            help="Stacca (senza cancellarle) le partizioni dei mesi precedenti.")
+
+    def handle(self, *args, **o):
+        create = assicura_partizioni(o["mesi_avanti"])
+        self.stdout.write(self.style.SUCCESS(f"Partizioni create: {', '.join(create) or 'nessuna'}."))
+        if o["stacca_prima"]:
+            try:
+                limite = date.fromisoformat(f"{o['stacca_prima']}-01")
+            except ValueError:
+                raise CommandError("--stacca-prima richiede il formato AAAA-MM.")
+            staccate = stacca_partizioni(limite)
+            self.stdout.write(self.style.SUCCESS(f"Partizioni staccate: {', '.join(staccate) or 'nessuna'}."))
@@ -0,0 +1,12 @@
+# core/management/commands/ricalcola_ore.py
+from django.core.management.base import BaseCommand
+
+from core.ore import ricalcola_tutto
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce il riepilogo mensile delle ore (OreMensili) da tutte le assegnazioni turno."
+
+    def handle(self, *args, **options):
+        n = ricalcola_tutto()
+        self.stdout.write(self.style.SUCCESS(f"Riepilogo ricostruito: {n} righe dipendente/mese."))
@@ -0,0 +1,34 @@
+# core/management/commands/token_api.py
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.api import crea_token
+from core.models import TokenAPI
+
+
+class Command(BaseCommand):
+    help = "Crea un token per l'API JSON (la chiave si mostra una sola volta) o revoca i token di un utente."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--utente", required=True)
+        parser.add_argument("--nome", default="", help="Dispositivo o integrazione, es. 'Tablet piano 1'.")
+        parser.add_argument("--revoca", action="store_true",
+                            help="Disattiva i token dell'utente (solo quello con --nome, se indicato).")
+
+    def handle(self, *args, **o):
+        try:
+            utente = get_user_model().objects.get(username=o["utente"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"Utente {o['utente']} inesistente.")
+        if o["revoca"]:
+            token = TokenAPI.objects.filter(utente=utente, attivo=True)
+            if o["nome"]:
+                token = token.filter(nome=o["nome"])
+            n = token.update(attivo=False)
+            self.stdout.write(self.style.SUCCESS(f"Token revocati: {n}."))
+            return
+        if not o["nome"]:
+            raise CommandError("--nome è obbligatorio per creare un token.")
+        chiave = crea_token(utente, o["nome"])
+        self.stdout.write(self.style.SUCCESS(f"Token creato per {utente} ({o['nome']}). Conservarlo: non sarà più mostrato."))
+        self.stdout.write(chiave)
@@ -0,0 +1,493 @@
+# core/menu.py
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Prefetch, Q, F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import MenuPasto, VoceMenu, Pasto, Pietanza, RicettaIngrediente, Episodio
+
+# Righe fisse della griglia: 4 pasti
+RIGHE_PASTI = [Pasto.COLAZ, Pasto.MEREN, Pasto.PRANZ, Pasto.CENA]
+
+# La griglia viene invalidata dai signal, il timeout è solo una rete di sicurezza
+GRIGLIA_TIMEOUT = 60 * 60 * 24
+
+
+def _chiave_griglia(periodo_id):
+    return f"core:menu:griglia:{periodo_id}"
+
+
+def _chiave_spesa(periodo_id):
+    return f"core:menu:spesa:{periodo_id}"
+
+
+def _label_voce(v):
+    if v.pietanza:
+        label = v.pietanza.nome
+        if v.descrizione_libera:
+            label += f" – {v.descrizione_libera}"
+    else:
+        label = v.descrizione_libera
+    if v.note:
+        label += f" ({v.note})"
+    return label
+
+
+def _testo_ricerca(v):
+    testo = v.descrizione_libera or ""
+    if v.pietanza:
+        testo += " " + v.pietanza.nome + " " + (v.pietanza.tag_dieta or "") + " " + (v.pietanza.allergeni_note or "")
+    return testo.lower()
+
+
+def _costruisci_griglia(periodo):
+    voci_prefetch = Prefetch(
+        "voci",
+        queryset=VoceMenu.objects.select_related("pietanza").order_by("ordine", "id")
+    )
+    pasti = (
+        MenuPasto.objects
+        .filter(periodo=periodo, data__range=[periodo.data_inizio, periodo.data_fine])
+        .prefetch_related(voci_prefetch)
+        .order_by("data", "pasto")
+    )
+
+    # (data, pasto_code) -> { id, items[list], note, testo (per la ricerca) }
+    grid = {}
+    for p in pasti:
+        voci = list(p.voci.all())
+        grid[(p.data, p.pasto)] = {
+            "id": p.id,
+            "items": [_label_voce(v) for v in voci],
+            "note": p.note,
+            "testo": "\n".join(_testo_ricerca(v) for v in voci),
+        }
+    return grid
+
+
+def griglia_menu(periodo):
+    """Griglia completa (data, pasto) → cella del periodo, dalla cache se disponibile."""
+    key = _chiave_griglia(periodo.pk)
+    grid = cache.get(key)
+    if grid is None:
+        grid = _costruisci_griglia(periodo)
+        cache.set(key, grid, GRIGLIA_TIMEOUT)
+    return grid
+
+
+def invalida_menu(*periodo_ids):
+    """Scarta griglia e lista della spesa dei periodi indicati."""
+    ids = {pid for pid in periodo_ids if pid}
+    keys = [_chiave_griglia(pid) for pid in ids] + [_chiave_spesa(pid) for pid in ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalida_lista_spesa(*periodo_ids):
+    keys = [_chiave_spesa(pid) for pid in set(periodo_ids) if pid]
+    if keys:
+        cache.delete_many(keys)
+
+
+def _spezza_settimane(dates):
+    weeks, curw, chunk = [], None, []
+    for d in dates:
+        w = d.isocalendar().week
+        if curw is None:
+            curw = w
+        if w != curw:
+            weeks.append({"iso_week": curw, "dates": chunk})
+            curw, chunk = w, []
+        chunk.append(d)
+    if chunk:
+        weeks.append({"iso_week": curw, "dates": chunk})
+    return weeks
+
+
+def settimane_menu(periodo, pasto=None, giorno=None, settimana_iso=None, q=""):
+    """
+    Tabelle settimanali (righe pasti × colonne giorni) del periodo.
+    I filtri sono applicati sulla griglia in cache, senza nuove query.
+    """
+    d_start, d_end = periodo.data_inizio, periodo.data_fine
+    if giorno:
+        d_start = d_end = giorno
+
+    dates, d = [], d_start
+    while d <= d_end:
+        if not settimana_iso or d.isocalendar().week == settimana_iso:
+            dates.append(d)
+        d += timedelta(days=1)
+    if not dates:
+        return []
+
+    rows = [{"code": code, "label": dict(Pasto.choices)[code]} for code in RIGHE_PASTI]
+    if pasto:
+        rows = [r for r in rows if r["code"] == pasto]
+
+    grid = griglia_menu(periodo)
+    ql = (q or "").strip().lower()
+
+    weeks = _spezza_settimane(dates)
+    for wk in weeks:
+        wk_table = []
+        for r in rows:
+            cells = []
+            for d in wk["dates"]:
+                cell = grid.get((d, r["code"]))  # None oppure {id,items,note}
+                if cell and ql and ql not in cell["testo"]:
+                    cell = None
+                cells.append({"cell": cell, "date": d, "pasto_code": r["code"]})
+            wk_table.append({"row": r, "cells": cells})
+        wk["table"] = wk_table
+    return weeks
+
+
+# === EDITOR SETTIMANALE (patch JSON su una settimana) ===
+class ConflittoVersione(Exception):
+    """Una o più celle sono state modificate da altri dopo la lettura."""
+
+    def __init__(self, celle):
+        super().__init__("Il menu è stato modificato da un altro utente.")
+        self.celle = celle
+
+
+def _versione(mp):
+    return mp.aggiornato_il.isoformat() if mp else None
+
+
+def lunedi_di(giorno):
+    return giorno - timedelta(days=giorno.weekday())
+
+
+def stato_settimana(periodo, lunedi):
+    """Celle della settimana con voci e versione (aggiornato_il), per l'editor."""
+    giorni = [lunedi + timedelta(days=i) for i in range(7)]
+    pasti = (
+        MenuPasto.objects
+        .filter(data__range=[giorni[0], giorni[-1]], periodo=periodo)
+        .prefetch_related(Prefetch("voci", queryset=VoceMenu.objects.order_by("ordine", "id")))
+        .order_by("data", "pasto")
+    )
+    celle = []
+    for mp in pasti:
+        celle.append({
+            "id": mp.id,
+            "data": mp.data.isoformat(),
+            "pasto": mp.pasto,
+            "versione": _versione(mp),
+            "note": mp.note,
+            "voci": [
+                {
+                    "id": v.id,
+                    "pietanza": v.pietanza_id,
+                    "descrizione_libera": v.descrizione_libera,
+                    "ordine": v.ordine,
+                    "note": v.note,
+                }
+                for v in mp.voci.all()
+            ],
+        })
+    return {"periodo": periodo.id, "settimana": lunedi.isoformat(), "celle": celle}
+
+
+def _intero(val):
+    if isinstance(val, bool):
+        return None
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalizza_patch(periodo, lunedi, celle_raw, errori):
+    """Controlli formali della patch; restituisce le celle normalizzate."""
+    fine = lunedi + timedelta(days=6)
+    pasti_validi = set(Pasto.values)
+    celle, viste = [], set()
+
+    if not isinstance(celle_raw, list):
+        errori.append("celle: deve essere una lista.")
+        return celle
+
+    for i, c in enumerate(celle_raw):
+        path = f"celle[{i}]"
+        if not isinstance(c, dict):
+            errori.append(f"{path}: formato non valido.")
+            continue
+        try:
+            d = parse_date(str(c.get("data") or ""))
+        except ValueError:
+            d = None
+        if not d:
+            errori.append(f"{path}: data non valida (AAAA-MM-GG).")
+            continue
+        if not (lunedi <= d <= fine):
+            errori.append(f"{path}: la data non appartiene alla settimana.")
+        if not (periodo.data_inizio <= d <= periodo.data_fine):
+            errori.append(f"{path}: la data è fuori dal periodo.")
+        pasto = c.get("pasto")
+        if pasto not in pasti_validi:
+            errori.append(f"{path}: pasto non valido.")
+            continue
+        if (d, pasto) in viste:
+            errori.append(f"{path}: cella duplicata nella patch.")
+            continue
+        viste.add((d, pasto))
+
+        note = c.get("note")
+        if note is not None:
+            note = str(note).strip()
+            if len(note) > 200:
+                errori.append(f"{path}: note troppo lunghe (max 200).")
+
+        voci_raw = c.get("voci", [])
+        if not isinstance(voci_raw, list):
+            errori.append(f"{path}.voci: deve essere una lista.")
+            continue
+        voci = []
+        for j, v in enumerate(voci_raw):
+            vpath = f"{path}.voci[{j}]"
+            if not isinstance(v, dict):
+                errori.append(f"{vpath}: formato non valido.")
+                continue
+            vid = v.get("id")
+            if vid is not None and _intero(vid) is None:
+                errori.append(f"{vpath}: id non valido.")
+            pietanza = v.get("pietanza")
+            if pietanza is not None and _intero(pietanza) is None:
+                errori.append(f"{vpath}: pietanza non valida.")
+            descr = str(v.get("descrizione_libera") or "").strip()
+            vnote = str(v.get("note") or "").strip()
+            ordine = _intero(v.get("ordine", j + 1))
+            if not pietanza and not descr:
+                errori.append(f"{vpath}: indicare una pietanza o una descrizione.")
+            if len(descr) > 150:
+                errori.append(f"{vpath}: descrizione troppo lunga (max 150).")
+            if len(vnote) > 200:
+                errori.append(f"{vpath}: note troppo lunghe (max 200).")
+            if ordine is None or not (1 <= ordine <= 32767):
+                errori.append(f"{vpath}: ordine non valido.")
+            voci.append({
+                "id": _intero(vid) if vid is not None else None,
+                "pietanza": _intero(pietanza) if pietanza is not None else None,
+                "descrizione_libera": descr,
+                "note": vnote,
+                "ordine": ordine,
+                "path": vpath,
+            })
+
+        celle.append({
+            "data": d, "pasto": pasto, "versione": c.get("versione") or None,
+            "note": note, "voci": voci, "path": path,
+        })
+    return celle
+
+
+def applica_patch_settimana(periodo, lunedi, celle_raw, utente=None):
+    """
+    Applica in blocco una patch sulle celle (data, pasto) di una settimana.
+
+    Ogni cella della patch sostituisce l'elenco delle sue voci: le voci con ``id``
+    vengono aggiornate (o spostate da un'altra cella della patch), quelle senza
+    ``id`` create, quelle non più elencate eliminate. La ``versione`` di ogni cella
+    deve coincidere con ``aggiornato_il`` del pasto (``null`` se il pasto non esiste).
+
+    Solleva ValidationError (patch non valida) o ConflittoVersione; tutto o niente.
+    """
+    errori = []
+    celle = _normalizza_patch(periodo, lunedi, celle_raw, errori)
+    if errori:
+        raise ValidationError(errori)
+
+    with transaction.atomic():
+        esistenti = {
+            (mp.data, mp.pasto): mp
+            for mp in MenuPasto.objects.select_for_update().filter(
+                data__range=[lunedi, lunedi + timedelta(days=6)],
+                pasto__in={c["pasto"] for c in celle},
+            )
+        }
+
+        # Concorrenza ottimistica su aggiornato_il
+        conflitti = []
+        for c in celle:
+            mp = esistenti.get((c["data"], c["pasto"]))
+            if _versione(mp) != c["versione"]:
+                conflitti.append({
+                    "data": c["data"].isoformat(), "pasto": c["pasto"], "versione": _versione(mp),
+                })
+        if conflitti:
+            raise ConflittoVersione(conflitti)
+
+        for c in celle:
+            mp = esistenti.get((c["data"], c["pasto"]))
+            if mp and mp.periodo_id != periodo.id:
+                errori.append(f"{c['path']}: pasto già presente in un altro periodo.")
+
+        # Voci attuali delle celle coinvolte: gli id della patch devono venire da qui
+        pasti_patch = [esistenti[(c["data"], c["pasto"])] for c in celle if (c["data"], c["pasto"]) in esistenti]
+        voci_attuali = {v.id: v for v in VoceMenu.objects.filter(pasto__in=pasti_patch)}
+        id_visti = set()
+        pietanze_richieste = set()
+        for c in celle:
+            for v in c["voci"]:
+                if v["id"] is not None:
+                    if v["id"] not in voci_attuali:
+                        errori.append(f"{v['path']}: la voce {v['id']} non appartiene alle celle della patch.")
+                    elif v["id"] in id_visti:
+                        errori.append(f"{v['path']}: la voce {v['id']} compare più volte.")
+                    id_visti.add(v["id"])
+                if v["pietanza"]:
+                    pietanze_richieste.add(v["pietanza"])
+        trovate = set(Pietanza.objects.filter(pk__in=pietanze_richieste).values_list("pk", flat=True))
+        for c in celle:
+            for v in c["voci"]:
+                if v["pietanza"] and v["pietanza"] not in trovate:
+                    errori.append(f"{v['path']}: pietanza {v['pietanza']} inesistente.")
+        if errori:
+            raise ValidationError(errori)
+
+        now = timezone.now()
+
+        # 1) pasti nuovi (solo se hanno contenuto)
+        nuovi = [
+            MenuPasto(
+                periodo=periodo, data=c["data"], pasto=c["pasto"], note=c["note"] or "",
+                creato_da=utente, aggiornato_da=utente,
+            )
+            for c in celle
+            if (c["data"], c["pasto"]) not in esistenti and (c["voci"] or c["note"])
+        ]
+        MenuPasto.objects.bulk_create(nuovi)
+
+        # 2) pasti esistenti: note e nuova versione
+        toccati = []
+        for c in celle:
+            mp = esistenti.get((c["data"], c["pasto"]))
+            if mp:
+                if c["note"] is not None:
+                    mp.note = c["note"]
+                mp.aggiornato_il = now
+                mp.aggiornato_da = utente
+                toccati.append(mp)
+        MenuPasto.objects.bulk_update(toccati, ["note", "aggiornato_il", "aggiornato_da"])
+        for mp in nuovi:
+            esistenti[(mp.data, mp.pasto)] = mp
+
+        # 3) voci: create / aggiornate (anche spostate) / eliminate
+        da_creare, da_aggiornare = [], []
+        for c in celle:
+            mp = esistenti.get((c["data"], c["pasto"]))
+            if mp is None:
+                continue
+            for v in c["voci"]:
+                campi = {
+                    "pietanza_id": v["pietanza"],
+                    "descrizione_libera": v["descrizione_libera"],
+                    "ordine": v["ordine"],
+                    "note": v["note"],
+                }
+                if v["id"] is not None:
+                    obj = voci_attuali[v["id"]]
+                    for k, val in campi.items():
+                        setattr(obj, k, val)
+                    obj.pasto = mp
+                    obj.aggiornato_il = now
+                    obj.aggiornato_da = utente
+                    da_aggiornare.append(obj)
+                else:
+                    da_creare.append(VoceMenu(pasto=mp, creato_da=utente, aggiornato_da=utente, **campi))
+        da_eliminare = [vid for vid in voci_attuali if vid not in id_visti]
+
+        VoceMenu.objects.bulk_create(da_creare)
+        VoceMenu.objects.bulk_update(
+            da_aggiornare,
+            ["pasto", "pietanza", "descrizione_libera", "ordine", "note", "aggiornato_il", "aggiornato_da"],
+        )
+        if da_eliminare:
+            VoceMenu.objects.filter(pk__in=da_eliminare).delete()
+
+        # le operazioni bulk non emettono signal: invalido a mano
+        transaction.on_commit(lambda: invalida_menu(periodo.id))
+
+    return {
+        "creati": len(da_creare),
+        "aggiornati": len(da_aggiornare),
+        "eliminati": len(da_eliminare),
+        "celle": [
+            {"id": mp.id, "data": mp.data.isoformat(), "pasto": mp.pasto, "versione": _versione(mp)}
+            for mp in sorted(
+                (esistenti[(c["data"], c["pasto"])] for c in celle if (c["data"], c["pasto"]) in esistenti),
+                key=lambda m: (m.data, m.pasto),
+            )
+        ],
+    }
+
+
+# === LISTA DELLA SPESA (esplosione ricette × porzioni) ===
+def presenze_giornaliere(d_start, d_end):
+    """{data: residenti presenti} nell'intervallo, da una sola query sugli episodi."""
+    episodi = (
+        Episodio.objects
+        .filter(data_inizio__lte=d_end)
+        .filter(Q(data_fine__isnull=True) | Q(data_fine__gte=d_start))
+        .values_list("data_inizio", "data_fine")
+    )
+    # array delle differenze: +1 all'ingresso, -1 il giorno dopo la dimissione
+    n_giorni = (d_end - d_start).days + 1
+    delta = [0] * (n_giorni + 1)
+    for inizio, fine in episodi:
+        i = max((inizio - d_start).days, 0)
+        j = (fine - d_start).days + 1 if fine else n_giorni
+        if j > i:
+            delta[i] += 1
+            delta[min(j, n_giorni)] -= 1
+    presenze, corrente = {}, 0
+    for k in range(n_giorni):
+        corrente += delta[k]
+        presenze[d_start + timedelta(days=k)] = corrente
+    return presenze
+
+
+def _costruisci_lista_spesa(periodo):
+    # quantità per porzione, per ingrediente e giorno (somma su tutte le voci del giorno)
+    per_giorno = (
+        RicettaIngrediente.objects
+        .filter(
+            pietanza__vocemenu__pasto__periodo=periodo,
+            pietanza__vocemenu__pasto__data__range=[periodo.data_inizio, periodo.data_fine],
+        )
+        .values("ingrediente_id", "ingrediente__nome", "ingrediente__udm")
+        .annotate(data=F("pietanza__vocemenu__pasto__data"), quantita=Sum("quantita_porzione"))
+        .order_by()
+    )
+    presenze = presenze_giornaliere(periodo.data_inizio, periodo.data_fine)
+
+    totali = {}
+    for r in per_giorno:
+        voce = totali.setdefault(r["ingrediente_id"], {
+            "ingrediente": r["ingrediente__nome"],
+            "udm": r["ingrediente__udm"],
+            "quantita": 0,
+        })
+        voce["quantita"] += r["quantita"] * presenze.get(r["data"], 0)
+
+    return {
+        "righe": sorted(totali.values(), key=lambda v: v["ingrediente"].lower()),
+        "porzioni_giorno": presenze,
+    }
+
+
+def lista_spesa(periodo):
+    """Fabbisogno ingredienti del periodo (porzioni = residenti presenti), dalla cache."""
+    key = _chiave_spesa(periodo.pk)
+    dati = cache.get(key)
+    if dati is None:
+        dati = _costruisci_lista_spesa(periodo)
+        cache.set(key, dati, GRIGLIA_TIMEOUT)
+    return dati
@@ -0,0 +1,212 @@
+# core/middleware.py
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("core.sql")
+
+# Numero massimo di query per rotta (nome URL di core/urls.py), con utente autenticato.
+# Usato dal middleware per segnalare gli sforamenti e da core/tests.py come soglia di regressione.
+BUDGET_QUERY = {
+    "home": 2,
+    "dashboard": 2,
+    "paziente_nuovo": 2,
+    "paziente_setup": 3,
+    "paziente_anagrafica": 12,
+    "contatti_edit": 5,
+    "contatto_nuovo": 3,
+    "contatto_modifica": 4,
+    "allergie_edit": 5,
+    "episodio_accetta": 5,
+    "letti_tabellone": 3,
+    "parametro_nuovo": 4,
+    "parametri_diario": 4,
+    "parametri_giro": 4,
+    "igiene_nuovo": 4,
+    "igiene_reparto": 4,
+    "igiene_diario": 4,
+    "somministrazione_nuova": 3,
+    "somministrazione_righe": 3,
+    "sincronizzazione": 2,
+    "terapia_diario": 4,
+    "prescrizione_nuova": 6,
+    "prescrizioni_lista": 7,
+    "menu_diario": 3,
+    "menu_periodo_nuovo": 2,
+    "menu_settimana_editor": 5,
+    "pietanza_nuova": 2,
+    "turni_diario": 4,
+    "turni_periodo_nuovo": 2,
+    "turni_periodo_gestisci": 8,
+    "turni_periodo_seleziona": 3,
+    "turni_copertura": 6,
+    "turni_in_servizio": 4,
+    "turni_calendario_ics": 3,
+    "dipendente_nuovo": 2,
+    "report_menu_periodo_select": 3,
+    "report_menu_periodo_print": 3,
+    "report_lista_spesa": 5,
+    "report_ore_csv": 3,
+    "report_diari": 3,
+    "export_diario": 3,
+    "report_censimento": 4,
+    # API: sessione/token + pagina; include= aggiunge una query per ogni relazione multipla
+    "api_pazienti": 3,
+    "api_episodi": 3,
+    "api_prescrizioni": 5,
+    "api_somministrazioni": 3,
+    "api_parametri": 3,
+    "api_igiene": 3,
+    "api_menu": 4,
+    "api_turni": 3,
+    "api_dettaglio": 3,
+    "fhir_export": 4,
+    "fhir_export_stato": 3,
+    "fhir_export_file": 3,
+}
+
+
+class _Rilevatore:
+    """execute_wrapper che registra (alias, sql, parametri, durata) di ogni query."""
+
+    def __init__(self):
+        self.query = []
+
+    def __call__(self, execute, sql, params, many, context):
+        inizio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            durata = time.perf_counter() - inizio
+            self.query.append((context["connection"].alias, sql, params, durata))
+
+
+# rilevatore della richiesta in corso: sync_to_async lo porta anche nei thread di views.in_parallelo
+_rilevatore_richiesta = ContextVar("core_rilevatore_sql", default=None)
+
+
+def _installa(stack, rilevatore):
+    for conn in connections.all():
+        stack.enter_context(conn.execute_wrapper(rilevatore))
+
+
+@contextmanager
+def rileva_query_nel_thread():
+    """Conteggia nel budget della richiesta anche le query delle connessioni di questo thread."""
+    rilevatore = _rilevatore_richiesta.get()
+    with ExitStack() as stack:
+        if rilevatore is not None:
+            _installa(stack, rilevatore)
+        yield
+
+
+class BudgetSQLMiddleware:
+    """
+    Strumentazione SQL per richiesta (attiva con SQL_BUDGET_ATTIVO): numero di query,
+    tempo DB, query duplicate e la più lenta con il suo EXPLAIN, per nome di rotta.
+    Il riepilogo va nel log "core.sql" e, con SQL_BUDGET_HEADER, nell'header X-SQL-Budget.
+    Le query in parallelo su altri thread (views.in_parallelo sotto ASGI) sono incluse;
+    quelle eseguite durante lo streaming della risposta no.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "SQL_BUDGET_ATTIVO", False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.header = getattr(settings, "SQL_BUDGET_HEADER", settings.DEBUG)
+        self.explain_ms = getattr(settings, "SQL_BUDGET_EXPLAIN_MS", 50)
+        self.budget = {**BUDGET_QUERY, **getattr(settings, "SQL_BUDGET_ROTTE", {})}
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        rilevatore = _Rilevatore()
+        token = _rilevatore_richiesta.set(rilevatore)
+        try:
+            with ExitStack() as stack:
+                _installa(stack, rilevatore)
+                response = self.get_response(request)
+        finally:
+            _rilevatore_richiesta.reset(token)
+        return self._concludi(request, response, rilevatore)
+
+    async def __acall__(self, request):
+        # le view sincrone e i sync_to_async della richiesta girano tutti sullo stesso thread:
+        # il rilevatore va installato sulle connessioni di quel thread, non del loop
+        rilevatore = _Rilevatore()
+        token = _rilevatore_richiesta.set(rilevatore)
+        stack = ExitStack()
+        try:
+            await sync_to_async(_installa)(stack, rilevatore)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _rilevatore_richiesta.reset(token)
+        return await sync_to_async(self._concludi)(request, response, rilevatore)
+
+    def _concludi(self, request, response, rilevatore):
+        match = getattr(request, "resolver_match", None)
+        rotta = (match.view_name if match else None) or request.path
+        rapporto = self._rapporto(rilevatore.query)
+        self._registra(request, rotta, rapporto)
+        if self.header:
+            response["X-SQL-Budget"] = (
+                f"rotta={rotta}; query={rapporto['query']}; tempo_ms={rapporto['tempo_ms']:.1f}; "
+                f"duplicate={rapporto['duplicate']}; ripetute_max={rapporto['ripetute_max']}"
+            )
+        return response
+
+    def _rapporto(self, query):
+        identiche = Counter((sql, repr(params)) for _, sql, params, _ in query)
+        simili = Counter(sql for _, sql, _, _ in query)
+        lenta = max(query, key=lambda q: q[3]) if query else None
+        return {
+            "query": len(query),
+            "tempo_ms": sum(q[3] for q in query) * 1000,
+            "duplicate": sum(n - 1 for n in identiche.values() if n > 1),
+            # stesso SQL con parametri diversi: indizio di N+1
+            "ripetute_max": max(simili.values(), default=0),
+            "lenta": lenta,
+        }
+
+    def _explain(self, alias, sql, params):
+        if not sql.lstrip().upper().startswith("SELECT"):
+            return None
+        conn = connections[alias]
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"{conn.ops.explain_query_prefix()} {sql}", params)
+                return "\n".join(" ".join(str(c) for c in riga) for riga in cur.fetchall())
+        except Exception as e:  # l'EXPLAIN è diagnostico: non deve mai rompere la richiesta
+            return f"EXPLAIN non disponibile: {e}"
+
+    def _registra(self, request, rotta, rapporto):
+        limite = self.budget.get(rotta)
+        oltre = limite is not None and rapporto["query"] > limite
+        livello = logging.WARNING if oltre else logging.INFO
+        logger.log(
+            livello,
+            "%s %s [%s]: %d query%s, %.1f ms, %d duplicate, max %d ripetute",
+            request.method, request.path, rotta, rapporto["query"],
+            f" (budget {limite})" if limite is not None else "",
+            rapporto["tempo_ms"], rapporto["duplicate"], rapporto["ripetute_max"],
+        )
+        lenta = rapporto["lenta"]
+        if lenta and lenta[3] * 1000 >= self.explain_ms:
+            alias, sql, params, durata = lenta
+            logger.log(
+                livello, "Query più lenta (%.1f ms) su %s: %s\n%s",
+                durata * 1000, rotta, sql, self._explain(alias, sql, params) or "",
+            )
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_alter_dipendente_options_alter_dipendente_ruolo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingrediente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('aggiornato_il', models.DateTimeField(auto_now=True)),
+                ('nome', models.CharField(max_length=120, unique=True)),
+                ('udm', models.CharField(choices=[('g', 'Grammi'), ('ml', 'Millilitri'), ('pz', 'Pezzi')], default='g', max_length=3, verbose_name='Unità di misura')),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('aggiornato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='aggiornato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('creato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='creato_%(class)s', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ingrediente',
+                'verbose_name_plural': 'Ingredienti',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RicettaIngrediente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('aggiornato_il', models.DateTimeField(auto_now=True)),
+                ('quantita_porzione', models.DecimalField(decimal_places=2, max_digits=8, verbose_name='Quantità per porzione')),
+                ('aggiornato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='aggiornato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('creato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='creato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('ingrediente', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ricette', to='core.ingrediente')),
+                ('pietanza', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredienti', to='core.pietanza')),
+            ],
+            options={
+                'verbose_name': 'Ingrediente della ricetta',
+                'verbose_name_plural': 'Ingredienti della ricetta',
+                'ordering': ['pietanza', 'ingrediente__nome'],
+                'constraints': [models.UniqueConstraint(fields=('pietanza', 'ingrediente'), name='ingrediente_unico_per_pietanza'), models.CheckConstraint(condition=models.Q(('quantita_porzione__gt', 0)), name='quantita_porzione_positiva')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_ingrediente_ricettaingrediente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssenzaDipendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('aggiornato_il', models.DateTimeField(auto_now=True)),
+                ('tipo', models.CharField(choices=[('FERIE', 'Ferie'), ('MALAT', 'Malattia'), ('PERM', 'Permesso'), ('ALTRO', 'Altro')], default='FERIE', max_length=5)),
+                ('data_inizio', models.DateField()),
+                ('data_fine', models.DateField()),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('aggiornato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='aggiornato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('creato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='creato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('dipendente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assenze', to='core.dipendente')),
+            ],
+            options={
+                'verbose_name': 'Assenza',
+                'verbose_name_plural': 'Assenze',
+                'ordering': ['-data_inizio'],
+                'indexes': [models.Index(fields=['dipendente', 'data_fine', 'data_inizio'], name='assenza_sovrapposizione_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('data_fine__gte', models.F('data_inizio'))), name='assenza_date_coerenti')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FabbisognoTurno',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('aggiornato_il', models.DateTimeField(auto_now=True)),
+                ('ruolo', models.CharField(choices=[('OSS', 'OSS'), ('INF', 'Infermiere'), ('CUOCO', 'Cuoco'), ('PUL', 'Pulizie'), ('COORD', 'Coordinatore'), ('AMM', 'Amministrativo'), ('VOL', 'Volontario'), ('ALTRO', 'Altro')], max_length=6)),
+                ('minimo', models.PositiveSmallIntegerField(default=1)),
+                ('aggiornato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='aggiornato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('creato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='creato_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('turno', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fabbisogni', to='core.turnotipo')),
+            ],
+            options={
+                'verbose_name': 'Fabbisogno turno',
+                'verbose_name_plural': 'Fabbisogni turno',
+                'ordering': ['turno__ordine', 'ruolo'],
+                'constraints': [models.UniqueConstraint(fields=('turno', 'ruolo'), name='fabbisogno_unico_per_turno_ruolo')],
+            },
+        ),
+    ]
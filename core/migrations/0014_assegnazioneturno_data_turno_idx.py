@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_assenzadipendente_fabbisognoturno'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assegnazioneturno',
+            index=models.Index(fields=['data', 'turno'], name='core_assegn_data_cccc22_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_assegnazioneturno_data_turno_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dipendente',
+            name='ore_settimanali',
+            field=models.DecimalField(decimal_places=1, default=38, max_digits=4, verbose_name='Ore settimanali da contratto'),
+        ),
+        migrations.CreateModel(
+            name='OreMensili',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mese', models.DateField(help_text='Primo giorno del mese')),
+                ('turni', models.PositiveSmallIntegerField(default=0)),
+                ('minuti_lavorati', models.PositiveIntegerField(default=0)),
+                ('minuti_notturni', models.PositiveIntegerField(default=0)),
+                ('minuti_festivi', models.PositiveIntegerField(default=0)),
+                ('minuti_contratto', models.PositiveIntegerField(default=0)),
+                ('minuti_straordinari', models.PositiveIntegerField(default=0)),
+                ('aggiornato_il', models.DateTimeField(auto_now=True)),
+                ('dipendente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ore_mensili', to='core.dipendente')),
+            ],
+            options={
+                'verbose_name': 'Ore mensili',
+                'verbose_name_plural': 'Ore mensili',
+                'ordering': ['-mese', 'dipendente__cognome', 'dipendente__nome'],
+                'indexes': [models.Index(fields=['mese', 'dipendente'], name='core_oremen_mese_987be7_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dipendente', 'mese'), name='ore_mensili_unico_per_mese')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:08
+
+import secrets
+
+from django.db import migrations, models
+
+
+def genera_token(apps, schema_editor):
+    Dipendente = apps.get_model("core", "Dipendente")
+    righe = list(Dipendente.objects.filter(token_calendario__isnull=True).only("id"))
+    for d in righe:
+        d.token_calendario = secrets.token_urlsafe(32)
+    Dipendente.objects.bulk_update(righe, ["token_calendario"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_oremensili_dipendente_ore_settimanali'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dipendente',
+            name='token_calendario',
+            field=models.CharField(blank=True, editable=False, max_length=43, null=True, unique=True),
+        ),
+        migrations.RunPython(genera_token, migrations.RunPython.noop),
+    ]
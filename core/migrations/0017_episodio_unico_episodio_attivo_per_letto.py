@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:12
+
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+logger = logging.getLogger("core.migrations")
+
+
+def libera_letti_doppi(apps, schema_editor):
+    """
+    Letti con più episodi attivi (accettazioni concorrenti precedenti al vincolo): il letto resta
+    all'episodio iniziato per primo, agli altri viene tolto. Gli id vanno nel log per ricollocarli.
+    """
+    Episodio = apps.get_model("core", "Episodio")
+    doppi = (
+        Episodio.objects.filter(data_fine__isnull=True, letto__isnull=False)
+        .values("letto_id").annotate(n=Count("id")).filter(n__gt=1).values_list("letto_id", flat=True)
+    )
+    for letto_id in list(doppi):
+        attivi = list(
+            Episodio.objects.filter(letto_id=letto_id, data_fine__isnull=True)
+            .order_by("data_inizio", "id").values_list("id", flat=True)
+        )
+        Episodio.objects.filter(pk__in=attivi[1:]).update(letto=None)
+        logger.warning(
+            "Letto %s assegnato a più episodi attivi: resta all'episodio %s, tolto agli episodi %s (da ricollocare).",
+            letto_id, attivi[0], ", ".join(map(str, attivi[1:])),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_dipendente_token_calendario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(libera_letti_doppi, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='episodio',
+            constraint=models.UniqueConstraint(condition=models.Q(('data_fine__isnull', True), ('letto__isnull', False)), fields=('letto',), name='unico_episodio_attivo_per_letto'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_episodio_unico_episodio_attivo_per_letto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GiornataDegenza',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('provenienza', models.CharField(choices=[('DOM', 'Domicilio'), ('OSP', 'Struttura Ospedaliera'), ('SOC', 'Servizi Sociali'), ('ALT', 'Altro')], max_length=3)),
+                ('episodio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='giornate', to='core.episodio')),
+                ('letto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='giornate', to='core.letto')),
+                ('paziente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='giornate_degenza', to='core.paziente')),
+            ],
+            options={
+                'verbose_name': 'Giornata di degenza',
+                'verbose_name_plural': 'Giornate di degenza',
+                'ordering': ['data', 'episodio'],
+                'indexes': [models.Index(fields=['data', 'provenienza'], name='giornata_data_provenienza_idx'), models.Index(fields=['letto', 'data'], name='giornata_letto_data_idx')],
+                'constraints': [models.UniqueConstraint(fields=('episodio', 'data'), name='giornata_unica_per_episodio')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PermanenzaLetto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_inizio', models.DateField()),
+                ('data_fine', models.DateField(blank=True, null=True)),
+                ('episodio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='permanenze', to='core.episodio')),
+                ('letto', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='permanenze', to='core.letto')),
+                ('paziente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='permanenze_letto', to='core.paziente')),
+            ],
+            options={
+                'verbose_name': 'Permanenza letto',
+                'verbose_name_plural': 'Permanenze letto',
+                'ordering': ['episodio', 'data_inizio'],
+                'indexes': [models.Index(fields=['letto', 'data_inizio', 'data_fine'], name='permanenza_letto_validita_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:36
+
+from datetime import date
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+TABELLA = "core_registromodifica"
+
+
+def partiziona_postgres(apps, schema_editor):
+    """
+    Su PostgreSQL ricrea la tabella partizionata per mese su istante. La chiave primaria dovrebbe
+    includere istante: la tabella resta senza PK (id è un'identity), con un BRIN sul tempo e il solo
+    btree per lo storico di un oggetto. Le partizioni future le crea audit.assicura_partizioni
+    (al primo scarico del registro di ogni mese, o con il comando partizioni_audit).
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    oggi = date.today()
+    mesi = [date(oggi.year + (oggi.month - 1 + i) // 12, (oggi.month - 1 + i) % 12 + 1, 1) for i in range(4)]
+    istruzioni = [
+        f"CREATE TABLE {TABELLA}_nuova (LIKE {TABELLA} INCLUDING DEFAULTS INCLUDING IDENTITY) PARTITION BY RANGE (istante)",
+        f"DROP TABLE {TABELLA}",
+        f"ALTER TABLE {TABELLA}_nuova RENAME TO {TABELLA}",
+        f"CREATE INDEX registro_oggetto_idx ON {TABELLA} (modello, oggetto_id, istante)",
+        f"CREATE INDEX registro_istante_brin ON {TABELLA} USING brin (istante)",
+        f"CREATE TABLE {TABELLA}_default PARTITION OF {TABELLA} DEFAULT",
+    ] + [
+        f"CREATE TABLE {TABELLA}_p{da:%Y_%m} PARTITION OF {TABELLA} FOR VALUES FROM ('{da}') TO ('{a}')"
+        for da, a in zip(mesi, mesi[1:])
+    ]
+    for sql in istruzioni:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_permanenzaletto_giornatadegenza'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroModifica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('istante', models.DateTimeField()),
+                ('modello', models.CharField(max_length=60)),
+                ('oggetto_id', models.CharField(max_length=40)),
+                ('azione', models.CharField(choices=[('C', 'Creazione'), ('M', 'Modifica'), ('E', 'Eliminazione')], max_length=1)),
+                ('utente_id', models.IntegerField(blank=True, null=True)),
+                ('modifiche', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+            ],
+            options={
+                'verbose_name': 'Modifica registrata',
+                'verbose_name_plural': 'Registro modifiche',
+                'ordering': ['-istante'],
+                'indexes': [models.Index(fields=['modello', 'oggetto_id', 'istante'], name='registro_oggetto_idx')],
+            },
+        ),
+        migrations.RunPython(partiziona_postgres, migrations.RunPython.noop),
+    ]
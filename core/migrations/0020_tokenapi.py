@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_registromodifica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenAPI',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(help_text="Dispositivo o integrazione, es. 'Tablet piano 1'", max_length=80)),
+                ('digest', models.CharField(editable=False, max_length=64, unique=True)),
+                ('attivo', models.BooleanField(default=True)),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('ultimo_uso', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('utente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_api', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Token API',
+                'verbose_name_plural': 'Token API',
+                'ordering': ['utente__username', 'nome'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_tokenapi'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChiaveIdempotenza',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chiave', models.UUIDField(unique=True)),
+                ('tipo', models.CharField(choices=[('somministrazione', 'Somministrazione'), ('parametro', 'Parametro vitale'), ('igiene', 'Diario igiene')], max_length=16)),
+                ('oggetto_id', models.PositiveBigIntegerField()),
+                ('ricevuta_il', models.DateTimeField(auto_now_add=True)),
+                ('utente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Chiave di idempotenza',
+                'verbose_name_plural': 'Chiavi di idempotenza',
+            },
+        ),
+    ]
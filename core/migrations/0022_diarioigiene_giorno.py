@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def calcola_giorno(apps, schema_editor):
+    """Data locale degli eventi esistenti; i doppioni dello stesso giorno (dopo il primo) restano senza."""
+    DiarioIgiene = apps.get_model("core", "DiarioIgiene")
+    visti, da_aggiornare = set(), []
+    for evento in DiarioIgiene.objects.only("id", "paziente_id", "evento", "rilevato_il").order_by("rilevato_il", "id").iterator(chunk_size=2000):
+        chiave = (evento.paziente_id, evento.evento, timezone.localdate(evento.rilevato_il))
+        if chiave in visti:
+            continue
+        visti.add(chiave)
+        evento.giorno = chiave[2]
+        da_aggiornare.append(evento)
+    DiarioIgiene.objects.bulk_update(da_aggiornare, ["giorno"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_chiaveidempotenza'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diarioigiene',
+            name='giorno',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(calcola_giorno, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='diarioigiene',
+            constraint=models.UniqueConstraint(fields=('paziente', 'evento', 'giorno'), name='igiene_un_evento_al_giorno', violation_error_message="Evento già registrato per l'ospite in questo giorno."),
+        ),
+    ]
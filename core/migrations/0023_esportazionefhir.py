@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:03
+
+import django.core.serializers.json
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_diarioigiene_giorno'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EsportazioneFHIR',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipi', models.CharField(help_text="Tipi di risorsa separati da virgola, es. 'Patient,Observation'", max_length=200)),
+                ('dal', models.DateTimeField(blank=True, help_text='_since: solo risorse aggiornate dopo', null=True)),
+                ('richiesta', models.URLField(blank=True, max_length=500)),
+                ('stato', models.CharField(choices=[('IN_CODA', 'In coda'), ('IN_CORSO', 'In corso'), ('COMPLETATA', 'Completata'), ('ERRORE', 'Errore'), ('ANNULLATA', 'Annullata')], default='IN_CODA', max_length=10)),
+                ('avanzamento', models.CharField(blank=True, max_length=200)),
+                ('file', models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('errore', models.TextField(blank=True)),
+                ('richiesta_il', models.DateTimeField(auto_now_add=True)),
+                ('iniziata_il', models.DateTimeField(blank=True, null=True)),
+                ('completata_il', models.DateTimeField(blank=True, null=True)),
+                ('utente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='esportazioni_fhir', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Export FHIR',
+                'verbose_name_plural': 'Export FHIR',
+                'ordering': ['-richiesta_il'],
+                'indexes': [models.Index(fields=['stato', 'richiesta_il'], name='core_esport_stato_f84e33_idx')],
+            },
+        ),
+    ]
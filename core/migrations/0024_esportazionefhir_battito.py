@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_esportazionefhir'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='esportazionefhir',
+            name='battito_il',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='esportazionefhir',
+            name='tentativi',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,8 +1,12 @@
 # core/models.py
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from datetime import date
+import secrets
+import uuid
 User = get_user_model()
 
 class TracciaMixin(models.Model):
@@ -140,12 +144,62 @@ class Episodio(TracciaMixin):
     provenienza = models.CharField("Provenienza", max_length=3, choices=PROVENIENZA)
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=["paziente"], condition=models.Q(data_fine__isnull=True), name="unico_episodio_attivo_per_paziente")
+            models.UniqueConstraint(fields=["paziente"], condition=models.Q(data_fine__isnull=True), name="unico_episodio_attivo_per_paziente"),
+            # un letto non può avere due episodi attivi (accettazioni concorrenti)
+            models.UniqueConstraint(fields=["letto"], condition=models.Q(data_fine__isnull=True, letto__isnull=False), name="unico_episodio_attivo_per_letto"),
         ]
         ordering = ["-data_inizio"]
         verbose_name = "Episodio"
         verbose_name_plural = "Episodi"
 
+class PermanenzaLetto(models.Model):
+    """
+    Storico dei letti occupati da un episodio, con intervallo di validità [data_inizio, data_fine)
+    (data_fine = giorno di uscita dal letto, nulla se ancora occupato). Gestito da core.censimento.
+    """
+    episodio = models.ForeignKey(Episodio, on_delete=models.CASCADE, related_name="permanenze")
+    paziente = models.ForeignKey(Paziente, on_delete=models.CASCADE, related_name="permanenze_letto")
+    letto = models.ForeignKey(Letto, on_delete=models.PROTECT, related_name="permanenze")
+    data_inizio = models.DateField()
+    data_fine = models.DateField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["episodio", "data_inizio"]
+        # "chi era nel letto X il giorno D": letto = X AND data_inizio <= D AND (data_fine > D OR nulla)
+        indexes = [models.Index(fields=["letto", "data_inizio", "data_fine"], name="permanenza_letto_validita_idx")]
+        verbose_name = "Permanenza letto"
+        verbose_name_plural = "Permanenze letto"
+
+    def __str__(self):
+        fine = f"{self.data_fine:%d/%m/%Y}" if self.data_fine else "oggi"
+        return f"{self.letto} – {self.paziente} ({self.data_inizio:%d/%m/%Y}–{fine})"
+
+class GiornataDegenza(models.Model):
+    """
+    Censimento giornaliero: una riga per episodio e giorno di presenza (giorno di dimissione escluso).
+    Tabella derivata da Episodio/PermanenzaLetto, aggiornata da core.censimento.
+    """
+    data = models.DateField()
+    episodio = models.ForeignKey(Episodio, on_delete=models.CASCADE, related_name="giornate")
+    paziente = models.ForeignKey(Paziente, on_delete=models.CASCADE, related_name="giornate_degenza")
+    letto = models.ForeignKey(Letto, null=True, blank=True, on_delete=models.PROTECT, related_name="giornate")
+    provenienza = models.CharField(max_length=3, choices=PROVENIENZA)
+
+    class Meta:
+        ordering = ["data", "episodio"]
+        indexes = [
+            models.Index(fields=["data", "provenienza"], name="giornata_data_provenienza_idx"),
+            models.Index(fields=["letto", "data"], name="giornata_letto_data_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["episodio", "data"], name="giornata_unica_per_episodio"),
+        ]
+        verbose_name = "Giornata di degenza"
+        verbose_name_plural = "Giornate di degenza"
+
+    def __str__(self):
+        return f"{self.data:%d/%m/%Y} – {self.paziente}"
+
 class Farmaco(TracciaMixin):
     class FormaFarmaco(models.TextChoices):
         BUST = "bust", "Bustina"
@@ -309,16 +363,37 @@ class DiarioIgiene(models.Model):
     rilevato_il = models.DateTimeField()
     evento = models.CharField(max_length=20, choices=EVENTO_CHOICES)
     operatore = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # data locale di rilevato_il, per il vincolo "un evento dello stesso tipo al giorno";
+    # nulla solo per i doppioni registrati prima del vincolo
+    giorno = models.DateField(null=True, editable=False)
 
     class Meta:
         ordering = ["-rilevato_il"]
         indexes = [
             models.Index(fields=["paziente", "rilevato_il"]),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["paziente", "evento", "giorno"], name="igiene_un_evento_al_giorno",
+                violation_error_message="Evento già registrato per l'ospite in questo giorno.",
+            ),
+        ]
         verbose_name = "DiarioIgiene"
         verbose_name_plural = "DiarioIgiene"
     def __str__(self):
         return f"{self.paziente} - {self.get_evento_display()} ({self.rilevato_il:%d/%m/%Y %H:%M})"
+
+    def imposta_giorno(self):
+        if self.rilevato_il:
+            self.giorno = timezone.localdate(self.rilevato_il)
+
+    def clean(self):
+        # i form (e la sincronizzazione, che inserisce con bulk_create) passano da qui
+        self.imposta_giorno()
+
+    def save(self, *args, **kwargs):
+        self.imposta_giorno()
+        super().save(*args, **kwargs)
         
 class ContattoEmergenza(TracciaMixin):
     class Relazione(models.TextChoices):
@@ -464,6 +539,42 @@ class Pietanza(TracciaMixin):
     def __str__(self):
         return self.nome
 
+class UnitaIngrediente(models.TextChoices):
+    G  = "g",  "Grammi"
+    ML = "ml", "Millilitri"
+    PZ = "pz", "Pezzi"
+
+class Ingrediente(TracciaMixin):
+    nome = models.CharField(max_length=120, unique=True)
+    udm = models.CharField("Unità di misura", max_length=3, choices=UnitaIngrediente.choices, default=UnitaIngrediente.G)
+    note = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ["nome"]
+        verbose_name = "Ingrediente"
+        verbose_name_plural = "Ingredienti"
+
+    def __str__(self):
+        return f"{self.nome} ({self.udm})"
+
+class RicettaIngrediente(TracciaMixin):
+    """Quantità di un ingrediente per UNA porzione della pietanza."""
+    pietanza = models.ForeignKey(Pietanza, on_delete=models.CASCADE, related_name="ingredienti")
+    ingrediente = models.ForeignKey(Ingrediente, on_delete=models.PROTECT, related_name="ricette")
+    quantita_porzione = models.DecimalField("Quantità per porzione", max_digits=8, decimal_places=2)
+
+    class Meta:
+        ordering = ["pietanza", "ingrediente__nome"]
+        constraints = [
+            models.UniqueConstraint(fields=["pietanza", "ingrediente"], name="ingrediente_unico_per_pietanza"),
+            models.CheckConstraint(name="quantita_porzione_positiva", check=models.Q(quantita_porzione__gt=0)),
+        ]
+        verbose_name = "Ingrediente della ricetta"
+        verbose_name_plural = "Ingredienti della ricetta"
+
+    def __str__(self):
+        return f"{self.ingrediente.nome}: {self.quantita_porzione} {self.ingrediente.udm} ({self.pietanza})"
+
 class MenuPeriodo(TracciaMixin):
     class Stato(models.TextChoices):
         BOZZA = "BOZZA", "Bozza"
@@ -547,6 +658,9 @@ class Dipendente(TracciaMixin):
     cognome = models.CharField(max_length=80)
     ruolo = models.CharField(max_length=6, choices=RuoloDipendente.choices, default=RuoloDipendente.OSS)
     attivo = models.BooleanField(default=True)
+    ore_settimanali = models.DecimalField("Ore settimanali da contratto", max_digits=4, decimal_places=1, default=38)
+    # token del link al calendario personale (iCalendar): rigenerabile per revocare il link
+    token_calendario = models.CharField(max_length=43, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ["cognome", "nome"]
@@ -557,6 +671,15 @@ class Dipendente(TracciaMixin):
     def __str__(self):
         return f"{self.cognome} {self.nome} ({self.get_ruolo_display()})"
 
+    def save(self, *args, **kwargs):
+        if not self.token_calendario:
+            self.token_calendario = secrets.token_urlsafe(32)
+        super().save(*args, **kwargs)
+
+    def rigenera_token_calendario(self):
+        self.token_calendario = secrets.token_urlsafe(32)
+        self.save(update_fields=["token_calendario"])
+
 class TurnoTipo(TracciaMixin):
     codice = models.CharField(max_length=12, unique=True)     # es. MATT, POM, NOTTE, RIP
     nome = models.CharField(max_length=40)                    # es. 06:30–13:30
@@ -604,7 +727,11 @@ class AssegnazioneTurno(TracciaMixin):
 
     class Meta:
         ordering = ["data", "turno__ordine", "dipendente__cognome"]
-        indexes = [models.Index(fields=["periodo", "data"]), models.Index(fields=["dipendente", "data"])]
+        indexes = [
+            models.Index(fields=["periodo", "data"]),
+            models.Index(fields=["dipendente", "data"]),
+            models.Index(fields=["data", "turno"]),  # "in servizio adesso", trasversale ai periodi
+        ]
         constraints = [
             # Un solo turno al giorno per dipendente nello stesso periodo
             models.UniqueConstraint(fields=["periodo", "data", "dipendente"], name="un_turno_per_giorno_per_dipendente"),
@@ -614,3 +741,166 @@ class AssegnazioneTurno(TracciaMixin):
 
     def __str__(self):
         return f"{self.data:%d/%m/%Y} – {self.turno} – {self.dipendente}"
+
+class FabbisognoTurno(TracciaMixin):
+    """Personale minimo richiesto per tipo turno e ruolo (usato dal pianificatore e dalla copertura)."""
+    turno = models.ForeignKey(TurnoTipo, on_delete=models.CASCADE, related_name="fabbisogni")
+    ruolo = models.CharField(max_length=6, choices=RuoloDipendente.choices)
+    minimo = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        ordering = ["turno__ordine", "ruolo"]
+        constraints = [
+            models.UniqueConstraint(fields=["turno", "ruolo"], name="fabbisogno_unico_per_turno_ruolo"),
+        ]
+        verbose_name = "Fabbisogno turno"
+        verbose_name_plural = "Fabbisogni turno"
+
+    def __str__(self):
+        return f"{self.turno} – {self.get_ruolo_display()}: {self.minimo}"
+
+class AssenzaDipendente(TracciaMixin):
+    class Tipo(models.TextChoices):
+        FERIE    = "FERIE", "Ferie"
+        MALATTIA = "MALAT", "Malattia"
+        PERMESSO = "PERM",  "Permesso"
+        ALTRO    = "ALTRO", "Altro"
+
+    dipendente = models.ForeignKey(Dipendente, on_delete=models.CASCADE, related_name="assenze")
+    tipo = models.CharField(max_length=5, choices=Tipo.choices, default=Tipo.FERIE)
+    data_inizio = models.DateField()
+    data_fine = models.DateField()
+    note = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ["-data_inizio"]
+        # ricerca per sovrapposizione: dipendente = X AND data_fine >= inizio AND data_inizio <= fine
+        indexes = [models.Index(fields=["dipendente", "data_fine", "data_inizio"], name="assenza_sovrapposizione_idx")]
+        constraints = [
+            models.CheckConstraint(name="assenza_date_coerenti", check=models.Q(data_fine__gte=models.F("data_inizio"))),
+        ]
+        verbose_name = "Assenza"
+        verbose_name_plural = "Assenze"
+
+    def __str__(self):
+        return f"{self.dipendente} – {self.get_tipo_display()} {self.data_inizio:%d/%m/%Y}–{self.data_fine:%d/%m/%Y}"
+
+class OreMensili(models.Model):
+    """
+    Riepilogo mensile delle ore per dipendente (minuti), derivato da AssegnazioneTurno.
+    Aggiornato in modo incrementale da core.ore: non va modificato a mano.
+    """
+    dipendente = models.ForeignKey(Dipendente, on_delete=models.CASCADE, related_name="ore_mensili")
+    mese = models.DateField(help_text="Primo giorno del mese")
+    turni = models.PositiveSmallIntegerField(default=0)
+    minuti_lavorati = models.PositiveIntegerField(default=0)
+    minuti_notturni = models.PositiveIntegerField(default=0)
+    minuti_festivi = models.PositiveIntegerField(default=0)
+    minuti_contratto = models.PositiveIntegerField(default=0)
+    minuti_straordinari = models.PositiveIntegerField(default=0)
+    aggiornato_il = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-mese", "dipendente__cognome", "dipendente__nome"]
+        indexes = [models.Index(fields=["mese", "dipendente"])]
+        constraints = [
+            models.UniqueConstraint(fields=["dipendente", "mese"], name="ore_mensili_unico_per_mese"),
+        ]
+        verbose_name = "Ore mensili"
+        verbose_name_plural = "Ore mensili"
+
+    def __str__(self):
+        return f"{self.dipendente} – {self.mese:%m/%Y}: {self.minuti_lavorati / 60:.1f} h"
+
+class RegistroModifica(models.Model):
+    """
+    Registro append-only delle modifiche ai dati clinici, campo per campo: {campo: [prima, dopo]}.
+    Scritto a lotti fuori dalla richiesta da core.audit. Su PostgreSQL la tabella è partizionata
+    per mese su ``istante`` (indice BRIN sul tempo, un solo btree per lo storico di un oggetto).
+    """
+    AZIONE = [("C", "Creazione"), ("M", "Modifica"), ("E", "Eliminazione")]
+    istante = models.DateTimeField()
+    modello = models.CharField(max_length=60)
+    oggetto_id = models.CharField(max_length=40)
+    azione = models.CharField(max_length=1, choices=AZIONE)
+    utente_id = models.IntegerField(null=True, blank=True)  # non è una FK: nessun vincolo né indice da mantenere
+    modifiche = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ["-istante"]
+        indexes = [models.Index(fields=["modello", "oggetto_id", "istante"], name="registro_oggetto_idx")]
+        verbose_name = "Modifica registrata"
+        verbose_name_plural = "Registro modifiche"
+
+    def __str__(self):
+        return f"{self.istante:%d/%m/%Y %H:%M} {self.get_azione_display()} {self.modello} #{self.oggetto_id}"
+
+class TokenAPI(models.Model):
+    """Credenziale dei client dell'API JSON (tablet, schermi di reparto). Si conserva solo l'hash SHA-256."""
+    utente = models.ForeignKey(User, on_delete=models.CASCADE, related_name="token_api")
+    nome = models.CharField(max_length=80, help_text="Dispositivo o integrazione, es. 'Tablet piano 1'")
+    digest = models.CharField(max_length=64, unique=True, editable=False)
+    attivo = models.BooleanField(default=True)
+    creato_il = models.DateTimeField(auto_now_add=True)
+    ultimo_uso = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ["utente__username", "nome"]
+        verbose_name = "Token API"
+        verbose_name_plural = "Token API"
+
+    def __str__(self):
+        return f"{self.nome} ({self.utente})"
+
+class ChiaveIdempotenza(models.Model):
+    """Chiave generata dal client per ogni voce inviata in sincronizzazione: un reinvio restituisce l'oggetto già creato."""
+    TIPO = [("somministrazione", "Somministrazione"), ("parametro", "Parametro vitale"), ("igiene", "Diario igiene")]
+    chiave = models.UUIDField(unique=True)
+    tipo = models.CharField(max_length=16, choices=TIPO)
+    oggetto_id = models.PositiveBigIntegerField()
+    utente = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    ricevuta_il = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Chiave di idempotenza"
+        verbose_name_plural = "Chiavi di idempotenza"
+
+    def __str__(self):
+        return f"{self.chiave} → {self.tipo} #{self.oggetto_id}"
+
+class EsportazioneFHIR(models.Model):
+    """Job di export FHIR in blocco ($export): un file NDJSON per tipo di risorsa in FHIR_EXPORT_DIR/<id>/."""
+    class Stato(models.TextChoices):
+        IN_CODA = "IN_CODA", "In coda"
+        IN_CORSO = "IN_CORSO", "In corso"
+        COMPLETATA = "COMPLETATA", "Completata"
+        ERRORE = "ERRORE", "Errore"
+        ANNULLATA = "ANNULLATA", "Annullata"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # l'URL di stato non si indovina
+    utente = models.ForeignKey(User, on_delete=models.CASCADE, related_name="esportazioni_fhir")
+    tipi = models.CharField(max_length=200, help_text="Tipi di risorsa separati da virgola, es. 'Patient,Observation'")
+    dal = models.DateTimeField(null=True, blank=True, help_text="_since: solo risorse aggiornate dopo")
+    richiesta = models.URLField(max_length=500, blank=True)
+    stato = models.CharField(max_length=10, choices=Stato.choices, default=Stato.IN_CODA)
+    avanzamento = models.CharField(max_length=200, blank=True)
+    file = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)  # [{"type", "count"}]
+    errore = models.TextField(blank=True)
+    richiesta_il = models.DateTimeField(auto_now_add=True)
+    iniziata_il = models.DateTimeField(null=True, blank=True)  # transactionTime del manifest
+    completata_il = models.DateTimeField(null=True, blank=True)
+    battito_il = models.DateTimeField(null=True, blank=True)  # ultimo segno di vita del worker che lo esegue
+    tentativi = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-richiesta_il"]
+        indexes = [models.Index(fields=["stato", "richiesta_il"])]
+        verbose_name = "Export FHIR"
+        verbose_name_plural = "Export FHIR"
+
+    def __str__(self):
+        return f"{self.tipi} ({self.get_stato_display()}, {self.richiesta_il:%d/%m/%Y %H:%M})"
+
+    @property
+    def elenco_tipi(self):
+        return [t for t in self.tipi.split(",") if t]
@@ -0,0 +1,196 @@
+# core/ore.py
+"""
+Ore lavorate, notturne, festive e straordinari per dipendente e mese.
+
+Le durate dei turni sono calcolate in SQL a partire da TurnoTipo.ora_inizio/ora_fine
+(un turno con fine <= inizio attraversa la mezzanotte); il riepilogo OreMensili
+viene ricalcolato solo per le coppie (dipendente, mese) toccate da una modifica.
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import ExtractHour, ExtractMinute, Greatest, Least, TruncMonth
+
+from .models import AssegnazioneTurno, AssenzaDipendente, Dipendente, OreMensili
+
+MINUTI_GIORNO = 24 * 60
+# fascia notturna 22:00–06:00, espressa sull'asse [0, 2 giorni) del turno
+FASCE_NOTTURNE = [(0, 6 * 60), (22 * 60, MINUTI_GIORNO + 6 * 60), (MINUTI_GIORNO + 22 * 60, 2 * MINUTI_GIORNO)]
+
+# festività nazionali a data fissa (mese, giorno); la Pasquetta si calcola per anno
+FESTIVITA_FISSE = [(1, 1), (1, 6), (4, 25), (5, 1), (6, 2), (8, 15), (11, 1), (12, 8), (12, 25), (12, 26)]
+
+
+def mese_di(d):
+    return d.replace(day=1)
+
+
+def _mese_successivo(m):
+    return (m.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _pasqua(anno):
+    # algoritmo di Meeus/Jones/Butcher (calendario gregoriano)
+    a, b, c = anno % 19, anno // 100, anno % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * l) // 433
+    mese = (h + l - 7 * m + 90) // 25
+    return date(anno, mese, (h + l - 7 * m + 33 * mese + 19) % 32)
+
+
+def festivita(anno):
+    """Festività nazionali dell'anno (le domeniche sono gestite a parte, in SQL)."""
+    giorni = {date(anno, m, g) for m, g in FESTIVITA_FISSE}
+    giorni.add(_pasqua(anno) + timedelta(days=1))
+    return giorni
+
+
+def _minuti(campo):
+    return ExtractHour(campo) * 60 + ExtractMinute(campo)
+
+
+def _espressioni_turno(festivi):
+    """Espressioni SQL (in minuti) per una riga di AssegnazioneTurno: durata, notturni, festivi."""
+    inizio = _minuti("turno__ora_inizio")
+    fine = Case(
+        When(turno__ora_fine__lte=F("turno__ora_inizio"), then=_minuti("turno__ora_fine") + MINUTI_GIORNO),
+        default=_minuti("turno__ora_fine"),
+        output_field=IntegerField(),
+    )
+    durata = fine - inizio
+    notturni = sum(
+        (Greatest(Value(0), Least(fine, Value(b)) - Greatest(inizio, Value(a))) for a, b in FASCE_NOTTURNE),
+        Value(0),
+    )
+    # il turno è festivo se inizia di domenica o in una festività
+    festivo = Case(
+        When(Q(data__week_day=1) | Q(data__in=festivi), then=durata),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return durata, notturni, festivo
+
+
+def totali_mensili(dipendenti_ids, mese_da, mese_a):
+    """
+    {(dipendente_id, mese): {turni, lavorati, notturni, festivi}} per i mesi nell'intervallo,
+    con un'unica query aggregata.
+    """
+    fine = _mese_successivo(mese_a) - timedelta(days=1)
+    festivi = set()
+    for anno in range(mese_da.year, mese_a.year + 1):
+        festivi |= festivita(anno)
+    durata, notturni, festivo = _espressioni_turno(sorted(festivi))
+
+    righe = (
+        AssegnazioneTurno.objects
+        .filter(
+            dipendente_id__in=dipendenti_ids, data__range=[mese_da, fine],
+            turno__is_riposo=False, turno__ora_inizio__isnull=False, turno__ora_fine__isnull=False,
+        )
+        .annotate(mese=TruncMonth("data"))
+        .values("dipendente_id", "mese")
+        .annotate(turni=Count("id"), lavorati=Sum(durata), notturni=Sum(notturni), festivi=Sum(festivo))
+        .order_by()
+    )
+    return {(r["dipendente_id"], r["mese"]): r for r in righe}
+
+
+def _giorni_assenza(dipendenti_ids, mese_da, mese_a):
+    """{(dipendente_id, mese): giorni di assenza nel mese}."""
+    fine = _mese_successivo(mese_a) - timedelta(days=1)
+    out = {}
+    for dip_id, inizio, fine_a in (
+        AssenzaDipendente.objects
+        .filter(dipendente_id__in=dipendenti_ids, data_fine__gte=mese_da, data_inizio__lte=fine)
+        .values_list("dipendente_id", "data_inizio", "data_fine")
+    ):
+        d = max(inizio, mese_da)
+        while d <= min(fine_a, fine):
+            k = (dip_id, mese_di(d))
+            out[k] = out.get(k, 0) + 1
+            d += timedelta(days=1)
+    return out
+
+
+def minuti_contratto(ore_settimanali, mese, giorni_assenza=0):
+    """Monte ore del mese in proporzione ai giorni di calendario, al netto delle assenze."""
+    giorni = (_mese_successivo(mese) - mese).days
+    return max(0, round(float(ore_settimanali) * 60 / 7 * (giorni - giorni_assenza)))
+
+
+def aggiorna_ore_mensili(coppie):
+    """
+    Ricalcola il riepilogo per le coppie (dipendente_id, mese) indicate: una query aggregata,
+    un upsert e una delete per le coppie rimaste senza turni.
+    """
+    coppie = {(dip_id, mese_di(m)) for dip_id, m in coppie if dip_id and m}
+    if not coppie:
+        return 0
+    dip_ids = {d for d, _ in coppie}
+    mesi = [m for _, m in coppie]
+    mese_da, mese_a = min(mesi), max(mesi)
+
+    totali = totali_mensili(dip_ids, mese_da, mese_a)
+    assenze = _giorni_assenza(dip_ids, mese_da, mese_a)
+    contratti = dict(Dipendente.objects.filter(pk__in=dip_ids).values_list("id", "ore_settimanali"))
+
+    righe, vuote = [], []
+    for dip_id, mese in coppie:
+        t = totali.get((dip_id, mese))
+        if not t or dip_id not in contratti:
+            vuote.append((dip_id, mese))
+            continue
+        contratto = minuti_contratto(contratti[dip_id], mese, assenze.get((dip_id, mese), 0))
+        righe.append(OreMensili(
+            dipendente_id=dip_id, mese=mese, turni=t["turni"],
+            minuti_lavorati=t["lavorati"] or 0, minuti_notturni=t["notturni"] or 0, minuti_festivi=t["festivi"] or 0,
+            minuti_contratto=contratto, minuti_straordinari=max(0, (t["lavorati"] or 0) - contratto),
+        ))
+
+    with transaction.atomic():
+        if righe:
+            OreMensili.objects.bulk_create(
+                righe, batch_size=500, update_conflicts=True, unique_fields=["dipendente", "mese"],
+                update_fields=["turni", "minuti_lavorati", "minuti_notturni", "minuti_festivi",
+                               "minuti_contratto", "minuti_straordinari", "aggiornato_il"],
+            )
+        if vuote:
+            filtro = Q()
+            for dip_id, mese in vuote:
+                filtro |= Q(dipendente_id=dip_id, mese=mese)
+            OreMensili.objects.filter(filtro).delete()
+    return len(righe)
+
+
+def coppie_intervallo(dipendente_id, inizio, fine):
+    """Coppie (dipendente_id, mese) coperte da un intervallo di date."""
+    out, m = set(), mese_di(inizio)
+    while m <= fine:
+        out.add((dipendente_id, m))
+        m = _mese_successivo(m)
+    return out
+
+
+def ricalcola_tutto(batch=200):
+    """Ricostruisce l'intero riepilogo (a blocchi di dipendenti)."""
+    OreMensili.objects.all().delete()
+    ids = list(AssegnazioneTurno.objects.values_list("dipendente_id", flat=True).distinct().order_by())
+    n = 0
+    for i in range(0, len(ids), batch):
+        blocco = ids[i:i + batch]
+        coppie = set(
+            AssegnazioneTurno.objects
+            .filter(dipendente_id__in=blocco)
+            .annotate(mese=TruncMonth("data"))
+            .values_list("dipendente_id", "mese")
+            .distinct()
+            .order_by()
+        )
+        n += aggiorna_ore_mensili(coppie)
+    return n
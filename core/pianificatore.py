@@ -0,0 +1,238 @@
+# core/pianificatore.py
+"""
+Pianificatore turni a vincoli: costruzione greedy + ricerca locale.
+
+Modulo in puro Python (nessun import Django): le ripartenze ricevono e restituiscono
+solo strutture semplici (liste, dict, set), quindi possono girare in processi separati.
+Dalla richiesta web (turni.pianifica_periodo) girano in sequenza nel processo del worker,
+salvo TURNI_PIANIFICATORE_PROCESSI > 1.
+
+Vincoli rigidi: assenze, un turno al giorno, coppie di turni incompatibili in giorni
+consecutivi (di default niente mattina dopo una notte), al massimo ``max_consecutivi``
+giorni lavorati di fila (riposo settimanale).
+Obiettivo: coprire i minimi per (turno, ruolo), poi equità di carico, notti e
+fine settimana fra dipendenti dello stesso ruolo.
+"""
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+LIBERO = -1
+BLOCCATO = -2          # assenza o cella già decisa (es. riposo esistente)
+PESO_SCOPERTO = 1000
+PESO_NOTTI = 2
+PESO_FESTIVI = 2
+
+
+class Problema:
+    """
+    Dati del problema, indicizzati: s = dipendente, g = giorno, t = turno lavorativo.
+
+    ruoli[s], notte[t], mattina[t], festivo[g]; fabbisogno = [(t, ruolo, minimo)];
+    bloccati = {(s, g)}; fissi = {(s, g): t} (assegnazioni da mantenere);
+    incompatibili = {(t_oggi, t_domani)} (default: notte seguita da mattina).
+    """
+
+    def __init__(self, n_giorni, ruoli, notte, mattina, festivo, fabbisogno,
+                 bloccati=(), fissi=None, max_consecutivi=6, incompatibili=None):
+        self.n_giorni = n_giorni
+        self.ruoli = list(ruoli)
+        self.notte = list(notte)
+        self.mattina = list(mattina)
+        self.festivo = list(festivo)
+        self.fabbisogno = list(fabbisogno)
+        self.bloccati = set(bloccati)
+        self.fissi = dict(fissi or {})
+        self.max_consecutivi = max_consecutivi
+        if incompatibili is None:
+            incompatibili = {
+                (a, b) for a in range(len(self.notte)) for b in range(len(self.mattina))
+                if self.notte[a] and self.mattina[b]
+            }
+        self.incompatibili = set(incompatibili)
+
+
+class _Stato:
+    def __init__(self, p):
+        self.p = p
+        n_s = len(p.ruoli)
+        self.a = [[LIBERO] * p.n_giorni for _ in range(n_s)]
+        self.lavorati = [0] * n_s
+        self.notti = [0] * n_s
+        self.festivi = [0] * n_s
+        self.copertura = {}
+        self.per_ruolo = {}
+        for s, ruolo in enumerate(p.ruoli):
+            self.per_ruolo.setdefault(ruolo, []).append(s)
+        for s, g in p.bloccati:
+            self.a[s][g] = BLOCCATO
+        for (s, g), t in p.fissi.items():
+            self.assegna(s, g, t)
+
+    # --- mosse elementari ---
+    def assegna(self, s, g, t):
+        self.a[s][g] = t
+        self.lavorati[s] += 1
+        if self.p.notte[t]:
+            self.notti[s] += 1
+        if self.p.festivo[g]:
+            self.festivi[s] += 1
+        k = (g, t, self.p.ruoli[s])
+        self.copertura[k] = self.copertura.get(k, 0) + 1
+
+    def libera(self, s, g):
+        t = self.a[s][g]
+        self.a[s][g] = LIBERO
+        self.lavorati[s] -= 1
+        if self.p.notte[t]:
+            self.notti[s] -= 1
+        if self.p.festivo[g]:
+            self.festivi[s] -= 1
+        self.copertura[(g, t, self.p.ruoli[s])] -= 1
+        return t
+
+    def ammissibile(self, s, g, t):
+        p, riga = self.p, self.a[s]
+        if riga[g] != LIBERO:
+            return False
+        # riposo minimo fra giorni consecutivi (es. niente mattina dopo una notte)
+        if g > 0 and riga[g - 1] >= 0 and (riga[g - 1], t) in p.incompatibili:
+            return False
+        if g + 1 < p.n_giorni and riga[g + 1] >= 0 and (t, riga[g + 1]) in p.incompatibili:
+            return False
+        # giorni lavorati consecutivi (riposo settimanale)
+        run, k = 1, g - 1
+        while k >= 0 and riga[k] >= 0:
+            run += 1
+            k -= 1
+        k = g + 1
+        while k < p.n_giorni and riga[k] >= 0:
+            run += 1
+            k += 1
+        return run <= p.max_consecutivi
+
+    # --- valutazione ---
+    def scoperti(self):
+        out = []
+        for g in range(self.p.n_giorni):
+            for t, ruolo, minimo in self.p.fabbisogno:
+                manca = minimo - self.copertura.get((g, t, ruolo), 0)
+                if manca > 0:
+                    out.append((g, t, ruolo, manca))
+        return out
+
+    def penalita(self):
+        equita = sum(
+            self.lavorati[s] ** 2 + PESO_NOTTI * self.notti[s] ** 2 + PESO_FESTIVI * self.festivi[s] ** 2
+            for s in range(len(self.p.ruoli))
+        )
+        return PESO_SCOPERTO * sum(m for *_, m in self.scoperti()) + equita
+
+
+def _chiave_candidato(stato, s, g, t, rnd):
+    return (
+        stato.lavorati[s],
+        stato.notti[s] if stato.p.notte[t] else 0,
+        stato.festivi[s] if stato.p.festivo[g] else 0,
+        rnd.random(),
+    )
+
+
+def _copri(stato, rnd):
+    """Costruzione greedy: giorno per giorno, prima le notti (più vincolate)."""
+    p = stato.p
+    domanda = sorted(p.fabbisogno, key=lambda d: (not p.notte[d[0]], d[0]))
+    for g in range(p.n_giorni):
+        for t, ruolo, minimo in domanda:
+            manca = minimo - stato.copertura.get((g, t, ruolo), 0)
+            if manca <= 0:
+                continue
+            cand = [s for s in stato.per_ruolo.get(ruolo, []) if stato.ammissibile(s, g, t)]
+            cand.sort(key=lambda s: _chiave_candidato(stato, s, g, t, rnd))
+            for s in cand[:manca]:
+                stato.assegna(s, g, t)
+
+
+def _delta_sposta(stato, s1, s2, g, t):
+    """Variazione di penalità spostando (g, t) da s1 a s2: d(x²) = 2(b - a + 1)."""
+    p = stato.p
+    d = 2 * (stato.lavorati[s2] - stato.lavorati[s1] + 1)
+    if p.notte[t]:
+        d += PESO_NOTTI * 2 * (stato.notti[s2] - stato.notti[s1] + 1)
+    if p.festivo[g]:
+        d += PESO_FESTIVI * 2 * (stato.festivi[s2] - stato.festivi[s1] + 1)
+    return d
+
+
+def _ricerca_locale(stato, rnd, iterazioni):
+    p = stato.p
+    n_s = len(p.ruoli)
+    if not n_s or not p.n_giorni:
+        return
+    for _ in range(iterazioni):
+        s1 = rnd.randrange(n_s)
+        g = rnd.randrange(p.n_giorni)
+        t1 = stato.a[s1][g]
+        if t1 < 0 or (s1, g) in p.fissi:
+            continue
+        colleghi = stato.per_ruolo[p.ruoli[s1]]
+        s2 = colleghi[rnd.randrange(len(colleghi))]
+        if s2 == s1:
+            continue
+        t2 = stato.a[s2][g]
+
+        if t2 == LIBERO:
+            # mossa 1: il turno passa a un collega libero
+            if _delta_sposta(stato, s1, s2, g, t1) > 0:
+                continue
+            stato.libera(s1, g)
+            if stato.ammissibile(s2, g, t1):
+                stato.assegna(s2, g, t1)
+            else:
+                stato.assegna(s1, g, t1)
+        elif t2 >= 0 and t2 != t1 and (s2, g) not in p.fissi and p.notte[t1] != p.notte[t2]:
+            # mossa 2: scambio di turno nello stesso giorno (riequilibra le notti)
+            n1, n2 = stato.notti[s1], stato.notti[s2]
+            d1 = 1 if p.notte[t2] else -1  # variazione delle notti di s1
+            if (n1 + d1) ** 2 + (n2 - d1) ** 2 > n1 ** 2 + n2 ** 2:
+                continue
+            stato.libera(s1, g)
+            stato.libera(s2, g)
+            if stato.ammissibile(s1, g, t2) and stato.ammissibile(s2, g, t1):
+                stato.assegna(s1, g, t2)
+                stato.assegna(s2, g, t1)
+            else:
+                stato.assegna(s1, g, t1)
+                stato.assegna(s2, g, t2)
+
+
+def _risolvi_seme(problema, seme, iterazioni):
+    rnd = random.Random(seme)
+    stato = _Stato(problema)
+    _copri(stato, rnd)
+    _ricerca_locale(stato, rnd, iterazioni)
+    _copri(stato, rnd)  # riparazione: la ricerca può liberare candidati per celle scoperte
+    return {
+        "penalita": stato.penalita(),
+        "assegnazioni": stato.a,
+        "scoperti": stato.scoperti(),
+        "seme": seme,
+    }
+
+
+def risolvi(problema, ripartenze=None, iterazioni=30000, seme=0, processi=None):
+    """
+    Esegue più ripartenze indipendenti (semi diversi), in parallelo su ``processi`` processi
+    (None: uno per CPU; 1: nello stesso processo, una ripartenza se non indicate),
+    e restituisce la soluzione con penalità minima.
+    """
+    ripartenze = ripartenze or max(1, processi or os.cpu_count() or 1)
+    semi = [seme + i for i in range(ripartenze)]
+    if ripartenze == 1 or processi == 1:
+        risultati = [_risolvi_seme(problema, s, iterazioni) for s in semi]
+    else:
+        # spawn: niente fork di un processo con thread e connessioni aperte (es. un worker web)
+        with ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context("spawn")) as ex:
+            risultati = list(ex.map(_risolvi_seme, [problema] * len(semi), semi, [iterazioni] * len(semi)))
+    return min(risultati, key=lambda r: (r["penalita"], r["seme"]))
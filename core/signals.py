@@ -0,0 +1,200 @@
+# core/signals.py
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.functions import TruncMonth
+from django.dispatch import receiver
+
+from .audit import MODELLI_CLINICI, differenze, istantanea, istantanea_dal_db, registra, valori_iniziali
+from .cache import incrementa_generazione
+from .menu import invalida_menu, invalida_lista_spesa
+from .models import (
+    TracciaMixin,
+    MenuPasto, VoceMenu, Pietanza, Ingrediente, RicettaIngrediente, Episodio, MenuPeriodo, TurnoTipo,
+    AssegnazioneTurno, AssenzaDipendente, Dipendente, OreMensili, Letto, Stanza, Paziente,
+)
+from .letti import invalida_tabellone
+from .censimento import CAMPI_CENSIMENTO, registra_permanenze, sincronizza_episodio
+from .ore import aggiorna_ore_mensili, coppie_intervallo, mese_di
+from .turni import invalida_indice_orario
+
+
+# === MENU: invalidazione griglia e lista della spesa per periodo ===
+def _periodi_con_pietanze(**filtro):
+    return (
+        MenuPasto.objects
+        .filter(periodo__isnull=False, **filtro)
+        .values_list("periodo_id", flat=True)
+        .distinct()
+    )
+
+
+@receiver(pre_save, sender=MenuPasto)
+def _menu_pasto_periodo_precedente(sender, instance, **kwargs):
+    # se il pasto cambia periodo va invalidato anche quello vecchio
+    if instance.pk:
+        instance._periodo_id_prec = (
+            MenuPasto.objects.filter(pk=instance.pk).values_list("periodo_id", flat=True).first()
+        )
+
+
+@receiver([post_save, post_delete], sender=MenuPeriodo)
+def _menu_periodo_modificato(sender, instance, **kwargs):
+    # le date del periodo delimitano griglia e lista della spesa (invalida_menu scarta entrambe)
+    invalida_menu(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=MenuPasto)
+def _menu_pasto_modificato(sender, instance, **kwargs):
+    invalida_menu(instance.periodo_id, getattr(instance, "_periodo_id_prec", None))
+
+
+@receiver([post_save, post_delete], sender=VoceMenu)
+def _voce_menu_modificata(sender, instance, **kwargs):
+    periodo_id = MenuPasto.objects.filter(pk=instance.pasto_id).values_list("periodo_id", flat=True).first()
+    invalida_menu(periodo_id)
+
+
+@receiver([post_save, post_delete], sender=Pietanza)
+def _pietanza_modificata(sender, instance, **kwargs):
+    invalida_menu(*_periodi_con_pietanze(voci__pietanza_id=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=RicettaIngrediente)
+def _ricetta_modificata(sender, instance, **kwargs):
+    invalida_lista_spesa(*_periodi_con_pietanze(voci__pietanza_id=instance.pietanza_id))
+
+
+@receiver(post_save, sender=Ingrediente)
+def _ingrediente_modificato(sender, instance, **kwargs):
+    invalida_lista_spesa(*_periodi_con_pietanze(voci__pietanza__ingredienti__ingrediente_id=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Episodio)
+def _presenze_modificate(sender, instance, **kwargs):
+    # cambiano le porzioni: periodi dall'ingresso in poi (copre anche la dimissione)
+    periodi = MenuPeriodo.objects.filter(data_fine__gte=instance.data_inizio).values_list("id", flat=True)
+    invalida_lista_spesa(*periodi)
+
+
+# === TURNI: indice orario per "in servizio adesso" ===
+@receiver([post_save, post_delete], sender=TurnoTipo)
+def _turno_tipo_modificato(sender, instance, **kwargs):
+    invalida_indice_orario()
+
+
+# === ORE: riepilogo mensile per dipendente ===
+@receiver(pre_save, sender=AssegnazioneTurno)
+def _assegnazione_precedente(sender, instance, **kwargs):
+    # se cambiano data o dipendente va ricalcolato anche il mese di partenza
+    if instance.pk:
+        instance._ore_prec = (
+            AssegnazioneTurno.objects.filter(pk=instance.pk).values_list("dipendente_id", "data").first()
+        )
+
+
+@receiver([post_save, post_delete], sender=AssegnazioneTurno)
+def _assegnazione_modificata(sender, instance, **kwargs):
+    coppie = {(instance.dipendente_id, mese_di(instance.data))}
+    prec = getattr(instance, "_ore_prec", None)
+    if prec:
+        coppie.add((prec[0], mese_di(prec[1])))
+    aggiorna_ore_mensili(coppie)
+
+
+@receiver(post_save, sender=TurnoTipo)
+def _turno_tipo_orari(sender, instance, created, **kwargs):
+    if created:
+        return
+    # cambiano gli orari: ricalcolo dei mesi in cui il turno è assegnato
+    aggiorna_ore_mensili(set(
+        AssegnazioneTurno.objects.filter(turno=instance)
+        .annotate(mese=TruncMonth("data"))
+        .values_list("dipendente_id", "mese").distinct().order_by()
+    ))
+
+
+@receiver(pre_save, sender=AssenzaDipendente)
+def _assenza_precedente(sender, instance, **kwargs):
+    if instance.pk:
+        instance._ore_prec = (
+            AssenzaDipendente.objects.filter(pk=instance.pk).values_list("dipendente_id", "data_inizio", "data_fine").first()
+        )
+
+
+@receiver([post_save, post_delete], sender=AssenzaDipendente)
+def _assenza_modificata(sender, instance, **kwargs):
+    # le assenze riducono il monte ore del mese, quindi gli straordinari
+    coppie = coppie_intervallo(instance.dipendente_id, instance.data_inizio, instance.data_fine)
+    prec = getattr(instance, "_ore_prec", None)
+    if prec:
+        coppie |= coppie_intervallo(*prec)
+    aggiorna_ore_mensili(coppie)
+
+
+@receiver(post_save, sender=Dipendente)
+def _dipendente_contratto(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and "ore_settimanali" not in update_fields:
+        return
+    if not created:
+        aggiorna_ore_mensili(set(OreMensili.objects.filter(dipendente=instance).values_list("dipendente_id", "mese")))
+
+
+# === LETTI: tabellone occupazione ===
+@receiver([post_save, post_delete], sender=Episodio)
+@receiver([post_save, post_delete], sender=Letto)
+@receiver([post_save, post_delete], sender=Stanza)
+@receiver(post_save, sender=Paziente)
+def _tabellone_letti_modificato(sender, **kwargs):
+    invalida_tabellone()
+
+
+# === CENSIMENTO: storico letti e giornate di degenza ===
+@receiver(pre_save, sender=Episodio)
+def _episodio_precedente(sender, instance, **kwargs):
+    if instance.pk:
+        instance._censimento_prec = (
+            Episodio.objects.filter(pk=instance.pk).values_list(*CAMPI_CENSIMENTO).first()
+        )
+
+
+@receiver(post_save, sender=Episodio)
+def _episodio_censimento(sender, instance, created, **kwargs):
+    prec = None if created else getattr(instance, "_censimento_prec", None)
+    if prec == tuple(getattr(instance, campo) for campo in CAMPI_CENSIMENTO):
+        return  # motivo, medico, note...: giornate e storico letti non cambiano
+    _, data_fine_prec, letto_prec, _, _ = prec or (None,) * len(CAMPI_CENSIMENTO)
+    registra_permanenze(instance, letto_prec=letto_prec, data_fine_prec=data_fine_prec, creato=created)
+    sincronizza_episodio(instance, prec)
+
+
+# === CACHE: generazioni per le chiavi versionate (core/cache.py) ===
+@receiver([post_save, post_delete])
+def _generazione_modello(sender, using, **kwargs):
+    if issubclass(sender, TracciaMixin):
+        incrementa_generazione(sender, using=using)
+
+
+# === AUDIT: registro modifiche dei dati clinici (core/audit.py) ===
+def _audit_prima(sender, instance, using, raw=False, **kwargs):
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._audit_prima = istantanea_dal_db(instance, using)
+
+
+def _audit_salvato(sender, instance, created, using, **kwargs):
+    prima = instance.__dict__.pop("_audit_prima", {})
+    if created:
+        modifiche = valori_iniziali(instance)
+    else:
+        modifiche = differenze(prima, istantanea(instance))
+    registra(instance, "C" if created else "M", modifiche, using)
+
+
+def _audit_eliminato(sender, instance, using, **kwargs):
+    stato = {f: [v, None] for f, v in istantanea(instance).items() if v not in (None, "")}
+    registra(instance, "E", stato, using)
+
+
+for _modello in MODELLI_CLINICI:
+    pre_save.connect(_audit_prima, sender=_modello)
+    post_save.connect(_audit_salvato, sender=_modello)
+    post_delete.connect(_audit_eliminato, sender=_modello)
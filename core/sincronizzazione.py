@@ -0,0 +1,160 @@
+# core/sincronizzazione.py
+"""
+Sincronizzazione delle voci registrate offline al letto dell'ospite (somministrazioni,
+parametri vitali, igiene): un solo invio con centinaia di voci, ognuna con una chiave
+generata dal client.
+
+Le voci si validano con i form delle pagine di inserimento, con pazienti e righe caricati
+una volta per tutto il lotto; le valide si inseriscono con bulk_create in un'unica transazione
+insieme alle loro ChiaveIdempotenza. Una chiave già ricevuta restituisce l'oggetto creato
+la prima volta, così il client può reinviare senza duplicare dopo una risposta persa.
+"""
+import uuid
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .audit import registra_creazioni
+from .cache import incrementa_generazione
+from .igiene import separa_doppioni
+from .forms import DiarioIgieneSyncForm, ParametroVitaleSyncForm, SomministrazioneSyncForm
+from .models import ChiaveIdempotenza, Paziente, RigaPrescrizione, TracciaMixin
+
+MAX_VOCI = 1000
+
+FORM_PER_TIPO = {
+    "somministrazione": SomministrazioneSyncForm,
+    "parametro": ParametroVitaleSyncForm,
+    "igiene": DiarioIgieneSyncForm,
+}
+
+
+class LottoNonValido(Exception):
+    """Corpo della richiesta malformato: nessuna voce viene considerata."""
+
+
+def _id(valore):
+    try:
+        return int(valore)
+    except (TypeError, ValueError):
+        return None
+
+
+def _precaricati(voci):
+    """Pazienti e righe (delle prescrizioni attive, come nel form) citati dal lotto, con due query."""
+    id_pazienti = {_id(v["dati"].get("paziente")) for v in voci} - {None}
+    id_righe = {_id(v["dati"].get("riga")) for v in voci if v["tipo"] == "somministrazione"} - {None}
+    pazienti = Paziente.objects.only("id").in_bulk(id_pazienti)
+    righe = (
+        RigaPrescrizione.objects.filter(pk__in=id_righe, prescrizione__attiva=True)
+        .select_related("prescrizione").only("id", "prescrizione__paziente_id").in_bulk()
+        if id_righe else {}
+    )
+    return {
+        "somministrazione": {"paziente": pazienti, "riga": righe},
+        "parametro": {"paziente": pazienti},
+        "igiene": {"paziente": pazienti},
+    }
+
+
+def _leggi(voci):
+    if not isinstance(voci, list):
+        raise LottoNonValido("'voci' deve essere una lista.")
+    if len(voci) > MAX_VOCI:
+        raise LottoNonValido(f"Al massimo {MAX_VOCI} voci per invio.")
+    lette = []
+    for i, v in enumerate(voci):
+        if not isinstance(v, dict) or not isinstance(v.get("dati"), dict):
+            raise LottoNonValido(f"voce {i}: attesi 'chiave', 'tipo' e 'dati'.")
+        try:
+            chiave = uuid.UUID(str(v.get("chiave")))
+        except ValueError:
+            raise LottoNonValido(f"voce {i}: chiave non valida (UUID).")
+        if v.get("tipo") not in FORM_PER_TIPO:
+            raise LottoNonValido(f"voce {i}: tipo sconosciuto.")
+        lette.append({"chiave": chiave, "tipo": v["tipo"], "dati": v["dati"]})
+    return lette
+
+
+def crea_in_blocco(oggetti):
+    """
+    bulk_create di oggetti dello stesso modello, con le voci del registro modifiche e
+    l'incremento della generazione in cache che i signal post_save farebbero per ciascuno.
+    """
+    if not oggetti:
+        return oggetti
+    modello = type(oggetti[0])
+    modello.objects.bulk_create(oggetti, batch_size=500)
+    registra_creazioni(oggetti, using=DEFAULT_DB_ALIAS)
+    if issubclass(modello, TracciaMixin):
+        incrementa_generazione(modello)
+    return oggetti
+
+
+def sincronizza(voci, utente):
+    """
+    Valida e inserisce le voci; restituisce un esito per voce, nello stesso ordine:
+    {"chiave", "esito": "creato" | "duplicato" | "errore", "id"} oppure {"errori": {campo: [...]}}.
+    Solleva LottoNonValido se il corpo è malformato e IntegrityError se un invio concorrente
+    con le stesse chiavi è arrivato prima (il client può reinviare).
+    """
+    voci = _leggi(voci)
+    esiti = [{"chiave": str(v["chiave"]), "tipo": v["tipo"]} for v in voci]
+
+    # chiavi già ricevute (in un invio precedente o ripetute nello stesso lotto)
+    ricevute = {
+        k.chiave: k for k in ChiaveIdempotenza.objects.filter(chiave__in=[v["chiave"] for v in voci])
+    }
+    nuove, viste = [], {}
+    for i, v in enumerate(voci):
+        if v["chiave"] in ricevute:
+            k = ricevute[v["chiave"]]
+            esiti[i].update(esito="duplicato", id=k.oggetto_id)
+        elif v["chiave"] in viste:
+            esiti[i].update(esito="duplicato", ripete=viste[v["chiave"]])
+        else:
+            viste[v["chiave"]] = i
+            nuove.append(i)
+
+    precaricati = _precaricati([voci[i] for i in nuove])
+    valide = defaultdict(list)  # tipo -> [(indice, oggetto)]
+    for i in nuove:
+        v = voci[i]
+        form = FORM_PER_TIPO[v["tipo"]](v["dati"], precaricati=precaricati[v["tipo"]])
+        if not form.is_valid():
+            esiti[i].update(esito="errore", errori=form.errors.get_json_data(escape_html=True))
+            continue
+        obj = form.save(commit=False)
+        obj.operatore = utente
+        if isinstance(obj, TracciaMixin):
+            obj.creato_da = obj.aggiornato_da = utente
+        valide[v["tipo"]].append((i, obj))
+
+    if valide["igiene"]:
+        # un evento dello stesso tipo al giorno per ospite: già registrato o ripetuto nel lotto
+        _, doppioni = separa_doppioni([obj for _, obj in valide["igiene"]])
+        doppioni = set(map(id, doppioni))
+        errore = {"__all__": [{"message": "Evento già registrato per l'ospite in questo giorno.", "code": "duplicato"}]}
+        for i, obj in valide["igiene"]:
+            if id(obj) in doppioni:
+                esiti[i].update(esito="errore", errori=errore)
+        valide["igiene"] = [(i, obj) for i, obj in valide["igiene"] if id(obj) not in doppioni]
+
+    if any(valide.values()):
+        with transaction.atomic():
+            chiavi = []
+            for tipo, coppie in valide.items():
+                crea_in_blocco([obj for _, obj in coppie])
+                for i, obj in coppie:
+                    esiti[i].update(esito="creato", id=obj.pk)
+                    chiavi.append(ChiaveIdempotenza(chiave=voci[i]["chiave"], tipo=tipo, oggetto_id=obj.pk, utente=utente))
+            ChiaveIdempotenza.objects.bulk_create(chiavi, batch_size=500)
+    # esito del primo invio anche per le chiavi ripetute nello stesso lotto
+    for esito in esiti:
+        if "ripete" in esito:
+            primo = esiti[esito.pop("ripete")]
+            if primo["esito"] == "errore":
+                esito.update(esito="errore", errori=primo["errori"])
+            else:
+                esito["id"] = primo["id"]
+    return esiti
@@ -0,0 +1,123 @@
+// Coda offline per i form al letto (somministrazioni, parametri, igiene).
+// Senza rete la voce resta nel browser (localStorage) con una chiave generata qui;
+// al ritorno della connessione tutte le voci partono in un solo invio a "sincronizzazione".
+// La chiave rende il reinvio sicuro: una voce già ricevuta torna come "duplicato".
+document.addEventListener("DOMContentLoaded", () => {
+  const form = document.querySelector("form[data-coda-tipo]");
+  if (!form) return;
+
+  const CHIAVE_CODA = "nd_coda_offline";
+  const urlSync = form.dataset.urlSincronizza;
+  const tipo = form.dataset.codaTipo;
+  const csrf = form.querySelector("input[name=csrfmiddlewaretoken]");
+
+  const leggiCoda = () => JSON.parse(localStorage.getItem(CHIAVE_CODA) || "[]");
+  const salvaCoda = (coda) => localStorage.setItem(CHIAVE_CODA, JSON.stringify(coda));
+
+  // Riquadro di stato sopra il form
+  const stato = document.createElement("div");
+  stato.className = "badge";
+  stato.style.cssText = "display:none;margin-bottom:12px;";
+  form.prepend(stato);
+
+  function mostraStato(messaggio) {
+    const coda = leggiCoda();
+    const inAttesa = coda.filter(v => !v.errori).length;
+    const errate = coda.filter(v => v.errori);
+    const righe = [];
+    if (messaggio) righe.push(messaggio);
+    if (inAttesa) righe.push(`${inAttesa} voci registrate offline in attesa di invio.`);
+    for (const v of errate) {
+      const dettaglio = Object.entries(v.errori)
+        .map(([campo, err]) => `${campo}: ${err.map(e => e.message).join(" ")}`).join("; ");
+      righe.push(`Non accettata (${v.tipo}, ${v.registrata_il.slice(0, 16).replace("T", " ")}): ${dettaglio}`);
+    }
+    stato.textContent = righe.join("\n");
+    stato.style.whiteSpace = "pre-line";
+    stato.style.display = righe.length ? "block" : "none";
+    stato.classList.toggle("danger", errate.length > 0);
+    if (errate.length) {
+      const scarta = document.createElement("button");
+      scarta.type = "button";
+      scarta.className = "btn";
+      scarta.textContent = "Elimina le voci non accettate";
+      scarta.addEventListener("click", () => {
+        salvaCoda(leggiCoda().filter(v => !v.errori));
+        mostraStato();
+      });
+      stato.append(document.createElement("br"), scarta);
+    }
+  }
+
+  async function raggiungibile() {
+    if (!navigator.onLine) return false;
+    const ctrl = new AbortController();
+    const timer = setTimeout(() => ctrl.abort(), 3000);
+    try {
+      const r = await fetch(urlSync, { signal: ctrl.signal, headers: { Accept: "application/json" } });
+      return r.ok && !r.redirected;
+    } catch (e) {
+      return false;
+    } finally {
+      clearTimeout(timer);
+    }
+  }
+
+  function accoda() {
+    const dati = Object.fromEntries(new FormData(form));
+    delete dati.csrfmiddlewaretoken;
+    const coda = leggiCoda();
+    coda.push({ chiave: crypto.randomUUID(), tipo, dati, registrata_il: new Date().toISOString() });
+    salvaCoda(coda);
+  }
+
+  let inCorso = false;
+  async function sincronizza() {
+    const daInviare = leggiCoda().filter(v => !v.errori).slice(0, 1000);  // MAX_VOCI del server
+    if (inCorso || !daInviare.length || !navigator.onLine) return;
+    inCorso = true;
+    try {
+      const r = await fetch(urlSync, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", Accept: "application/json", "X-CSRFToken": csrf ? csrf.value : "" },
+        body: JSON.stringify({ voci: daInviare.map(({ chiave, tipo, dati }) => ({ chiave, tipo, dati })) }),
+      });
+      if (r.redirected || !r.ok) {
+        mostraStato(r.redirected ? "Sessione scaduta: accedere di nuovo per inviare le voci offline." : "");
+        return;  // la coda resta; si riprova al prossimo evento
+      }
+      const esiti = new Map((await r.json()).esiti.map(e => [e.chiave, e]));
+      // rilette: nel frattempo potrebbero essere state accodate altre voci
+      const rimaste = [];
+      let inviate = 0;
+      for (const v of leggiCoda()) {
+        const esito = esiti.get(v.chiave);
+        if (!esito) rimaste.push(v);
+        else if (esito.esito === "errore") rimaste.push({ ...v, errori: esito.errori });
+        else inviate += 1;
+      }
+      salvaCoda(rimaste);
+      mostraStato(inviate ? `${inviate} voci offline inviate.` : "");
+    } catch (e) {
+      mostraStato();  // rete ancora assente
+    } finally {
+      inCorso = false;
+    }
+  }
+
+  // Invio del form: con la rete si procede normalmente, senza si accoda
+  form.addEventListener("submit", async (ev) => {
+    ev.preventDefault();
+    if (await raggiungibile()) {
+      form.submit();
+      return;
+    }
+    accoda();
+    form.querySelectorAll("input[type=number], input[type=text]:not([readonly])").forEach(el => { el.value = ""; });
+    mostraStato("Rete assente: voce salvata sul dispositivo, verrà inviata al ritorno della connessione.");
+  });
+
+  window.addEventListener("online", sincronizza);
+  mostraStato();
+  sincronizza();
+});
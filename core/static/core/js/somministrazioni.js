@@ -1,21 +1,57 @@
 document.addEventListener("DOMContentLoaded", () => {
+  const form    = document.querySelector("form[data-url-righe]");
   const selPaz  = document.getElementById("id_sel_paziente");
   const stato   = document.getElementById("id_stato");
   const dose    = document.getElementById("id_dose_erogata");
   const datao   = document.getElementById("id_data_ora");
+  const progr   = document.getElementById("id_programmata_il");
   const riga    = document.getElementById("id_riga");
   const udmVis  = document.getElementById("id_dose_udm_vis");
-  const formaSel = document.getElementById("id_forma_vis"); // <-- nuovo
+  const formaSel = document.getElementById("id_forma_vis");
+  const prossimaVis = document.getElementById("id_prossima_dose");
+
+  const metaEl = document.getElementById("righe-meta");
+  let righeMeta = (metaEl && JSON.parse(metaEl.textContent)) || {};
+
+  // "2025-10-19T20:00+02:00" → "19/10 20:00"
+  function formattaOra(iso) {
+    return `${iso.slice(8, 10)}/${iso.slice(5, 7)} ${iso.slice(11, 16)}`;
+  }
+
+  // Cambio paziente: righe attive via JSON, senza ricaricare la pagina
+  let richiesta = null;
+  async function caricaRighe(id) {
+    const u = new URL(window.location.href);
+    if (id) u.searchParams.set("paziente", id);
+    else u.searchParams.delete("paziente");
+    history.replaceState(null, "", u);  // un reload mantiene il paziente scelto
+
+    righeMeta = {};
+    if (riga) riga.replaceChildren(new Option("---------", ""));
+    applyRigaDefaults();
+    if (!id || !riga) return;
+
+    if (richiesta) richiesta.abort();  // cambi rapidi: vale solo l'ultimo
+    richiesta = new AbortController();
+    try {
+      const url = `${form.dataset.urlRighe}?paziente=${encodeURIComponent(id)}`;
+      const r = await fetch(url, { signal: richiesta.signal, headers: { Accept: "application/json" } });
+      if (!r.ok) throw new Error(`HTTP ${r.status}`);
+      const dati = await r.json();
+      for (const meta of dati.righe) {
+        righeMeta[meta.id] = meta;
+        riga.add(new Option(meta.etichetta, meta.id));
+      }
+    } catch (e) {
+      if (e.name === "AbortError") return;
+      window.location.href = u.toString();  // ripiego: pagina completa
+      return;
+    }
+    applyRigaDefaults();
+  }
 
-  // Cambio paziente: ricarica con querystring ?paziente=...
   if (selPaz) {
-    selPaz.addEventListener("change", () => {
-      const id = selPaz.value || "";
-      const u = new URL(window.location.href);
-      if (id) u.searchParams.set("paziente", id);
-      else u.searchParams.delete("paziente");
-      window.location.href = u.toString();
-    });
+    selPaz.addEventListener("change", () => caricaRighe(selPaz.value || ""));
   }
 
   function toggleObblighi() {
@@ -26,11 +62,12 @@ document.addEventListener("DOMContentLoaded", () => {
 
   function applyRigaDefaults() {
     if (!riga) return;
-    const meta = (window.RIGHE_META || {})[riga.value];
+    const meta = righeMeta[riga.value];
     if (!meta) {
       if (udmVis)  udmVis.value  = "";
       if (dose)    dose.placeholder = "";
       if (formaSel) formaSel.value = "";
+      if (prossimaVis) prossimaVis.textContent = "";
       return;
     }
     // UDM e dose
@@ -40,10 +77,22 @@ document.addEventListener("DOMContentLoaded", () => {
     }
     if (dose && meta.dose) dose.placeholder = meta.dose;
 
-    // --- NUOVO: Forma dalla riga selezionata (codice: "cpr", "bust", "F", "FL", "gtt") ---
+    // Forma dalla riga selezionata (codice: "cpr", "bust", "F", "FL", "gtt")
     if (formaSel) formaSel.value = meta.forma || "";
+
+    // Dose in programma (anche appena passata, se registrata in ritardo): suggerita come orario programmato
+    if (prossimaVis) {
+      prossimaVis.textContent = meta.prossima ? `Dose in programma: ${formattaOra(meta.prossima)}`
+                              : (meta.prn ? "Al bisogno" : "");
+    }
+    if (progr && (!progr.value || progr.dataset.auto) && meta.prossima) {
+      progr.value = meta.prossima.slice(0, 16);
+      progr.dataset.auto = "1";  // si riallinea al cambio riga finché l'utente non lo modifica
+    }
   }
 
+  if (progr) progr.addEventListener("input", () => { delete progr.dataset.auto; });
+
   if (stato) {
     toggleObblighi();
     stato.addEventListener("change", toggleObblighi);
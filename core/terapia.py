@@ -0,0 +1,64 @@
+# core/terapia.py
+"""
+Righe di terapia attive di un ospite e dose in programma, per il form delle somministrazioni.
+"""
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .models import RigaPrescrizione
+
+_VIE = dict(RigaPrescrizione.VIE)
+
+# una dose registrata in ritardo si riferisce ancora all'orario passato da meno di così
+TOLLERANZA_RITARDO = timedelta(hours=2)
+
+
+def prossima_dose(orari, adesso, tolleranza=TOLLERANZA_RITARDO):
+    """
+    Orario (ora, giorni_settimana "1".."7" = lun..dom) più vicino ad ``adesso`` tra quelli dei
+    prossimi 7 giorni e quelli passati da meno di ``tolleranza``: la dose delle 8 registrata
+    alle 8:30 resta quella delle 8, non passa alla successiva.
+    """
+    adesso = timezone.localtime(adesso)
+    candidati = [
+        timezone.make_aware(datetime.combine(giorno, ora))
+        for giorno in (adesso.date() + timedelta(days=n) for n in range(-1, 8))  # da ieri: ritardi dopo mezzanotte
+        for ora, settimana in orari
+        if str(giorno.isoweekday()) in (settimana or "1234567")
+    ]
+    candidati = [c for c in candidati if c > adesso - tolleranza]
+    return min(candidati, key=lambda c: (abs(c - adesso), c)) if candidati else None
+
+
+def righe_attive(paziente_id, adesso=None):
+    """
+    Righe delle prescrizioni attive dell'ospite con i dati che il form precompila (dose, udm, forma)
+    e la dose in programma (vedi prossima_dose); una sola query, con gli orari in LEFT JOIN.
+    """
+    adesso = adesso or timezone.now()
+    righe = {}
+    for r in (
+        RigaPrescrizione.objects
+        .filter(prescrizione__paziente_id=paziente_id, prescrizione__attiva=True)
+        .order_by("id")  # come le opzioni del form
+        .values("id", "dose_val", "dose_udm", "via", "prn", "farmaco__nome", "farmaco__forma",
+                "orari__ora", "orari__giorni_settimana")
+    ):
+        riga = righe.get(r["id"])
+        if riga is None:
+            riga = righe[r["id"]] = {
+                "id": r["id"],
+                "etichetta": f"{r['farmaco__nome']} – {r['dose_val']} {r['dose_udm']} via {_VIE.get(r['via'], r['via'])}",
+                "dose": str(r["dose_val"]),
+                "udm": r["dose_udm"],
+                "forma": r["farmaco__forma"] or "",
+                "prn": r["prn"],
+                "orari": [],
+            }
+        if r["orari__ora"] is not None:
+            riga["orari"].append((r["orari__ora"], r["orari__giorni_settimana"]))
+    for riga in righe.values():
+        prossima = prossima_dose(riga.pop("orari"), adesso)
+        riga["prossima"] = timezone.localtime(prossima).isoformat(timespec="minutes") if prossima else None
+    return list(righe.values())
@@ -1,3 +1,1132 @@
-from django.test import TestCase
+# core/tests.py
+import io
+import json
+import tempfile
+import threading
+import uuid
+import zipfile
+from contextlib import aclosing
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import connection, connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .admin import AssegnazioneTurnoInline
+from .api import crea_token
+from .audit import buffer as buffer_audit
+from .benchmark import ROTTE_CON_EFFETTI, argomenti_rotte
+from .cache import in_cache, metriche
+from .censimento import aggiorna_censimento, giornate_mensili, ricostruisci_censimento
+from .esportazione_fhir import Interrotto, _in_corso, recupera_interrotti
+from .esportazione_fhir import esegui as esegui_export_fhir
+from .export import Diario
+from .terapia import prossima_dose
+from .db_router import REPLICA, ReplicaRouter, _alias_lettura, _in_streaming
+from .letti import LettoOccupato, salva_episodio_con_letto, tabellone_letti
+from .menu import ConflittoVersione, applica_patch_settimana, griglia_menu, lista_spesa, stato_settimana
+from .middleware import BUDGET_QUERY, BudgetSQLMiddleware, _Rilevatore, _rilevatore_richiesta
+from .models import (
+    Allergia, AssegnazioneTurno, AssenzaDipendente, ContattoEmergenza, DiarioIgiene, Dipendente, Episodio,
+    EsportazioneFHIR, FabbisognoTurno, Farmaco, GiornataDegenza, Ingrediente, Letto, MenuPasto, MenuPeriodo,
+    OrarioDose, OreMensili, ParametroVitale, Paziente, PianoTurniPeriodo, Pietanza, Prescrizione, RecapitoContatto,
+    RegistroModifica, RicettaIngrediente, RigaPrescrizione, Somministrazione, Stanza, TurnoTipo, VoceMenu,
+)
+from .ore import festivita, ricalcola_tutto
+from .turni import (
+    applica_piano, conflitti_turno, in_servizio, is_mattutino, is_notturno, pianifica_periodo, piano_rotazione,
+    turni_attivi,
+)
+from .views import _con_connessione_propria
+
+User = get_user_model()
+
+# abbastanza righe per ogni entità da rendere visibile una query per riga (N+1) oltre il budget
+N_PAZIENTI = 12
+N_DIPENDENTI = 8
+
+
+class DatiDiProva:
+    """Dataset di riferimento per i test di budget: pazienti, terapia, menu, turni, letti."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user("budget", password="x", is_staff=True, is_superuser=True)
+        oggi = timezone.localdate()
+        lun = oggi - timedelta(days=oggi.weekday())
+        cls.oggi = oggi
+
+        farmaci = [Farmaco.objects.create(nome=f"Farmaco {i}", forma="cpr") for i in range(3)]
+        stanze = [Stanza.objects.create(nome=f"S{i:02d}") for i in range(N_PAZIENTI // 2 + 1)]
+        letti = [Letto.objects.create(stanza=s, codice=c) for s in stanze for c in "AB"]
+
+        cls.pazienti = []
+        for i in range(N_PAZIENTI):
+            p = Paziente.objects.create(
+                nome=f"Nome{i}", cognome=f"Cognome{i:02d}", sesso="MF"[i % 2],
+                data_nascita=oggi.replace(year=oggi.year - 80) - timedelta(days=i),
+                codice_fiscale=f"RSSMRA40A01H{i:03d}Z",
+            )
+            cls.pazienti.append(p)
+            Episodio.objects.create(
+                paziente=p, data_inizio=oggi - timedelta(days=30 + i), letto=letti[i], provenienza="DOM",
+            )
+            contatto = ContattoEmergenza.objects.create(paziente=p, nome="Anna", cognome=f"Cognome{i:02d}", is_primario=True)
+            RecapitoContatto.objects.create(contatto=contatto, tipo="MOBILE", valore="3331234567", preferito=True)
+            Allergia.objects.create(paziente=p, categoria="FARMACO", farmaco=farmaci[i % 3])
+
+            prescrizione = Prescrizione.objects.create(paziente=p, data_inizio=oggi - timedelta(days=10))
+            for f in farmaci[:2]:
+                riga = RigaPrescrizione.objects.create(
+                    prescrizione=prescrizione, farmaco=f, dose_val=1, dose_udm="cpr", via="Orale",
+                )
+                OrarioDose.objects.create(riga=riga, ora=time(8))
+                for g in range(7):
+                    quando = timezone.make_aware(datetime.combine(lun + timedelta(days=g), time(8)))
+                    Somministrazione.objects.create(
+                        paziente=p, riga=riga, programmata_il=quando, data_ora=quando,
+                        dose_erogata=1, stato="SOMMINISTRATO", operatore=cls.utente,
+                    )
+
+            for h in (8, 14, 20):
+                ParametroVitale.objects.create(
+                    paziente=p, rilevato_il=timezone.make_aware(datetime.combine(oggi, time(h))),
+                    pas=130, pad=80, fc=72, spo2=97, operatore=cls.utente,
+                )
+            for g in range(0, 7, 2):
+                DiarioIgiene.objects.create(
+                    paziente=p, evento="DOCCIA", operatore=cls.utente,
+                    rilevato_il=timezone.make_aware(datetime.combine(lun + timedelta(days=g), time(9))),
+                )
+
+        # menu: due settimane con pietanze e ricette
+        ingredienti = [Ingrediente.objects.create(nome=f"Ingrediente {i}") for i in range(4)]
+        pietanze = []
+        for i in range(4):
+            pietanza = Pietanza.objects.create(nome=f"Pietanza {i}")
+            for ing in ingredienti[:2 + i % 2]:
+                RicettaIngrediente.objects.create(pietanza=pietanza, ingrediente=ing, quantita_porzione=50)
+            pietanze.append(pietanza)
+        cls.menu = MenuPeriodo.objects.create(nome="Prova", data_inizio=lun, data_fine=lun + timedelta(days=13))
+        for g in range(14):
+            for pasto in ("PRANZ", "CENA"):
+                mp = MenuPasto.objects.create(periodo=cls.menu, data=lun + timedelta(days=g), pasto=pasto)
+                for k, pietanza in enumerate(pietanze[:2]):
+                    VoceMenu.objects.create(pasto=mp, pietanza=pietanza, ordine=k + 1)
+
+        # turni: rotazione di un mese attorno a oggi
+        turni = [
+            TurnoTipo.objects.create(codice="M", nome="Mattina", ora_inizio=time(7), ora_fine=time(14), ordine=1),
+            TurnoTipo.objects.create(codice="P", nome="Pomeriggio", ora_inizio=time(14), ora_fine=time(21), ordine=2),
+            TurnoTipo.objects.create(codice="N", nome="Notte", ora_inizio=time(21), ora_fine=time(7), ordine=3),
+            TurnoTipo.objects.create(codice="R", nome="Riposo", is_riposo=True, ordine=4),
+        ]
+        for t in turni[:3]:
+            FabbisognoTurno.objects.create(turno=t, ruolo="OSS", minimo=1)
+        cls.dipendenti = [
+            Dipendente.objects.create(nome=f"Op{i}", cognome=f"Operatore{i:02d}") for i in range(N_DIPENDENTI)
+        ]
+        cls.periodo = PianoTurniPeriodo.objects.create(
+            nome="Prova", data_inizio=oggi - timedelta(days=14), data_fine=oggi + timedelta(days=14),
+        )
+        assegnazioni, d = [], cls.periodo.data_inizio
+        while d <= cls.periodo.data_fine:
+            n = (d - cls.periodo.data_inizio).days
+            for i, dip in enumerate(cls.dipendenti):
+                assegnazioni.append(AssegnazioneTurno(
+                    periodo=cls.periodo, data=d, dipendente=dip, turno=turni[(i + n) % len(turni)],
+                ))
+            d += timedelta(days=1)
+        AssegnazioneTurno.objects.bulk_create(assegnazioni)
+        cls.turni = turni
+
+        # riepiloghi derivati (i bulk non passano dai signal)
+        ricalcola_tutto()
+        ricostruisci_censimento()
+
+    def setUp(self):
+        self.client.force_login(self.utente)
+
+
+# file degli export FHIR dei test, rimossi a fine esecuzione
+CARTELLA_FHIR = tempfile.TemporaryDirectory(prefix="nd_fhir_")
+
+
+def _esportazione_completata(utente, tipi="Patient", **campi):
+    job = EsportazioneFHIR.objects.create(utente=utente, tipi=tipi, **campi)
+    esegui_export_fhir(job, processi=1)
+    job.refresh_from_db()
+    return job
+
+
+def _argomenti_rotta(test, nome):
+    """Argomenti e query string con cui chiamare ogni rotta sui dati di prova."""
+    paziente = test.pazienti[0]
+    contatto = paziente.contatti_emergenza.first()
+    per_paziente = {"pk": paziente.pk}
+    rotte = {
+        "paziente_setup": (per_paziente, ""),
+        "paziente_anagrafica": ({}, f"?p={paziente.pk}"),
+        "contatti_edit": (per_paziente, ""),
+        "contatto_nuovo": (per_paziente, ""),
+        "contatto_modifica": ({"cid": contatto.pk}, ""),
+        "allergie_edit": (per_paziente, ""),
+        "menu_settimana_editor": ({"pk": test.menu.pk}, ""),
+        "turni_periodo_gestisci": ({"pk": test.periodo.pk}, ""),
+        "turni_copertura": ({"pk": test.periodo.pk}, ""),
+        "turni_calendario_ics": ({"token": test.dipendenti[0].token_calendario}, ""),
+        "report_menu_periodo_print": ({"pk": test.menu.pk}, ""),
+        "report_lista_spesa": ({"pk": test.menu.pk}, ""),
+        "report_ore_csv": ({}, f"?mese={test.oggi:%Y-%m}"),
+        "export_diario": ({"diario": "parametri", "formato": "xlsx"}, ""),
+        "api_dettaglio": ({"risorsa": "pazienti", "pk": paziente.pk}, ""),
+        "somministrazione_righe": ({}, f"?paziente={paziente.pk}"),
+    }
+    if nome in ("fhir_export_stato", "fhir_export_file"):
+        job = _esportazione_completata(test.utente)
+        rotte.update(fhir_export_stato=({"pk": job.pk}, ""), fhir_export_file=({"pk": job.pk, "tipo": "Patient"}, ""))
+    return rotte.get(nome, ({}, ""))
+
+
+def _rotte_core():
+    return sorted(p.name for p in get_resolver("core.urls").url_patterns if getattr(p, "name", None))
+
+
+# con DATABASE_REPLICA_URL la replica è un mirror del default, che non vede la transazione del test
+@override_settings(DB_REPLICA_ROTTE=[], FHIR_EXPORT_DIR=CARTELLA_FHIR.name)
+class BudgetQueryRotteTest(DatiDiProva, TestCase):
+    """Ogni rotta di core/urls.py resta entro il suo budget di query (BUDGET_QUERY)."""
+
+    def _misura(self, nome):
+        kwargs, query_string = _argomenti_rotta(self, nome)
+        url = reverse(nome, kwargs=kwargs) + query_string
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+            # le risposte in streaming eseguono le query mentre vengono consumate
+            if getattr(response, "streaming", False):
+                b"".join(response.streaming_content)
+        return response, len(ctx.captured_queries), ctx.captured_queries
+
+    def test_ogni_rotta_ha_un_budget(self):
+        mancanti = [nome for nome in _rotte_core() if nome not in BUDGET_QUERY]
+        self.assertEqual(mancanti, [], "Aggiungere le rotte a BUDGET_QUERY in core/middleware.py")
+
+    def test_budget_per_rotta(self):
+        for nome in _rotte_core():
+            with self.subTest(rotta=nome):
+                response, n, query = self._misura(nome)
+                self.assertLess(response.status_code, 400, f"{nome}: HTTP {response.status_code}")
+                dettaglio = "\n".join(q["sql"] for q in query)
+                self.assertLessEqual(n, BUDGET_QUERY[nome], f"{nome}: {n} query\n{dettaglio}")
+
+    def test_benchmark_non_chiama_le_rotte_con_effetti(self):
+        rotte = argomenti_rotte(self.utente)
+        self.assertIn("parametri_diario", rotte)
+        self.assertFalse(ROTTE_CON_EFFETTI & set(rotte))
+
+    def test_diario_igiene_non_cresce_con_i_pazienti(self):
+        _, prima, _ = self._misura("igiene_diario")
+        for i in range(5):
+            p = Paziente.objects.create(
+                nome="Extra", cognome=f"Extra{i}", sesso="F",
+                data_nascita=self.oggi.replace(year=self.oggi.year - 85), codice_fiscale=f"VRDLGU40A01H{i:03d}X",
+            )
+            DiarioIgiene.objects.create(paziente=p, evento="DOCCIA", rilevato_il=timezone.now())
+        _, dopo, _ = self._misura("igiene_diario")
+        self.assertEqual(prima, dopo)
+
+    def test_rotazione_non_cresce_con_il_periodo(self):
+        url = reverse("turni_periodo_gestisci", kwargs={"pk": self.periodo.pk})
+        dati = {"auto_fill": "1", "anteprima": "1", "overwrite": "1"}
+        dati.update({f"op{i + 1}": str(d.pk) for i, d in enumerate(self.dipendenti[:len(self.turni)])})
+
+        def misura(inizio):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(url, {**dati, "start_date": inizio.isoformat()})
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        breve = misura(self.periodo.data_fine - timedelta(days=2))
+        lungo = misura(self.periodo.data_inizio)
+        # letture e scritture sono in blocco: 29 giorni non costano più di 3
+        self.assertLessEqual(lungo, breve)
+
+
+@override_settings(DB_REPLICA_ROTTE=[])
+class BudgetSQLMiddlewareTest(DatiDiProva, TestCase):
+
+    def test_disattivato_per_default(self):
+        response = self.client.get(reverse("dashboard"))
+        self.assertNotIn("X-SQL-Budget", response)
+
+    @override_settings(SQL_BUDGET_ATTIVO=True, SQL_BUDGET_HEADER=True, SQL_BUDGET_EXPLAIN_MS=0)
+    def test_header_e_log(self):
+        # il client di test carica i middleware alla prima richiesta, con le impostazioni correnti
+        with self.assertLogs("core.sql", level="INFO") as log:
+            response = self.client.get(reverse("igiene_diario"))
+        intestazione = response["X-SQL-Budget"]
+        self.assertIn("rotta=igiene_diario", intestazione)
+        self.assertRegex(intestazione, r"query=\d+; tempo_ms=[\d.]+; duplicate=\d+; ripetute_max=\d+")
+        self.assertTrue(any("[igiene_diario]" in riga for riga in log.output))
+        self.assertTrue(any("Query più lenta" in riga for riga in log.output))
+
+    @override_settings(SQL_BUDGET_ATTIVO=True, SQL_BUDGET_HEADER=False, SQL_BUDGET_ROTTE={"dashboard": 0})
+    def test_sforamento_in_warning(self):
+        with self.assertLogs("core.sql", level="WARNING") as log:
+            response = self.client.get(reverse("dashboard"))
+        self.assertNotIn("X-SQL-Budget", response)
+        self.assertIn("(budget 0)", log.output[0])
+
+    @override_settings(SQL_BUDGET_ATTIVO=True, SQL_BUDGET_HEADER=True)
+    async def test_middleware_asincrono_conta_le_stesse_query(self):
+        await self.async_client.aforce_login(self.utente)
+        with self.assertLogs("core.sql", level="INFO"):
+            sincrona = await sync_to_async(self.client.get)(reverse("igiene_diario"))
+            asincrona = await self.async_client.get(reverse("igiene_diario"))
+        conta = lambda r: r["X-SQL-Budget"].split("; ")[1]
+        self.assertEqual(conta(asincrona), conta(sincrona))
+        self.assertNotEqual(conta(asincrona), "query=0")
+
+    async def test_query_dei_thread_paralleli_nel_budget(self):
+        def seleziona():
+            with connections["default"].cursor() as cur:
+                cur.execute("SELECT 1")
+            return threading.get_ident()
+
+        rilevatore = _Rilevatore()
+        token = _rilevatore_richiesta.set(rilevatore)
+        try:
+            # come in_parallelo fuori da una transazione: thread e connessione propri
+            thread = await sync_to_async(_con_connessione_propria(seleziona), thread_sensitive=False)()
+        finally:
+            _rilevatore_richiesta.reset(token)
+        self.assertNotEqual(thread, threading.get_ident())
+        self.assertEqual([sql for _, sql, _, _ in rilevatore.query], ["SELECT 1"])
+
+    def test_rapporto_duplicate(self):
+        middleware = BudgetSQLMiddleware.__new__(BudgetSQLMiddleware)
+        query = [
+            ("default", "SELECT 1 WHERE id = %s", (1,), 0.001),
+            ("default", "SELECT 1 WHERE id = %s", (1,), 0.002),
+            ("default", "SELECT 1 WHERE id = %s", (2,), 0.003),
+        ]
+        rapporto = middleware._rapporto(query)
+        self.assertEqual(rapporto["query"], 3)
+        self.assertEqual(rapporto["duplicate"], 1)
+        self.assertEqual(rapporto["ripetute_max"], 3)
+        self.assertEqual(rapporto["lenta"][2], (2,))
+
+
+class ReplicaRouterTest(SimpleTestCase):
+
+    def test_letture_sulla_replica_solo_se_richiesto(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Paziente), "default")
+        token = _alias_lettura.set(REPLICA)
+        try:
+            self.assertEqual(router.db_for_read(Paziente), REPLICA)
+            self.assertEqual(router.db_for_read(User), "default")  # sessioni e utenti sempre dal primario
+            self.assertEqual(router.db_for_write(Paziente), "default")
+        finally:
+            _alias_lettura.reset(token)
+        self.assertFalse(router.allow_migrate(REPLICA, "core"))
+
+    def test_streaming_mantiene_l_alias(self):
+        def contenuto():
+            for _ in range(3):
+                yield _alias_lettura.get()
+        self.assertEqual(list(_in_streaming(contenuto(), REPLICA)), [REPLICA] * 3)
+        self.assertIsNone(_alias_lettura.get())
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "core.cache.CacheLivelli", "OPTIONS": {"CONDIVISA": "condivisa", "TTL_LOCALE": 60}},
+    "condivisa": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-condivisa"},
+})
+class CacheLivelliTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_livello_locale_e_delete(self):
+        cache.set("k", {"a": 1}, 60)
+        caches["condivisa"].set("k", {"a": 2}, 60)  # scrittura di un altro processo
+        self.assertEqual(cache.get("k"), {"a": 1})  # servita dal livello locale
+        cache.get("k")["a"] = 99  # chi legge riceve una copia
+        self.assertEqual(cache.get("k"), {"a": 1})
+        cache.delete("k")
+        self.assertIsNone(cache.get("k"))
+        self.assertIsNone(caches["condivisa"].get("k"))
+
+    def test_chiavi_versionate_seguono_i_salvataggi(self):
+        def conta():
+            return in_cache("farmaci_test", (Farmaco,), Farmaco.objects.count)
+
+        self.assertEqual(conta(), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(conta(), 0)
+        farmaco = Farmaco.objects.create(nome="Paracetamolo", forma="cpr")
+        self.assertEqual(conta(), 1)
+        farmaco.delete()
+        self.assertEqual(conta(), 0)
+        self.assertEqual(metriche()["prefissi"]["farmaci_test"]["hit"], 1)
+
+
+@override_settings(DB_REPLICA_ROTTE=[])
+class APITest(DatiDiProva, TestCase):
+    def setUp(self):
+        self.api = self.client_class(HTTP_AUTHORIZATION=f"Bearer {crea_token(self.utente, 'tablet')}")
+
+    def test_token_cursore_e_campi(self):
+        self.assertEqual(self.client_class().get(reverse("api_parametri")).status_code, 401)
+        self.assertEqual(self.client_class(HTTP_AUTHORIZATION="Bearer x").get(reverse("api_parametri")).status_code, 401)
+
+        ids, cursore = [], None
+        while True:
+            dati = self.api.get(reverse("api_parametri"), {"limite": 5, "fields": "rilevato_il,pas", **(
+                {"cursore": cursore} if cursore else {})}).json()
+            self.assertEqual(set(dati["dati"][0]), {"id", "rilevato_il", "pas"})
+            ids += [d["id"] for d in dati["dati"]]
+            cursore = dati["successivo"]
+            if not cursore:
+                break
+        attesi = list(ParametroVitale.objects.order_by("-rilevato_il", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, attesi)  # stessi istanti su più righe: nessuna saltata o ripetuta
+
+        paziente = self.pazienti[0]
+        url = reverse("api_prescrizioni") + f"?paziente={paziente.pk}&include=righe.orari,righe.farmaco"
+        with CaptureQueriesContext(connection) as ctx:
+            risposta = self.api.get(url)
+        self.assertEqual(len(ctx), 4)  # token, prescrizioni, righe + farmaco, orari
+        riga = risposta.json()["dati"][0]["righe"][0]
+        self.assertEqual((riga["farmaco"]["nome"], riga["orari"][0]["ora"]), ("Farmaco 0", "08:00:00"))
+        self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=risposta["ETag"]).status_code, 304)
+        self.assertEqual(self.api.get(reverse("api_pazienti") + "?include=boh").status_code, 400)
+
+
+@override_settings(DB_REPLICA_ROTTE=[], AUDIT_THREAD=False)
+class SincronizzazioneTest(DatiDiProva, TestCase):
+    def _invia(self, voci):
+        return self.client.post(reverse("sincronizzazione"), {"voci": voci}, content_type="application/json")
+
+    def test_lotto_idempotente(self):
+        paziente = self.pazienti[0]
+        riga = RigaPrescrizione.objects.filter(prescrizione__paziente=paziente).first()
+        voci = [
+            {"chiave": str(uuid.uuid4()), "tipo": "somministrazione", "dati": {
+                "paziente": paziente.pk, "riga": riga.pk, "data_ora": "2025-10-19T08:00",
+                "dose_erogata": "1", "stato": "SOMMINISTRATO"}},
+            {"chiave": str(uuid.uuid4()), "tipo": "parametro", "dati": {
+                "paziente": paziente.pk, "rilevato_il": "2025-10-19T08:05", "fc": "70"}},
+            {"chiave": str(uuid.uuid4()), "tipo": "igiene", "dati": {
+                "paziente": self.pazienti[1].pk, "rilevato_il": "2025-10-19T09:00", "evento": "DOCCIA"}},
+            # riga di un altro ospite: rifiutata dal form, le altre entrano comunque
+            {"chiave": str(uuid.uuid4()), "tipo": "somministrazione", "dati": {
+                "paziente": self.pazienti[1].pk, "riga": riga.pk, "stato": "RIFIUTATO"}},
+        ]
+        prima = (Somministrazione.objects.count(), ParametroVitale.objects.count(), DiarioIgiene.objects.count())
+        with CaptureQueriesContext(connection) as ctx:
+            esiti = self._invia(voci).json()["esiti"]
+        self.assertLess(len(ctx), 15)  # non dipende dal numero di voci
+        self.assertEqual([e["esito"] for e in esiti], ["creato", "creato", "creato", "errore"])
+        self.assertIn("riga", esiti[3]["errori"])
+        dopo = (Somministrazione.objects.count(), ParametroVitale.objects.count(), DiarioIgiene.objects.count())
+        self.assertEqual([d - p for p, d in zip(prima, dopo)], [1, 1, 1])
+        self.assertEqual(Somministrazione.objects.get(pk=esiti[0]["id"]).operatore, self.utente)
+
+        # risposta persa: il reinvio non duplica e restituisce gli stessi id
+        reinvio = self._invia(voci[:3]).json()["esiti"]
+        self.assertEqual([(e["esito"], e["id"]) for e in reinvio], [("duplicato", e["id"]) for e in esiti[:3]])
+        self.assertEqual(Somministrazione.objects.count(), dopo[0])
+        self.assertEqual(self._invia([{"chiave": "x", "tipo": "igiene", "dati": {}}]).status_code, 400)
+
+
+@override_settings(DB_REPLICA_ROTTE=[], AUDIT_THREAD=False)
+class GiroParametriTest(DatiDiProva, TestCase):
+    def test_righe_vuote_saltate_e_regole_del_form(self):
+        righe = self.client.get(reverse("parametri_giro")).context["righe"]
+        self.assertEqual(len(righe), N_PAZIENTI)
+        dati = {"form-TOTAL_FORMS": N_PAZIENTI, "form-INITIAL_FORMS": N_PAZIENTI, "rilevato_il": "2025-10-19T07:30"}
+        for i, (episodio, _, _) in enumerate(righe):
+            dati[f"form-{i}-paziente"] = episodio.paziente_id
+        dati.update({"form-0-pas": "125", "form-0-pad": "80", "form-1-fc": "66", "form-2-pas": "140"})
+        prima = ParametroVitale.objects.count()
+
+        risposta = self.client.post(reverse("parametri_giro"), dati)
+        self.assertEqual(risposta.status_code, 200)  # PA MAX senza PA MIN: nulla salvato
+        self.assertIn("pad", risposta.context["formset"][2].errors)
+        self.assertEqual(ParametroVitale.objects.count(), prima)
+
+        dati["form-2-pad"] = "90"
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertRedirects(self.client.post(reverse("parametri_giro"), dati), reverse("parametri_diario"),
+                                 fetch_redirect_response=False)
+        self.assertEqual(ParametroVitale.objects.count(), prima + 3)
+        self.assertLess(len(ctx), 10)  # una INSERT per il blocco, non una per ospite
+
+
+@override_settings(DB_REPLICA_ROTTE=[], AUDIT_THREAD=False)
+class IgieneRepartoTest(DatiDiProva, TestCase):
+    def test_un_evento_al_giorno_per_ospite(self):
+        righe = self.client.get(reverse("igiene_reparto")).context["righe"]
+        pazienti = [episodio.paziente_id for episodio, _, _ in righe]
+        dati = {"evento": "DOCCIA", "rilevato_il": "2025-10-21T09:00", "pazienti": pazienti[:3]}
+        prima = DiarioIgiene.objects.count()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse("igiene_reparto"), dati)
+        self.assertEqual(DiarioIgiene.objects.count(), prima + 3)
+        self.assertLess(len(ctx), 10)
+
+        # stesso giorno, ora diversa: i tre già registrati vengono saltati
+        dati.update(rilevato_il="2025-10-21T15:00", pazienti=pazienti[:4])
+        self.client.post(reverse("igiene_reparto"), dati)
+        self.assertEqual(DiarioIgiene.objects.count(), prima + 4)
+
+        # il form del singolo evento usa lo stesso vincolo
+        risposta = self.client.post(reverse("igiene_nuovo"), {
+            "paziente": pazienti[0], "evento": "DOCCIA", "rilevato_il": "2025-10-21T18:00",
+        })
+        self.assertIn("Evento già registrato", str(risposta.context["form"].non_field_errors()))
+        self.assertEqual(DiarioIgiene.objects.count(), prima + 4)
+
+
+@override_settings(DB_REPLICA_ROTTE=[], AUDIT_THREAD=False)
+class ExportDiarioTest(DatiDiProva, TestCase):
+    def _scarica(self, formato, **query):
+        risposta = self.client.get(reverse("export_diario", kwargs={"diario": "parametri", "formato": formato}), query)
+        self.assertTrue(risposta.streaming)
+        return b"".join(risposta.streaming_content)
+
+    def test_csv_e_xlsx_con_le_stesse_righe(self):
+        paziente = self.pazienti[0]
+        periodo = {"dal": (self.oggi - timedelta(days=30)).isoformat(), "al": self.oggi.isoformat()}
+        attese = ParametroVitale.objects.filter(
+            paziente=paziente, rilevato_il__date__range=[periodo["dal"], periodo["al"]],
+        ).count()
+        self.assertGreater(attese, 0)
+
+        righe_csv = self._scarica("csv", paziente=paziente.pk, **periodo).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(righe_csv), attese + 1)
+        self.assertTrue(all(paziente.cognome in r for r in righe_csv[1:]))
+
+        with zipfile.ZipFile(io.BytesIO(self._scarica("xlsx", paziente=paziente.pk, **periodo))) as zf:
+            self.assertIsNone(zf.testzip())
+            foglio = zf.read("xl/worksheets/sheet1.xml").decode()
+        self.assertEqual(foglio.count("<row>"), attese + 1)
+
+        risposta = self.client.get(reverse("export_diario", kwargs={"diario": "parametri", "formato": "pdf"}))
+        self.assertEqual(risposta.status_code, 400)
+
+    async def test_streaming_asincrono_sotto_asgi(self):
+        # sotto ASGI un iteratore sincrono verrebbe letto tutto con sync_to_async(list) prima di inviare
+        periodo = {"dal": (self.oggi - timedelta(days=30)).isoformat(), "al": self.oggi.isoformat()}
+        attese = await ParametroVitale.objects.filter(
+            rilevato_il__date__range=[periodo["dal"], periodo["al"]],
+        ).acount()
+        righe, lette = Diario.righe, []
+
+        def conta(diario, *args, **kwargs):
+            for riga in righe(diario, *args, **kwargs):
+                lette.append(riga)
+                yield riga
+
+        await self.async_client.aforce_login(self.utente)
+        with mock.patch.object(Diario, "righe", conta), mock.patch("core.export.PEZZO_BYTE", 1):
+            risposta = await self.async_client.get(
+                reverse("export_diario", kwargs={"diario": "parametri", "formato": "csv"}), periodo,
+            )
+            self.assertTrue(risposta.is_async)
+            async with aclosing(aiter(risposta)) as pezzi:
+                for _ in range(3):
+                    await anext(pezzi)
+                self.assertLess(len(lette), attese)
+                resto = [p async for p in pezzi]
+        self.assertEqual(len(lette), attese)
+        self.assertEqual(b"".join(resto).count(b"\n"), attese - 1)
+
+
+@override_settings(DB_REPLICA_ROTTE=[], AUDIT_THREAD=False, FHIR_EXPORT_DIR=CARTELLA_FHIR.name)
+class EsportazioneFHIRTest(DatiDiProva, TestCase):
+    def setUp(self):
+        self.api = self.client_class(HTTP_AUTHORIZATION=f"Bearer {crea_token(self.utente, 'fascicolo regionale')}")
+
+    def _ndjson(self, manifest, tipo):
+        url = next(f["url"] for f in manifest["output"] if f["type"] == tipo)
+        risposta = self.api.get(url)
+        return [json.loads(riga) for riga in b"".join(risposta.streaming_content).splitlines()]
+
+    def test_avvio_stato_e_file(self):
+        avvio = self.api.get("/fhir/$export", {"_type": "Patient,Observation,MedicationRequest"})
+        self.assertEqual(avvio.status_code, 202)
+        stato = avvio["Content-Location"]
+        self.assertEqual(self.api.get("/fhir/$export", {"_type": "Patient,Observation,MedicationRequest"})["Content-Location"], stato)
+        self.assertEqual(self.api.get(stato).status_code, 202)
+        self.assertEqual(self.api.get("/fhir/$export", {"_type": "Boh"}).status_code, 400)
+
+        esegui_export_fhir(EsportazioneFHIR.objects.get(), processi=1)
+        manifest = self.api.get(stato).json()
+        conteggi = {f["type"]: f["count"] for f in manifest["output"]}
+        self.assertEqual(conteggi["Patient"], N_PAZIENTI)
+        self.assertEqual(conteggi["MedicationRequest"], RigaPrescrizione.objects.count())
+        pazienti = self._ndjson(manifest, "Patient")
+        self.assertEqual({p["identifier"][0]["value"] for p in pazienti}, {p.codice_fiscale for p in self.pazienti})
+        richieste = self._ndjson(manifest, "MedicationRequest")
+        self.assertTrue(all(r["subject"]["reference"].startswith("Patient/") for r in richieste))
+
+        # altro utente: il job non esiste
+        altro = User.objects.create_user("altro", password="x")
+        estraneo = self.client_class(HTTP_AUTHORIZATION=f"Bearer {crea_token(altro, 'x')}")
+        self.assertEqual(estraneo.get(stato).status_code, 404)
+
+        self.assertEqual(self.api.delete(stato).status_code, 202)
+        self.assertEqual(self.api.get(stato).status_code, 404)
+
+    def test_delete_csrf_solo_per_la_sessione(self):
+        token = crea_token(self.utente, "fascicolo regionale")
+        api = self.client_class(enforce_csrf_checks=True, HTTP_AUTHORIZATION=f"Bearer {token}")
+        stato = reverse("fhir_export_stato", args=[_esportazione_completata(self.utente).pk])
+        self.assertEqual(api.delete(stato).status_code, 202)
+
+        sessione = self.client_class(enforce_csrf_checks=True)
+        sessione.force_login(self.utente)
+        job = _esportazione_completata(self.utente)
+        self.assertEqual(sessione.delete(reverse("fhir_export_stato", args=[job.pk])).status_code, 403)
+        self.assertTrue(EsportazioneFHIR.objects.filter(pk=job.pk).exists())
+
+    def test_job_del_worker_morto_torna_in_coda(self):
+        vecchio = timezone.now() - timedelta(hours=1)
+        job = EsportazioneFHIR.objects.create(
+            utente=self.utente, tipi="Patient", stato=EsportazioneFHIR.Stato.IN_CORSO,
+            iniziata_il=vecchio, battito_il=vecchio, tentativi=1,
+        )
+        self.assertEqual(recupera_interrotti(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.stato, EsportazioneFHIR.Stato.IN_CODA)
+
+        # il worker dato per morto era solo lento: non tocca più il job ripreso da un altro
+        self.assertFalse(_in_corso(job, avanzamento="Patient: 1000 risorse"))
+        self.assertTrue(esegui_export_fhir(job, processi=1))
+        job.refresh_from_db()
+        self.assertEqual((job.stato, job.tentativi), (EsportazioneFHIR.Stato.COMPLETATA, 2))
+
+        with override_settings(FHIR_EXPORT_TENTATIVI=2):
+            EsportazioneFHIR.objects.filter(pk=job.pk).update(stato=EsportazioneFHIR.Stato.IN_CORSO, battito_il=vecchio)
+            self.assertEqual(recupera_interrotti(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.stato, EsportazioneFHIR.Stato.ERRORE)
+
+    def test_sigterm_rimette_in_coda(self):
+        job = EsportazioneFHIR.objects.create(utente=self.utente, tipi="Patient,Observation")
+        with mock.patch("core.esportazione_fhir._esporta_tipo", side_effect=Interrotto), self.assertRaises(Interrotto):
+            esegui_export_fhir(job, processi=1)
+        job.refresh_from_db()
+        self.assertEqual((job.stato, job.tentativi), (EsportazioneFHIR.Stato.IN_CODA, 0))
+
+    def test_since_esporta_solo_le_modifiche(self):
+        prima = _esportazione_completata(self.utente)
+        self.assertEqual(prima.file, [{"type": "Patient", "count": N_PAZIENTI}])
+        paziente = self.pazienti[0]
+        paziente.telefono = "0212345678"
+        paziente.save()
+        dopo = _esportazione_completata(self.utente, dal=prima.iniziata_il)
+        self.assertEqual(dopo.file, [{"type": "Patient", "count": 1}])
+
+
+class ProssimaDoseTest(SimpleTestCase):
+    def test_orari_e_giorni_della_settimana(self):
+        lunedi_10 = timezone.make_aware(datetime(2025, 10, 13, 10))
+        orari = [(time(8), "1234567"), (time(20), "135")]
+        self.assertEqual(prossima_dose(orari, lunedi_10), timezone.make_aware(datetime(2025, 10, 13, 20)))
+        martedi_21 = lunedi_10 + timedelta(days=1, hours=11)
+        self.assertEqual(prossima_dose(orari, martedi_21), timezone.make_aware(datetime(2025, 10, 15, 8)))
+        self.assertIsNone(prossima_dose([], lunedi_10))
+
+    def test_dose_in_ritardo_resta_al_suo_orario(self):
+        orari = [(time(8), "1234567"), (time(20), "1234567")]
+        lunedi = datetime(2025, 10, 13)
+        for registrata, programmata in (
+            (lunedi.replace(hour=8, minute=30), lunedi.replace(hour=8)),  # non le 20
+            (lunedi.replace(hour=19, minute=30), lunedi.replace(hour=20)),
+            (lunedi.replace(hour=21, minute=45), lunedi.replace(hour=20)),
+            (lunedi.replace(hour=22, minute=30), lunedi.replace(day=14, hour=8)),  # oltre la tolleranza
+        ):
+            self.assertEqual(prossima_dose(orari, timezone.make_aware(registrata)), timezone.make_aware(programmata))
+        # a cavallo della mezzanotte
+        self.assertEqual(prossima_dose([(time(23), "1")], timezone.make_aware(datetime(2025, 10, 14, 0, 30))),
+                         timezone.make_aware(datetime(2025, 10, 13, 23)))
+
+
+@override_settings(AUDIT_THREAD=False)
+class RegistroModificheTest(TestCase):
+    def test_differenze_scritte_a_lotti_dopo_il_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Farmaco.objects.create(nome="Furosemide", forma="cpr")
+            paziente = Paziente.objects.create(
+                nome="Anna", cognome="Neri", sesso="F", data_nascita=datetime(1940, 1, 1).date(),
+                codice_fiscale="NRENNA40A41H501X",
+            )
+        self.assertFalse(RegistroModifica.objects.exists())  # ancora nel buffer
+        buffer_audit.scarica()
+        creato = RegistroModifica.objects.get(modello="core.paziente", azione="C")
+        self.assertEqual(creato.modifiche["cognome"], [None, "Neri"])
+        self.assertFalse(RegistroModifica.objects.filter(modello="core.farmaco").exists())  # non clinico
+
+        paziente = Paziente.objects.get(pk=paziente.pk)
+        self.assertNotIn("_audit_prima", paziente.__dict__)  # caricare non fotografa: si rilegge al salvataggio
+        with self.captureOnCommitCallbacks(execute=True):
+            paziente.cognome = "Neri Bianchi"
+            paziente.save()
+            paziente.save()  # nessuna differenza: nessuna voce
+        with self.captureOnCommitCallbacks(execute=False):
+            paziente.nome = "Annamaria"
+            paziente.save()  # transazione mai committata: nessuna voce
+        buffer_audit.scarica()
+        modifiche = RegistroModifica.objects.filter(modello="core.paziente", azione="M")
+        self.assertEqual([m.modifiche for m in modifiche], [{"cognome": ["Neri", "Neri Bianchi"]}])
+
+
+class MenuTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        lunedi = date(2025, 10, 13)
+        cls.menu = MenuPeriodo.objects.create(nome="Prova", data_inizio=lunedi, data_fine=lunedi + timedelta(days=13))
+        cls.pietanza = Pietanza.objects.create(nome="Minestrone")
+        for g in range(14):
+            for pasto in ("PRANZ", "CENA"):
+                mp = MenuPasto.objects.create(periodo=cls.menu, data=lunedi + timedelta(days=g), pasto=pasto)
+                VoceMenu.objects.create(pasto=mp, pietanza=cls.pietanza, ordine=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_griglia_in_cache_invalidata_dai_signal(self):
+        self.assertEqual(len(griglia_menu(self.menu)), 28)
+        with self.assertNumQueries(0):
+            griglia_menu(self.menu)
+
+        self.pietanza.nome = "Passato di verdure"
+        self.pietanza.save()
+        self.assertEqual({tuple(c["items"]) for c in griglia_menu(self.menu).values()}, {("Passato di verdure",)})
+
+        pasto = MenuPasto.objects.get(periodo=self.menu, data=self.menu.data_inizio, pasto="PRANZ")
+        VoceMenu.objects.create(pasto=pasto, descrizione_libera="Frutta", ordine=2)
+        self.assertEqual(griglia_menu(self.menu)[(pasto.data, "PRANZ")]["items"], ["Passato di verdure", "Frutta"])
+        pasto.delete()
+        self.assertNotIn((pasto.data, "PRANZ"), griglia_menu(self.menu))
+
+    def test_date_del_periodo_invalidano_griglia_e_spesa(self):
+        self.assertEqual(len(griglia_menu(self.menu)), 28)
+        self.assertEqual(len(lista_spesa(self.menu)["porzioni_giorno"]), 14)
+        self.menu.data_fine -= timedelta(days=7)
+        self.menu.save()
+        self.assertEqual(len(griglia_menu(self.menu)), 14)
+        self.assertEqual(len(lista_spesa(self.menu)["porzioni_giorno"]), 7)
+
+    def test_editor_settimana_non_valida(self):
+        self.client.force_login(User.objects.create_user("menu", password="x", is_staff=True))
+        url = reverse("menu_settimana_editor", kwargs={"pk": self.menu.pk})
+        self.assertEqual(self.client.get(url).json()["settimana"], self.menu.data_inizio.isoformat())
+        for settimana in ("foo", "2025-02-30"):
+            with self.subTest(settimana=settimana):
+                self.assertEqual(self.client.get(url, {"settimana": settimana}).status_code, 400)
+                risposta = self.client.post(url, {"settimana": settimana, "celle": []}, content_type="application/json")
+                self.assertEqual(risposta.status_code, 400)
+
+    def test_patch_con_versione_superata_non_tocca_le_celle(self):
+        lunedi = self.menu.data_inizio
+        celle = {c["pasto"]: c for c in stato_settimana(self.menu, lunedi)["celle"] if c["data"] == lunedi.isoformat()}
+        pranzo, cena = celle["PRANZ"], celle["CENA"]
+        voce = {"descrizione_libera": "Minestrone", "ordine": 1}
+        esito = applica_patch_settimana(self.menu, lunedi, [{**pranzo, "voci": [voce]}])
+        self.assertEqual((esito["creati"], esito["eliminati"]), (1, 1))
+
+        prima = stato_settimana(self.menu, lunedi)
+        patch = [  # pranzo letto prima della modifica: tutta la patch va respinta, anche la cena
+            {**pranzo, "voci": [{**voce, "descrizione_libera": "Pasta al pomodoro"}]},
+            {**cena, "voci": []},
+        ]
+        with self.assertRaises(ConflittoVersione) as conflitto:
+            applica_patch_settimana(self.menu, lunedi, patch)
+        self.assertEqual([c["pasto"] for c in conflitto.exception.celle], ["PRANZ"])
+        self.assertEqual(stato_settimana(self.menu, lunedi), prima)
+
+
+class ListaSpesaTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        lunedi = date(2025, 11, 3)
+        cls.menu = MenuPeriodo.objects.create(nome="Spesa", data_inizio=lunedi, data_fine=lunedi + timedelta(days=1))
+        pasta, pomodoro, pane = (
+            Ingrediente.objects.create(nome=nome, udm=udm) for nome, udm in (("Pasta", "g"), ("Pomodoro", "g"), ("Pane", "pz"))
+        )
+        primo = Pietanza.objects.create(nome="Pasta al pomodoro")
+        RicettaIngrediente.objects.create(pietanza=primo, ingrediente=pasta, quantita_porzione=80)
+        RicettaIngrediente.objects.create(pietanza=primo, ingrediente=pomodoro, quantita_porzione=100)
+        minestra = Pietanza.objects.create(nome="Minestra di pomodoro")
+        RicettaIngrediente.objects.create(pietanza=minestra, ingrediente=pomodoro, quantita_porzione=30)
+        RicettaIngrediente.objects.create(pietanza=minestra, ingrediente=pane, quantita_porzione=1)
+
+        pranzo = MenuPasto.objects.create(periodo=cls.menu, data=lunedi, pasto="PRANZ")
+        VoceMenu.objects.create(pasto=pranzo, pietanza=primo, ordine=1)
+        VoceMenu.objects.create(pasto=pranzo, pietanza=minestra, ordine=2)
+        cena = MenuPasto.objects.create(periodo=cls.menu, data=lunedi + timedelta(days=1), pasto="CENA")
+        VoceMenu.objects.create(pasto=cena, pietanza=minestra, ordine=1)
+
+        # lunedì 3 presenti (uno dimesso in giornata), martedì 2; gli altri fuori periodo
+        for i, (inizio, fine) in enumerate((
+            (date(2025, 10, 1), None),
+            (date(2025, 10, 1), lunedi),
+            (lunedi, None),
+            (date(2025, 9, 1), date(2025, 10, 31)),
+            (lunedi + timedelta(days=2), None),
+        )):
+            paziente = Paziente.objects.create(
+                nome=f"Nome{i}", cognome="Prova", sesso="F", data_nascita=date(1940, 1, 1),
+                codice_fiscale=f"PRVNMO40A41H{i:03d}X",
+            )
+            Episodio.objects.create(paziente=paziente, data_inizio=inizio, data_fine=fine, provenienza="DOM")
+
+    def test_porzioni_per_presenti_e_unita(self):
+        cache.clear()
+        spesa = lista_spesa(self.menu)
+        self.assertEqual(spesa["porzioni_giorno"], {self.menu.data_inizio: 3, self.menu.data_fine: 2})
+        self.assertEqual(
+            [(r["ingrediente"], r["udm"], r["quantita"]) for r in spesa["righe"]],
+            [("Pane", "pz", 1 * 3 + 1 * 2), ("Pasta", "g", 80 * 3), ("Pomodoro", "g", (100 + 30) * 3 + 30 * 2)],
+        )
+
+
+@override_settings(DB_REPLICA_ROTTE=[])
+class TurniTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.turni = [
+            TurnoTipo.objects.create(codice="M", nome="Mattina", ora_inizio=time(7), ora_fine=time(14), ordine=1),
+            TurnoTipo.objects.create(codice="P", nome="Pomeriggio", ora_inizio=time(14), ora_fine=time(21), ordine=2),
+            TurnoTipo.objects.create(codice="N", nome="Notte", ora_inizio=time(21), ora_fine=time(7), ordine=3),
+            TurnoTipo.objects.create(codice="R", nome="Riposo", is_riposo=True, ordine=4),
+        ]
+        cls.dipendenti = [Dipendente.objects.create(nome=f"Op{i}", cognome=f"Operatore{i}") for i in range(4)]
+        cls.periodo = PianoTurniPeriodo.objects.create(
+            nome="Ottobre", data_inizio=date(2025, 10, 1), data_fine=date(2025, 10, 14),
+        )
+
+    def _rotazione(self):
+        return piano_rotazione(self.turni, self.dipendenti, self.periodo.data_inizio, self.periodo.data_fine)
+
+    def test_rotazione_e_applica_piano(self):
+        piano = self._rotazione()
+        self.assertEqual(len(piano), 14 * 4)
+        # il primo dipendente ruota M, P, N, R, M, ...
+        dip, giorno = self.dipendenti[0], self.periodo.data_inizio
+        self.assertEqual([piano[(giorno + timedelta(days=n), dip.pk)] for n in range(5)],
+                         [t.pk for t in self.turni] + [self.turni[0].pk])
+
+        self.assertEqual(applica_piano(self.periodo, piano, dry_run=True)["creati"], len(piano))
+        self.assertFalse(AssegnazioneTurno.objects.exists())
+        self.assertEqual(applica_piano(self.periodo, piano)["creati"], len(piano))
+        self.assertEqual(applica_piano(self.periodo, piano)["invariati"], len(piano))
+
+        # senza overwrite la cella esistente resta; con overwrite cambia solo il turno, la riga e le note restano
+        mattina, pomeriggio = self.turni[:2]
+        cella = AssegnazioneTurno.objects.get(periodo=self.periodo, dipendente=dip, data=giorno)
+        cella.note = "Cambio concordato"
+        cella.save()
+        piano = {(giorno, dip.pk): pomeriggio.pk}
+        self.assertEqual(applica_piano(self.periodo, piano)["saltati"], 1)
+        self.assertEqual(AssegnazioneTurno.objects.get(pk=cella.pk).turno, mattina)
+        self.assertEqual(applica_piano(self.periodo, piano, overwrite=True)["aggiornati"], 1)
+        cella = AssegnazioneTurno.objects.get(pk=cella.pk)
+        self.assertEqual((cella.turno, cella.note), (pomeriggio, "Cambio concordato"))
+
+    @override_settings(TURNI_PIANIFICATORE_PROCESSI=1, TURNI_PIANIFICATORE_ITERAZIONI=2000)
+    def test_pianificazione_con_assenze(self):
+        for turno in self.turni[:3]:
+            FabbisognoTurno.objects.create(turno=turno, ruolo="OSS", minimo=1)
+        applica_piano(self.periodo, self._rotazione())
+        assente, giorno = self.dipendenti[0], self.periodo.data_inizio
+        AssenzaDipendente.objects.create(dipendente=assente, data_inizio=giorno, data_fine=giorno + timedelta(days=2))
+
+        piano, _ = pianifica_periodo(self.periodo, overwrite=True)
+        self.assertFalse([d for d, dip in piano if dip == assente.pk and d <= giorno + timedelta(days=2)])
+        turni = {t.pk: t for t in self.turni}
+        for (data, dip), turno in piano.items():
+            dopo = piano.get((data + timedelta(days=1), dip))
+            if is_notturno(turni[turno]) and dopo:
+                self.assertFalse(is_mattutino(turni[dopo]), (data, dip))
+
+        # con overwrite le assegnazioni che il piano non prevede (i giorni di assenza) spariscono
+        self.assertEqual(applica_piano(self.periodo, piano, overwrite=True, dry_run=True)["eliminati"], 3)
+        self.assertEqual(applica_piano(self.periodo, piano, overwrite=True)["eliminati"], 3)
+        self.assertFalse(AssegnazioneTurno.objects.filter(dipendente=assente, data__lte=giorno + timedelta(days=2)).exists())
+
+    def test_pianificazione_senza_pool_nella_richiesta(self):
+        FabbisognoTurno.objects.create(turno=self.turni[0], ruolo="OSS", minimo=1)
+        with mock.patch("core.pianificatore.ProcessPoolExecutor") as pool:
+            piano, _ = pianifica_periodo(self.periodo, overwrite=True)
+        pool.assert_not_called()
+        self.assertTrue(piano)
+
+    def test_in_servizio_con_la_notte_del_giorno_prima(self):
+        cache.clear()
+        applica_piano(self.periodo, self._rotazione())
+        mattina, _, notte, _ = self.turni
+        giorno = self.periodo.data_inizio + timedelta(days=1)  # notte del secondo dipendente
+
+        alle_2 = timezone.make_aware(datetime.combine(giorno + timedelta(days=1), time(2)))
+        self.assertEqual(turni_attivi(alle_2), [(notte.pk, giorno)])
+        self.assertEqual([(a.dipendente, a.data) for a in in_servizio(alle_2)], [(self.dipendenti[1], giorno)])
+        alle_21 = timezone.make_aware(datetime.combine(giorno, time(21, 30)))
+        self.assertEqual([(a.dipendente, a.data) for a in in_servizio(alle_21)], [(self.dipendenti[1], giorno)])
+        alle_7 = alle_2 + timedelta(hours=5)  # fine della notte, inizio della mattina
+        self.assertEqual([a.turno for a in in_servizio(alle_7)], [mattina])
+
+    def test_copertura_e_in_servizio_solo_autenticati(self):
+        for url in (reverse("turni_copertura", args=[self.periodo.pk]), reverse("turni_in_servizio")):
+            self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user("turni", password="x", is_staff=True))
+        for url in (reverse("turni_copertura", args=[self.periodo.pk]), reverse("turni_in_servizio")):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_conflitti_anche_fra_periodi(self):
+        applica_piano(self.periodo, self._rotazione())
+        dip, giorno = self.dipendenti[0], self.periodo.data_inizio
+        mattina, pomeriggio, _, riposo = self.turni
+
+        # mattina del giorno 3 dopo la notte del giorno 2: non scritta, segnalata
+        esito = applica_piano(self.periodo, {(giorno + timedelta(days=3), dip.pk): mattina.pk}, overwrite=True)
+        self.assertEqual((esito["aggiornati"], len(esito["conflitti"])), (0, 1))
+        self.assertEqual(esito["conflitti"][0]["dipendente"], dip)
+        self.assertEqual(AssegnazioneTurno.objects.get(dipendente=dip, data=giorno + timedelta(days=3)).turno, riposo)
+
+        # un secondo periodo sugli stessi giorni non può prenotare di nuovo il dipendente
+        sostituzioni = PianoTurniPeriodo.objects.create(nome="Sostituzioni", data_inizio=giorno, data_fine=giorno)
+        self.assertEqual([m for _, m in conflitti_turno(dip.pk, giorno, pomeriggio)], ["doppio turno nello stesso giorno"])
+        esito = applica_piano(sostituzioni, {(giorno, dip.pk): pomeriggio.pk})
+        self.assertEqual((esito["creati"], len(esito["conflitti"])), (0, 1))
+        self.assertFalse(sostituzioni.assegnazioni.exists())
+
+    def test_inline_admin_con_i_conflitti_fra_periodi(self):
+        applica_piano(self.periodo, self._rotazione())
+        dip, giorno, pomeriggio = self.dipendenti[0], self.periodo.data_inizio, self.turni[1]
+        sostituzioni = PianoTurniPeriodo.objects.create(nome="Sostituzioni", data_inizio=giorno, data_fine=giorno)
+        richiesta = RequestFactory().get("/")
+        richiesta.user = User.objects.create_superuser("admin_turni", password="x")
+        FormSet = AssegnazioneTurnoInline(PianoTurniPeriodo, admin.site).get_formset(richiesta, sostituzioni)
+        prefisso = FormSet.get_default_prefix()
+        formset = FormSet({
+            f"{prefisso}-TOTAL_FORMS": "1", f"{prefisso}-INITIAL_FORMS": "0",
+            f"{prefisso}-0-data": giorno.isoformat(), f"{prefisso}-0-turno": pomeriggio.pk,
+            f"{prefisso}-0-dipendente": dip.pk,
+        }, instance=sostituzioni, prefix=prefisso)
+        self.assertFalse(formset.is_valid())
+        self.assertIn("doppio turno nello stesso giorno", str(formset.errors))
+
+    def test_calendario_ics_etag_e_304(self):
+        dip, oggi = self.dipendenti[0], timezone.localdate()
+        periodo = PianoTurniPeriodo.objects.create(nome="Corrente", data_inizio=oggi, data_fine=oggi + timedelta(days=1))
+        for n, turno in enumerate(self.turni[:2]):
+            AssegnazioneTurno.objects.create(periodo=periodo, data=oggi + timedelta(days=n), dipendente=dip, turno=turno)
+        url = reverse("turni_calendario_ics", args=[dip.token_calendario])
+        risposta = self.client.get(url)  # feed pubblico, letto dai client calendario
+        self.assertEqual(risposta.status_code, 200)
+        self.assertTrue(risposta.content.startswith(b"BEGIN:VCALENDAR"))
+        self.assertEqual(risposta.content.count(b"BEGIN:VEVENT"), 2)
+        etag = risposta["ETag"]
+
+        non_modificato = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((non_modificato.status_code, non_modificato.content), (304, b""))
+
+        self.assertNotIn("Last-Modified", risposta)
+
+        # una cancellazione non sposta l'ultima modifica, ma cambia l'ETag
+        AssegnazioneTurno.objects.filter(dipendente=dip, data=oggi).delete()
+        dopo = http_date(timezone.now().timestamp() + 3600)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=dopo).status_code, 200)
+        risposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(risposta.status_code, 200)
+        self.assertNotEqual(risposta["ETag"], etag)
+        self.assertEqual(risposta.content.count(b"BEGIN:VEVENT"), 1)
+        self.assertEqual(self.client.get(reverse("turni_calendario_ics", args=[uuid.uuid4()])).status_code, 404)
+
+
+@override_settings(DB_REPLICA_ROTTE=[])
+class OreTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user("paghe", password="x", is_staff=True)
+        turni = [
+            TurnoTipo.objects.create(codice="M", nome="Mattina", ora_inizio=time(7), ora_fine=time(14), ordine=1),
+            TurnoTipo.objects.create(codice="P", nome="Pomeriggio", ora_inizio=time(14), ora_fine=time(21), ordine=2),
+            TurnoTipo.objects.create(codice="N", nome="Notte", ora_inizio=time(21), ora_fine=time(7), ordine=3),
+            TurnoTipo.objects.create(codice="A", nome="Alba", ora_inizio=time(5), ora_fine=time(13), ordine=4),
+        ]
+        cls.dipendente = Dipendente.objects.create(nome="Ada", cognome="Prova")
+        periodo = PianoTurniPeriodo.objects.create(nome="Aprile 2025", data_inizio=date(2025, 4, 1), data_fine=date(2025, 4, 30))
+        mattina, pomeriggio, notte, alba = turni
+        for giorno, turno in (
+            (2, notte),  # mercoledì 21-7: 8 ore nella fascia 22-6
+            (4, alba),  # venerdì 5-13: un'ora notturna
+            (6, mattina),  # domenica
+            (21, pomeriggio),  # Pasquetta
+        ):
+            AssegnazioneTurno.objects.create(periodo=periodo, data=date(2025, 4, giorno), dipendente=cls.dipendente, turno=turno)
+
+    def test_minuti_notturni_e_festivi(self):
+        self.assertIn(date(2025, 4, 21), festivita(2025))  # Pasquetta
+        self.assertIn(date(2024, 4, 1), festivita(2024))
+        ore = OreMensili.objects.get(dipendente=self.dipendente, mese=date(2025, 4, 1))
+        self.assertEqual((ore.turni, ore.minuti_lavorati), (4, 600 + 480 + 420 + 420))
+        self.assertEqual(ore.minuti_notturni, 480 + 60)
+        self.assertEqual(ore.minuti_festivi, 420 + 420)
+
+    def test_csv_in_streaming(self):
+        self.client.force_login(self.utente)
+        risposta = self.client.get(reverse("report_ore_csv"), {"mese": "2025-04"})
+        self.assertTrue(risposta.streaming)
+        righe = b"".join(risposta.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(righe), 2)
+        self.assertEqual(righe[1].split(";")[1:4], [str(self.dipendente.pk), "Prova", "Ada"])
+        self.assertEqual(righe[1].split(";")[6:9], ["32,00", "9,00", "14,00"])
+
+    def test_csv_mese_non_valido(self):
+        self.client.force_login(self.utente)
+        for parametri in ({"mese": "2025-13"}, {"mese": "boh"}, {"da": "2025-01", "a": "2025-00"}):
+            self.assertEqual(self.client.get(reverse("report_ore_csv"), parametri).status_code, 400)
+        self.assertEqual(self.client.get(reverse("report_ore_csv"), {"mese": "2025-12"}).status_code, 200)
+
+
+class LettiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user("accettazione", password="x", is_staff=True)
+        stanza = Stanza.objects.create(nome="S01")
+        cls.letti = [Letto.objects.create(stanza=stanza, codice=c) for c in "AB"]
+        cls.oggi = timezone.localdate()
+        cls.occupato = salva_episodio_con_letto(cls._nuovo_episodio(cls.letti[0]))
+
+    @classmethod
+    def _nuovo_episodio(cls, letto):
+        n = Paziente.objects.count()
+        paziente = Paziente.objects.create(
+            nome="Anna", cognome="Verdi", sesso="F", data_nascita=date(1938, 5, 2),
+            codice_fiscale=f"VRDNNA38E42H{n:03d}X",
+        )
+        return Episodio(paziente=paziente, data_inizio=cls.oggi, letto=letto, provenienza="DOM")
+
+    def test_letto_occupato_e_liberato_dalla_dimissione(self):
+        cache.clear()
+        letto = self.occupato.letto
+        self.assertEqual(tabellone_letti()["occupati"], 1)
+        with self.assertRaises(LettoOccupato):
+            salva_episodio_con_letto(self._nuovo_episodio(letto))
+        self.assertEqual(Episodio.objects.filter(letto=letto, data_fine__isnull=True).count(), 1)
+
+        # dalla vista: errore sul campo, non un 500
+        self.client.force_login(self.utente)
+        risposta = self.client.post(reverse("episodio_accetta"), {
+            "paziente": self._nuovo_episodio(None).paziente_id, "data_inizio": f"{self.oggi:%Y-%m-%d}",
+            "provenienza": "DOM", "letto": letto.pk,
+        })
+        self.assertEqual(risposta.status_code, 200)
+        self.assertTrue(risposta.context["form"].errors["letto"])
+
+        self.occupato.data_fine = self.oggi
+        salva_episodio_con_letto(self.occupato)
+        self.assertEqual(tabellone_letti()["occupati"], 0)  # cache invalidata dalla dimissione
+        nuovo = salva_episodio_con_letto(self._nuovo_episodio(letto))
+        self.assertEqual(Episodio.objects.get(letto=letto, data_fine__isnull=True), nuovo)
+
+
+@override_settings(DB_REPLICA_ROTTE=[])
+class CensimentoTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user("censimento", password="x", is_staff=True)
+        stanza = Stanza.objects.create(nome="S01")
+        cls.letti = [Letto.objects.create(stanza=stanza, codice=c) for c in "ABC"]
+        cls.oggi = timezone.localdate()
+        cls.paziente = Paziente.objects.create(
+            nome="Mario", cognome="Rossi", sesso="M", data_nascita=date(1940, 1, 1), codice_fiscale="RSSMRA40A01H501Z",
+        )
+        cls.episodio = Episodio.objects.create(
+            paziente=cls.paziente, data_inizio=cls.oggi - timedelta(days=10), letto=cls.letti[0], provenienza="DOM",
+        )
+
+    def _giornate(self):
+        return sorted(GiornataDegenza.objects.values_list("data", "episodio_id", "paziente_id", "letto_id", "provenienza"))
+
+    def _come_ricostruito(self):
+        incrementale = self._giornate()
+        ricostruisci_censimento()
+        self.assertEqual(incrementale, self._giornate())
+
+    def test_sincronizzazione_incrementale_come_ricostruzione(self):
+        self.assertEqual(GiornataDegenza.objects.filter(episodio=self.episodio).count(), 11)  # oggi incluso
+        episodio = self.episodio
+        passi = [
+            {"letto": self.letti[1]},
+            {"provenienza": "OSP"},
+            {"data_inizio": episodio.data_inizio - timedelta(days=5)},
+            {"data_inizio": episodio.data_inizio + timedelta(days=3)},
+            {"data_fine": self.oggi - timedelta(days=2)},
+            {"data_fine": None, "letto": self.letti[2]},
+            {"letto": None},
+        ]
+        for campi in passi:
+            with self.subTest(**{k: str(v) for k, v in campi.items()}):
+                for campo, valore in campi.items():
+                    setattr(episodio, campo, valore)
+                episodio.save()
+                self._come_ricostruito()
+
+        # il giorno di dimissione non è giornata di degenza
+        episodio.data_fine = self.oggi
+        episodio.save()
+        self.assertEqual(GiornataDegenza.objects.filter(episodio=episodio).latest("data").data, self.oggi - timedelta(days=1))
+
+    def test_salvataggio_senza_modifiche_e_nuovo_episodio(self):
+        episodio = self.episodio
+        episodio.motivo = "Controllo"
+        with CaptureQueriesContext(connection) as query:
+            episodio.save()
+        self.assertFalse([q for q in query.captured_queries if "giornatadegenza" in q["sql"]])
+
+        paziente = Paziente.objects.create(
+            nome="Anna", cognome="Verdi", sesso="F", data_nascita=date(1938, 5, 2), codice_fiscale="VRDNNA38E42H501X",
+        )
+        nuovo = Episodio.objects.create(
+            paziente=paziente, data_inizio=self.oggi - timedelta(days=3), letto=self.letti[1], provenienza="SOC",
+        )
+        self.assertEqual(GiornataDegenza.objects.filter(episodio=nuovo).count(), 4)
+        self._come_ricostruito()
+
+    def test_report_per_mese_e_provenienza(self):
+        totali = giornate_mensili(self.oggi.year)
+        self.assertEqual(sum(n for (_, provenienza), n in totali.items() if provenienza == "DOM"),
+                         GiornataDegenza.objects.filter(data__year=self.oggi.year).count())
+        self.client.force_login(self.utente)
+        risposta = self.client.get(reverse("report_censimento"), {"anno": self.oggi.year})
+        self.assertEqual((risposta.status_code, risposta.context["anno"]), (200, self.oggi.year))
+        self.assertEqual(risposta.context["totale"], sum(totali.values()))
+
+    def test_report_conta_i_giorni_non_ancora_censiti(self):
+        dopo = self.oggi + timedelta(days=5)  # il comando censimento non è ancora passato
+        stimate = giornate_mensili(dopo.year, oggi=dopo)
+        self.assertEqual(sum(stimate.values()), (dopo - max(self.episodio.data_inizio, date(dopo.year, 1, 1))).days + 1)
+        aggiorna_censimento(dopo)
+        self.assertEqual(giornate_mensili(dopo.year, oggi=dopo), stimate)
+
+    def test_report_anno_fuori_intervallo(self):
+        self.client.force_login(self.utente)
+        for anno, atteso in (("0", 1), ("99999", 9998), ("abc", self.oggi.year)):
+            risposta = self.client.get(reverse("report_censimento"), {"anno": anno})
+            self.assertEqual((risposta.status_code, risposta.context["anno"]), (200, atteso))
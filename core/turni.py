@@ -0,0 +1,498 @@
+# core/turni.py
+import hashlib
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import AssegnazioneTurno, AssenzaDipendente, Dipendente, FabbisognoTurno, TurnoTipo, RuoloDipendente
+from .ore import aggiorna_ore_mensili, mese_di
+from .pianificatore import Problema, risolvi, LIBERO
+
+# L'indice orario viene invalidato dai signal su TurnoTipo, il timeout è solo una rete di sicurezza
+INDICE_ORARIO_CHIAVE = "core:turni:indice_orario"
+INDICE_ORARIO_TIMEOUT = 60 * 60 * 24
+MINUTI_GIORNO = 24 * 60
+
+# Il feed iCalendar include i turni da N giorni fa in poi
+CALENDARIO_GIORNI_PASSATI = getattr(settings, "TURNI_CALENDARIO_GIORNI_PASSATI", 30)
+
+
+def is_notturno(turno):
+    """Turno che attraversa la mezzanotte o inizia dalle 20:00 in poi."""
+    if turno.is_riposo or not turno.ora_inizio:
+        return False
+    if turno.ora_fine and turno.ora_fine <= turno.ora_inizio:
+        return True
+    return turno.ora_inizio >= time(20, 0)
+
+
+def is_mattutino(turno):
+    return bool(turno.ora_inizio) and not turno.is_riposo and turno.ora_inizio < time(12, 0) and not is_notturno(turno)
+
+
+def piano_rotazione(turni, dipendenti, start, fine):
+    """
+    Rotazione ciclica calcolata in memoria: {(data, dipendente_id): turno_id}.
+    Il giorno k dalla partenza il turno i va a dipendenti[(i - k) % n].
+    """
+    n = len(turni)
+    piano = {}
+    day = start
+    while day <= fine:
+        k = (day - start).days
+        for i, turno in enumerate(turni):
+            piano[(day, dipendenti[(i - k) % n].pk)] = turno.pk
+        day += timedelta(days=1)
+    return piano
+
+
+# === CONFLITTI FRA TURNI (anche fra periodi diversi) ===
+def _riposo_minimo():
+    return timedelta(hours=getattr(settings, "TURNI_RIPOSO_MINIMO_ORE", 11))
+
+
+def intervallo_turno(data, turno):
+    """(inizio, fine) locali del turno lavorativo nella data, None per riposi e turni senza orario."""
+    if turno.is_riposo or not turno.ora_inizio or not turno.ora_fine:
+        return None
+    inizio = datetime.combine(data, turno.ora_inizio)
+    fine = datetime.combine(data, turno.ora_fine)
+    if fine <= inizio:
+        fine += timedelta(days=1)
+    return inizio, fine
+
+
+def motivo_conflitto(data1, turno1, data2, turno2, riposo_minimo=None):
+    """Motivo del conflitto fra due assegnazioni dello stesso dipendente, None se compatibili."""
+    if data1 == data2:
+        return "doppio turno nello stesso giorno"
+    i1, i2 = intervallo_turno(data1, turno1), intervallo_turno(data2, turno2)
+    if not i1 or not i2:
+        return None
+    (_, fine_prima), (inizio_dopo, _) = sorted([i1, i2])
+    pausa = inizio_dopo - fine_prima
+    if pausa < timedelta(0):
+        return "turni sovrapposti"
+    riposo_minimo = riposo_minimo or _riposo_minimo()
+    if pausa < riposo_minimo:
+        return f"riposo di {pausa.total_seconds() / 3600:g} ore (minimo {riposo_minimo.total_seconds() / 3600:g})"
+    return None
+
+
+def conflitti_turno(dipendente_id, data, turno, escludi_pk=None):
+    """
+    Assegnazioni del dipendente, in qualunque periodo, incompatibili con il turno indicato:
+    [(assegnazione, motivo)]. Una query sull'indice (dipendente, data), giorno prima e dopo.
+    """
+    vicini = (
+        AssegnazioneTurno.objects
+        .filter(dipendente_id=dipendente_id, data__range=[data - timedelta(days=1), data + timedelta(days=1)])
+        .exclude(pk=escludi_pk)
+        .select_related("turno", "periodo")
+    )
+    riposo_minimo = _riposo_minimo()
+    out = []
+    for a in vicini:
+        motivo = motivo_conflitto(data, turno, a.data, a.turno, riposo_minimo)
+        if motivo:
+            out.append((a, motivo))
+    return out
+
+
+def applica_piano(periodo, piano, overwrite=False, dry_run=False, utente=None):
+    """
+    Confronta il piano con le assegnazioni esistenti (una sola query, su tutti i periodi
+    nell'intervallo ±1 giorno) e lo applica con bulk_create/bulk_update in un'unica transazione.
+    Con overwrite, le assegnazioni dei dipendenti del piano che il piano non prevede
+    (nell'intervallo pianificato) vengono eliminate con un'unica delete.
+    Le celle in conflitto con altre assegnazioni (doppio turno, sovrapposizione o riposo
+    insufficiente, anche in altri periodi) non vengono scritte e sono elencate in "conflitti".
+    Con dry_run restituisce solo i conteggi, senza scrivere.
+    """
+    esito = {"creati": 0, "aggiornati": 0, "saltati": 0, "invariati": 0, "eliminati": 0, "conflitti": []}
+    if not piano:
+        return esito
+
+    giorni = [d for d, _ in piano]
+    g0, g1 = min(giorni), max(giorni)
+    turni = TurnoTipo.objects.in_bulk()
+    esistenti = {}
+    occupati = defaultdict(dict)  # (dipendente_id, data) -> {chiave: turno_id}
+    for a in AssegnazioneTurno.objects.filter(
+        data__range=[g0 - timedelta(days=1), g1 + timedelta(days=1)],
+        dipendente_id__in={dip_id for _, dip_id in piano},
+    ):
+        if a.periodo_id == periodo.pk and g0 <= a.data <= g1:
+            esistenti[(a.data, a.dipendente_id)] = a
+        occupati[(a.dipendente_id, a.data)][a.pk] = a.turno_id
+
+    da_eliminare = []
+    if overwrite:
+        for k, a in esistenti.items():
+            if k not in piano:
+                da_eliminare.append(a.pk)
+                del occupati[(a.dipendente_id, a.data)][a.pk]
+
+    # stato finale previsto: le celle da scrivere prendono il turno del piano
+    da_scrivere = []
+    for (data, dip_id), turno_id in sorted(piano.items()):
+        a = esistenti.get((data, dip_id))
+        if a is not None and a.turno_id == turno_id:
+            esito["invariati"] += 1
+        elif a is not None and not overwrite:
+            esito["saltati"] += 1
+        else:
+            chiave = a.pk if a is not None else ("nuovo", data, dip_id)
+            occupati[(dip_id, data)][chiave] = turno_id
+            da_scrivere.append((data, dip_id, turno_id, a, chiave))
+
+    riposo_minimo = _riposo_minimo()
+    now = timezone.now()
+    da_creare, da_aggiornare = [], []
+    for data, dip_id, turno_id, a, chiave in da_scrivere:
+        motivo = None
+        for giorno in (data - timedelta(days=1), data, data + timedelta(days=1)):
+            for altra, altro_turno in occupati.get((dip_id, giorno), {}).items():
+                if altra != chiave:
+                    motivo = motivo or motivo_conflitto(data, turni[turno_id], giorno, turni[altro_turno], riposo_minimo)
+        if motivo:
+            # la cella resta com'era: la si toglie dallo stato previsto
+            if a is not None:
+                occupati[(dip_id, data)][chiave] = a.turno_id
+            else:
+                del occupati[(dip_id, data)][chiave]
+            esito["conflitti"].append({"data": data, "dipendente_id": dip_id, "turno": turni[turno_id], "motivo": motivo})
+        elif a is None:
+            da_creare.append(AssegnazioneTurno(
+                periodo=periodo, data=data, dipendente_id=dip_id, turno_id=turno_id,
+                creato_da=utente, aggiornato_da=utente,
+            ))
+        else:
+            a.turno_id = turno_id
+            a.aggiornato_il = now
+            a.aggiornato_da = utente
+            da_aggiornare.append(a)
+
+    if esito["conflitti"]:
+        nomi = Dipendente.objects.in_bulk({c["dipendente_id"] for c in esito["conflitti"]})
+        for c in esito["conflitti"]:
+            c["dipendente"] = nomi.get(c["dipendente_id"])
+
+    esito["creati"] = len(da_creare)
+    esito["aggiornati"] = len(da_aggiornare)
+    esito["eliminati"] = len(da_eliminare)
+    if dry_run:
+        return esito
+
+    with transaction.atomic():
+        if da_eliminare:
+            AssegnazioneTurno.objects.filter(pk__in=da_eliminare).delete()
+        AssegnazioneTurno.objects.bulk_create(da_creare, batch_size=1000)
+        AssegnazioneTurno.objects.bulk_update(
+            da_aggiornare, ["turno", "aggiornato_il", "aggiornato_da"], batch_size=500
+        )
+        # le operazioni bulk non emettono signal: riepilogo ore aggiornato qui
+        if da_creare or da_aggiornare or da_eliminare:
+            aggiorna_ore_mensili({(dip_id, mese_di(d)) for d, dip_id in piano})
+    return esito
+
+
+def pianifica_periodo(periodo, overwrite=False):
+    """
+    Piano a vincoli per il periodo: {(data, dipendente_id): turno_id} più l'elenco
+    delle coperture mancanti. Con overwrite=False le assegnazioni esistenti restano fisse.
+    """
+    giorni = [periodo.data_inizio + timedelta(days=i) for i in range((periodo.data_fine - periodo.data_inizio).days + 1)]
+    g_idx = {d: i for i, d in enumerate(giorni)}
+
+    tutti = list(TurnoTipo.objects.order_by("ordine", "codice"))
+    turni = [t for t in tutti if not t.is_riposo]
+    riposo = next((t for t in tutti if t.is_riposo), None)
+    t_idx = {t.pk: i for i, t in enumerate(turni)}
+
+    fabbisogni = [
+        (t_idx[f.turno_id], f.ruolo, f.minimo)
+        for f in FabbisognoTurno.objects.filter(minimo__gt=0, turno__is_riposo=False)
+    ]
+    ruoli_richiesti = {r for _, r, _ in fabbisogni}
+    staff = list(
+        Dipendente.objects.filter(attivo=True, ruolo__in=ruoli_richiesti)
+        .order_by("cognome", "nome").only("id", "ruolo")
+    )
+    s_idx = {d.pk: i for i, d in enumerate(staff)}
+
+    bloccati = set()
+    assenze = AssenzaDipendente.objects.filter(
+        dipendente_id__in=s_idx, data_fine__gte=periodo.data_inizio, data_inizio__lte=periodo.data_fine,
+    ).values_list("dipendente_id", "data_inizio", "data_fine")
+    for dip_id, inizio, fine in assenze:
+        d = max(inizio, periodo.data_inizio)
+        while d <= min(fine, periodo.data_fine):
+            bloccati.add((s_idx[dip_id], g_idx[d]))
+            d += timedelta(days=1)
+
+    # assegnazioni esistenti nel periodo, anche di altri periodi sovrapposti: una query
+    fissi = {}
+    esistenti = AssegnazioneTurno.objects.filter(
+        dipendente_id__in=s_idx, data__range=[periodo.data_inizio, periodo.data_fine],
+    ).values_list("periodo_id", "dipendente_id", "data", "turno_id")
+    for periodo_id, dip_id, data, turno_id in esistenti:
+        cella = (s_idx[dip_id], g_idx[data])
+        if periodo_id != periodo.pk:
+            bloccati.add(cella)  # già impegnato in un altro periodo
+            fissi.pop(cella, None)
+        elif overwrite or cella in bloccati:
+            continue
+        elif turno_id in t_idx:
+            fissi[cella] = t_idx[turno_id]
+        else:
+            bloccati.add(cella)  # riposo già assegnato
+
+    # coppie (turno del giorno, turno del giorno dopo) senza il riposo minimo
+    domani = timedelta(days=1)
+    incompatibili = {
+        (i, j)
+        for i, t1 in enumerate(turni) for j, t2 in enumerate(turni)
+        if motivo_conflitto(periodo.data_inizio, t1, periodo.data_inizio + domani, t2)
+    }
+
+    problema = Problema(
+        n_giorni=len(giorni),
+        ruoli=[d.ruolo for d in staff],
+        notte=[is_notturno(t) for t in turni],
+        mattina=[is_mattutino(t) for t in turni],
+        festivo=[d.weekday() >= 5 for d in giorni],
+        fabbisogno=fabbisogni,
+        bloccati=bloccati,
+        fissi=fissi,
+        max_consecutivi=getattr(settings, "TURNI_MAX_GIORNI_CONSECUTIVI", 6),
+        incompatibili=incompatibili,
+    )
+    # gira dentro la richiesta web: di default nessun pool di processi (settings.TURNI_PIANIFICATORE_PROCESSI)
+    ris = risolvi(
+        problema,
+        ripartenze=getattr(settings, "TURNI_PIANIFICATORE_RIPARTENZE", None),
+        iterazioni=getattr(settings, "TURNI_PIANIFICATORE_ITERAZIONI", 30000),
+        processi=getattr(settings, "TURNI_PIANIFICATORE_PROCESSI", 1),
+    )
+
+    piano = {}
+    for s, riga in enumerate(ris["assegnazioni"]):
+        dip_id = staff[s].pk
+        for g, t in enumerate(riga):
+            if t >= 0:
+                piano[(giorni[g], dip_id)] = turni[t].pk
+            elif t == LIBERO and riposo:
+                piano[(giorni[g], dip_id)] = riposo.pk
+    scoperti = [
+        {"data": giorni[g], "turno": turni[t], "ruolo": ruolo, "mancano": manca}
+        for g, t, ruolo, manca in ris["scoperti"]
+    ]
+    return piano, scoperti
+
+
+# === COPERTURA E PERSONALE IN SERVIZIO ===
+def copertura_periodo(periodo):
+    """
+    Copertura giorno × turno × ruolo confrontata con i minimi di FabbisognoTurno.
+    Un'unica query aggregata sulle assegnazioni (niente iterazione sulle righe).
+    """
+    conteggi = {
+        (r["data"], r["turno_id"], r["dipendente__ruolo"]): r["n"]
+        for r in (
+            AssegnazioneTurno.objects
+            .filter(periodo=periodo, turno__is_riposo=False)
+            .values("data", "turno_id", "dipendente__ruolo")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+    }
+    minimi = {
+        (f.turno_id, f.ruolo): f.minimo
+        for f in FabbisognoTurno.objects.filter(turno__is_riposo=False)
+    }
+
+    turni = {t.pk: t for t in TurnoTipo.objects.filter(is_riposo=False).order_by("ordine", "codice")}
+    ordine_turni = {pk: i for i, pk in enumerate(turni)}
+    ordine_ruoli = {r: i for i, r in enumerate(RuoloDipendente.values)}
+    chiavi = set(minimi) | {(t_id, ruolo) for _, t_id, ruolo in conteggi}
+    chiavi = sorted(
+        (k for k in chiavi if k[0] in turni),
+        key=lambda k: (ordine_turni[k[0]], ordine_ruoli.get(k[1], 99)),
+    )
+
+    giorni = [periodo.data_inizio + timedelta(days=i) for i in range((periodo.data_fine - periodo.data_inizio).days + 1)]
+    righe, scoperti = [], 0
+    for turno_id, ruolo in chiavi:
+        minimo = minimi.get((turno_id, ruolo), 0)
+        celle = []
+        for d in giorni:
+            n = conteggi.get((d, turno_id, ruolo), 0)
+            stato = "sotto" if n < minimo else ("sopra" if minimo and n > minimo else "ok")
+            scoperti += stato == "sotto"
+            celle.append({"data": d, "n": n, "stato": stato})
+        righe.append({
+            "turno": turni[turno_id],
+            "ruolo": RuoloDipendente(ruolo).label if ruolo in ordine_ruoli else ruolo,
+            "minimo": minimo,
+            "celle": celle,
+        })
+    return {"giorni": giorni, "righe": righe, "scoperti": scoperti}
+
+
+def _costruisci_indice_orario():
+    """
+    Indice per bisezione sui minuti del giorno: confini ordinati e, per ogni intervallo,
+    le coppie (turno_id, sfasamento). Un turno che attraversa la mezzanotte vale dopo
+    le 00:00 per l'assegnazione del giorno precedente (sfasamento 1).
+    """
+    segmenti = []
+    for t_id, inizio, fine in (
+        TurnoTipo.objects
+        .filter(is_riposo=False, ora_inizio__isnull=False, ora_fine__isnull=False)
+        .values_list("id", "ora_inizio", "ora_fine")
+    ):
+        a, b = inizio.hour * 60 + inizio.minute, fine.hour * 60 + fine.minute
+        if b > a:
+            segmenti.append((a, b, t_id, 0))
+        else:
+            segmenti.append((a, MINUTI_GIORNO, t_id, 0))
+            if b:
+                segmenti.append((0, b, t_id, 1))
+
+    confini = sorted({0, MINUTI_GIORNO} | {x for a, b, *_ in segmenti for x in (a, b)})
+    attivi = [
+        tuple((t_id, sf) for a, b, t_id, sf in segmenti if a <= confini[i] < b)
+        for i in range(len(confini) - 1)
+    ]
+    return confini, attivi
+
+
+def indice_orario():
+    indice = cache.get(INDICE_ORARIO_CHIAVE)
+    if indice is None:
+        indice = _costruisci_indice_orario()
+        cache.set(INDICE_ORARIO_CHIAVE, indice, INDICE_ORARIO_TIMEOUT)
+    return indice
+
+
+def invalida_indice_orario():
+    cache.delete(INDICE_ORARIO_CHIAVE)
+
+
+def turni_attivi(quando):
+    """Coppie (turno_id, data dell'assegnazione) in corso al datetime locale indicato."""
+    confini, attivi = indice_orario()
+    minuto = quando.hour * 60 + quando.minute
+    i = bisect_right(confini, minuto) - 1
+    if i < 0 or i >= len(attivi):
+        return []
+    return [(t_id, quando.date() - timedelta(days=sf)) for t_id, sf in attivi[i]]
+
+
+def in_servizio(quando=None):
+    """Assegnazioni in corso adesso (o al datetime indicato): una query sull'indice (data, turno)."""
+    quando = timezone.localtime(quando) if quando else timezone.localtime()
+    attivi = turni_attivi(quando)
+    if not attivi:
+        return []
+    filtro = Q()
+    for t_id, d in attivi:
+        filtro |= Q(turno_id=t_id, data=d)
+    return list(
+        AssegnazioneTurno.objects
+        .filter(filtro)
+        .select_related("turno", "dipendente")
+        .order_by("turno__ordine", "dipendente__ruolo", "dipendente__cognome", "dipendente__nome")
+    )
+
+
+# === CALENDARIO PERSONALE (iCalendar) ===
+def _assegnazioni_calendario(dipendente, da):
+    return AssegnazioneTurno.objects.filter(
+        dipendente=dipendente, data__gte=da,
+        turno__is_riposo=False, turno__ora_inizio__isnull=False, turno__ora_fine__isnull=False,
+    )
+
+
+def stato_calendario(dipendente, oggi=None):
+    """
+    ETag del feed con un'unica query aggregata. Niente Last-Modified: una cancellazione
+    non sposta il massimo di aggiornato_il, mentre il conteggio nella firma la intercetta.
+    """
+    da = (oggi or timezone.localdate()) - timedelta(days=CALENDARIO_GIORNI_PASSATI)
+    agg = _assegnazioni_calendario(dipendente, da).aggregate(
+        n=Count("id"), ultima=Max("aggiornato_il"), ultima_turno=Max("turno__aggiornato_il"),
+    )
+    firma = f"{dipendente.pk}:{dipendente.token_calendario}:{da}:{agg['n']}:{agg['ultima']}:{agg['ultima_turno']}:{dipendente.aggiornato_il}"
+    return hashlib.sha256(firma.encode()).hexdigest()[:32]
+
+
+def _ics_testo(valore):
+    return (valore or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_piega(riga):
+    # righe al massimo di 75 ottetti (RFC 5545 §3.1), continuazione con uno spazio
+    dati = riga.encode("utf-8")
+    if len(dati) <= 75:
+        return riga
+    parti, corrente = [], b""
+    for ch in riga:
+        b = ch.encode("utf-8")
+        if len(corrente) + len(b) > (75 if not parti else 74):
+            parti.append(corrente.decode("utf-8"))
+            corrente = b""
+        corrente += b
+    parti.append(corrente.decode("utf-8"))
+    return "\r\n ".join(parti)
+
+
+def _ics_utc(dt):
+    return dt.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def calendario_ics(dipendente, oggi=None, dominio="novadomus"):
+    """Feed iCalendar dei turni lavorativi del dipendente (orari in UTC)."""
+    da = (oggi or timezone.localdate()) - timedelta(days=CALENDARIO_GIORNI_PASSATI)
+    tz = timezone.get_current_timezone()
+    righe = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:-//{dominio}//Turni//IT",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_ics_testo(f'Turni {dipendente.cognome} {dipendente.nome}')}",
+        "X-PUBLISHED-TTL:PT15M",
+    ]
+    assegnazioni = (
+        _assegnazioni_calendario(dipendente, da)
+        .select_related("turno")
+        .order_by("data", "turno__ora_inizio")
+        .iterator(chunk_size=500)
+    )
+    for a in assegnazioni:
+        t = a.turno
+        inizio = timezone.make_aware(datetime.combine(a.data, t.ora_inizio), tz)
+        giorno_fine = a.data + timedelta(days=1) if t.ora_fine <= t.ora_inizio else a.data
+        fine = timezone.make_aware(datetime.combine(giorno_fine, t.ora_fine), tz)
+        righe += [
+            "BEGIN:VEVENT",
+            f"UID:turno-{a.pk}@{dominio}",
+            f"DTSTAMP:{_ics_utc(a.aggiornato_il)}",
+            f"LAST-MODIFIED:{_ics_utc(a.aggiornato_il)}",
+            f"DTSTART:{_ics_utc(inizio)}",
+            f"DTEND:{_ics_utc(fine)}",
+            f"SUMMARY:{_ics_testo(t.nome or t.codice)}",
+        ]
+        if a.note:
+            righe.append(f"DESCRIPTION:{_ics_testo(a.note)}")
+        righe.append("END:VEVENT")
+    righe.append("END:VCALENDAR")
+    return "\r\n".join(_ics_piega(r) for r in righe) + "\r\n"
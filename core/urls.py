@@ -3,7 +3,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path
 
-from . import views
+from . import api, views
 from .views import (
     HomeView,
     DashboardView,
@@ -12,23 +12,32 @@ from .views import (
     PazientePostCreateSetupView,
     # Episodi / Parametri / Igiene / Terapia
     EpisodioCreateView,
+    TabelloneLettiView,
     ParametroVitaleCreateView,
     DiarioIgieneCreateView,
     DiarioIgieneView,
     SomministrazioneCreateView,
+    SomministrazioneRigheView,
+    SincronizzazioneView,
     DiarioSomministrazioniView,
     DiarioParametriView,
+    GiroParametriView,
+    IgieneRepartoView,
     # Prescrizioni
     PrescrizioneCreateView,
     PrescrizioniListaView,
     # Menu / Turni
     MenuDiarioView,
     MenuPeriodoCreateView,
+    MenuSettimanaEditorView,
     PietanzaCreateView,
     TurniDiarioView,
     PianoTurniPeriodoCreateView,
     TurniPeriodoGestisciView,
     TurniPeriodoSelezionaView,
+    TurniCoperturaView,
+    TurniInServizioView,
+    CalendarioDipendenteView,
     # Dipendenti
     DipendenteCreateView,
     # Step 2/3: Contatti & Allergie
@@ -37,7 +46,12 @@ from .views import (
     ContattoUpdateView,
     AllergieEditView,
     ReportMenuPeriodoSelectView,
-    ReportMenuPeriodoPrintView
+    ReportMenuPeriodoPrintView,
+    ListaSpesaPeriodoView,
+    ExportOreMensiliCsvView,
+    ReportDiariView,
+    ExportDiarioView,
+    ReportCensimentoView,
 )
 
 urlpatterns = [
@@ -59,11 +73,16 @@ urlpatterns = [
 
     # Episodi / Parametri / Igiene / Terapia
     path("episodi/accetta/", EpisodioCreateView.as_view(), name="episodio_accetta"),
+    path("letti/tabellone/", TabelloneLettiView.as_view(), name="letti_tabellone"),
     path("parametri/nuovo/", ParametroVitaleCreateView.as_view(), name="parametro_nuovo"),
     path("parametri/diario/", DiarioParametriView.as_view(), name="parametri_diario"),
+    path("parametri/giro/", GiroParametriView.as_view(), name="parametri_giro"),
     path("igiene/nuovo/", DiarioIgieneCreateView.as_view(), name="igiene_nuovo"),
+    path("igiene/reparto/", IgieneRepartoView.as_view(), name="igiene_reparto"),
     path("igiene/diario/", DiarioIgieneView.as_view(), name="igiene_diario"),
     path("terapia/somministrazioni/nuova/", SomministrazioneCreateView.as_view(), name="somministrazione_nuova"),
+    path("terapia/somministrazioni/righe/", SomministrazioneRigheView.as_view(), name="somministrazione_righe"),
+    path("terapia/sincronizza/", SincronizzazioneView.as_view(), name="sincronizzazione"),
     path("terapia/diario/", DiarioSomministrazioniView.as_view(), name="terapia_diario"),
 
     # Prescrizioni
@@ -73,6 +92,7 @@ urlpatterns = [
     # Menu
     path("menu/diario/", MenuDiarioView.as_view(), name="menu_diario"),
     path("menu/periodi/nuovo/", MenuPeriodoCreateView.as_view(), name="menu_periodo_nuovo"),
+    path("menu/periodi/<int:pk>/settimana/", MenuSettimanaEditorView.as_view(), name="menu_settimana_editor"),
     path("menu/pietanze/nuova/", PietanzaCreateView.as_view(), name="pietanza_nuova"),
 
     # Turni
@@ -80,11 +100,26 @@ urlpatterns = [
     path("turni/periodi/nuovo/", PianoTurniPeriodoCreateView.as_view(), name="turni_periodo_nuovo"),
     path("turni/periodi/<int:pk>/gestisci/", TurniPeriodoGestisciView.as_view(), name="turni_periodo_gestisci"),
     path("turni/periodi/", TurniPeriodoSelezionaView.as_view(), name="turni_periodo_seleziona"),
+    path("turni/periodi/<int:pk>/copertura/", TurniCoperturaView.as_view(), name="turni_copertura"),
+    path("turni/in-servizio/", TurniInServizioView.as_view(), name="turni_in_servizio"),
+    path("turni/calendario/<str:token>.ics", CalendarioDipendenteView.as_view(), name="turni_calendario_ics"),
     # Dipendenti
     path("dipendenti/nuovo/", DipendenteCreateView.as_view(), name="dipendente_nuovo"),
     # Report
     path("report/menu/periodo/", ReportMenuPeriodoSelectView.as_view(), name="report_menu_periodo_select"),
     path("report/menu/periodo/<int:pk>/", ReportMenuPeriodoPrintView.as_view(), name="report_menu_periodo_print"),
+    path("report/menu/periodo/<int:pk>/lista-spesa/", ListaSpesaPeriodoView.as_view(), name="report_lista_spesa"),
+    path("report/ore/mensili.csv", ExportOreMensiliCsvView.as_view(), name="report_ore_csv"),
+    path("report/diari/", ReportDiariView.as_view(), name="report_diari"),
+    path("report/diari/<slug:diario>.<slug:formato>", ExportDiarioView.as_view(), name="export_diario"),
+    path("report/censimento/", ReportCensimentoView.as_view(), name="report_censimento"),
+
+    # API JSON (sola lettura)
+    *[path(f"api/v1/{nome}/", api.elenco, {"risorsa": nome}, name=f"api_{nome}") for nome in api.RISORSE],
+    path("api/v1/<str:risorsa>/<int:pk>/", api.dettaglio, name="api_dettaglio"),
+    path("fhir/$export", api.fhir_export, name="fhir_export"),
+    path("fhir/$export/<uuid:pk>/", api.fhir_export_stato, name="fhir_export_stato"),
+    path("fhir/$export/<uuid:pk>/<str:tipo>.ndjson", api.fhir_export_file, name="fhir_export_file"),
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -1,30 +1,51 @@
 from django.views.generic import TemplateView, CreateView, View, FormView, DetailView
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin
 from django.urls import reverse_lazy, reverse, NoReverseMatch
 from django.contrib import messages
-from datetime import timedelta
-from django.utils.dateparse import parse_date
+from datetime import date, timedelta
+from django.utils.dateparse import parse_date, parse_datetime
 from .models import (
 Paziente,ContattoEmergenza, Episodio, Letto, Documento, ParametroVitale, DiarioIgiene, Prescrizione, 
 OrarioDose, Somministrazione, ParametroVitale, Farmaco, MenuPeriodo, MenuPasto, 
 VoceMenu, Pasto, PianoTurniPeriodo, AssegnazioneTurno, TurnoTipo, Dipendente, PianoTurniPeriodo,
-AssegnazioneTurno, Pietanza,)
+AssegnazioneTurno, Pietanza, OreMensili, Allergia, PROVENIENZA,)
 from .forms import (
 PazienteForm, ContattoEmergenzaFormSet, ContattoEmergenzaForm, AllergiaFormSet, EpisodioForm, 
 ParametroVitaleForm, DiarioIgieneForm, PrescrizioneForm, RigaPrescrizioneFormSet, MenuPeriodoSelectForm,
 SomministrazioneForm, MenuDiarioFilterForm, TurniDiarioFilterForm, DipendenteForm, PianoTurniPeriodoForm, 
-AssegnazioneTurnoForm, MenuPeriodoForm, PietanzaForm, RecapitoContatto, RecapitoFormSet)
+AssegnazioneTurnoForm, MenuPeriodoForm, PietanzaForm, RecapitoContatto, RecapitoFormSet,
+GiroParametriForm, GiroParametriFormSet, IgieneRepartoForm, ExportDiarioForm)
 from django.views import View
 from django.shortcuts import render, redirect, get_object_or_404
 from collections import defaultdict
 from django.utils import timezone
 from datetime import timedelta
 import json
-from django.db import transaction
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+import asyncio
+from asgiref.sync import sync_to_async
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
-from django.http import HttpResponseRedirect
-from django.db.models import Prefetch, Q
+from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
+from django.db.models import F, OuterRef, Prefetch, Q, Subquery
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.http import JsonResponse, StreamingHttpResponse
+import csv
+from urllib.parse import urlencode
+from django.utils.text import slugify
+from .censimento import giornate_mensili
+from .sincronizzazione import FORM_PER_TIPO, MAX_VOCI, LottoNonValido, crea_in_blocco, sincronizza
+from .terapia import righe_attive
+from .igiene import separa_doppioni
+from .export import DIARI, Eco, csv_in_streaming, streaming_per_asgi, xlsx_in_streaming
+from .middleware import rileva_query_nel_thread
+from .letti import letti_liberi, salva_episodio_con_letto, tabellone_letti, LettoOccupato
+from .turni import (piano_rotazione, applica_piano, pianifica_periodo, copertura_periodo, in_servizio,
+                    stato_calendario, calendario_ics)
+from .menu import settimane_menu, lista_spesa, stato_settimana, applica_patch_settimana, lunedi_di, ConflittoVersione
 
 def safe_reverse(name, *args, **kwargs):
     try:
@@ -32,6 +53,53 @@ def safe_reverse(name, *args, **kwargs):
     except NoReverseMatch:
         return None
 
+
+# === LETTURE ASYNC (ASGI) ===
+def _letture_in_sequenza():
+    connessione = connections[DEFAULT_DB_ALIAS]
+    # SQLite è nel processo: più thread si contendono il GIL e aprono connessioni senza guadagno
+    return connessione.in_atomic_block or connessione.vendor == "sqlite"
+
+
+def _con_connessione_propria(interrogazione):
+    def esegui():
+        try:
+            with rileva_query_nel_thread():
+                return interrogazione()
+        finally:
+            close_old_connections()  # rilascia la connessione del thread (al pool, o secondo CONN_MAX_AGE)
+    return esegui
+
+
+async def in_parallelo(*interrogazioni):
+    """
+    Esegue callable sincroni indipendenti (query già materializzate) in thread separati, ognuno
+    con la propria connessione: la latenza è quella della query più lenta, non la somma.
+    Dentro una transazione (ATOMIC_REQUESTS, TestCase) le altre connessioni non vedrebbero
+    i dati non committati, quindi si eseguono in sequenza sulla connessione della richiesta;
+    lo stesso con SQLite, dove il parallelismo non ripaga il costo dei thread.
+    """
+    if await sync_to_async(_letture_in_sequenza)():
+        return await sync_to_async(lambda: [f() for f in interrogazioni])()
+    return await asyncio.gather(*(
+        sync_to_async(_con_connessione_propria(f), thread_sensitive=False)() for f in interrogazioni
+    ))
+
+
+class LoginRequiredAsyncMixin(AccessMixin):
+    """LoginRequiredMixin per le View con handler async: l'utente si carica con request.auser()."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        # assegnato a request.user così template e context processor non lo ricaricano in modo sincrono
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def render_async(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
 class HomeView(TemplateView):
     template_name = "core/home.html"
 
@@ -187,14 +255,21 @@ class EpisodioCreateView(LoginRequiredMixin, CreateView):
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        # mostra solo i letti liberi (nessun episodio ATTIVO associato)
-        occupati = Episodio.objects.filter(data_fine__isnull=True, letto__isnull=False).values_list("letto_id", flat=True)
-        form.fields["letto"].queryset = Letto.objects.exclude(id__in=occupati)
+        # mostra solo i letti liberi (nessun episodio ATTIVO associato): un'unica LEFT JOIN
+        form.fields["letto"].queryset = letti_liberi()
         form.fields["letto"].required = False  # opzionale: consenti accettazione senza assegnare subito il letto
         return form
 
     def form_valid(self, form):
-        resp = super().form_valid(form)  # salva l'episodio
+        # letto bloccato e ricontrollato in transazione: due accettazioni contemporanee non lo condividono
+        self.object = form.save(commit=False)
+        try:
+            salva_episodio_con_letto(self.object)
+        except LettoOccupato:
+            form.add_error("letto", "Il letto selezionato è stato appena assegnato a un altro paziente.")
+            return self.form_invalid(form)
+        form.save_m2m()
+        resp = HttpResponseRedirect(self.get_success_url())
         files = self.request.FILES.getlist("allegati")
         for f in files:
             Documento.objects.create(
@@ -207,6 +282,14 @@ class EpisodioCreateView(LoginRequiredMixin, CreateView):
             )
         return resp
 
+class TabelloneLettiView(LoginRequiredMixin, TemplateView):
+    template_name = "core/letti_tabellone.html"
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["tabellone"] = tabellone_letti()
+        return ctx
+
 class ParametroVitaleCreateView(LoginRequiredMixin, CreateView):
     model = ParametroVitale
     form_class = ParametroVitaleForm
@@ -234,6 +317,68 @@ class ParametroVitaleCreateView(LoginRequiredMixin, CreateView):
         messages.success(self.request, "Parametro vitale registrato.")
         return resp
         
+class GiroParametriView(LoginRequiredMixin, View):
+    """Giro parametri: una riga per ospite in degenza (per stanza e letto) con l'ultima rilevazione, salvate in blocco."""
+    template_name = "core/parametri_giro.html"
+
+    def _ospiti(self):
+        return list(
+            Episodio.objects.filter(data_fine__isnull=True)
+            .select_related("paziente", "letto__stanza")
+            .order_by(F("letto__stanza__nome").asc(nulls_last=True), "letto__codice", "paziente__cognome", "paziente__nome")
+        )
+
+    def _ultime(self, episodi):
+        ultima = (ParametroVitale.objects.filter(paziente=OuterRef("paziente"))
+                  .order_by("-rilevato_il", "-id").values("pk")[:1])
+        return {
+            p.paziente_id: p
+            for p in ParametroVitale.objects.filter(
+                paziente_id__in=[e.paziente_id for e in episodi], pk=Subquery(ultima),
+            )
+        }
+
+    def _formset(self, episodi, data=None):
+        return GiroParametriFormSet(
+            data,
+            initial=None if data else [{"paziente": e.paziente_id} for e in episodi],
+            form_kwargs={"precaricati": {"paziente": {e.paziente_id: e.paziente for e in episodi}}},
+        )
+
+    def _render(self, request, form, formset, episodi):
+        per_paziente = {e.paziente_id: e for e in episodi}
+        ultime = self._ultime(episodi)
+        righe = []
+        for f in formset:
+            pid = int(f["paziente"].value())
+            righe.append((per_paziente.get(pid), ultime.get(pid), f))
+        return render(request, self.template_name, {"form": form, "formset": formset, "righe": righe})
+
+    def get(self, request):
+        episodi = self._ospiti()
+        form = GiroParametriForm(initial={"rilevato_il": timezone.localtime().replace(second=0, microsecond=0)})
+        return self._render(request, form, self._formset(episodi), episodi)
+
+    def post(self, request):
+        episodi = self._ospiti()
+        form = GiroParametriForm(request.POST)
+        formset = self._formset(episodi, request.POST)
+        if form.is_valid() and formset.is_valid():
+            compilate = [f for f in formset if f.has_changed()]
+            if compilate:
+                rilevazioni = []
+                for f in compilate:
+                    obj = f.save(commit=False)
+                    obj.rilevato_il = form.cleaned_data["rilevato_il"]
+                    obj.operatore = obj.creato_da = obj.aggiornato_da = request.user
+                    rilevazioni.append(obj)
+                with transaction.atomic():
+                    crea_in_blocco(rilevazioni)
+                messages.success(request, f"Giro parametri registrato: {len(rilevazioni)} ospiti.")
+                return redirect("parametri_diario")
+            messages.warning(request, "Nessun valore inserito.")
+        return self._render(request, form, formset, episodi)
+
 class DiarioIgieneCreateView(LoginRequiredMixin, CreateView):
     model = DiarioIgiene
     form_class = DiarioIgieneForm
@@ -257,10 +402,74 @@ class DiarioIgieneCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.operatore = self.request.user
-        resp = super().form_valid(form)
+        try:
+            with transaction.atomic():
+                resp = super().form_valid(form)
+        except IntegrityError:
+            # stesso evento registrato da un altro operatore dopo la validazione
+            form.add_error(None, "Evento già registrato per l'ospite in questo giorno.")
+            return self.form_invalid(form)
         messages.success(self.request, "Diario igiene salvato.")
         return resp
 
+class IgieneRepartoView(LoginRequiredMixin, View):
+    """Igiene di reparto: lo stesso evento per gli ospiti spuntati, inserito con un solo bulk_create."""
+    template_name = "core/igiene_reparto.html"
+
+    def _ospiti(self):
+        return list(
+            Episodio.objects.filter(data_fine__isnull=True)
+            .select_related("paziente", "letto__stanza")
+            .order_by(F("letto__stanza__nome").asc(nulls_last=True), "letto__codice", "paziente__cognome", "paziente__nome")
+        )
+
+    def _render(self, request, form, episodi):
+        oggi = defaultdict(list)
+        for pid, evento in DiarioIgiene.objects.filter(
+            giorno=timezone.localdate(), paziente_id__in=[e.paziente_id for e in episodi],
+        ).values_list("paziente_id", "evento"):
+            oggi[pid].append(dict(DiarioIgiene.EVENTO_CHOICES)[evento])
+        caselle = {int(c.data["value"]): c for c in form["pazienti"]}
+        righe = [(e, caselle[e.paziente_id], oggi.get(e.paziente_id, [])) for e in episodi]
+        return render(request, self.template_name, {"form": form, "righe": righe})
+
+    def get(self, request):
+        episodi = self._ospiti()
+        form = IgieneRepartoForm(
+            initial={"rilevato_il": timezone.localtime().replace(second=0, microsecond=0)},
+            ospiti=[e.paziente for e in episodi],
+        )
+        return self._render(request, form, episodi)
+
+    def post(self, request):
+        episodi = self._ospiti()
+        form = IgieneRepartoForm(request.POST, ospiti=[e.paziente for e in episodi])
+        if not form.is_valid():
+            return self._render(request, form, episodi)
+
+        pazienti = {e.paziente_id: e.paziente for e in episodi}
+        eventi = [
+            DiarioIgiene(paziente=pazienti[pid], evento=form.cleaned_data["evento"],
+                         rilevato_il=form.cleaned_data["rilevato_il"], operatore=request.user)
+            for pid in form.cleaned_data["pazienti"]
+        ]
+        nuovi, doppioni = separa_doppioni(eventi)
+        try:
+            with transaction.atomic():
+                crea_in_blocco(nuovi)
+        except IntegrityError:
+            # un altro operatore ha registrato uno degli stessi eventi nel frattempo: nulla è stato salvato
+            form.add_error(None, "Alcuni eventi sono stati appena registrati da un altro operatore: nessun evento salvato, riprovare.")
+            return self._render(request, form, episodi)
+
+        evento = dict(DiarioIgiene.EVENTO_CHOICES)[form.cleaned_data["evento"]]
+        if nuovi:
+            messages.success(request, f"«{evento}» registrato per {len(nuovi)} ospiti.")
+        if doppioni:
+            nomi = ", ".join(f"{e.paziente.cognome} {e.paziente.nome}" for e in doppioni)
+            messages.warning(request, f"«{evento}» già registrato in quel giorno, non ripetuto per: {nomi}.")
+        return redirect("igiene_diario")
+
 class PrescrizioneCreateView(LoginRequiredMixin, View):
     template_name = "core/prescrizione_form.html"
     success_url = reverse_lazy("dashboard")
@@ -341,27 +550,31 @@ class PrescrizioneCreateView(LoginRequiredMixin, View):
         # Se invalidi, ripassa la mappa
         return render(request, self.template_name, self._ctx(p_form, fs))
         
-class PrescrizioniListaView(LoginRequiredMixin, View):
+class PrescrizioniListaView(LoginRequiredAsyncMixin, View):
     template_name = "core/prescrizioni_lista.html"
 
-    def get(self, request):
+    async def get(self, request):
         pid = request.GET.get("paziente")
-        paz_qs = Paziente.objects.all().order_by("cognome", "nome")
-        if pid:
-            paz_qs = paz_qs.filter(pk=pid)
-
         presc_qs = (
             Prescrizione.objects
-            .filter(paziente__in=paz_qs)
             .select_related("paziente", "medico")
             .prefetch_related("righe__farmaco", "righe__orari")
             .order_by("-attiva", "-data_inizio")
         )
+        if pid:
+            presc_qs = presc_qs.filter(paziente_id=pid)
+
+        # pazienti e prescrizioni (con i prefetch) in parallelo
+        pazienti, prescrizioni = await in_parallelo(
+            lambda: list(Paziente.objects.all().order_by("cognome", "nome")),
+            lambda: list(presc_qs),
+        )
+        paz_qs = [p for p in pazienti if str(p.pk) == pid] if pid else pazienti
 
         # raggruppo per paziente e preparo stringhe orari leggibili
         days_map = {"1":"Lun","2":"Mar","3":"Mer","4":"Gio","5":"Ven","6":"Sab","7":"Dom"}
         per_paz = defaultdict(list)
-        for pr in presc_qs:
+        for pr in prescrizioni:
             righe_pack = []
             for r in pr.righe.all():
                 orari_fmt = []
@@ -372,13 +585,13 @@ class PrescrizioniListaView(LoginRequiredMixin, View):
             per_paz[pr.paziente_id].append({"pr": pr, "righe": righe_pack})
 
         data = [{"paziente": p, "entries": per_paz.get(p.id, [])} for p in paz_qs]
-        ctx = {"data": data, "pazienti": Paziente.objects.all().order_by("cognome","nome"), "selected_id": pid}
-        return render(request, self.template_name, ctx)
+        ctx = {"data": data, "pazienti": pazienti, "selected_id": pid}
+        return await render_async(request, self.template_name, ctx)
 
-class DiarioIgieneView(LoginRequiredMixin, View):
+class DiarioIgieneView(LoginRequiredAsyncMixin, View):
     template_name = "core/igiene_diario.html"
 
-    def get(self, request):
+    async def get(self, request):
         pid = request.GET.get("paziente")
         settimana_str = request.GET.get("settimana")
 
@@ -392,36 +605,38 @@ class DiarioIgieneView(LoginRequiredMixin, View):
                 pass
         giorni = [lun + timedelta(days=i) for i in range(7)]
 
-        # queryset pazienti
+        # eventi di igiene della settimana, in un'unica query: (paziente, giorno) -> evento più recente
+        eventi = DiarioIgiene.objects.filter(rilevato_il__date__range=[giorni[0], giorni[-1]]).order_by("-rilevato_il")
         if pid:
-            paz_qs = Paziente.objects.filter(pk=pid)
-        else:
-            paz_qs = Paziente.objects.all().order_by("cognome","nome")
+            eventi = eventi.filter(paziente_id=pid)
 
-        # eventi di igiene della settimana
-        eventi = (
-            DiarioIgiene.objects
-            .filter(rilevato_il__date__range=[giorni[0], giorni[-1]])
-            .select_related("paziente")
+        # pazienti (una query, riusata anche per il filtro) ed eventi in parallelo
+        pazienti, eventi = await in_parallelo(
+            lambda: list(Paziente.objects.all().order_by("cognome","nome")),
+            lambda: list(eventi),
         )
+        paz_qs = [p for p in pazienti if str(p.pk) == pid] if pid else pazienti
+        per_giorno = {}
+        for ev in eventi:
+            per_giorno.setdefault((ev.paziente_id, timezone.localtime(ev.rilevato_il).date()), ev)
 
         # organizzo dati
         tabella = []
         for p in paz_qs:
             riga = {"paziente": p, "giorni": []}
             for g in giorni:
-                ev = eventi.filter(paziente=p, rilevato_il__date=g).first()
+                ev = per_giorno.get((p.pk, g))
                 riga["giorni"].append(ev.get_evento_display() if ev else "")
             tabella.append(riga)
 
         ctx = {
             "giorni": giorni,
             "tabella": tabella,
-            "pazienti": Paziente.objects.all().order_by("cognome","nome"),
+            "pazienti": pazienti,
             "selected_id": pid,
             "settimana": giorni[0],
         }
-        return render(request, self.template_name, ctx)
+        return await render_async(request, self.template_name, ctx)
         
 
 class SomministrazioneCreateView(LoginRequiredMixin, View):
@@ -435,20 +650,13 @@ class SomministrazioneCreateView(LoginRequiredMixin, View):
             initial["paziente"] = pid
         form = SomministrazioneForm(initial=initial, paziente_prefiltro=pid)
         pazienti = Paziente.objects.all().order_by("cognome","nome")
-
-        righe_meta = {
-            str(r.id): {
-                "dose": str(r.dose_val),
-                "udm": r.dose_udm,
-                "forma": r.farmaco.forma or "",
-            }
-            for r in form.fields["riga"].queryset.select_related("farmaco")
-        }
+        # stessi dati dell'endpoint usato dal JS al cambio paziente
+        righe_meta = {str(r["id"]): r for r in righe_attive(pid)} if pid and pid.isdigit() else {}
 
         return render(request, self.template_name, {
             "form": form,
             "pazienti": pazienti,
-            "righe_meta_json": json.dumps(righe_meta),
+            "righe_meta": righe_meta,
         })
 
     def post(self, request):
@@ -463,12 +671,48 @@ class SomministrazioneCreateView(LoginRequiredMixin, View):
             messages.success(request, "Somministrazione registrata.")
             return redirect(self.success_url)
         pazienti = Paziente.objects.all().order_by("cognome","nome")
-        return render(request, self.template_name, {"form": form, "pazienti": pazienti})
+        righe_meta = {str(r["id"]): r for r in righe_attive(pid)} if pid and pid.isdigit() else {}
+        return render(request, self.template_name, {"form": form, "pazienti": pazienti, "righe_meta": righe_meta})
 
-class DiarioSomministrazioniView(LoginRequiredMixin, View):
-    template_name = "core/terapia_diario.html"
+class SomministrazioneRigheView(LoginRequiredMixin, View):
+    """JSON: righe attive dell'ospite ?paziente=ID con dose, udm, forma e dose in programma (aggiornamento del form senza ricaricare)."""
+
+    def get(self, request):
+        pid = request.GET.get("paziente", "")
+        if not pid.isdigit():
+            return JsonResponse({"errore": "Parametro 'paziente' non valido."}, status=400)
+        return JsonResponse({"paziente": int(pid), "righe": righe_attive(int(pid))})
+
+class SincronizzazioneView(LoginRequiredMixin, View):
+    """
+    Voci registrate offline (somministrazioni, parametri, igiene).
+    GET → limiti del lotto (usato anche dal client per verificare la connessione);
+    POST JSON {"voci": [{"chiave": uuid, "tipo": ..., "dati": {...}}]} → un esito per voce.
+    """
 
     def get(self, request):
+        return JsonResponse({"max_voci": MAX_VOCI, "tipi": sorted(FORM_PER_TIPO)})
+
+    def post(self, request):
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"errori": ["JSON non valido."]}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({"errori": ["Atteso un oggetto con 'voci'."]}, status=400)
+        try:
+            esiti = sincronizza(payload.get("voci"), request.user)
+        except LottoNonValido as e:
+            return JsonResponse({"errori": [str(e)]}, status=400)
+        except IntegrityError:
+            # un invio concorrente con le stesse chiavi: al reinvio risulteranno duplicati
+            return JsonResponse({"errore": "Invio concorrente, riprovare."}, status=409)
+        return JsonResponse({"esiti": esiti})
+
+class DiarioSomministrazioniView(LoginRequiredAsyncMixin, View):
+    template_name = "core/terapia_diario.html"
+
+    async def get(self, request):
         pid = request.GET.get("paziente")
         settimana_str = request.GET.get("settimana")
 
@@ -482,16 +726,20 @@ class DiarioSomministrazioniView(LoginRequiredMixin, View):
                 pass
         giorni = [lun + timedelta(days=i) for i in range(7)]
 
-        # pazienti
-        paz_qs = Paziente.objects.all().order_by("cognome", "nome")
-        if pid:
-            paz_qs = paz_qs.filter(pk=pid)
-
         # somministrazioni della settimana
         somms = (Somministrazione.objects
                  .filter(data_ora__date__range=[giorni[0], giorni[-1]])
                  .select_related("paziente", "riga__farmaco")
                  .order_by("data_ora"))
+        if pid:
+            somms = somms.filter(paziente_id=pid)
+
+        # pazienti (riusati per il filtro) e somministrazioni in parallelo
+        pazienti, somms = await in_parallelo(
+            lambda: list(Paziente.objects.all().order_by("cognome", "nome")),
+            lambda: list(somms),
+        )
+        paz_qs = [p for p in pazienti if str(p.pk) == pid] if pid else pazienti
 
         # tabella: per paziente → per giorno → lista voci
         per_paz = {p.id: {g: [] for g in giorni} for p in paz_qs}
@@ -511,16 +759,16 @@ class DiarioSomministrazioniView(LoginRequiredMixin, View):
         ctx = {
             "giorni": giorni,
             "tabella": tabella,
-            "pazienti": Paziente.objects.all().order_by("cognome", "nome"),
+            "pazienti": pazienti,
             "selected_id": pid,
             "settimana": giorni[0],
         }
-        return render(request, self.template_name, ctx)
+        return await render_async(request, self.template_name, ctx)
         
-class DiarioParametriView(LoginRequiredMixin, View):
+class DiarioParametriView(LoginRequiredAsyncMixin, View):
     template_name = "core/parametri_diario.html"
 
-    def get(self, request):
+    async def get(self, request):
         pid = request.GET.get("paziente")
         giorno_str = request.GET.get("giorno")
         oggi = timezone.localdate()
@@ -529,23 +777,27 @@ class DiarioParametriView(LoginRequiredMixin, View):
         except Exception:
             giorno = oggi
 
-        pazienti = Paziente.objects.all().order_by("cognome", "nome")
-
         if pid:  # modalità singolo paziente
-            selezionato = pazienti.filter(pk=pid).first()
             rows = (ParametroVitale.objects
-                    .filter(paziente=selezionato, rilevato_il__date=giorno)
+                    .filter(paziente_id=pid, rilevato_il__date=giorno)
                     .select_related("operatore")
-                    .order_by("rilevato_il")) if selezionato else []
+                    .order_by("rilevato_il"))
             all_mode = False
         else:    # modalità "Tutti"
-            selezionato = None
             rows = (ParametroVitale.objects
                     .filter(rilevato_il__date=giorno)
                     .select_related("paziente", "operatore")
                     .order_by("paziente__cognome", "paziente__nome", "rilevato_il"))
             all_mode = True
 
+        pazienti, rows = await in_parallelo(
+            lambda: list(Paziente.objects.all().order_by("cognome", "nome")),
+            lambda: list(rows),
+        )
+        selezionato = next((p for p in pazienti if str(p.pk) == pid), None) if pid else None
+        if pid and not selezionato:
+            rows = []
+
         ctx = {
             "pazienti": pazienti,
             "selected_id": pid,
@@ -554,32 +806,44 @@ class DiarioParametriView(LoginRequiredMixin, View):
             "paziente": selezionato,
             "all_mode": all_mode,
         }
-        return render(request, self.template_name, ctx)
+        return await render_async(request, self.template_name, ctx)
     
-def paziente_anagrafica(request):
-    pazienti = Paziente.objects.all().order_by("cognome", "nome")
+async def paziente_anagrafica(request):
     p_id = request.GET.get("p")
 
     paziente = None
     contatti = allergie = episodi = prescrizioni = documenti = []
 
     if p_id:
-        paziente = get_object_or_404(Paziente, pk=p_id)
-
-        contatti = paziente.contatti_emergenza.prefetch_related("recapiti").order_by("-is_primario", "cognome", "nome")
-        allergie = paziente.allergie.all().order_by("-attiva", "categoria", "gravita")
-        episodi = paziente.episodi.select_related("medico", "letto").all()
-        prescrizioni = (
-            paziente.prescrizioni
-            .prefetch_related("righe", "righe__farmaco")
-            .select_related("medico")
-            .all()
-        )
-        documenti = (
-            paziente.documenti
-            .select_related("episodio", "caricato_da")
-            .order_by("-id")
+        # le sezioni della scheda sono indipendenti: tutte in parallelo, filtrate per id
+        (pazienti, trovati, contatti, allergie, episodi, prescrizioni, documenti) = await in_parallelo(
+            lambda: list(Paziente.objects.all().order_by("cognome", "nome")),
+            lambda: list(Paziente.objects.filter(pk=p_id)),
+            lambda: list(
+                ContattoEmergenza.objects.filter(paziente_id=p_id)
+                .prefetch_related("recapiti").order_by("-is_primario", "cognome", "nome")
+            ),
+            lambda: list(
+                Allergia.objects.filter(paziente_id=p_id)
+                .select_related("farmaco").order_by("-attiva", "categoria", "gravita")
+            ),
+            lambda: list(Episodio.objects.filter(paziente_id=p_id).select_related("medico", "letto__stanza")),
+            lambda: list(
+                Prescrizione.objects.filter(paziente_id=p_id)
+                .prefetch_related("righe", "righe__farmaco")
+                .select_related("medico")
+            ),
+            lambda: list(
+                Documento.objects.filter(paziente_id=p_id)
+                .select_related("episodio", "caricato_da")
+                .order_by("-id")
+            ),
         )
+        if not trovati:
+            raise Http404("Paziente inesistente.")
+        paziente = trovati[0]
+    else:
+        pazienti = await sync_to_async(list)(Paziente.objects.all().order_by("cognome", "nome"))
 
     ctx = {
         "pazienti": pazienti,
@@ -590,7 +854,7 @@ def paziente_anagrafica(request):
         "prescrizioni": prescrizioni,
         "documenti": documenti,
     }
-    return render(request, "core/paziente_anagrafica.html", ctx)
+    return await render_async(request, "core/paziente_anagrafica.html", ctx)
 
 class MenuDiarioView(TemplateView):
     template_name = "core/menu_diario.html"
@@ -607,99 +871,61 @@ class MenuDiarioView(TemplateView):
         settimana_iso = form.cleaned_data.get("settimana_iso")
         q = (form.cleaned_data.get("q") or "").strip()
 
-        # Intervallo base
-        d_start, d_end = periodo.data_inizio, periodo.data_fine
-        if giorno:
-            d_start = d_end = giorno
-
-        # Giorni del periodo, filtrati eventualmente per settimana ISO
-        dates, d = [], d_start
-        while d <= d_end:
-            if not settimana_iso or d.isocalendar().week == settimana_iso:
-                dates.append(d)
-            d += timedelta(days=1)
-        if not dates:
-            ctx.update({"periodo": periodo, "weeks": []})
-            return self.render_to_response(ctx)
-
-        # Righe fisse: 4 pasti (come richiesto)
-        row_order = [Pasto.COLAZ, Pasto.MEREN, Pasto.PRANZ, Pasto.CENA]
-        rows = [{"code": code, "label": dict(Pasto.choices)[code]} for code in row_order]
-        if pasto_filter:
-            rows = [r for r in rows if r["code"] == pasto_filter]
+        # Griglia del periodo dalla cache; i filtri sono viste sulla griglia
+        weeks = settimane_menu(
+            periodo, pasto=pasto_filter, giorno=giorno, settimana_iso=settimana_iso, q=q
+        )
 
-        # Query pasti del periodo
-        qp = Q(periodo=periodo, data__in=dates)
-        if pasto_filter:
-            qp &= Q(pasto=pasto_filter)
+        ctx.update({"form": form, "periodo": periodo, "weeks": weeks})
+        return self.render_to_response(ctx)
 
-        voci_prefetch = Prefetch(
-            "voci",
-            queryset=VoceMenu.objects.select_related("pietanza").order_by("ordine", "id")
-        )
-        pasti = (
-            MenuPasto.objects
-            .filter(qp)
-            .select_related("periodo")
-            .prefetch_related(voci_prefetch)
-            .order_by("data", "pasto")
-        )
+class MenuSettimanaEditorView(LoginRequiredMixin, View):
+    """
+    Editor a griglia di una settimana di menu.
+    GET ?settimana=AAAA-MM-GG → celle con voci e versione;
+    POST JSON {"settimana": ..., "celle": [...]} → patch applicata in blocco.
+    """
+
+    def _lunedi(self, raw, periodo):
+        """Lunedì della settimana indicata (assente: la prima del periodo); ValueError se non è una data."""
+        if not raw:
+            return lunedi_di(periodo.data_inizio)
+        giorno = parse_date(raw)
+        if giorno is None:
+            raise ValueError(raw)
+        return lunedi_di(giorno)
 
-        # Ricerca testuale su voci (nome/tag/allergeni/descrizione)
-        if q:
-            ql = q.lower()
-            def match(pm: MenuPasto):
-                for v in pm.voci.all():
-                    testo = (v.descrizione_libera or "")
-                    if v.pietanza:
-                        testo += " " + v.pietanza.nome + " " + (v.pietanza.tag_dieta or "") + " " + (v.pietanza.allergeni_note or "")
-                    if ql in testo.lower():
-                        return True
-                return False
-            pasti = [p for p in pasti if match(p)]
-
-        # Griglia: (data, pasto_code) -> { id, items[list], note }
-        grid = {}
-        for p in pasti:
-            items = []
-            for v in p.voci.all():
-                if v.pietanza:
-                    label = v.pietanza.nome
-                    if v.descrizione_libera:
-                        label += f" – {v.descrizione_libera}"
-                else:
-                    label = v.descrizione_libera
-                if v.note:
-                    label += f" ({v.note})"
-                items.append(label)
-            grid[(p.data, p.pasto)] = {"id": p.id, "items": items, "note": p.note}
-
-        # Spezza per settimane ISO
-        weeks, curw, chunk = [], None, []
-        for d in dates:
-            w = d.isocalendar().week
-            if curw is None:
-                curw = w
-            if w != curw:
-                weeks.append({"iso_week": curw, "dates": chunk})
-                curw, chunk = w, []
-            chunk.append(d)
-        if chunk:
-            weeks.append({"iso_week": curw, "dates": chunk})
+    def get(self, request, pk):
+        periodo = get_object_or_404(MenuPeriodo, pk=pk)
+        try:
+            lunedi = self._lunedi(request.GET.get("settimana"), periodo)
+        except ValueError:
+            return JsonResponse({"errori": ["settimana: data non valida."]}, status=400)
+        return JsonResponse(stato_settimana(periodo, lunedi))
 
-        # Per ogni settimana crea la tabella (righe pasti × colonne giorni)
-        for wk in weeks:
-            wk_table = []
-            for r in rows:
-                cells = []
-                for d in wk["dates"]:
-                    cell = grid.get((d, r["code"]))  # None oppure {id,items,note}
-                    cells.append({"cell": cell, "date": d, "pasto_code": r["code"]})
-                wk_table.append({"row": r, "cells": cells})
-            wk["table"] = wk_table
+    def post(self, request, pk):
+        periodo = get_object_or_404(MenuPeriodo, pk=pk)
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"errori": ["JSON non valido."]}, status=400)
+        if not isinstance(payload, dict) or not payload.get("settimana"):
+            return JsonResponse({"errori": ["settimana: obbligatoria."]}, status=400)
+        try:
+            lunedi = self._lunedi(str(payload["settimana"]), periodo)
+        except ValueError:
+            return JsonResponse({"errori": ["settimana: data non valida."]}, status=400)
 
-        ctx.update({"form": form, "periodo": periodo, "weeks": weeks})
-        return self.render_to_response(ctx)
+        try:
+            esito = applica_patch_settimana(periodo, lunedi, payload.get("celle"), utente=request.user)
+        except ValidationError as e:
+            return JsonResponse({"errori": e.messages}, status=400)
+        except ConflittoVersione as e:
+            return JsonResponse({"errore": str(e), "conflitti": e.celle}, status=409)
+        except IntegrityError:
+            # due editor hanno creato lo stesso pasto nello stesso istante
+            return JsonResponse({"errore": "Il menu è stato modificato da un altro utente."}, status=409)
+        return JsonResponse(esito)
 
 class TurniDiarioView(TemplateView):
     template_name = "core/turni_diario.html"
@@ -831,28 +1057,40 @@ class PianoTurniPeriodoCreateView(CreateView):
 class TurniPeriodoGestisciView(View):
     template_name = "core/turni_periodo_gestisci.html"
 
-    def get(self, request, pk):
-        periodo = get_object_or_404(PianoTurniPeriodo, pk=pk)
-        form = AssegnazioneTurnoForm(periodo=periodo)
+    def _render(self, request, periodo, form, rotazione=None, anteprima=None, pianificazione=None):
         assegnazioni = (AssegnazioneTurno.objects
                         .filter(periodo=periodo)
                         .select_related("turno", "dipendente")
                         .order_by("data", "turno__ordine", "dipendente__cognome"))
-
         dipendenti = Dipendente.objects.filter(attivo=True).order_by("cognome", "nome")
-        turni = TurnoTipo.objects.order_by("ordine")
+        turni = list(TurnoTipo.objects.order_by("ordine"))
+        # selezioni della rotazione (ripresentate dopo l'anteprima)
+        rotazione = rotazione or {}
+        ops = rotazione.get("ops") or [None] * len(turni)
         return render(request, self.template_name, {
             "periodo": periodo, "form": form, "assegnazioni": assegnazioni,
             "dipendenti": dipendenti, "turni": turni,
+            "turni_sel": list(zip(turni, ops)),
+            "rotazione": rotazione, "anteprima": anteprima,
+            "pianificazione": pianificazione,
         })
 
+    def get(self, request, pk):
+        periodo = get_object_or_404(PianoTurniPeriodo, pk=pk)
+        form = AssegnazioneTurnoForm(periodo=periodo)
+        return self._render(request, periodo, form)
+
     def post(self, request, pk):
         periodo = get_object_or_404(PianoTurniPeriodo, pk=pk)
 
-        # --- azione: rotazione automatica ---
+        # --- azione: rotazione automatica (o sua anteprima) ---
         if "auto_fill" in request.POST:
             return self._auto_fill(request, periodo)
 
+        # --- azione: pianificazione a vincoli (fabbisogni, assenze, riposi) ---
+        if "pianifica" in request.POST:
+            return self._pianifica(request, periodo)
+
         # --- azione: inserimento singolo turno ---
         form = AssegnazioneTurnoForm(request.POST, periodo=periodo)
         if form.is_valid():
@@ -862,68 +1100,141 @@ class TurniPeriodoGestisciView(View):
             messages.success(request, "Turno inserito.")
             return redirect("turni_periodo_gestisci", pk=periodo.pk)
 
-        assegnazioni = (AssegnazioneTurno.objects
-                        .filter(periodo=periodo)
-                        .select_related("turno", "dipendente")
-                        .order_by("data", "turno__ordine", "dipendente__cognome"))
-        dipendenti = Dipendente.objects.filter(attivo=True).order_by("cognome", "nome")
-        turni = TurnoTipo.objects.order_by("ordine")
-        return render(request, self.template_name, {
-            "periodo": periodo, "form": form, "assegnazioni": assegnazioni,
-            "dipendenti": dipendenti, "turni": turni,
-        })
+        return self._render(request, periodo, form)
 
     def _auto_fill(self, request, periodo):
         # data di partenza (default = inizio periodo)
-        start = parse_date(request.POST.get("start_date")) or periodo.data_inizio
+        start = parse_date(request.POST.get("start_date") or "") or periodo.data_inizio
         overwrite = bool(request.POST.get("overwrite"))
+        dry_run = "anteprima" in request.POST
 
         turni = list(TurnoTipo.objects.order_by("ordine"))
         n = len(turni)  # es. 4: Mattina, Pomeriggio, Notte, Riposo
 
-        # dipendenti scelti nell'ordine del giorno iniziale (Mattina..Riposo)
+        # dipendenti scelti nell'ordine del giorno iniziale (Mattina..Riposo), in una query
         dip_ids = [request.POST.get(f"op{i}") for i in range(1, n + 1)]
-        dips = [Dipendente.objects.get(pk=pk) for pk in dip_ids if pk]
+        trovati = Dipendente.objects.in_bulk([pk for pk in dip_ids if pk and pk.isdigit()])
+        dips = [trovati.get(int(pk)) for pk in dip_ids if pk and pk.isdigit()]
 
-        if len(dips) != n:
+        if n == 0 or len(dips) != n or None in dips:
             messages.error(request, "Seleziona un dipendente per ogni turno del giorno iniziale.")
             return redirect("turni_periodo_gestisci", pk=periodo.pk)
+        if len({d.pk for d in dips}) != n:
+            messages.error(request, "Lo stesso dipendente è selezionato su più turni.")
+            return redirect("turni_periodo_gestisci", pk=periodo.pk)
 
-        created, updated, skipped = 0, 0, 0
-        day = start
-        while day <= periodo.data_fine:
-            day_offset = (day - start).days  # 0,1,2,...
-            # mappatura: indice turno i → dipendente dips[(i - day_offset) % n]
-            for i, turno in enumerate(turni):
-                dip = dips[(i - day_offset) % n]
-
-                # gestisci eventuali collisioni
-                qs = AssegnazioneTurno.objects.filter(periodo=periodo, data=day, dipendente=dip)
-                if qs.exists():
-                    if not overwrite:
-                        skipped += 1
-                        continue
-                    qs.delete()
-
-                obj, created_flag = AssegnazioneTurno.objects.get_or_create(
-                    periodo=periodo, data=day, dipendente=dip,
-                    defaults={"turno": turno}
-                )
-                if created_flag:
-                    created += 1
-                else:
-                    if obj.turno_id != turno.id:
-                        obj.turno = turno
-                        obj.save(update_fields=["turno"])
-                        updated += 1
-            day += timedelta(days=1)
+        piano = piano_rotazione(turni, dips, start, periodo.data_fine)
+        esito = applica_piano(periodo, piano, overwrite=overwrite, dry_run=dry_run, utente=request.user)
+
+        if dry_run:
+            rotazione = {"start_date": start, "ops": dip_ids, "overwrite": overwrite}
+            return self._render(request, periodo, AssegnazioneTurnoForm(periodo=periodo),
+                                rotazione=rotazione, anteprima=esito)
 
         messages.success(
             request,
-            f"Rotazione completata: {created} nuove, {updated} aggiornate, {skipped} saltate."
+            f"Rotazione completata: {esito['creati']} nuove, {esito['aggiornati']} aggiornate, "
+            f"{esito['saltati']} saltate, {esito['invariati']} già presenti."
         )
+        self._avvisa_conflitti(request, esito)
         return redirect("turni_periodo_gestisci", pk=periodo.pk)
-        
+
+    def _avvisa_conflitti(self, request, esito):
+        if esito["conflitti"]:
+            messages.warning(
+                request,
+                f"{len(esito['conflitti'])} turni non inseriti per conflitti con altre assegnazioni "
+                f"(doppio turno o riposo insufficiente, anche in altri periodi)."
+            )
+
+    def _pianifica(self, request, periodo):
+        overwrite = bool(request.POST.get("overwrite"))
+        dry_run = "anteprima" in request.POST
+
+        piano, scoperti = pianifica_periodo(periodo, overwrite=overwrite)
+        if not piano:
+            messages.error(request, "Nessun fabbisogno minimo definito o nessun dipendente disponibile.")
+            return redirect("turni_periodo_gestisci", pk=periodo.pk)
+        esito = applica_piano(periodo, piano, overwrite=overwrite, dry_run=dry_run, utente=request.user)
+
+        if dry_run:
+            pianificazione = {"overwrite": overwrite, "esito": esito, "scoperti": scoperti}
+            return self._render(request, periodo, AssegnazioneTurnoForm(periodo=periodo),
+                                pianificazione=pianificazione)
+
+        messages.success(
+            request,
+            f"Pianificazione completata: {esito['creati']} nuove, {esito['aggiornati']} aggiornate, "
+            f"{esito['eliminati']} eliminate, {esito['invariati']} già presenti."
+        )
+        if scoperti:
+            messages.warning(request, f"Coperture minime non raggiunte in {len(scoperti)} turni.")
+        self._avvisa_conflitti(request, esito)
+        return redirect("turni_periodo_gestisci", pk=periodo.pk)
+
+class TurniCoperturaView(LoginRequiredMixin, View):
+    template_name = "core/turni_copertura.html"
+
+    def get(self, request, pk):
+        periodo = get_object_or_404(PianoTurniPeriodo, pk=pk)
+        return render(request, self.template_name, {"periodo": periodo, "copertura": copertura_periodo(periodo)})
+
+class TurniInServizioView(LoginRequiredMixin, View):
+    """JSON: personale in servizio adesso (o a ?quando=YYYY-MM-DDTHH:MM)."""
+
+    def get(self, request):
+        quando = None
+        if request.GET.get("quando"):
+            quando = parse_datetime(request.GET["quando"])
+            if quando is None:
+                return JsonResponse({"errore": "Parametro 'quando' non valido."}, status=400)
+            if timezone.is_naive(quando):
+                quando = timezone.make_aware(quando)
+        quando = timezone.localtime(quando) if quando else timezone.localtime()
+
+        assegnazioni = in_servizio(quando)
+        return JsonResponse({
+            "quando": quando.isoformat(),
+            "in_servizio": [
+                {
+                    "data_turno": a.data.isoformat(),
+                    "turno": a.turno.codice,
+                    "turno_nome": a.turno.nome,
+                    "ora_inizio": a.turno.ora_inizio.strftime("%H:%M"),
+                    "ora_fine": a.turno.ora_fine.strftime("%H:%M"),
+                    "dipendente_id": a.dipendente_id,
+                    "dipendente": f"{a.dipendente.cognome} {a.dipendente.nome}",
+                    "ruolo": a.dipendente.ruolo,
+                }
+                for a in assegnazioni
+            ],
+        })
+
+def _calendario_stato(request, token):
+    # calcolato una volta per richiesta: lo usano sia l'ETag sia la view
+    if not hasattr(request, "_calendario_stato"):
+        dip = Dipendente.objects.filter(token_calendario=token, attivo=True).first()
+        request._calendario_stato = (dip, stato_calendario(dip)) if dip else (None, None)
+    return request._calendario_stato
+
+def _calendario_etag(request, token):
+    return _calendario_stato(request, token)[1]
+
+# solo ETag: con Last-Modified un If-Modified-Since darebbe 304 anche dopo una cancellazione
+@method_decorator(condition(etag_func=_calendario_etag), name="get")
+class CalendarioDipendenteView(View):
+    """Feed iCalendar pubblico (link con token) dei turni del dipendente; 304 se invariato."""
+
+    def get(self, request, token):
+        dip = _calendario_stato(request, token)[0]
+        if dip is None:
+            raise Http404("Calendario non trovato.")
+        resp = HttpResponse(calendario_ics(dip, dominio=request.get_host().split(":")[0]),
+                            content_type="text/calendar; charset=utf-8")
+        resp["Content-Disposition"] = 'inline; filename="turni.ics"'
+        patch_cache_control(resp, private=True, no_cache=True)
+        return resp
+
 class TurniPeriodoSelezionaView(View):
     template_name = "core/turni_periodo_seleziona.html"
 
@@ -973,80 +1284,8 @@ class PietanzaCreateView(CreateView):
         return resp        
         
 def build_menu_weeks(periodo, pasto_filter=None):
-    # intervallo date (tutto il periodo)
-    d_start, d_end = periodo.data_inizio, periodo.data_fine
-
-    dates, d = [], d_start
-    while d <= d_end:
-        dates.append(d)
-        d += timedelta(days=1)
-    if not dates:
-        return []
-
-    # righe fisse
-    row_order = [Pasto.COLAZ, Pasto.MEREN, Pasto.PRANZ, Pasto.CENA]
-    rows = [{"code": code, "label": dict(Pasto.choices)[code]} for code in row_order]
-    if pasto_filter:
-        rows = [r for r in rows if r["code"] == pasto_filter]
-
-    # query pasti
-    qp = Q(periodo=periodo, data__in=dates)
-    if pasto_filter:
-        qp &= Q(pasto=pasto_filter)
-
-    voci_prefetch = Prefetch(
-        "voci",
-        queryset=VoceMenu.objects.select_related("pietanza").order_by("ordine", "id")
-    )
-    pasti = (
-        MenuPasto.objects
-        .filter(qp)
-        .select_related("periodo")
-        .prefetch_related(voci_prefetch)
-        .order_by("data", "pasto")
-    )
-
-    # griglia (data, pasto_code) -> cella
-    grid = {}
-    for p in pasti:
-        items = []
-        for v in p.voci.all():
-            if v.pietanza:
-                label = v.pietanza.nome
-                if v.descrizione_libera:
-                    label += f" – {v.descrizione_libera}"
-            else:
-                label = v.descrizione_libera
-            if v.note:
-                label += f" ({v.note})"
-            items.append(label)
-        grid[(p.data, p.pasto)] = {"id": p.id, "items": items, "note": p.note}
-
-    # spezza in settimane ISO
-    weeks, curw, chunk = [], None, []
-    for d in dates:
-        w = d.isocalendar().week
-        if curw is None:
-            curw = w
-        if w != curw:
-            weeks.append({"iso_week": curw, "dates": chunk})
-            curw, chunk = w, []
-        chunk.append(d)
-    if chunk:
-        weeks.append({"iso_week": curw, "dates": chunk})
-
-    # tabella per ciascuna settimana
-    for wk in weeks:
-        wk_table = []
-        for r in rows:
-            cells = []
-            for d in wk["dates"]:
-                cell = grid.get((d, r["code"]))  # None oppure {id,items,note}
-                cells.append({"cell": cell, "date": d, "pasto_code": r["code"]})
-            wk_table.append({"row": r, "cells": cells})
-        wk["table"] = wk_table
-
-    return weeks
+    # tutto il periodo, dalla griglia in cache
+    return settimane_menu(periodo, pasto=pasto_filter)
 
 class ReportMenuPeriodoSelectView(FormView):
     template_name = "core/report_menu_periodo_select.html"
@@ -1062,4 +1301,129 @@ class ReportMenuPeriodoPrintView(View):
         periodo = get_object_or_404(MenuPeriodo, pk=pk)
         weeks = build_menu_weeks(periodo)
         ctx = {"periodo": periodo, "weeks": weeks}
-        return render(request, self.template_name, ctx)
\ No newline at end of file
+        return render(request, self.template_name, ctx)
+def _ore(minuti):
+    return f"{minuti / 60:.2f}".replace(".", ",")
+
+class ExportOreMensiliCsvView(LoginRequiredMixin, View):
+    """CSV paghe in streaming (memoria costante): ?mese=YYYY-MM oppure ?da=YYYY-MM&a=YYYY-MM."""
+
+    def _mese(self, valore):
+        if not valore:
+            return None
+        mese = parse_date(f"{valore}-01")  # ValueError per mesi inesistenti (2025-13), None se malformato
+        if mese is None:
+            raise ValueError(valore)
+        return mese
+
+    def get(self, request):
+        oggi = timezone.localdate().replace(day=1)
+        try:
+            mese_da = self._mese(request.GET.get("da") or request.GET.get("mese")) or oggi
+            mese_a = self._mese(request.GET.get("a") or request.GET.get("mese")) or mese_da
+        except ValueError:
+            return JsonResponse({"errore": "Mese non valido: atteso YYYY-MM."}, status=400)
+
+        righe = (
+            OreMensili.objects
+            .filter(mese__range=[mese_da, mese_a])
+            .order_by("mese", "dipendente__cognome", "dipendente__nome", "dipendente_id")
+            .values_list(
+                "mese", "dipendente_id", "dipendente__cognome", "dipendente__nome", "dipendente__ruolo", "turni",
+                "minuti_lavorati", "minuti_notturni", "minuti_festivi", "minuti_contratto", "minuti_straordinari",
+            )
+            .iterator(chunk_size=2000)
+        )
+
+        def genera():
+            w = csv.writer(Eco(), delimiter=";")
+            yield "\ufeff"  # BOM per Excel
+            yield w.writerow(["Mese", "Matricola", "Cognome", "Nome", "Ruolo", "Turni", "Ore lavorate",
+                              "Ore notturne", "Ore festive", "Ore contratto", "Ore straordinarie"])
+            for mese, dip_id, cognome, nome, ruolo, turni, lav, notte, fest, contr, straord in righe:
+                yield w.writerow([f"{mese:%Y-%m}", dip_id, cognome, nome, ruolo, turni,
+                                  _ore(lav), _ore(notte), _ore(fest), _ore(contr), _ore(straord)])
+
+        resp = streaming_per_asgi(request, StreamingHttpResponse(genera(), content_type="text/csv; charset=utf-8"))
+        nome = f"ore_{mese_da:%Y-%m}" + (f"_{mese_a:%Y-%m}" if mese_a != mese_da else "")
+        resp["Content-Disposition"] = f'attachment; filename="{nome}.csv"'
+        return resp
+
+class ReportDiariView(LoginRequiredMixin, View):
+    """Scelta di diario, ospite e periodo per l'export (verifiche ASL)."""
+    template_name = "core/report_diari.html"
+
+    def get(self, request):
+        if "diario" not in request.GET:
+            return render(request, self.template_name, {"form": ExportDiarioForm()})
+        form = ExportDiarioForm(request.GET)
+        if not form.is_valid():
+            return render(request, self.template_name, {"form": form})
+        dati = form.cleaned_data
+        query = {"dal": dati["dal"].isoformat(), "al": dati["al"].isoformat()}
+        if dati["paziente"]:
+            query["paziente"] = dati["paziente"].pk
+        url = reverse("export_diario", kwargs={"diario": dati["diario"], "formato": dati["formato"]})
+        return redirect(f"{url}?{urlencode(query)}")
+
+class ExportDiarioView(LoginRequiredMixin, View):
+    """Diario igiene/parametri/somministrazioni in CSV o XLSX, in streaming: ?dal=&al=&paziente= (predefinito il mese corrente)."""
+
+    def get(self, request, diario, formato):
+        form = ExportDiarioForm({**request.GET.dict(), "diario": diario, "formato": formato})
+        if not form.is_valid():
+            return JsonResponse({"errori": form.errors.get_json_data()}, status=400)
+        dati = form.cleaned_data
+        d = DIARI[diario]
+        righe = d.righe(dati["dal"], dati["al"], paziente_id=dati["paziente"] and dati["paziente"].pk)
+        nome = f"{diario}_{dati['dal']:%Y%m%d}_{dati['al']:%Y%m%d}"
+        if dati["paziente"]:
+            nome += f"_{dati['paziente'].cognome}"
+        if formato == "csv":
+            resp = StreamingHttpResponse(csv_in_streaming(d.intestazioni, righe), content_type="text/csv; charset=utf-8")
+        else:
+            resp = StreamingHttpResponse(
+                xlsx_in_streaming(d.titolo, d.intestazioni, righe),
+                content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+        resp["Content-Disposition"] = f'attachment; filename="{slugify(nome)}.{formato}"'
+        return streaming_per_asgi(request, resp)
+
+class ReportCensimentoView(LoginRequiredMixin, TemplateView):
+    """Giornate di degenza per mese e provenienza (fatturazione ASL)."""
+    template_name = "core/report_censimento.html"
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        oggi = timezone.localdate()
+        anno = self.request.GET.get("anno")
+        anno = int(anno) if anno and anno.isdigit() else oggi.year
+        anno = min(max(anno, 1), 9998)  # date() e i filtri per anno non vanno oltre
+        totali = giornate_mensili(anno)
+        provenienze = PROVENIENZA
+        righe = []
+        for m in range(1, 13):
+            mese = date(anno, m, 1)
+            valori = [totali.get((mese, codice), 0) for codice, _ in provenienze]
+            righe.append({"mese": mese, "valori": valori, "totale": sum(valori)})
+        ctx.update({
+            "anno": anno, "provenienze": provenienze, "righe": righe,
+            "totali": [sum(r["valori"][i] for r in righe) for i in range(len(provenienze))],
+            "totale": sum(totali.values()),
+        })
+        return ctx
+
+class ListaSpesaPeriodoView(LoginRequiredMixin, View):
+    template_name = "core/report_lista_spesa.html"
+
+    def get(self, request, pk):
+        periodo = get_object_or_404(MenuPeriodo, pk=pk)
+        dati = lista_spesa(periodo)
+        presenze = dati["porzioni_giorno"]
+        ctx = {
+            "periodo": periodo,
+            "righe": dati["righe"],
+            "porzioni_totali": sum(presenze.values()),
+            "giorni": len(presenze),
+        }
+        return render(request, self.template_name, ctx)
@@ -93,10 +93,13 @@ JAZZMIN_UI_TWEAKS = {
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "core.middleware.BudgetSQLMiddleware",  # attivo solo con SQL_BUDGET_ATTIVO
+    "core.db_router.ReplicaLetturaMiddleware",  # attivo solo con DATABASE_REPLICA_URL
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    "core.audit.AuditMiddleware",  # utente delle voci del registro modifiche
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -127,7 +130,55 @@ DATABASES = {
         "DATABASE_URL",  
     )
 }
-
+# Replica in sola lettura (facoltativa) per diari, report ed export: vedi core/db_router.py.
+# In locale basta un secondo database, es. DATABASE_REPLICA_URL=sqlite:////tmp/replica.sqlite3
+if env("DATABASE_REPLICA_URL", default=""):
+    DATABASES["replica"] = env.db("DATABASE_REPLICA_URL")
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+    DATABASE_ROUTERS = ["core.db_router.ReplicaRouter"]
+DB_REPLICA_STICKY_S = env.int("DB_REPLICA_STICKY_S", default=15)  # dopo una scrittura si legge dal primario
+
+# Connessioni PostgreSQL: pool psycopg3 (DB_POOL=True, richiede psycopg[pool]) oppure connessioni
+# persistenti per worker; in entrambi i casi con verifica della connessione prima dell'uso.
+for _db in DATABASES.values():
+    if _db["ENGINE"] != "django.db.backends.postgresql":
+        continue
+    if env.bool("DB_POOL", default=False):
+        from psycopg_pool import ConnectionPool
+
+        _db.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": env.int("DB_POOL_MIN", default=2),
+            "max_size": env.int("DB_POOL_MAX", default=10),
+            "timeout": env.float("DB_POOL_TIMEOUT", default=10),     # attesa massima di una connessione libera
+            "max_idle": env.float("DB_POOL_MAX_IDLE", default=300),  # chiude le connessioni inattive
+            "max_lifetime": env.float("DB_POOL_MAX_LIFETIME", default=1800),
+            "check": ConnectionPool.check_connection,                # health check alla consegna
+        }
+        _db["CONN_MAX_AGE"] = 0  # obbligatorio con il pool
+    else:
+        _db["CONN_MAX_AGE"] = env.int("DB_CONN_MAX_AGE", default=60)
+        _db["CONN_HEALTH_CHECKS"] = True
+
+
+# Cache a due livelli (core/cache.py): LRU per processo davanti alla cache condivisa.
+# La condivisa è su file di default; CACHE_URL=redis://host:6379/0 usa Redis (richiede il pacchetto redis),
+# CACHE_URL=locmemcache:// una cache in memoria del solo processo (sviluppo).
+_cache_url = env("CACHE_URL", default=f"filecache://{BASE_DIR / '.cache'}")
+CACHES = {
+    "default": {
+        "BACKEND": "core.cache.CacheLivelli",
+        "OPTIONS": {
+            "CONDIVISA": "condivisa",
+            "MAX_VOCI": env.int("CACHE_LOCALE_MAX_VOCI", default=1000),
+            "TTL_LOCALE": env.float("CACHE_LOCALE_TTL", default=5),  # ritardo massimo tra worker per le chiavi non versionate
+            "METRICHE_OGNI": env.int("CACHE_METRICHE_OGNI", default=0),  # log "core.cache" ogni N letture
+        },
+    },
+    "condivisa": env.cache_url_config(
+        _cache_url,
+        backend="django.core.cache.backends.redis.RedisCache" if _cache_url.startswith("redis") else None,
+    ),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -181,4 +232,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = "dashboard"   # dove atterrare dopo il login
 LOGOUT_REDIRECT_URL = "login"      # dopo il logout
-LOGIN_URL = "login"
\ No newline at end of file
+LOGIN_URL = "login"
+# --- Strumentazione SQL per richiesta (core.middleware.BudgetSQLMiddleware) ---
+SQL_BUDGET_ATTIVO = env.bool("SQL_BUDGET_ATTIVO", default=False)
+SQL_BUDGET_HEADER = env.bool("SQL_BUDGET_HEADER", default=DEBUG)      # header X-SQL-Budget
+SQL_BUDGET_EXPLAIN_MS = env.int("SQL_BUDGET_EXPLAIN_MS", default=50)  # EXPLAIN della query più lenta oltre questa soglia
+
+# --- Registro modifiche dei dati clinici (core.audit), scritto a lotti da un thread per processo ---
+AUDIT_FLUSH_S = env.float("AUDIT_FLUSH_S", default=2)          # intervallo massimo tra due scritture
+AUDIT_BATCH = env.int("AUDIT_BATCH", default=500)              # scrittura anticipata a buffer pieno
+AUDIT_MAX_BUFFER = env.int("AUDIT_MAX_BUFFER", default=50000)  # voci trattenute se il DB non risponde
+AUDIT_THREAD = env.bool("AUDIT_THREAD", default=True)          # False: scrittura nella richiesta che riempie il lotto
+
+# --- Export FHIR in blocco (core.esportazione_fhir), eseguito dal worker "manage.py esporta_fhir --continuo" ---
+FHIR_EXPORT_DIR = env("FHIR_EXPORT_DIR", default=str(BASE_DIR / "export_fhir"))  # fuori da MEDIA_ROOT: si scarica solo autenticati
+FHIR_EXPORT_PROCESSI = env.int("FHIR_EXPORT_PROCESSI", default=0)          # processi di serializzazione (0: uno per CPU)
+FHIR_EXPORT_SCADENZA_ORE = env.int("FHIR_EXPORT_SCADENZA_ORE", default=24)  # poi job e file vengono eliminati
+FHIR_EXPORT_BATTITO_MINUTI = env.int("FHIR_EXPORT_BATTITO_MINUTI", default=10)  # job in corso senza battito: worker morto
+FHIR_EXPORT_TENTATIVI = env.int("FHIR_EXPORT_TENTATIVI", default=3)        # poi il job interrotto va in errore
+
+# --- Pianificatore turni (core.turni.pianifica_periodo), eseguito dentro la richiesta web ---
+TURNI_PIANIFICATORE_PROCESSI = env.int("TURNI_PIANIFICATORE_PROCESSI", default=1)          # >1: pool spawn per richiesta
+TURNI_PIANIFICATORE_ITERAZIONI = env.int("TURNI_PIANIFICATORE_ITERAZIONI", default=30000)  # passi di ricerca per ripartenza
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "core.sql": {"handlers": ["console"], "level": env("SQL_BUDGET_LOG_LEVEL", default="INFO"), "propagate": False},
+        "core.cache": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "core.audit": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}